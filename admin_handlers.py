@@ -10,7 +10,7 @@ import logging
 import asyncio
 from datetime import datetime
 
-from database import Database
+from storage import get_storage
 from keyboards import Keyboards
 from utils import (
     is_admin, export_to_csv, format_product_info,
@@ -19,7 +19,7 @@ from utils import (
 import config
 
 logger = logging.getLogger(__name__)
-db = Database(config.DATABASE_NAME)
+db = get_storage()
 kb = Keyboards()
 
 
@@ -109,7 +109,7 @@ class AdminCommandsHandler:
     async def create_product(query, context, product_data):
         """إنشاء المنتج في قاعدة البيانات"""
         try:
-            product_id = db.add_product(
+            product_id = await db.aio.add_product(
                 name=product_data['name'],
                 description=product_data['description'],
                 price=product_data['price'],
@@ -122,7 +122,7 @@ class AdminCommandsHandler:
             if product_id:
                 # إضافة الأكواد إذا كان من نوع code
                 if product_data['type'] == 'code' and product_data.get('codes'):
-                    db.add_codes(product_id, product_data['codes'])
+                    await db.aio.add_codes(product_id, product_data['codes'])
                 
                 success_text = (
                     f"✅ تم إضافة المنتج بنجاح!\n\n"
@@ -138,7 +138,7 @@ class AdminCommandsHandler:
                 )
                 
                 # تسجيل
-                db.add_log('admin', query.from_user.id, 'add_product', 
+                await db.aio.add_log('admin', query.from_user.id, 'add_product', 
                           f'منتج: {product_id}')
                 
                 # حذف البيانات المؤقتة
@@ -231,7 +231,7 @@ class AdminCommandsHandler:
                     )
                     
                     # إنشاء المنتج مباشرة
-                    product_id = db.add_product(
+                    product_id = await db.aio.add_product(
                         name=product_data['name'],
                         description=product_data['description'],
                         price=product_data['price'],
@@ -242,7 +242,7 @@ class AdminCommandsHandler:
                     )
                     
                     if product_id:
-                        db.add_codes(product_id, codes)
+                        await db.aio.add_codes(product_id, codes)
                         
                         await update.message.reply_text(
                             f"✅ تم إضافة المنتج بنجاح! (المعرف: {product_id})",
@@ -308,7 +308,7 @@ class AdminCommandsHandler:
             )
             
             # إنشاء المنتج
-            product_id = db.add_product(
+            product_id = await db.aio.add_product(
                 name=product_data['name'],
                 description=product_data['description'],
                 price=product_data['price'],
@@ -324,7 +324,7 @@ class AdminCommandsHandler:
                     reply_markup=kb.admin_products()
                 )
                 
-                db.add_log('admin', user.id, 'add_product', f'منتج: {product_id}')
+                await db.aio.add_log('admin', user.id, 'add_product', f'منتج: {product_id}')
                 del context.user_data['adding_product']
             else:
                 await update.message.reply_text(
@@ -374,19 +374,19 @@ class AdminCommandsHandler:
         
         try:
             if data_type == 'users':
-                data = db.export_data('users')
+                data = await db.aio.export_data('users')
                 filename = f'users_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
             
             elif data_type == 'products':
-                data = db.export_data('products')
+                data = await db.aio.export_data('products')
                 filename = f'products_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
             
             elif data_type == 'orders':
-                data = db.export_data('orders')
+                data = await db.aio.export_data('orders')
                 filename = f'orders_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
             
             elif data_type == 'stats':
-                stats = db.get_statistics()
+                stats = await db.aio.get_statistics()
                 data = [stats]
                 filename = f'stats_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
             
@@ -413,7 +413,7 @@ class AdminCommandsHandler:
                     reply_markup=kb.export_options()
                 )
                 
-                db.add_log('admin', user.id, 'export_data', f'نوع: {data_type}')
+                await db.aio.add_log('admin', user.id, 'export_data', f'نوع: {data_type}')
             else:
                 await query.edit_message_text(
                     "❌ فشل التصدير!",
@@ -440,9 +440,9 @@ class AdminCommandsHandler:
         
         user_id = int(query.data.split(":")[1])
         
-        if db.ban_user(user_id, "محظور من قبل المسؤول"):
+        if await db.aio.ban_user(user_id, "محظور من قبل المسؤول"):
             await query.answer("✅ تم حظر المستخدم!", show_alert=True)
-            db.add_log('admin', admin.id, 'ban_user', f'مستخدم: {user_id}')
+            await db.aio.add_log('admin', admin.id, 'ban_user', f'مستخدم: {user_id}')
         else:
             await query.answer("❌ فشل حظر المستخدم!", show_alert=True)
     
@@ -459,9 +459,9 @@ class AdminCommandsHandler:
         
         user_id = int(query.data.split(":")[1])
         
-        if db.unban_user(user_id):
+        if await db.aio.unban_user(user_id):
             await query.answer("✅ تم إلغاء حظر المستخدم!", show_alert=True)
-            db.add_log('admin', admin.id, 'unban_user', f'مستخدم: {user_id}')
+            await db.aio.add_log('admin', admin.id, 'unban_user', f'مستخدم: {user_id}')
         else:
             await query.answer("❌ فشل إلغاء الحظر!", show_alert=True)
 
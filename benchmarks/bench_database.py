@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Database Microbenchmarks
+قياسات أداء دقيقة لطبقة قاعدة البيانات
+
+تقيس الدوال الأكثر استخداماً في Database على أحجام بيانات مختلفة،
+وتحفظ النتائج بصيغة JSON وتقارنها بخط أساس محفوظ لاكتشاف التراجعات.
+
+الاستخدام:
+    python -m benchmarks.bench_database --sizes 1000 100000
+    python -m benchmarks.bench_database --sizes 1000 --save-baseline
+    python -m benchmarks.bench_database --sizes 1000 --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# نسبة التراجع المسموح بها قبل اعتبار القياس تراجعاً (على الوسيط)
+DEFAULT_THRESHOLD = 0.25
+
+BATCH = 10000
+
+
+# ==================== تعبئة البيانات ====================
+
+def seed(db: Database, rows: int, rng: random.Random) -> Dict[str, int]:
+    """تعبئة قاعدة البيانات بعدد الصفوف المطلوب (إدخال مباشر بالدفعات)"""
+    conn = db._get_connection()
+    cursor = conn.cursor()
+    products = max(100, rows // 100)
+    code_products = max(10, products // 10)
+
+    def insert_many(sql: str, generator):
+        while True:
+            batch = list(itertools.islice(generator, BATCH))
+            if not batch:
+                break
+            cursor.executemany(sql, batch)
+        conn.commit()
+
+    insert_many(
+        "INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)",
+        ((uid, f'user{uid}', f'User{uid}') for uid in range(1, rows + 1))
+    )
+    insert_many(
+        "INSERT INTO user_stats (user_id, balance, last_activity) VALUES (?, ?, datetime('now', ?))",
+        ((uid, rng.randint(0, 500), f'-{rng.randint(0, 72)} hours') for uid in range(1, rows + 1))
+    )
+    insert_many(
+        "INSERT INTO products (name, description, price, type, delivery_content, "
+        "stock, is_limited, category, sales_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        ((f'منتج {i}', f'وصف المنتج {i}', rng.randint(1, 2500),
+          'code' if i <= code_products else 'text', f'content {i}',
+          -1, 0, f'فئة {i % 20}', rng.randint(0, 1000))
+         for i in range(1, products + 1))
+    )
+    insert_many(
+        "INSERT INTO codes (product_id, code_value) VALUES (?, ?)",
+        ((rng.randint(1, code_products), f'CODE-{i}') for i in range(rows))
+    )
+    insert_many(
+        "INSERT INTO orders (user_id, product_id, product_name, payment_id, price, "
+        "final_price, status) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ((rng.randint(1, rows), pid, f'منتج {pid}', f'seed_{i}', 100, 100,
+          'completed' if i % 4 else 'pending')
+         for i, pid in ((i, rng.randint(1, products)) for i in range(rows)))
+    )
+    insert_many(
+        "INSERT INTO logs (type, user_id, action, details) VALUES (?, ?, ?, ?)",
+        (('info', rng.randint(1, rows), 'seed', f'سجل {i}') for i in range(rows))
+    )
+    insert_many(
+        "INSERT INTO bot_donations (user_id, amount, username) VALUES (?, ?, ?)",
+        ((rng.randint(1, rows), rng.randint(1, 500), None) for _ in range(rows))
+    )
+    insert_many(
+        "INSERT INTO rate_limits (user_id, request_count, last_reset) VALUES (?, ?, ?)",
+        ((uid, 1, datetime.now()) for uid in range(1, rows + 1))
+    )
+
+    return {'users': rows, 'products': products, 'code_products': code_products}
+
+
+# ==================== أداة القياس ====================
+
+def measure(func: Callable[[], object], min_time: float, max_iterations: int,
+            warmup: int = 3) -> Dict[str, float]:
+    """تشغيل دالة بشكل متكرر وحساب إحصائيات الزمن (بالميكروثانية)"""
+    for _ in range(warmup):
+        func()
+
+    samples: List[float] = []
+    started = time.perf_counter()
+    while len(samples) < max_iterations:
+        t0 = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t0)
+        if time.perf_counter() - started >= min_time and len(samples) >= 5:
+            break
+
+    ordered = sorted(samples)
+    to_us = 1e6
+    return {
+        'iterations': len(samples),
+        'mean_us': round(statistics.fmean(samples) * to_us, 2),
+        'median_us': round(statistics.median(samples) * to_us, 2),
+        'p95_us': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * to_us, 2),
+        'min_us': round(ordered[0] * to_us, 2),
+        'ops_per_sec': round(len(samples) / sum(samples), 1),
+    }
+
+
+def build_benchmarks(db: Database, shape: Dict[str, int],
+                     rng: random.Random) -> Dict[str, Callable[[], object]]:
+    """تعريف القياسات لكل دالة ساخنة"""
+    users = shape['users']
+    products = shape['products']
+    code_products = shape['code_products']
+    payment_ids = itertools.count()
+
+    return {
+        'get_product': lambda: db.get_product(rng.randint(1, products)),
+        'get_active_products': lambda: db.get_active_products(),
+        'get_active_products_page': lambda: db.get_active_products(
+            limit=6, offset=rng.randint(0, max(0, products - 6))),
+        'check_rate_limit': lambda: db.check_rate_limit(rng.randint(1, users), 10 ** 9),
+        'get_unused_code': lambda: db.get_unused_code(rng.randint(1, code_products),
+                                                      rng.randint(1, users)),
+        'create_order': lambda: db.create_order(rng.randint(1, users), rng.randint(1, products),
+                                                'منتج', f'bench_{next(payment_ids)}', 100),
+        'complete_purchase': lambda: db.complete_purchase(rng.randint(1, users),
+                                                          rng.randint(1, products), 100),
+        'add_log': lambda: db.add_log('info', rng.randint(1, users), 'bench', 'قياس'),
+        'get_statistics': lambda: db.get_statistics(),
+        'get_donation_stats': lambda: db.get_donation_stats(),
+    }
+
+
+def run_size(rows: int, args) -> Dict[str, Dict[str, float]]:
+    """تعبئة قاعدة بيانات بالحجم المطلوب وتشغيل جميع القياسات عليها"""
+    workdir = tempfile.mkdtemp(prefix='bench_db_')
+    db_path = os.path.join(workdir, f'bench_{rows}.db')
+    rng = random.Random(args.seed)
+
+    db = Database(db_path)
+    seed_started = time.perf_counter()
+    shape = seed(db, rows, rng)
+    print(f"[{rows}] seeded in {time.perf_counter() - seed_started:.1f}s", file=sys.stderr)
+
+    results = {}
+    for name, func in build_benchmarks(db, shape, rng).items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = measure(func, args.min_time, args.max_iterations)
+        print(f"[{rows}] {name:<26} median {results[name]['median_us']:>12} us",
+              file=sys.stderr)
+
+    db.close()
+    Database._instances.pop(db_path, None)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    return results
+
+
+# ==================== المقارنة بخط الأساس ====================
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[Dict]:
+    """مقارنة النتائج بخط الأساس وإرجاع قائمة التراجعات"""
+    regressions = []
+    for size, benches in results['results'].items():
+        base_benches = baseline.get('results', {}).get(size, {})
+        for name, stats in benches.items():
+            base = base_benches.get(name)
+            if not base or not base.get('median_us'):
+                continue
+            ratio = stats['median_us'] / base['median_us']
+            stats['baseline_median_us'] = base['median_us']
+            stats['ratio'] = round(ratio, 3)
+            if ratio > 1 + threshold:
+                regressions.append({
+                    'size': size,
+                    'benchmark': name,
+                    'baseline_median_us': base['median_us'],
+                    'median_us': stats['median_us'],
+                    'ratio': round(ratio, 3),
+                })
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="قياس أداء طبقة قاعدة البيانات")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="أحجام البيانات (عدد الصفوف)")
+    parser.add_argument('--only', nargs='+', help="تشغيل قياسات محددة فقط")
+    parser.add_argument('--min-time', type=float, default=0.5,
+                        help="أقل زمن قياس لكل دالة بالثواني")
+    parser.add_argument('--max-iterations', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', help="مسار ملف JSON للنتائج")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help="ملف خط الأساس للمقارنة")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="حفظ النتائج كخط أساس جديد")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="نسبة التراجع المسموحة (0.25 = 25%%)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+        },
+        'results': {str(rows): run_size(rows, args) for rows in args.sizes},
+    }
+
+    regressions = []
+    if not args.save_baseline and args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        results['regressions'] = regressions
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            f.write(output)
+        print(f"baseline saved: {args.baseline}", file=sys.stderr)
+
+    for item in regressions:
+        print(f"REGRESSION [{item['size']}] {item['benchmark']}: "
+              f"{item['baseline_median_us']}us -> {item['median_us']}us (x{item['ratio']})",
+              file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Cluster Mode
+تشغيل البوت على عدة عمليات
+
+عملية رئيسية تستقبل تحديثات تيليجرام عبر webhook وتوزعها على N عملية عاملة حسب
+user_id، فتبقى تحديثات المستخدم الواحد (وحالة user_data الخاصة به) في نفس العملية.
+المهام العامة (البث، النسخ الاحتياطي) تُنسَّق عبر أقفال في جدول job_locks، ويُبطل كل
+عامل الكاش الخاص به عندما تعدّل عملية أخرى المنتجات.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import uuid
+from typing import List, Optional
+
+import config
+from storage import Storage, get_storage
+
+logger = logging.getLogger(__name__)
+
+# معرّف هذه العملية كمالك للأقفال
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+# ==================== التوزيع ====================
+
+def shard_key(data: dict) -> Optional[int]:
+    """معرّف المستخدم (أو المحادثة) من تحديث خام دون تحويله إلى كائنات"""
+    for field, value in data.items():
+        if field == 'update_id' or not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if user and 'id' in user:
+            return user['id']
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat and 'id' in chat:
+            return chat['id']
+    return None
+
+
+def shard_for(data: dict, workers: int) -> int:
+    """رقم العامل المسؤول عن التحديث"""
+    key = shard_key(data)
+    if key is None:
+        key = data.get('update_id', 0)
+    return key % workers
+
+
+# ==================== أقفال المهام العامة ====================
+
+class JobLock:
+    """قفل مشترك بين العمليات لمهمة عامة، يُمدَّد تلقائياً ما دامت المهمة تعمل
+
+    async with JobLock('broadcast') as lock:
+        if not lock.acquired:
+            ...  # مهمة أخرى تعمل
+    """
+
+    def __init__(self, name: str, ttl: float = None, database: Storage = None):
+        self.name = name
+        self.ttl = config.JOB_LOCK_TTL if ttl is None else ttl
+        self.db = database or get_storage()
+        self.acquired = False
+        self._renew_task = None
+
+    async def acquire(self) -> bool:
+        self.acquired = self.db.acquire_job_lock(self.name, OWNER_ID, self.ttl)
+        if self.acquired:
+            self._renew_task = asyncio.get_running_loop().create_task(self._renew())
+        return self.acquired
+
+    async def release(self):
+        if self._renew_task is not None:
+            self._renew_task.cancel()
+            self._renew_task = None
+        if self.acquired:
+            self.db.release_job_lock(self.name, OWNER_ID)
+            self.acquired = False
+
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            if not self.db.acquire_job_lock(self.name, OWNER_ID, self.ttl):
+                logger.warning(f"⚠️ فُقد قفل المهمة {self.name}")
+                return
+
+    async def __aenter__(self) -> 'JobLock':
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.release()
+
+
+# ==================== العمليات العاملة ====================
+
+def _forward_updates(queue, application, loop):
+    """خيط ينقل التحديثات من طابور العملية الرئيسية إلى طابور التطبيق"""
+    from telegram import Update
+    from lifecycle import lifecycle
+
+    def enqueue(raw: bytes):
+        try:
+            update = Update.de_json(json.loads(raw), application.bot)
+            application.update_queue.put_nowait(update)
+        except Exception as e:
+            logger.error(f"خطأ في قراءة تحديث: {e}")
+
+    while True:
+        raw = queue.get()
+        if raw is None:
+            loop.call_soon_threadsafe(lifecycle.request_stop, application)
+            return
+        loop.call_soon_threadsafe(enqueue, raw)
+
+
+async def _sync_catalog_loop(database: Storage):
+    """إبطال الكاش عند تعديل المنتجات من عامل آخر"""
+    while True:
+        database.sync_catalog()
+        await asyncio.sleep(config.CATALOG_SYNC_INTERVAL)
+
+
+def worker_main(index: int, queue):
+    """نقطة دخول العملية العاملة: تطبيق بلا Updater يستقبل التحديثات من الطابور"""
+    # الإيقاف تنسقه العملية الرئيسية عبر الطابور
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if config.METRICS_PORT:
+        config.METRICS_PORT += 1 + index
+
+    import main
+    from utils import prerender_product_cards
+
+    database = get_storage()
+    database.initialize()
+    prerender_product_cards()
+
+    application = main.build_application(updater=None)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(application.initialize())
+        loop.run_until_complete(main.post_init(application))
+        # SIGINT (Ctrl+C) يصل لكل العمليات، والعملية الرئيسية هي من يقرر الإيقاف
+        loop.remove_signal_handler(signal.SIGINT)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        loop.run_until_complete(application.start())
+        sync_task = loop.create_task(_sync_catalog_loop(database))
+        threading.Thread(target=_forward_updates, args=(queue, application, loop),
+                         name=f'ingress-{index}', daemon=True).start()
+        logger.info(f"👷 العامل {index} جاهز (pid {os.getpid()})")
+        loop.run_forever()
+        sync_task.cancel()
+    finally:
+        if application.running:
+            loop.run_until_complete(application.stop())
+        loop.run_until_complete(application.shutdown())
+        loop.run_until_complete(main.post_shutdown(application))
+        loop.close()
+
+
+# ==================== استقبال webhook ====================
+
+class Ingress:
+    """خادم webhook يوزع التحديثات الخام على طوابير العمال"""
+
+    def __init__(self, queues: List, host: str = None, port: int = None,
+                 path: str = None, secret: str = None):
+        self.queues = queues
+        self.host = host or config.WEBHOOK_LISTEN
+        self.port = config.WEBHOOK_PORT if port is None else port
+        self.path = path or config.WEBHOOK_PATH
+        self.secret = config.WEBHOOK_SECRET if secret is None else secret
+        self.routed = [0] * len(queues)
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"🌐 استقبال webhook على {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        status = '200 OK'
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            if len(request_line) < 2 or request_line[0] != 'POST' or request_line[1] != self.path:
+                status = '404 Not Found'
+            elif self.secret and headers.get('x-telegram-bot-api-secret-token') != self.secret:
+                status = '403 Forbidden'
+            else:
+                shard = shard_for(json.loads(body), len(self.queues))
+                self.queues[shard].put(body)
+                self.routed[shard] += 1
+        except Exception as e:
+            logger.error(f"خطأ في استقبال التحديث: {e}")
+            status = '400 Bad Request'
+
+        try:
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n"
+                         f"Connection: close\r\n\r\n".encode('latin-1'))
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+# ==================== العملية الرئيسية ====================
+
+async def _serve(queues: List, processes: List, context) -> None:
+    """تسجيل webhook، استقبال التحديثات، وإعادة تشغيل العمال المتوقفين حتى إشارة الإيقاف"""
+    from telegram import Bot, Update
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with Bot(config.BOT_TOKEN) as bot:
+        await bot.set_webhook(
+            url=config.WEBHOOK_URL.rstrip('/') + config.WEBHOOK_PATH,
+            secret_token=config.WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES
+        )
+
+    ingress = Ingress(queues)
+    await ingress.start()
+    try:
+        while not stop.is_set():
+            for index, process in enumerate(processes):
+                if not process.is_alive():
+                    logger.error(f"❌ توقف العامل {index} (رمز {process.exitcode})، إعادة تشغيله")
+                    processes[index] = _start_worker(context, index, queues[index])
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await ingress.stop()
+
+
+def _start_worker(context, index: int, queue):
+    process = context.Process(target=worker_main, args=(index, queue), name=f'worker-{index}')
+    process.start()
+    return process
+
+
+def run_cluster(workers: int = None):
+    """تشغيل وضع العمليات المتعددة حتى SIGINT/SIGTERM"""
+    workers = workers or config.CLUSTER_WORKERS
+    if not config.WEBHOOK_URL:
+        raise ValueError("وضع العمليات المتعددة يتطلب WEBHOOK_URL")
+
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue() for _ in range(workers)]
+    processes = [_start_worker(context, index, queue) for index, queue in enumerate(queues)]
+    logger.info(f"🚀 تم تشغيل {workers} عامل")
+
+    try:
+        asyncio.run(_serve(queues, processes, context))
+    finally:
+        # كل عامل يكمل ما في طابوره ثم يغلق بالترتيب (انظر lifecycle.py)
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(config.SHUTDOWN_DRAIN_TIMEOUT + 10)
+            if process.is_alive():
+                logger.warning(f"⚠️ إنهاء العامل {process.name} قسراً")
+                process.terminate()
+        logger.info("⏹ تم إيقاف جميع العمال")
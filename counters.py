@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Cached Counters
+عدادات مجمّعة في الذاكرة (مثل عدد الطلبات لكل حالة)
+
+تُحمَّل مرة بـ GROUP BY ثم تُعدَّل مع كل كتابة بعد التزامها (add و move) بدل إعادة العد.
+رقم الجيل يمنع قراءة سبقت كتابة من حفظ نتيجة قديمة، ومدة الصلاحية تغطي كتابات
+العمليات الأخرى (مثل قوائم الأعلى في leaderboards.py).
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import config
+
+
+class CachedCounts:
+    """عدد لكل مفتاح، يُحمَّل من قاعدة البيانات ويُحدَّث تزايدياً"""
+
+    def __init__(self, ttl: float = None):
+        self.ttl = config.COUNTS_CACHE_TTL if ttl is None else ttl
+        self.generation = 0
+        self._counts = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[Dict[str, int]]:
+        """نسخة من الأعداد، أو None إن لم تكن محمّلة أو انتهت صلاحيتها"""
+        with self._lock:
+            if self._counts is None or time.monotonic() - self._loaded_at > self.ttl:
+                return None
+            return dict(self._counts)
+
+    def fill(self, counts: Dict[str, int], generation: int) -> None:
+        """حفظ نتيجة العد إن لم تحدث كتابة منذ قراءة رقم الجيل"""
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._counts = dict(counts)
+            self._loaded_at = time.monotonic()
+
+    def read(self, load: Callable) -> Dict[str, int]:
+        """الأعداد من الذاكرة أو عبر load()"""
+        counts = self.get() if config.ENABLE_CACHE else None
+        if counts is None:
+            generation = self.generation
+            counts = load()
+            self.fill(counts, generation)
+        return counts
+
+    async def aread(self, load: Callable) -> Dict[str, int]:
+        """مثل read لكن load دالة غير متزامنة"""
+        counts = self.get() if config.ENABLE_CACHE else None
+        if counts is None:
+            generation = self.generation
+            counts = await load()
+            self.fill(counts, generation)
+        return counts
+
+    def add(self, key: str, delta: int = 1) -> None:
+        with self._lock:
+            self.generation += 1
+            if self._counts is not None:
+                count = self._counts.get(key, 0) + delta
+                if count:
+                    self._counts[key] = count
+                else:
+                    self._counts.pop(key, None)
+
+    def move(self, old: str, new: str) -> None:
+        """صف انتقل من مفتاح لآخر (تغيّر حالة طلب)"""
+        if old != new:
+            self.add(old, -1)
+            self.add(new, 1)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._counts = None
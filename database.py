@@ -6,20 +6,85 @@ Database Management Module
 
 import sqlite3
 import threading
+import time
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 import json
 import logging
+import re
+
+import config
+from counters import CachedCounts
+from instrumentation import InstrumentedConnection
+from leaderboards import Leaderboards
+from migrations import migrate, get_version as get_schema_version
+from records import Donation, LogEntry, Order, Product, Row, User
+from storage import Storage
 
 logger = logging.getLogger(__name__)
 
 
-class Database:
-    """فئة إدارة قاعدة البيانات مع حماية من التعارضات"""
+# ==================== تطبيع النص للبحث ====================
+
+# توحيد أشكال الحروف العربية (الهمزات، الألف المقصورة، التاء المربوطة، الأرقام الهندية)
+_SEARCH_TRANSLATION = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+})
+
+# التشكيل والتطويل
+_SEARCH_DIACRITICS = re.compile('[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]')
+_SEARCH_SEPARATORS = re.compile(r'[^\w]+')
+
+
+def normalize_search_text(text: str) -> str:
+    """تطبيع النص العربي للفهرسة والبحث"""
+    if not text:
+        return ''
+    text = _SEARCH_DIACRITICS.sub('', str(text).lower()).translate(_SEARCH_TRANSLATION)
+    words = []
+    for word in _SEARCH_SEPARATORS.sub(' ', text).split():
+        # إزالة أداة التعريف حتى يطابق "كتاب" كلمة "الكتاب"
+        if word.startswith('ال') and len(word) > 3:
+            word = word[2:]
+        words.append(word)
+    return ' '.join(words)
+
+
+def product_search_text(name: str, description: str, category: str) -> str:
+    """النص المطبّع المخزن في products.search_text (كل حقل في سطر، انظر الترحيل 14)"""
+    return '\n'.join(normalize_search_text(value) for value in (name, description, category))
+
+
+# أعمدة المستخدم الكاملة: الملف الشخصي من users والعدادات من user_stats (انظر الترحيل 7)
+_USER_COLUMNS = """
+    u.user_id, u.username, u.first_name, u.last_name,
+    COALESCE(s.balance, 0) AS balance, COALESCE(s.total_spent, 0) AS total_spent,
+    COALESCE(s.total_purchases, 0) AS total_purchases,
+    u.referrer_id, u.referral_count, u.join_date, s.last_activity,
+    COALESCE(s.is_banned, 0) AS is_banned, u.ban_reason, u.language
+"""
+_USER_FROM = "users u LEFT JOIN user_stats s ON s.user_id = u.user_id"
+
+# أعمدة صفحات سجل الطلبات: كلها ضمن فهرس idx_orders_user_history (انظر الترحيل 11)
+_ORDER_HISTORY_COLUMNS = "id, user_id, product_name, final_price, status, discount_amount, created_at"
+
+# نوع السجل لكل جدول قابل للتصدير (الباقي Row عام)
+_EXPORT_KINDS = {'users': User, 'products': Product, 'orders': Order,
+                 'donations': Donation, 'logs': LogEntry}
+
+
+class Database(Storage):
+    """تخزين SQLite (التنفيذ الافتراضي لواجهة Storage) مع حماية من التعارضات"""
     
     _instances = {}
     _lock = threading.Lock()
     
+    # فئة الاتصال المستخدمة (تقيس زمن الاستعلامات، انظر instrumentation.py)
+    connection_factory = InstrumentedConnection
+    
     def __new__(cls, db_name: str):
         # لا نستخدم التخزين المؤقت لمثيلات in-memory لتجنب مشاركة الحالة بين الاختبارات
         if db_name == ":memory:":
@@ -36,8 +101,23 @@ class Database:
         if not hasattr(self, 'initialized'):
             self.db_name = db_name
             self.local = threading.local()
+            # نسخة الكتالوج: تزداد مع كل كتابة على المنتجات لإبطال الكاش
+            self._catalog_version = 0
+            self._catalog_listeners = []
+            # آخر ما رأته هذه العملية من تعديلات العمليات الأخرى (انظر sync_catalog)
+            self._data_version = None
+            self._shared_catalog_version = None
+            self._fts_available = False
+            # قوائم الأعلى (الرصيد، الإنفاق، المبيعات، الحملات) تُحدَّث مع الكتابات
+            self.leaderboards = Leaderboards()
+            # عدد الطلبات لكل حالة (رأس لوحة الطلبات والإحصائيات)
+            self.order_counts = CachedCounts()
+            # تُطبق الترحيلات عند أول اتصال وليس عند الاستيراد (انظر initialize)
+            self._schema_ready = False
+            self._schema_lock = threading.Lock()
+            # كل الاتصالات المفتوحة (من كل الخيوط) لإغلاقها عند الإيقاف
+            self._connections = []
             self.initialized = True
-            self._create_tables()
     
     def _get_connection(self):
         """الحصول على اتصال خاص بكل thread"""
@@ -45,231 +125,90 @@ class Database:
             self.local.conn = sqlite3.connect(
                 self.db_name,
                 check_same_thread=False,
-                timeout=30
+                timeout=30,
+                factory=self.connection_factory
             )
             self.local.conn.row_factory = sqlite3.Row
+            # يحتاجها الترحيل 3 فقط عند ترقية قاعدة قديمة (الفهرسة بعدها من search_text)
+            self.local.conn.create_function(
+                'normalize_ar', 1, normalize_search_text, deterministic=True
+            )
+            self._connections.append(self.local.conn)
+            if not self._schema_ready:
+                self.initialize()
         return self.local.conn
     
+    def initialize(self) -> None:
+        """تهيئة المخطط مرة واحدة لكل قاعدة بيانات (آمنة بين الخيوط)"""
+        if self._schema_ready:
+            return
+        if not hasattr(self.local, 'conn'):
+            # فتح أول اتصال في هذا الخيط يستدعي initialize من جديد
+            self._get_connection()
+            return
+        with self._schema_lock:
+            if not self._schema_ready:
+                if config.DB_JOURNAL_MODE and self.db_name != ":memory:":
+                    self.local.conn.execute(f"PRAGMA journal_mode = {config.DB_JOURNAL_MODE}")
+                self._create_tables()
+                self._schema_ready = True
+    
+    # ==================== نسخة الكتالوج ====================
+    
+    def get_catalog_version(self) -> int:
+        """رقم نسخة الكتالوج الحالي (يتغير عند أي تعديل على المنتجات)"""
+        return self._catalog_version
+    
+    def add_catalog_listener(self, callback) -> None:
+        """تسجيل دالة تُستدعى بمعرف المنتج عند تعديل الكتالوج"""
+        self._catalog_listeners.append(callback)
+    
+    def _touch_catalog(self, product_id: int = None) -> None:
+        """زيادة نسخة الكتالوج وإبلاغ المستمعين"""
+        self._catalog_version += 1
+        for callback in self._catalog_listeners:
+            try:
+                callback(product_id)
+            except Exception as e:
+                logger.error(f"خطأ في مستمع الكتالوج: {e}")
+    
+    def sync_catalog(self) -> bool:
+        """إبطال الكاش المحلي إذا عدّلت عملية أخرى المنتجات (وضع العمليات المتعددة)"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            # data_version لا يتغير إلا عند التزام اتصال آخر، فالفحص المعتاد بلا قراءة جداول
+            cursor.execute("PRAGMA data_version")
+            data_version = cursor.fetchone()[0]
+            if data_version == self._data_version:
+                return False
+            self._data_version = data_version
+            
+            cursor.execute("SELECT version FROM catalog_state WHERE id = 1")
+            row = cursor.fetchone()
+            version = row['version'] if row else 0
+            changed = self._shared_catalog_version is not None and version != self._shared_catalog_version
+            self._shared_catalog_version = version
+            if changed:
+                self.leaderboards.products.invalidate()
+                self._touch_catalog(None)
+            return changed
+        except Exception as e:
+            logger.error(f"خطأ في مزامنة نسخة الكتالوج: {e}")
+            return False
+    
     def _create_tables(self):
-        """إنشاء جداول قاعدة البيانات"""
+        """تطبيق ترحيلات المخطط الناقصة (انظر migrations.py)"""
         conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        # جدول المستخدمين
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                balance INTEGER DEFAULT 0,
-                total_spent INTEGER DEFAULT 0,
-                total_purchases INTEGER DEFAULT 0,
-                referrer_id INTEGER,
-                referral_count INTEGER DEFAULT 0,
-                join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_banned INTEGER DEFAULT 0,
-                ban_reason TEXT,
-                language TEXT DEFAULT 'ar'
-            )
-        """)
-        
-        # جدول المنتجات
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT,
-                price INTEGER NOT NULL,
-                type TEXT NOT NULL,
-                delivery_content TEXT,
-                stock INTEGER DEFAULT -1,
-                is_limited INTEGER DEFAULT 0,
-                is_active INTEGER DEFAULT 1,
-                category TEXT DEFAULT 'عام',
-                image_url TEXT,
-                discount_percentage INTEGER DEFAULT 0,
-                sales_count INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
         
-        # جدول الأكواد
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS codes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id INTEGER NOT NULL,
-                code_value TEXT NOT NULL,
-                is_used INTEGER DEFAULT 0,
-                used_by INTEGER,
-                used_at TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
-            )
-        """)
-        
-        # جدول الطلبات
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                product_id INTEGER NOT NULL,
-                product_name TEXT NOT NULL,
-                payment_id TEXT UNIQUE NOT NULL,
-                price INTEGER NOT NULL,
-                discount_amount INTEGER DEFAULT 0,
-                final_price INTEGER NOT NULL,
-                status TEXT DEFAULT 'pending',
-                delivery_status TEXT DEFAULT 'pending',
-                delivery_content TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                completed_at TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                FOREIGN KEY (product_id) REFERENCES products (id)
-            )
-        """)
-        
-        # جدول السجلات
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                type TEXT NOT NULL,
-                user_id INTEGER,
-                action TEXT NOT NULL,
-                details TEXT,
-                ip_address TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # جدول الإحصائيات اليومية
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS daily_stats (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date DATE UNIQUE NOT NULL,
-                total_sales INTEGER DEFAULT 0,
-                total_revenue INTEGER DEFAULT 0,
-                new_users INTEGER DEFAULT 0,
-                total_orders INTEGER DEFAULT 0
-            )
-        """)
+        applied = migrate(conn)
+        if applied:
+            logger.info(f"تم تحديث مخطط قاعدة البيانات إلى النسخة {get_schema_version(conn)}")
         
-        # جدول معدل الطلبات (للحماية من الفلود)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS rate_limits (
-                user_id INTEGER PRIMARY KEY,
-                request_count INTEGER DEFAULT 0,
-                last_reset TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                failed_attempts INTEGER DEFAULT 0,
-                is_temp_banned INTEGER DEFAULT 0,
-                temp_ban_until TIMESTAMP
-            )
-        """)
-        
-        # جدول الإعدادات القابلة للتعديل
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # جدول الفئات
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS categories (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE NOT NULL,
-                description TEXT,
-                icon TEXT DEFAULT '📦',
-                is_active INTEGER DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # جدول التبرعات
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS donations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                donor_id INTEGER NOT NULL,
-                amount INTEGER NOT NULL,
-                donation_url TEXT UNIQUE,
-                description TEXT,
-                status TEXT DEFAULT 'active',
-                total_received INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (donor_id) REFERENCES users (user_id)
-            )
-        """)
-        
-        # جدول سجل التبرعات
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS donation_records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                donation_id INTEGER NOT NULL,
-                contributor_id INTEGER,
-                amount INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (donation_id) REFERENCES donations (id),
-                FOREIGN KEY (contributor_id) REFERENCES users (user_id)
-            )
-        """)
-        
-        # جدول النقاط
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_points (
-                user_id INTEGER PRIMARY KEY,
-                points INTEGER DEFAULT 0,
-                total_earned INTEGER DEFAULT 0,
-                total_exchanged INTEGER DEFAULT 0,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        """)
-        
-        # جدول سجل تبادل النقاط
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS points_exchange_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                points_used INTEGER NOT NULL,
-                stars_received INTEGER NOT NULL,
-                exchange_rate REAL NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        """)
-        
-        # جدول التبرعات للبوت
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS bot_donations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                amount INTEGER NOT NULL,
-                username TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        """)
-        
-        # إنشاء الفهارس لتحسين الأداء
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_codes_product ON codes(product_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_codes_used ON codes(is_used)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_active ON products(is_active)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_logs_user ON logs(user_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_logs_type ON logs(type)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_donations_donor ON donations(donor_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_donations_status ON donations(status)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_donation_records_donation ON donation_records(donation_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_bot_donations_user ON bot_donations(user_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_bot_donations_created ON bot_donations(created_at)")
-        
-        conn.commit()
-        logger.info("تم إنشاء جداول قاعدة البيانات بنجاح")
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'")
+        self._fts_available = cursor.fetchone() is not None
     
     # ==================== دوال المستخدمين ====================
     
@@ -285,6 +224,9 @@ class Database:
                 (user_id, username, first_name, last_name, referrer_id)
                 VALUES (?, ?, ?, ?, ?)
             """, (user_id, username, first_name, last_name, referrer_id))
+            added = cursor.rowcount > 0
+            
+            cursor.execute("INSERT OR IGNORE INTO user_stats (user_id) VALUES (?)", (user_id,))
             
             if referrer_id:
                 cursor.execute("""
@@ -293,25 +235,51 @@ class Database:
                 """, (referrer_id,))
             
             conn.commit()
-            return cursor.rowcount > 0
+            return added
         except Exception as e:
             logger.error(f"خطأ في إضافة مستخدم: {e}")
             return False
     
     def get_user(self, user_id: int) -> Optional[Dict]:
         """الحصول على بيانات مستخدم"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.row_factory = User.row_factory
+            
+            cursor.execute(f"SELECT {_USER_COLUMNS} FROM {_USER_FROM} WHERE u.user_id = ?", (user_id,))
+            return cursor.fetchone()
+        except Exception as e:
+            logger.error(f"خطأ في جلب بيانات المستخدم: {e}")
+            return None
+    
+    def is_user_banned(self, user_id: int) -> bool:
+        """فحص الحظر من جدول العدادات فقط (يُستدعى مع كل تحديث)"""
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
             
-            cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+            cursor.execute("SELECT is_banned FROM user_stats WHERE user_id = ?", (user_id,))
             row = cursor.fetchone()
+            return bool(row and row['is_banned'])
+        except Exception as e:
+            logger.error(f"خطأ في فحص حظر المستخدم: {e}")
+            return False
+    
+    def get_user_stats(self, user_id: int) -> Optional[Dict]:
+        """عدادات المستخدم فقط (الرصيد والمصروفات والمشتريات) دون بيانات الملف الشخصي"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.row_factory = Row.row_factory
             
-            if row:
-                return dict(row)
-            return None
+            cursor.execute("""
+                SELECT user_id, balance, total_spent, total_purchases, last_activity, is_banned
+                FROM user_stats WHERE user_id = ?
+            """, (user_id,))
+            return cursor.fetchone()
         except Exception as e:
-            logger.error(f"خطأ في جلب بيانات المستخدم: {e}")
+            logger.error(f"خطأ في جلب عدادات المستخدم: {e}")
             return None
     
     def update_user_activity(self, user_id: int):
@@ -321,7 +289,7 @@ class Database:
             cursor = conn.cursor()
             
             cursor.execute("""
-                UPDATE users SET last_activity = CURRENT_TIMESTAMP
+                UPDATE user_stats SET last_activity = CURRENT_TIMESTAMP
                 WHERE user_id = ?
             """, (user_id,))
             
@@ -335,10 +303,8 @@ class Database:
             conn = self._get_connection()
             cursor = conn.cursor()
             
-            cursor.execute("""
-                UPDATE users SET is_banned = 1, ban_reason = ?
-                WHERE user_id = ?
-            """, (reason, user_id))
+            cursor.execute("UPDATE users SET ban_reason = ? WHERE user_id = ?", (reason, user_id))
+            cursor.execute("UPDATE user_stats SET is_banned = 1 WHERE user_id = ?", (user_id,))
             
             conn.commit()
             return True
@@ -352,10 +318,8 @@ class Database:
             conn = self._get_connection()
             cursor = conn.cursor()
             
-            cursor.execute("""
-                UPDATE users SET is_banned = 0, ban_reason = NULL
-                WHERE user_id = ?
-            """, (user_id,))
+            cursor.execute("UPDATE users SET ban_reason = NULL WHERE user_id = ?", (user_id,))
+            cursor.execute("UPDATE user_stats SET is_banned = 0 WHERE user_id = ?", (user_id,))
             
             conn.commit()
             return True
@@ -368,8 +332,9 @@ class Database:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = User.row_factory
             
-            query = "SELECT * FROM users ORDER BY join_date DESC"
+            query = f"SELECT {_USER_COLUMNS} FROM {_USER_FROM} ORDER BY u.join_date DESC"
             params: List = []
             if limit is not None:
                 try:
@@ -385,7 +350,7 @@ class Database:
                 params.extend([l, o])
 
             cursor.execute(query, params)
-            return [dict(row) for row in cursor.fetchall()]
+            return cursor.fetchall()
         except Exception as e:
             logger.error(f"خطأ في جلب المستخدمين: {e}")
             return []
@@ -415,12 +380,16 @@ class Database:
             
             cursor.execute("""
                 INSERT INTO products 
-                (name, description, price, type, delivery_content, stock, is_limited, category)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                (name, description, price, type, delivery_content, stock, is_limited, category,
+                 search_text)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (name, description, price, product_type, delivery_content, 
-                  stock, is_limited, category))
+                  stock, is_limited, category,
+                  product_search_text(name, description, category)))
             
             conn.commit()
+            self.leaderboards.products.offer(cursor.lastrowid, 0)
+            self._touch_catalog(cursor.lastrowid)
             return cursor.lastrowid
         except Exception as e:
             logger.error(f"خطأ في إضافة منتج: {e}")
@@ -431,13 +400,10 @@ class Database:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = Product.row_factory
             
             cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
-            row = cursor.fetchone()
-            
-            if row:
-                return dict(row)
-            return None
+            return cursor.fetchone()
         except Exception as e:
             logger.error(f"خطأ في جلب المنتج: {e}")
             return None
@@ -448,6 +414,7 @@ class Database:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = Product.row_factory
             
             query = "SELECT * FROM products WHERE is_active = 1"
             params: List = []
@@ -472,11 +439,65 @@ class Database:
                 params.extend([l, o])
 
             cursor.execute(query, params)
-            return [dict(row) for row in cursor.fetchall()]
+            return cursor.fetchall()
         except Exception as e:
             logger.error(f"خطأ في جلب المنتجات: {e}")
             return []
     
+    
+    def search_products(self, query: str, limit: int = 10, offset: int = 0) -> List[Dict]:
+        """البحث في المنتجات النشطة بالاسم والوصف والفئة (مرتبة حسب الصلة)"""
+        words = normalize_search_text(query).split()
+        if not words:
+            return []
+        
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.row_factory = Product.row_factory
+            
+            if self._fts_available:
+                # كل كلمة تُطابق كبادئة، والاسم أعلى وزناً من الفئة ثم الوصف
+                match = ' '.join(f'"{word}"*' for word in words)
+                cursor.execute("""
+                    SELECT p.* FROM products_fts
+                    JOIN products p ON p.id = products_fts.rowid
+                    WHERE products_fts MATCH ? AND p.is_active = 1
+                    ORDER BY bm25(products_fts, 10.0, 1.0, 4.0), p.sales_count DESC
+                    LIMIT ? OFFSET ?
+                """, (match, limit, offset))
+            else:
+                conditions = ' AND '.join("search_text LIKE ?" for _ in words)
+                cursor.execute(f"""
+                    SELECT * FROM products
+                    WHERE is_active = 1 AND {conditions}
+                    ORDER BY sales_count DESC
+                    LIMIT ? OFFSET ?
+                """, [f'%{word}%' for word in words] + [limit, offset])
+            
+            return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"خطأ في البحث عن المنتجات: {e}")
+            return []
+    def _load_top_products(self, limit: int, offset: int) -> List[Dict]:
+        cursor = self._get_connection().cursor()
+        cursor.row_factory = Product.row_factory
+        cursor.execute("""
+            SELECT * FROM products
+            WHERE is_active = 1
+            ORDER BY sales_count DESC, id DESC
+            LIMIT ? OFFSET ?
+        """, (limit, offset))
+        return cursor.fetchall()
+    
+    def get_top_selling_products(self, limit: int = 10, offset: int = 0) -> List[Dict]:
+        """الحصول على المنتجات النشطة الأكثر مبيعاً"""
+        try:
+            return self.leaderboards.products.read(limit, offset, self._load_top_products)
+        except Exception as e:
+            logger.error(f"خطأ في جلب المنتجات الأكثر مبيعاً: {e}")
+            return []
+    
     def update_product(self, product_id: int, **kwargs) -> bool:
         """تحديث منتج"""
         try:
@@ -496,11 +517,26 @@ class Database:
                 return False
             
             values.append(product_id)
-            query = f"UPDATE products SET {', '.join(updates)}, updated_at = CURRENT_TIMESTAMP WHERE id = ?"
+            query = f"""
+                UPDATE products SET {', '.join(updates)}, updated_at = CURRENT_TIMESTAMP WHERE id = ?
+                RETURNING name, description, category, search_text
+            """
             
             cursor.execute(query, values)
+            row = cursor.fetchone()
+            updated = row is not None
+            if updated:
+                # نص البحث يُعاد حسابه في نفس المعاملة إذا تغير الاسم أو الوصف أو الفئة
+                search_text = product_search_text(row['name'], row['description'], row['category'])
+                if search_text != row['search_text']:
+                    cursor.execute("UPDATE products SET search_text = ? WHERE id = ?",
+                                   (search_text, product_id))
             conn.commit()
-            return cursor.rowcount > 0
+            if updated:
+                # إعادة تفعيل منتج قد تُدخله القائمة، وغير ذلك يمس صفه فقط
+                self.leaderboards.products.invalidate(None if 'is_active' in kwargs else product_id)
+                self._touch_catalog(product_id)
+            return updated
         except Exception as e:
             logger.error(f"خطأ في تحديث المنتج: {e}")
             return False
@@ -513,7 +549,11 @@ class Database:
             
             cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
             conn.commit()
-            return cursor.rowcount > 0
+            deleted = cursor.rowcount > 0
+            if deleted:
+                self.leaderboards.products.invalidate(product_id)
+                self._touch_catalog(product_id)
+            return deleted
         except Exception as e:
             logger.error(f"خطأ في حذف المنتج: {e}")
             return False
@@ -530,10 +570,15 @@ class Database:
             cursor.execute("""
                 UPDATE products SET stock = stock - 1
                 WHERE id = ? AND is_limited = 1 AND stock > 0
+                RETURNING stock
             """, (product_id,))
             
-            success = cursor.rowcount > 0
+            row = cursor.fetchone()
             conn.commit()
+            success = row is not None
+            if success:
+                self.leaderboards.products.update(product_id, stock=row['stock'])
+                self._touch_catalog(product_id)
             return success
         except Exception as e:
             conn.rollback()
@@ -631,8 +676,10 @@ class Database:
                   price, discount_amount, final_price))
             
             conn.commit()
+            self.order_counts.add('pending')
             return cursor.lastrowid
         except sqlite3.IntegrityError:
+            conn.rollback()
             logger.warning(f"طلب مكرر: {payment_id}")
             return None
         except Exception as e:
@@ -664,27 +711,35 @@ class Database:
             values.append(order_id)
             query = f"UPDATE orders SET {', '.join(updates)} WHERE id = ?"
             
+            # الحالة السابقة لنقل الطلب بين عدادات الحالات
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT status FROM orders WHERE id = ?", (order_id,))
+            row = cursor.fetchone()
             cursor.execute(query, values)
             conn.commit()
+            if row:
+                self.order_counts.move(row['status'], status)
             return True
         except Exception as e:
+            conn.rollback()
             logger.error(f"خطأ في تحديث الطلب: {e}")
             return False
     
-    def get_user_orders(self, user_id: int, limit: int = 10) -> List[Dict]:
-        """الحصول على طلبات المستخدم"""
+    def get_user_orders(self, user_id: int, limit: int = 10, offset: int = 0) -> List[Dict]:
+        """صفحة من طلبات المستخدم (الأحدث أولاً)"""
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = Order.row_factory
             
-            cursor.execute("""
-                SELECT * FROM orders
+            cursor.execute(f"""
+                SELECT {_ORDER_HISTORY_COLUMNS} FROM orders
                 WHERE user_id = ?
-                ORDER BY created_at DESC
-                LIMIT ?
-            """, (user_id, limit))
+                ORDER BY created_at DESC, id DESC
+                LIMIT ? OFFSET ?
+            """, (user_id, limit, offset))
             
-            return [dict(row) for row in cursor.fetchall()]
+            return cursor.fetchall()
         except Exception as e:
             logger.error(f"خطأ في جلب الطلبات: {e}")
             return []
@@ -694,35 +749,78 @@ class Database:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = Order.row_factory
 
             cursor.execute("SELECT * FROM orders WHERE id = ?", (order_id,))
-            row = cursor.fetchone()
-            if row:
-                return dict(row)
-            return None
+            return cursor.fetchone()
         except Exception as e:
             logger.error(f"خطأ في جلب الطلب: {e}")
             return None
     
     def get_all_orders(self, limit: int = 50) -> List[Dict]:
         """الحصول على جميع الطلبات"""
+        return self.get_order_feed(limit=limit)
+    
+    def get_order_feed(self, status: str = None, product_id: int = None,
+                       since: str = None, until: str = None,
+                       before_id: int = None, limit: int = 20) -> List[Dict]:
+        """صفحة من كل الطلبات (الأحدث أولاً)، والصفحة التالية تبدأ بعد before_id (آخر طلب معروض)"""
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = Order.row_factory
             
-            cursor.execute("""
+            # كل مرشح له فهرس يبدأ به ثم (created_at, id)، فالصفحة قراءة مدى من الفهرس
+            query = """
                 SELECT o.*, u.username
                 FROM orders o
                 LEFT JOIN users u ON o.user_id = u.user_id
-                ORDER BY o.created_at DESC
-                LIMIT ?
-            """, (limit,))
+                WHERE 1=1
+            """
+            params = []
+            
+            if status:
+                query += " AND o.status = ?"
+                params.append(status)
+            
+            if product_id:
+                query += " AND o.product_id = ?"
+                params.append(product_id)
+            
+            if since:
+                query += " AND o.created_at >= ?"
+                params.append(since)
+            
+            if until:
+                query += " AND o.created_at < ?"
+                params.append(until)
+            
+            if before_id:
+                query += " AND (o.created_at, o.id) < (SELECT created_at, id FROM orders WHERE id = ?)"
+                params.append(before_id)
+            
+            query += " ORDER BY o.created_at DESC, o.id DESC LIMIT ?"
+            params.append(limit)
             
-            return [dict(row) for row in cursor.fetchall()]
+            cursor.execute(query, params)
+            return cursor.fetchall()
         except Exception as e:
             logger.error(f"خطأ في جلب الطلبات: {e}")
             return []
     
+    def _load_order_counts(self) -> Dict[str, int]:
+        cursor = self._get_connection().cursor()
+        cursor.execute("SELECT status, COUNT(*) AS count FROM orders GROUP BY status")
+        return {row['status']: row['count'] for row in cursor.fetchall()}
+    
+    def get_order_status_counts(self) -> Dict[str, int]:
+        """عدد الطلبات لكل حالة (من الذاكرة، ويُحدَّث مع إنشاء الطلبات وتغيير حالتها)"""
+        try:
+            return self.order_counts.read(self._load_order_counts)
+        except Exception as e:
+            logger.error(f"خطأ في عد الطلبات: {e}")
+            return {}
+    
     def complete_purchase(self, user_id: int, product_id: int, price: int) -> bool:
         """تحديث إحصائيات الشراء"""
         try:
@@ -733,20 +831,32 @@ class Database:
             
             # تحديث بيانات المستخدم
             cursor.execute("""
-                UPDATE users 
+                UPDATE user_stats 
                 SET total_spent = total_spent + ?, 
                     total_purchases = total_purchases + 1
                 WHERE user_id = ?
+                RETURNING total_spent, total_purchases
             """, (price, user_id))
+            spent = cursor.fetchone()
             
             # تحديث مبيعات المنتج
             cursor.execute("""
                 UPDATE products
                 SET sales_count = sales_count + 1
                 WHERE id = ?
+                RETURNING sales_count
             """, (product_id,))
+            sold = cursor.fetchone()
             
             conn.commit()
+            boards = self.leaderboards
+            if spent:
+                boards.spend.offer(user_id, spent['total_spent'],
+                                   total_purchases=spent['total_purchases'])
+                boards.balance.update(user_id, total_spent=spent['total_spent'])
+            if sold:
+                boards.products.offer(product_id, sold['sales_count'])
+            self._touch_catalog(product_id)
             return True
         except Exception as e:
             conn.rollback()
@@ -779,6 +889,7 @@ class Database:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = LogEntry.row_factory
             
             query = "SELECT * FROM logs WHERE 1=1"
             params = []
@@ -795,7 +906,7 @@ class Database:
             params.append(limit)
             
             cursor.execute(query, params)
-            return [dict(row) for row in cursor.fetchall()]
+            return cursor.fetchall()
         except Exception as e:
             logger.error(f"خطأ في جلب السجلات: {e}")
             return []
@@ -816,7 +927,7 @@ class Database:
             
             # المستخدمون النشطون (آخر 24 ساعة)
             cursor.execute("""
-                SELECT COUNT(*) as count FROM users
+                SELECT COUNT(*) as count FROM user_stats
                 WHERE last_activity >= datetime('now', '-1 day')
             """)
             stats['active_users_24h'] = cursor.fetchone()['count']
@@ -828,30 +939,18 @@ class Database:
             """)
             stats['total_revenue'] = cursor.fetchone()['total']
             
-            # عدد الطلبات
-            cursor.execute("SELECT COUNT(*) as count FROM orders")
-            stats['total_orders'] = cursor.fetchone()['count']
-            
-            # الطلبات المكتملة
-            cursor.execute("""
-                SELECT COUNT(*) as count FROM orders 
-                WHERE status = 'completed'
-            """)
-            stats['completed_orders'] = cursor.fetchone()['count']
+            # عدد الطلبات والمكتملة منها
+            counts = self.order_counts.read(self._load_order_counts)
+            stats['total_orders'] = sum(counts.values())
+            stats['completed_orders'] = counts.get('completed', 0)
             
             # عدد المنتجات
             cursor.execute("SELECT COUNT(*) as count FROM products WHERE is_active = 1")
             stats['active_products'] = cursor.fetchone()['count']
             
-            # أكثر المنتجات مبيعاً
-            cursor.execute("""
-                SELECT id, name, sales_count, price
-                FROM products
-                WHERE is_active = 1
-                ORDER BY sales_count DESC
-                LIMIT 5
-            """)
-            stats['top_products'] = [dict(row) for row in cursor.fetchall()]
+            # أكثر المنتجات مبيعاً والأعلى إنفاقاً (من قوائم الأعلى)
+            stats['top_products'] = self.leaderboards.products.read(5, 0, self._load_top_products)
+            stats['top_spenders'] = self.leaderboards.spend.read(5, 0, self._load_top_spenders)
             
             return stats
         except Exception as e:
@@ -1019,6 +1118,98 @@ class Database:
             logger.error(f"خطأ في جلب الإعدادات: {e}")
             return {}
     
+    # ==================== حالة المحادثات (user_data) ====================
+    
+    def get_user_states(self) -> Dict[int, str]:
+        """جميع حالات المحادثات المحفوظة (نص JSON لكل مستخدم)"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT user_id, data FROM user_state")
+            return {row['user_id']: row['data'] for row in cursor.fetchall()}
+        except Exception as e:
+            logger.error(f"خطأ في جلب حالات المحادثات: {e}")
+            return {}
+    
+    def get_user_state(self, user_id: int) -> Optional[str]:
+        """حالة محادثة مستخدم واحد (نص JSON)"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT data FROM user_state WHERE user_id = ?", (user_id,))
+            row = cursor.fetchone()
+            return row['data'] if row else None
+        except Exception as e:
+            logger.error(f"خطأ في جلب حالة المحادثة: {e}")
+            return None
+    
+    def save_user_states(self, states: Dict[int, Optional[str]]) -> bool:
+        """حفظ عدة حالات في معاملة واحدة (None = حذف الحالة)"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            cursor.executemany("""
+                INSERT INTO user_state (user_id, data)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    data = excluded.data,
+                    updated_at = CURRENT_TIMESTAMP
+            """, [(user_id, data) for user_id, data in states.items() if data is not None])
+            cursor.executemany(
+                "DELETE FROM user_state WHERE user_id = ?",
+                [(user_id,) for user_id, data in states.items() if data is None]
+            )
+            
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"خطأ في حفظ حالات المحادثات: {e}")
+            return False
+    
+    # ==================== أقفال المهام المشتركة ====================
+    
+    def acquire_job_lock(self, name: str, owner: str, ttl: float) -> bool:
+        """حجز قفل مهمة عامة (بث، نسخ احتياطي) أو تمديده إن كان لنفس المالك"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            now = time.time()
+            cursor.execute("""
+                INSERT INTO job_locks (name, owner, expires_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    owner = excluded.owner,
+                    expires_at = excluded.expires_at
+                WHERE job_locks.expires_at < ? OR job_locks.owner = excluded.owner
+            """, (name, owner, now + ttl, now))
+            acquired = cursor.rowcount == 1
+            
+            conn.commit()
+            return acquired
+        except Exception as e:
+            logger.error(f"خطأ في حجز قفل المهمة: {e}")
+            return False
+    
+    def release_job_lock(self, name: str, owner: str) -> bool:
+        """تحرير قفل مهمة (فقط إن كان لنفس المالك)"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute("DELETE FROM job_locks WHERE name = ? AND owner = ?", (name, owner))
+            released = cursor.rowcount == 1
+            
+            conn.commit()
+            return released
+        except Exception as e:
+            logger.error(f"خطأ في تحرير قفل المهمة: {e}")
+            return False
+    
     # ==================== دوال الفئات ====================
     
     def add_category(self, name: str, description: str = None, icon: str = '📦') -> bool:
@@ -1043,17 +1234,53 @@ class Database:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = Row.row_factory
             
             cursor.execute("""
                 SELECT * FROM categories WHERE is_active = 1
                 ORDER BY name
             """)
             
-            return [dict(row) for row in cursor.fetchall()]
+            return cursor.fetchall()
         except Exception as e:
             logger.error(f"خطأ في جلب الفئات: {e}")
             return []
     
+    def get_category_counts(self) -> List[Dict]:
+        """الفئات التي تحتوي منتجات نشطة مع عدد منتجاتها (id, name, count)"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.row_factory = Row.row_factory
+            
+            cursor.execute("""
+                SELECT id, category AS name, active_count AS count
+                FROM category_counts WHERE active_count > 0
+                ORDER BY category
+            """)
+            
+            return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"خطأ في جلب أعداد الفئات: {e}")
+            return []
+    
+    def get_category_count(self, category_id: int) -> Optional[Dict]:
+        """فئة واحدة مع عدد منتجاتها النشطة"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.row_factory = Row.row_factory
+            
+            cursor.execute("""
+                SELECT id, category AS name, active_count AS count
+                FROM category_counts WHERE id = ?
+            """, (category_id,))
+            
+            return cursor.fetchone()
+        except Exception as e:
+            logger.error(f"خطأ في جلب الفئة: {e}")
+            return None
+    
     # ==================== دوال التصدير ====================
     
     def export_data(self, table: str) -> List[Dict]:
@@ -1061,56 +1288,81 @@ class Database:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = _EXPORT_KINDS.get(table, Row).row_factory
             
-            cursor.execute(f"SELECT * FROM {table}")
-            return [dict(row) for row in cursor.fetchall()]
+            if table == 'users':
+                cursor.execute(f"SELECT {_USER_COLUMNS} FROM {_USER_FROM}")
+            else:
+                cursor.execute(f"SELECT * FROM {table}")
+            return cursor.fetchall()
         except Exception as e:
             logger.error(f"خطأ في تصدير البيانات: {e}")
             return []
     
     # ==================== دوال الرصيد والمحفظة ====================
     
-    def add_user_balance(self, user_id: int, amount: int) -> bool:
-        """إضافة رصيد للمستخدم"""
+    def _apply_balance(self, cursor, user_id: int, delta: int, reason: str,
+                       idempotency_key: str = None) -> Optional[int]:
+        """تطبيق حركة رصيد داخل معاملة المستدعي وإلحاقها بالسجل
+        (يُرجع الرصيد بعد الحركة، أو None إذا لم يوجد المستخدم أو لم يكفِ الرصيد)"""
+        cursor.execute("""
+            UPDATE user_stats SET balance = balance + ?
+            WHERE user_id = ? AND balance + ? >= 0
+            RETURNING balance
+        """, (delta, user_id, delta))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        
+        cursor.execute("""
+            INSERT INTO balance_ledger (user_id, delta, balance_after, reason, idempotency_key)
+            VALUES (?, ?, ?, ?, ?)
+        """, (user_id, delta, row['balance'], reason, idempotency_key))
+        return row['balance']
+    
+    def _post_balance(self, entries: List[tuple], idempotency_key: str = None) -> bool:
+        """تطبيق حركات (user_id, delta, reason) كلها أو لا شيء، والمفتاح يُحفظ مع أول حركة"""
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
             
-            cursor.execute("BEGIN EXCLUSIVE")
+            cursor.execute("BEGIN IMMEDIATE")
             
-            cursor.execute("""
-                UPDATE users SET balance = balance + ?
-                WHERE user_id = ?
-            """, (amount, user_id))
+            # الحركة طُبقت سابقاً (إعادة إرسال الدفع مثلاً)
+            if idempotency_key is not None:
+                cursor.execute("SELECT 1 FROM balance_ledger WHERE idempotency_key = ?",
+                               (idempotency_key,))
+                if cursor.fetchone():
+                    conn.rollback()
+                    return True
+            
+            balances = []
+            for index, (user_id, delta, reason) in enumerate(entries):
+                key = idempotency_key if index == 0 else None
+                balance = self._apply_balance(cursor, user_id, delta, reason, key)
+                if balance is None:
+                    conn.rollback()
+                    return False
+                balances.append((user_id, balance))
             
-            success = cursor.rowcount > 0
             conn.commit()
-            return success
+            for user_id, balance in balances:
+                self.leaderboards.balance.offer(user_id, balance)
+            return True
         except Exception as e:
             conn.rollback()
-            logger.error(f"خطأ في إضافة الرصيد: {e}")
+            logger.error(f"خطأ في تسجيل حركة الرصيد: {e}")
             return False
     
-    def subtract_user_balance(self, user_id: int, amount: int) -> bool:
+    def add_user_balance(self, user_id: int, amount: int, reason: str = 'deposit',
+                         idempotency_key: str = None) -> bool:
+        """إضافة رصيد للمستخدم"""
+        return self._post_balance([(user_id, amount, reason)], idempotency_key)
+    
+    def subtract_user_balance(self, user_id: int, amount: int, reason: str = 'withdraw',
+                              idempotency_key: str = None) -> bool:
         """خصم رصيد من المستخدم"""
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("BEGIN EXCLUSIVE")
-            
-            cursor.execute("""
-                UPDATE users SET balance = balance - ?
-                WHERE user_id = ? AND balance >= ?
-            """, (amount, user_id, amount))
-            
-            success = cursor.rowcount > 0
-            conn.commit()
-            return success
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"خطأ في خصم الرصيد: {e}")
-            return False
+        return self._post_balance([(user_id, -amount, reason)], idempotency_key)
     
     def get_user_balance(self, user_id: int) -> int:
         """الحصول على رصيد المستخدم"""
@@ -1119,7 +1371,7 @@ class Database:
             cursor = conn.cursor()
             
             cursor.execute("""
-                SELECT balance FROM users WHERE user_id = ?
+                SELECT balance FROM user_stats WHERE user_id = ?
             """, (user_id,))
             
             row = cursor.fetchone()
@@ -1130,80 +1382,156 @@ class Database:
             logger.error(f"خطأ في جلب الرصيد: {e}")
             return 0
     
-    def transfer_balance(self, from_user: int, to_user: int, amount: int) -> bool:
+    def transfer_balance(self, from_user: int, to_user: int, amount: int,
+                         idempotency_key: str = None) -> bool:
         """تحويل رصيد بين مستخدمين"""
+        if amount <= 0:
+            return False
+        return self._post_balance([(from_user, -amount, 'transfer_out'),
+                                   (to_user, amount, 'transfer_in')], idempotency_key)
+    
+    def get_balance_history(self, user_id: int, limit: int = 20) -> List[Dict]:
+        """آخر حركات رصيد المستخدم (الأحدث أولاً)"""
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = Row.row_factory
             
-            cursor.execute("BEGIN EXCLUSIVE")
-            
-            # التحقق من أن المستخدم الأول لديه رصيد كافي
             cursor.execute("""
-                SELECT balance FROM users WHERE user_id = ?
-            """, (from_user,))
-            
-            row = cursor.fetchone()
-            if not row or row['balance'] < amount:
-                conn.rollback()
-                return False
-            
-            # خصم من المستخدم الأول
-            cursor.execute("""
-                UPDATE users SET balance = balance - ?
+                SELECT id, delta, balance_after, reason, created_at
+                FROM balance_ledger
                 WHERE user_id = ?
-            """, (amount, from_user))
-            
-            # إضافة للمستخدم الثاني
-            cursor.execute("""
-                UPDATE users SET balance = balance + ?
-                WHERE user_id = ?
-            """, (amount, to_user))
+                ORDER BY id DESC
+                LIMIT ?
+            """, (user_id, limit))
             
-            conn.commit()
-            return True
+            return cursor.fetchall()
         except Exception as e:
-            conn.rollback()
-            logger.error(f"خطأ في تحويل الرصيد: {e}")
-            return False
+            logger.error(f"خطأ في جلب سجل الرصيد: {e}")
+            return []
     
-    def get_top_users_by_balance(self, limit: int = 10) -> List[Dict]:
-        """الحصول على أعلى المستخدمين برصيد"""
+    def compact_balance_ledger(self, older_than_days: int, batch_size: int = 500) -> int:
+        """دمج الحركات الأقدم من المدة في سطر snapshot واحد لكل مستخدم (دفعات قصيرة من المستخدمين)"""
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
             
+            cutoff = cursor.execute("SELECT datetime('now', ?)",
+                                    (f'{-int(older_than_days)} days',)).fetchone()[0]
             cursor.execute("""
-                SELECT user_id, username, first_name, balance, total_spent
-                FROM users
-                WHERE balance > 0
-                ORDER BY balance DESC
-                LIMIT ?
-            """, (limit,))
+                SELECT user_id FROM balance_ledger
+                WHERE created_at < ?
+                GROUP BY user_id HAVING COUNT(*) > 1
+            """, (cutoff,))
+            users = [row['user_id'] for row in cursor.fetchall()]
+            
+            removed = 0
+            for start in range(0, len(users), batch_size):
+                batch = users[start:start + batch_size]
+                placeholders = ','.join('?' * len(batch))
+                cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    # آخر حركة قديمة تحمل الرصيد بعدها، فتصبح سطراً افتتاحياً بمجموع ما قبلها
+                    cursor.execute(f"""
+                        SELECT user_id, MAX(id) AS last_id, SUM(delta) AS total
+                        FROM balance_ledger
+                        WHERE user_id IN ({placeholders}) AND created_at < ?
+                        GROUP BY user_id HAVING COUNT(*) > 1
+                    """, batch + [cutoff])
+                    groups = cursor.fetchall()
+                    cursor.executemany("""
+                        UPDATE balance_ledger
+                        SET delta = ?, reason = 'snapshot', idempotency_key = NULL
+                        WHERE id = ?
+                    """, [(group['total'], group['last_id']) for group in groups])
+                    cursor.executemany("""
+                        DELETE FROM balance_ledger WHERE user_id = ? AND id < ?
+                    """, [(group['user_id'], group['last_id']) for group in groups])
+                    removed += cursor.rowcount
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
             
-            return [dict(row) for row in cursor.fetchall()]
+            return removed
+        except Exception as e:
+            logger.error(f"خطأ في دمج سجل الرصيد: {e}")
+            return 0
+    
+    def _load_top_balances(self, limit: int, offset: int) -> List[Dict]:
+        cursor = self._get_connection().cursor()
+        cursor.row_factory = User.row_factory
+        cursor.execute("""
+            SELECT s.user_id, u.username, u.first_name, s.balance, s.total_spent
+            FROM user_stats s
+            JOIN users u ON u.user_id = s.user_id
+            WHERE s.balance > 0
+            ORDER BY s.balance DESC, s.user_id DESC
+            LIMIT ? OFFSET ?
+        """, (limit, offset))
+        return cursor.fetchall()
+    
+    def _load_top_spenders(self, limit: int, offset: int) -> List[Dict]:
+        cursor = self._get_connection().cursor()
+        cursor.row_factory = User.row_factory
+        cursor.execute("""
+            SELECT s.user_id, u.username, u.first_name, s.total_spent, s.total_purchases
+            FROM user_stats s
+            JOIN users u ON u.user_id = s.user_id
+            WHERE s.total_spent > 0
+            ORDER BY s.total_spent DESC, s.user_id DESC
+            LIMIT ? OFFSET ?
+        """, (limit, offset))
+        return cursor.fetchall()
+    
+    def get_top_users_by_balance(self, limit: int = 10) -> List[Dict]:
+        """الحصول على أعلى المستخدمين برصيد"""
+        try:
+            return self.leaderboards.balance.read(limit, 0, self._load_top_balances)
         except Exception as e:
             logger.error(f"خطأ في جلب المستخدمين برصيد: {e}")
             return []
     
+    def get_top_users_by_spend(self, limit: int = 10) -> List[Dict]:
+        """الحصول على أعلى المستخدمين إنفاقاً"""
+        try:
+            return self.leaderboards.spend.read(limit, 0, self._load_top_spenders)
+        except Exception as e:
+            logger.error(f"خطأ في جلب المستخدمين الأعلى إنفاقاً: {e}")
+            return []
+    
     def reset_all_balances(self) -> bool:
         """إعادة تعيين جميع الأرصدة (للاختبار/الإدارة)"""
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
             
-            cursor.execute("UPDATE users SET balance = 0")
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                INSERT INTO balance_ledger (user_id, delta, balance_after, reason)
+                SELECT user_id, -balance, 0, 'reset' FROM user_stats WHERE balance != 0
+            """)
+            cursor.execute("UPDATE user_stats SET balance = 0 WHERE balance != 0")
             conn.commit()
+            self.leaderboards.balance.invalidate()
             return True
         except Exception as e:
+            conn.rollback()
             logger.error(f"خطأ في إعادة تعيين الأرصدة: {e}")
             return False
     
     # ==================== دوال النسخ الاحتياطي والتصدير الإضافية ====================
     
+    def copy_to(self, path: str) -> None:
+        """نسخة متسقة من قاعدة البيانات إلى ملف (آمنة أثناء الكتابة)"""
+        target = sqlite3.connect(path)
+        try:
+            self._get_connection().backup(target)
+        finally:
+            target.close()
+    
     def backup_database(self, backup_path: str = None) -> Optional[str]:
         """نسخ احتياطي لقاعدة البيانات"""
-        import shutil
         import os
         from datetime import datetime
         
@@ -1216,8 +1544,8 @@ class Database:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_file = os.path.join(backup_path, f"backup_{timestamp}.db")
             
-            # نسخ قاعدة البيانات
-            shutil.copy2(self.db_name, backup_file)
+            # نسخ قاعدة البيانات عبر واجهة النسخ في SQLite (تشمل ما في ملف WAL)
+            self.copy_to(backup_file)
             
             logger.info(f"تم إنشاء نسخة احتياطية: {backup_file}")
             return backup_file
@@ -1252,16 +1580,6 @@ class Database:
             import uuid, json
             donation_url = f"donate_{uuid.uuid4().hex[:10]}"
 
-            # Ensure donations table has donation_options column
-            try:
-                cursor.execute("SELECT donation_options FROM donations LIMIT 1")
-            except Exception:
-                try:
-                    cursor.execute("ALTER TABLE donations ADD COLUMN donation_options TEXT DEFAULT NULL")
-                    conn.commit()
-                except Exception:
-                    pass
-
             cursor.execute("""
                 INSERT INTO donations 
                 (donor_id, amount, donation_url, description, donation_options)
@@ -1270,6 +1588,7 @@ class Database:
             
             conn.commit()
             donation_id = cursor.lastrowid
+            self.leaderboards.campaigns.offer(donation_id, 0)
             
             logger.info(f"تم إنشاء حملة تبرع جديدة: {donation_id}")
             return donation_id
@@ -1282,63 +1601,104 @@ class Database:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = Donation.row_factory
             
             cursor.execute("SELECT * FROM donations WHERE id = ?", (donation_id,))
-            row = cursor.fetchone()
-            
-            if row:
-                return dict(row)
-            return None
+            return cursor.fetchone()
         except Exception as e:
             logger.error(f"خطأ في جلب حملة التبرع: {e}")
             return None
     
     def add_donation_contribution(self, donation_id: int, contributor_id: int, 
-                                 amount: int) -> bool:
+                                 amount: int, payment_id: str = None) -> bool:
         """إضافة مساهمة لحملة تبرع"""
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
             
-            cursor.execute("BEGIN EXCLUSIVE")
+            cursor.execute("BEGIN IMMEDIATE")
             
-            # إضافة السجل
+            # إضافة السجل (مرة واحدة لكل معرف دفع)
             cursor.execute("""
                 INSERT INTO donation_records
-                (donation_id, contributor_id, amount)
-                VALUES (?, ?, ?)
-            """, (donation_id, contributor_id, amount))
+                (donation_id, contributor_id, amount, payment_id)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT DO NOTHING
+                RETURNING id
+            """, (donation_id, contributor_id, amount, payment_id))
+            if cursor.fetchone() is None:
+                # دفع سبق تسجيله (تحديث أُعيد تسليمه)
+                conn.rollback()
+                return True
             
             # تحديث المجموع
             cursor.execute("""
                 UPDATE donations
                 SET total_received = total_received + ?
                 WHERE id = ?
+                RETURNING id, amount, total_received
             """, (amount, donation_id))
+            totals = cursor.fetchall()
             
-            # إضافة نقاط للمساهمة (1 نقطة لكل نجمة)
-            self.add_user_points(contributor_id, amount)
+            # إضافة نقاط للمساهمة (1 نقطة لكل نجمة) في نفس المعاملة
+            self._accrue_points(cursor, [(contributor_id, amount)])
             
             conn.commit()
+            self._offer_campaigns(totals)
             return True
         except Exception as e:
             conn.rollback()
             logger.error(f"خطأ في إضافة مساهمة: {e}")
             return False
     
+    def add_donation_contributions(self, contributions: List[tuple]) -> int:
+        """إضافة مساهمات (donation_id, contributor_id, amount) دفعة واحدة (للاستيراد والتسوية)
+        ويُرجع عدد المساهمات المضافة"""
+        if not contributions:
+            return 0
+        
+        # تحديث واحد لكل حملة ولكل مساهم مهما كان عدد المساهمات
+        totals: Dict[int, int] = {}
+        points: Dict[int, int] = {}
+        for donation_id, contributor_id, amount in contributions:
+            totals[donation_id] = totals.get(donation_id, 0) + amount
+            points[contributor_id] = points.get(contributor_id, 0) + amount
+        
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.executemany("""
+                INSERT INTO donation_records (donation_id, contributor_id, amount)
+                VALUES (?, ?, ?)
+            """, contributions)
+            updated = []
+            for donation_id, total in totals.items():
+                cursor.execute("""
+                    UPDATE donations SET total_received = total_received + ? WHERE id = ?
+                    RETURNING id, amount, total_received
+                """, (total, donation_id))
+                updated.extend(cursor.fetchall())
+            self._accrue_points(cursor, points.items())
+            conn.commit()
+            self._offer_campaigns(updated)
+            return len(contributions)
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"خطأ في إضافة المساهمات: {e}")
+            return 0
+    
     def get_donation_by_url(self, donation_url: str) -> Optional[Dict]:
         """جلب حملة تبرع من الرابط"""
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = Donation.row_factory
             
             cursor.execute("SELECT * FROM donations WHERE donation_url = ?", 
                           (donation_url,))
-            row = cursor.fetchone()
-            
-            if row:
-                return dict(row)
-            return None
+            return cursor.fetchone()
         except Exception as e:
             logger.error(f"خطأ في جلب الحملة: {e}")
             return None
@@ -1348,6 +1708,7 @@ class Database:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = Donation.row_factory
             
             cursor.execute("""
                 SELECT * FROM donations
@@ -1355,42 +1716,66 @@ class Database:
                 ORDER BY created_at DESC
             """, (user_id,))
             
-            return [dict(row) for row in cursor.fetchall()]
+            return cursor.fetchall()
         except Exception as e:
             logger.error(f"خطأ في جلب الحملات: {e}")
             return []
     
     # ==================== دوال النقاط ====================
     
+    def _accrue_points(self, cursor, accruals) -> None:
+        """إضافة نقاط (user_id, points) بجملة UPSERT واحدة لكل مستخدم داخل معاملة المستدعي (بلا commit)"""
+        cursor.executemany("""
+            INSERT INTO user_points (user_id, points, total_earned)
+            VALUES (?1, ?2, ?2)
+            ON CONFLICT(user_id) DO UPDATE
+            SET points = points + excluded.points,
+                total_earned = total_earned + excluded.total_earned,
+                updated_at = CURRENT_TIMESTAMP
+        """, accruals)
+    
     def add_user_points(self, user_id: int, points: int) -> bool:
         """إضافة نقاط للمستخدم"""
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
             
-            cursor.execute("""
-                INSERT OR IGNORE INTO user_points (user_id, points, total_earned)
-                VALUES (?, 0, 0)
-            """, (user_id,))
-            
-            cursor.execute("""
-                UPDATE user_points
-                SET points = points + ?,
-                    total_earned = total_earned + ?
-                WHERE user_id = ?
-            """, (points, points, user_id))
-            
+            cursor.execute("BEGIN IMMEDIATE")
+            self._accrue_points(cursor, [(user_id, points)])
             conn.commit()
             return True
         except Exception as e:
+            conn.rollback()
             logger.error(f"خطأ في إضافة نقاط: {e}")
             return False
     
+    def get_points_leaderboard(self, limit: int = 10) -> List[Dict]:
+        """أعلى المستخدمين في النقاط المكتسبة (من فهرس الترتيب دون فرز الجدول)"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.row_factory = Row.row_factory
+            
+            cursor.execute("""
+                SELECT p.user_id, u.username, u.first_name, p.points, p.total_earned
+                FROM user_points p
+                LEFT JOIN users u ON u.user_id = p.user_id
+                WHERE p.total_earned > 0
+                ORDER BY p.total_earned DESC, p.user_id
+                LIMIT ?
+            """, (limit,))
+            
+            return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"خطأ في جلب ترتيب النقاط: {e}")
+            return []
+    
     def get_user_points(self, user_id: int) -> Dict:
         """جلب نقاط المستخدم"""
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = Row.row_factory
             
             cursor.execute("""
                 SELECT * FROM user_points WHERE user_id = ?
@@ -1398,7 +1783,7 @@ class Database:
             
             row = cursor.fetchone()
             if row:
-                return dict(row)
+                return row
             
             # إنشاء سجل جديد إذا لم يكن موجوداً
             cursor.execute("""
@@ -1447,10 +1832,10 @@ class Database:
             """, (points, stars, user_id))
             
             # إضافة النجوم
-            cursor.execute("""
-                UPDATE users SET balance = balance + ?
-                WHERE user_id = ?
-            """, (stars, user_id))
+            balance = self._apply_balance(cursor, user_id, stars, 'points_exchange')
+            if balance is None:
+                conn.rollback()
+                return False
             
             # تسجيل السجل
             cursor.execute("""
@@ -1460,6 +1845,7 @@ class Database:
             """, (user_id, points, stars, exchange_rate))
             
             conn.commit()
+            self.leaderboards.balance.offer(user_id, balance)
             return True
         except Exception as e:
             conn.rollback()
@@ -1471,6 +1857,7 @@ class Database:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = Row.row_factory
             
             cursor.execute("""
                 SELECT * FROM points_exchange_history
@@ -1479,21 +1866,23 @@ class Database:
                 LIMIT ?
             """, (user_id, limit))
             
-            return [dict(row) for row in cursor.fetchall()]
+            return cursor.fetchall()
         except Exception as e:
             logger.error(f"خطأ في جلب السجل: {e}")
             return []
     
-    def add_donation_to_bot(self, user_id: int, amount: int, username: str = None) -> bool:
-        """إضافة تبرع للبوت"""
+    def add_donation_to_bot(self, user_id: int, amount: int, username: str = None,
+                            payment_id: str = None) -> bool:
+        """إضافة تبرع للبوت (مرة واحدة لكل معرف دفع)"""
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
             
             cursor.execute("""
-                INSERT INTO bot_donations (user_id, amount, username)
-                VALUES (?, ?, ?)
-            """, (user_id, amount, username))
+                INSERT INTO bot_donations (user_id, amount, username, payment_id)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT DO NOTHING
+            """, (user_id, amount, username, payment_id))
             
             conn.commit()
             return True
@@ -1543,6 +1932,7 @@ class Database:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            cursor.row_factory = Row.row_factory
             
             cursor.execute("""
                 SELECT * FROM bot_donations
@@ -1550,7 +1940,7 @@ class Database:
                 LIMIT ?
             """, (limit,))
             
-            return [dict(row) for row in cursor.fetchall()]
+            return cursor.fetchall()
         except Exception as e:
             logger.error(f"خطأ في جلب التبرعات: {e}")
             return []
@@ -1603,28 +1993,60 @@ class Database:
             logger.error(f"خطأ في جلب إحصائيات الحملة: {e}")
             return {}
     
+    def _offer_campaigns(self, totals) -> None:
+        """تمرير المجاميع الجديدة (id, amount, total_received) لقائمة أفضل الحملات"""
+        for row in totals:
+            percentage = row['total_received'] / row['amount'] * 100 if row['amount'] else None
+            self.leaderboards.campaigns.offer(row['id'], row['total_received'], percentage=percentage)
+    
+    def _load_top_campaigns(self, limit: int, offset: int) -> List[Dict]:
+        cursor = self._get_connection().cursor()
+        cursor.row_factory = Donation.row_factory
+        cursor.execute("""
+            SELECT id, description, amount, total_received,
+                   (CAST(total_received AS FLOAT) / amount * 100) as percentage,
+                   donor_id, created_at
+            FROM donations
+            WHERE status = 'active'
+            ORDER BY total_received DESC, id DESC
+            LIMIT ? OFFSET ?
+        """, (limit, offset))
+        return cursor.fetchall()
+    
     def get_top_campaigns(self, limit: int = 10) -> List[Dict]:
         """جلب أفضل حملات التبرع"""
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, description, amount, total_received,
-                       (CAST(total_received AS FLOAT) / amount * 100) as percentage,
-                       donor_id, created_at
-                FROM donations
-                WHERE status = 'active'
-                ORDER BY total_received DESC
-                LIMIT ?
-            """, (limit,))
-            
-            return [dict(row) for row in cursor.fetchall()]
+            return self.leaderboards.campaigns.read(limit, 0, self._load_top_campaigns)
         except Exception as e:
             logger.error(f"خطأ في جلب أفضل الحملات: {e}")
             return []
 
+    def checkpoint(self) -> bool:
+        """دمج ملف WAL في قاعدة البيانات وتفريغه"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            busy, _, _ = cursor.fetchone()
+            return busy == 0
+        except Exception as e:
+            logger.error(f"خطأ في دمج سجل WAL: {e}")
+            return False
+    
     def close(self):
         """إغلاق الاتصال"""
         if hasattr(self.local, 'conn'):
-            self.local.conn.close()
+            conn = self.local.conn
+            if conn in self._connections:
+                self._connections.remove(conn)
+            conn.close()
+    
+    def close_all(self):
+        """إغلاق اتصالات كل الخيوط (عند إيقاف البوت)"""
+        for conn in list(self._connections):
+            try:
+                conn.close()
+            except Exception as e:
+                logger.error(f"خطأ في إغلاق اتصال قاعدة البيانات: {e}")
+        self._connections.clear()
+        self.local = threading.local()
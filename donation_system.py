@@ -11,11 +11,11 @@ import logging
 from datetime import datetime
 import uuid
 
-from database import Database
+from storage import get_storage
 import config
 
 logger = logging.getLogger(__name__)
-db = Database(config.DATABASE_NAME)
+db = get_storage()
 
 
 class DonationSystem:
@@ -157,7 +157,7 @@ class DonationSystem:
                     pass
             
             # تسجيل المحاولة
-            db.add_log('donation', user.id, 'donation_initiated', f'محاولة تبرع: {amount} نجمة')
+            await db.aio.add_log('donation', user.id, 'donation_initiated', f'محاولة تبرع: {amount} نجمة')
             
             if is_callback:
                 await query.answer(f"✅ تم إنشاء فاتورة التبرع بـ {amount}⭐", show_alert=True)
@@ -171,7 +171,7 @@ class DonationSystem:
                 await query.answer(error_msg, show_alert=True)
             else:
                 await update.message.reply_text(error_msg)
-            db.add_log('donation', user.id, 'donation_error', f'خطأ: {str(e)}')
+            await db.aio.add_log('donation', user.id, 'donation_error', f'خطأ: {str(e)}')
     
     @staticmethod
     async def handle_donation_payment_success(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -195,10 +195,11 @@ class DonationSystem:
                 amount = int(total)
             
             # إضافة المساهمة في جدول التبرعات
-            db.add_donation_to_bot(
+            await db.aio.add_donation_to_bot(
                 user_id=user.id,
                 amount=amount,
-                username=user.username or user.first_name
+                username=user.username or user.first_name,
+                payment_id=payment.telegram_payment_charge_id
             )
             
             # إرسال رسالة شكر
@@ -232,12 +233,12 @@ class DonationSystem:
                     pass
             
             # تسجيل
-            db.add_log('donation', user.id, 'donation_successful', f'تبرع ناجح: {amount} نجمة')
+            await db.aio.add_log('donation', user.id, 'donation_successful', f'تبرع ناجح: {amount} نجمة')
             
         except Exception as e:
             logger.error(f"خطأ في معالجة دفع التبرع: {e}")
             await message.reply_text("❌ حدث خطأ في معالجة التبرع!")
-            db.add_log('donation', user.id, 'donation_error', f'خطأ في المعالجة: {str(e)}')
+            await db.aio.add_log('donation', user.id, 'donation_error', f'خطأ في المعالجة: {str(e)}')
     
     @staticmethod
     async def show_donation_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -245,7 +246,7 @@ class DonationSystem:
         query = update.callback_query
         
         try:
-            stats = db.get_donation_stats()
+            stats = await db.aio.get_donation_stats()
             
             stats_text = (
                 f"🎁 <b>إحصائيات التبرعات</b>\n\n"
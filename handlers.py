@@ -4,31 +4,48 @@ Handlers Module
 معالجات الرسائل والأوامر
 """
 
-from telegram import Update, LabeledPrice
+from telegram import (
+    Update, LabeledPrice,
+    InlineKeyboardButton, InlineKeyboardMarkup,
+    InlineQueryResultArticle, InputTextMessageContent
+)
 from telegram.ext import ContextTypes
 from telegram.error import TelegramError
 import logging
 from datetime import datetime
 import os
 import csv
+import html
 import time
 import asyncio
 
-from database import Database
+from database import normalize_search_text
+from storage import get_storage
 from keyboards import Keyboards
 from donation_system import DonationSystem
 from utils import (
     is_admin, check_banned, check_maintenance,
     format_product_info, format_user_info,
-    format_order_info, check_rate_limit
+    format_order_info, format_balance_entry, check_rate_limit
 )
 import config
+import instrumentation
+import profiler
+from lifecycle import lifecycle
+from cluster import JobLock
+from metrics import BROADCAST_MESSAGES, cache_hit
 
 logger = logging.getLogger(__name__)
-db = Database(config.DATABASE_NAME)
+db = get_storage()
 kb = Keyboards()
+db.add_catalog_listener(Keyboards.forget_product)
 donation = DonationSystem()
 
+# كاش نتائج البحث المضمّن: (الاستعلام المطبّع، الإزاحة) -> (النتائج، الإزاحة التالية)
+# يُفرَّغ بالكامل عند تغيّر نسخة الكتالوج
+_inline_cache = {}
+_inline_cache_version = [None]
+
 
 # ==================== معالجات المستخدمين ====================
 
@@ -55,7 +72,7 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # التبرع
         if arg.startswith("donate:"):
             donation_url = arg.split(":")[1]
-            donation = db.get_donation_by_url(donation_url)
+            donation = await db.aio.get_donation_by_url(donation_url)
             
             if donation:
                 # show preset buttons if donation has options
@@ -65,16 +82,25 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 context.user_data['donation_contribute'] = donation['id']
                 return
         
-        # الإحالة العادية
-        try:
-            referrer_id = int(arg)
-        except ValueError:
+        # رابط منتج (من نتائج البحث المضمّن)
+        if arg.startswith("product_"):
+            suffix = arg[len("product_"):]
+            product_id = int(suffix) if suffix.isdigit() else None
             referrer_id = None
+        else:
+            product_id = None
+            
+            # الإحالة العادية
+            try:
+                referrer_id = int(arg)
+            except ValueError:
+                referrer_id = None
     else:
         referrer_id = None
+        product_id = None
     
     # إضافة المستخدم إلى قاعدة البيانات
-    db.add_user(
+    await db.aio.add_user(
         user_id=user.id,
         username=user.username,
         first_name=user.first_name,
@@ -83,10 +109,21 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     # تحديث آخر نشاط
-    db.update_user_activity(user.id)
+    await db.aio.update_user_activity(user.id)
     
     # تسجيل
-    db.add_log('info', user.id, 'start_command', 'بدء استخدام البوت')
+    await db.aio.add_log('info', user.id, 'start_command', 'بدء استخدام البوت')
+    
+    # عرض المنتج مباشرة عند الدخول من رابط منتج
+    if product_id:
+        product = await db.aio.get_product(product_id)
+        if product and product['is_active']:
+            await update.message.reply_text(
+                format_product_info(product),
+                reply_markup=kb.product_detail(product_id, is_admin(user.id)),
+                parse_mode='HTML'
+            )
+            return
     
     # الرسالة الترحيبية
     welcome_text = config.MESSAGES['welcome']
@@ -118,7 +155,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # تحديث النشاط
-    db.update_user_activity(user.id)
+    await db.aio.update_user_activity(user.id)
     
     try:
         # القائمة الرئيسية
@@ -132,6 +169,23 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         elif data == "browse_products":
             await browse_products_handler(query, context)
         
+        # تصفح فئة: category:all أو category:<id>[:<page>]
+        elif data.startswith("category:"):
+            parts = data.split(":")
+            if parts[1] == "all":
+                await browse_products_handler(query, context, show_categories=False)
+            else:
+                page = int(parts[2]) if len(parts) > 2 else 0
+                await browse_category_handler(query, context, int(parts[1]), page)
+        
+        # البحث عن المنتجات
+        elif data == "search_products":
+            context.user_data['searching_products'] = True
+            await query.edit_message_text(
+                f"{config.EMOJI['search']} أرسل اسم المنتج أو جزءاً من وصفه للبحث:",
+                reply_markup=kb.back_button("start")
+            )
+        
         # عرض منتج
         elif data.startswith("product:"):
             product_id = int(data.split(":")[1])
@@ -142,13 +196,15 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             product_id = int(data.split(":")[1])
             await buy_product_handler(query, context, product_id, user.id)
         
-        # مشترياتي
-        elif data == "my_purchases":
-            await my_purchases_handler(query, context, user.id)
+        # مشترياتي: my_purchases[:<page>]
+        elif data == "my_purchases" or data.startswith("my_purchases:"):
+            page = int(data.split(":")[1]) if ":" in data else 0
+            await my_purchases_handler(query, context, user.id, page)
         
-        # طلباتي
-        elif data == "my_orders":
-            await my_orders_handler(query, context, user.id)
+        # طلباتي: my_orders[:<page>]
+        elif data == "my_orders" or data.startswith("my_orders:"):
+            page = int(data.split(":")[1]) if ":" in data else 0
+            await my_orders_handler(query, context, user.id, page)
         
         # حسابي
         elif data == "my_account":
@@ -232,14 +288,14 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await query.answer("⛔ غير مصرح لك!", show_alert=True)
                 return
 
-            products = db.get_active_products()
+            products = await db.aio.get_active_products()
             if not products:
                 await query.edit_message_text("😔 لا توجد منتجات", reply_markup=kb.admin_products())
                 return
 
             await query.edit_message_text(
                 "✏️ اختر المنتج لتعديله:",
-                reply_markup=kb.products_list(products, 0, "edit_product")
+                reply_markup=kb.products_list(products, 0, "edit_product", await db.aio.get_catalog_version())
             )
 
         # قائمة حذف المنتجات
@@ -248,26 +304,26 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await query.answer("⛔ غير مصرح لك!", show_alert=True)
                 return
 
-            products = db.get_active_products()
+            products = await db.aio.get_active_products()
             if not products:
                 await query.edit_message_text("😔 لا توجد منتجات", reply_markup=kb.admin_products())
                 return
 
             await query.edit_message_text(
                 "🗑 اختر المنتج للحذف:",
-                reply_markup=kb.products_list(products, 0, "delete_product")
+                reply_markup=kb.products_list(products, 0, "delete_product", await db.aio.get_catalog_version())
             )
 
         # عرض جميع المنتجات (قائمة عامة)
         elif data == "view_all_products" or data == "list_products":
-            products = db.get_active_products()
+            products = await db.aio.get_active_products()
             if not products:
                 await query.edit_message_text(config.MESSAGES['no_products'], reply_markup=kb.back_button("start"))
                 return
 
             await query.edit_message_text(
                 f"🛍 المنتجات المتاحة ({len(products)})\n\nاختر المنتج:",
-                reply_markup=kb.products_list(products, 0, "product")
+                reply_markup=kb.products_list(products, 0, "product", await db.aio.get_catalog_version())
             )
         
         # إضافة منتج
@@ -299,13 +355,16 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             await show_users_handler(query, context)
         
-        # الطلبات
-        elif data == "admin_orders":
+        # الطلبات: admin_orders[:<status|all>[:<before_id>]]
+        elif data == "admin_orders" or data.startswith("admin_orders:"):
             if not is_admin(user.id):
                 await query.answer("⛔ غير مصرح لك!", show_alert=True)
                 return
             
-            await show_orders_handler(query, context)
+            parts = data.split(":")
+            status = parts[1] if len(parts) > 1 and parts[1] != "all" else None
+            before_id = int(parts[2]) if len(parts) > 2 else None
+            await show_orders_handler(query, context, status, before_id)
         
         # الإعدادات
         elif data == "admin_settings":
@@ -344,8 +403,8 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             config.MAINTENANCE_MODE = not config.MAINTENANCE_MODE
             status = "مُفعَّل ✅" if config.MAINTENANCE_MODE else "مُعطَّل ❌"
             
-            db.set_setting('maintenance_mode', str(config.MAINTENANCE_MODE))
-            db.add_log('admin', user.id, 'toggle_maintenance', f'وضع الصيانة: {status}')
+            await db.aio.set_setting('maintenance_mode', str(config.MAINTENANCE_MODE))
+            await db.aio.add_log('admin', user.id, 'toggle_maintenance', f'وضع الصيانة: {status}')
             
             await query.answer(f"تم تغيير وضع الصيانة: {status}", show_alert=True)
             await query.edit_message_text(
@@ -387,7 +446,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             page = int(parts[2])
             
             if callback_type == "product":
-                await browse_products_handler(query, context, page)
+                await browse_products_handler(query, context, page, show_categories=False)
         
         # اختيار نوع المنتج
         elif data.startswith("product_type:"):
@@ -436,7 +495,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
 
             target_id = int(data.split(":")[1])
-            logs = db.get_logs(user_id=target_id, limit=50)
+            logs = await db.aio.get_logs(user_id=target_id, limit=50)
             if not logs:
                 await query.edit_message_text("❌ لا توجد سجلات لهذا المستخدم", reply_markup=kb.back_button('admin_users'))
                 return
@@ -450,7 +509,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # عرض إيصال الطلب
         elif data.startswith("receipt:"):
             order_id = int(data.split(":")[1])
-            order = db.get_order(order_id)
+            order = await db.aio.get_order(order_id)
             if not order:
                 await query.answer("❌ لم يتم العثور على الطلب!", show_alert=True)
                 return
@@ -487,8 +546,8 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
             
             product_id = int(data.split(":")[1])
-            if db.delete_product(product_id):
-                db.add_log('admin', user.id, 'delete_product', f'حذف منتج: {product_id}')
+            if await db.aio.delete_product(product_id):
+                await db.aio.add_log('admin', user.id, 'delete_product', f'حذف منتج: {product_id}')
                 await query.answer("✅ تم حذف المنتج بنجاح!", show_alert=True)
             else:
                 await query.answer("❌ فشل حذف المنتج!", show_alert=True)
@@ -505,11 +564,11 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
             
             product_id = int(data.split(":")[1])
-            product = db.get_product(product_id)
+            product = await db.aio.get_product(product_id)
             
             if product:
                 new_status = 0 if product['is_active'] else 1
-                db.update_product(product_id, is_active=new_status)
+                await db.aio.update_product(product_id, is_active=new_status)
                 
                 status_text = "مفعّل" if new_status else "معطّل"
                 await query.answer(f"تم تغيير حالة المنتج إلى: {status_text}")
@@ -555,8 +614,8 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 except ValueError:
                     percent = 0
 
-                if db.update_product(product_id, discount_percentage=percent):
-                    db.add_log('admin', user.id, 'quick_discount', f'منتج: {product_id}, نسبة: {percent}')
+                if await db.aio.update_product(product_id, discount_percentage=percent):
+                    await db.aio.add_log('admin', user.id, 'quick_discount', f'منتج: {product_id}, نسبة: {percent}')
                     await query.answer(f"✅ تم تعيين خصم {percent}% للمنتج")
                 else:
                     await query.answer("❌ فشل تحديث الخصم!", show_alert=True)
@@ -571,9 +630,10 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             product_id = int(data.split(":")[1])
             # عرض اختيار من الفئات المعرفة
+            counts = {c['name']: c['count'] for c in await db.aio.get_category_counts()}
             await query.edit_message_text(
                 "🏷️ اختر فئة للمنتج:",
-                reply_markup=kb.category_select(product_id)
+                reply_markup=kb.category_select(product_id, counts)
             )
 
         # اختيار فئة محددة من القائمة
@@ -589,8 +649,8 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 # نستخدم الاسم (key) كقيمة الفئة
                 # احفظ التسمية (label) بدلاً من المفتاح لتسهيل العرض
                 category_label = config.PRODUCT_TYPES.get(category_key, category_key)
-                if db.update_product(product_id, category=category_label):
-                    db.add_log('admin', user.id, 'change_category', f'منتج: {product_id}, فئة: {category_label}')
+                if await db.aio.update_product(product_id, category=category_label):
+                    await db.aio.add_log('admin', user.id, 'change_category', f'منتج: {product_id}, فئة: {category_label}')
                     await query.answer(f"✅ تم تغيير الفئة إلى: {category_label}")
                 else:
                     await query.answer("❌ فشل تغيير الفئة!", show_alert=True)
@@ -625,7 +685,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # رصيدي
         elif data == "my_balance":
-            user_data = db.get_user(user.id)
+            user_data = await db.aio.get_user_stats(user.id)
             if user_data:
                 balance_text = (
                     f"💰 رصيدك الحالي\n\n"
@@ -646,16 +706,22 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data['buying_balance'] = True
 
         elif data == "balance_history":
-            user_data = db.get_user(user.id)
+            user_data = await db.aio.get_user_stats(user.id)
             if not user_data:
                 await query.answer("❌ خطأ في جلب البيانات!", show_alert=True)
                 return
 
+            entries = await db.aio.get_balance_history(user.id, limit=config.BALANCE_HISTORY_LIMIT)
             history_text = (
                 f"📜 تاريخ الحساب\n\n"
+                f"💰 الرصيد الحالي: {user_data.get('balance', 0)} ⭐\n"
                 f"إجمالي المصروفات: {user_data.get('total_spent',0)} ⭐\n"
-                f"عدد المشتريات: {user_data.get('total_purchases',0)}\n"
+                f"عدد المشتريات: {user_data.get('total_purchases',0)}\n\n"
             )
+            if entries:
+                history_text += "\n".join(format_balance_entry(entry) for entry in entries)
+            else:
+                history_text += "لا توجد حركات على الرصيد بعد"
             await query.edit_message_text(history_text, reply_markup=kb.back_button('my_account'))
         
         # رابط الإحالة
@@ -663,7 +729,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             bot = await context.bot.get_me()
             referral_link = f"https://t.me/{bot.username}?start={user.id}"
             
-            user_data = db.get_user(user.id)
+            user_data = await db.aio.get_user(user.id)
             referral_count = user_data.get('referral_count', 0) if user_data else 0
             
             referral_text = (
@@ -682,7 +748,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # معلومات الحساب (تفاصيل)
         elif data == "account_info":
-            user_data = db.get_user(user.id)
+            user_data = await db.aio.get_user(user.id)
             if not user_data:
                 await query.answer("❌ خطأ في جلب البيانات!", show_alert=True)
                 return
@@ -699,7 +765,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # إحصائياتي
         elif data == "my_stats":
-            user_data = db.get_user(user.id)
+            user_data = await db.aio.get_user(user.id)
             if user_data:
                 stats_text = (
                     f"📊 إحصائياتك\n\n"
@@ -729,7 +795,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if len(parts) >= 3:
                 donation_url = parts[1]
                 amount = int(parts[2])
-                donation = db.get_donation_by_url(donation_url)
+                donation = await db.aio.get_donation_by_url(donation_url)
                 if not donation:
                     await query.answer("❌ حملة التبرع غير موجودة!", show_alert=True)
                     return
@@ -740,7 +806,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         elif data.startswith("donate_campaign_custom:"):
             donation_url = data.split(":")[1]
-            donation = db.get_donation_by_url(donation_url)
+            donation = await db.aio.get_donation_by_url(donation_url)
             if not donation:
                 await query.answer("❌ حملة التبرع غير موجودة!", show_alert=True)
                 return
@@ -768,7 +834,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # تأكيد تبرع (زر في لوحة التأكيد)
         elif data.startswith("confirm_donation:"):
             donation_id = int(data.split(":")[1])
-            donation_obj = db.get_donation(donation_id)
+            donation_obj = await db.aio.get_donation(donation_id)
             if not donation_obj:
                 await query.answer("❌ حملة التبرع غير موجودة!", show_alert=True)
                 return
@@ -863,7 +929,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
             
             # إضافة المساهمة
-            if db.add_donation_contribution(donation_id, user.id, amount):
+            if await db.aio.add_donation_contribution(donation_id, user.id, amount):
                 await update.message.reply_text(
                     f"✅ شكراً لتبرعك!\n\n"
                     f"🎁 تبرعت بـ {amount}⭐\n"
@@ -872,7 +938,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
                 
                 # إخطار صاحب الحملة
-                donation = db.get_donation(donation_id)
+                donation = await db.aio.get_donation(donation_id)
                 try:
                     await context.bot.send_message(
                         chat_id=donation['donor_id'],
@@ -893,6 +959,11 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ أدخل رقماً صحيحاً!")
         return
 
+    # معالجة البحث عن المنتجات
+    if context.user_data.pop('searching_products', False):
+        await search_products_handler(update, context, text)
+        return
+    
     # معالجة إضافة رصيد (من قبل المسؤول)
     if 'adding_balance' in context.user_data:
         if not is_admin(user.id):
@@ -905,9 +976,9 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text("❌ أدخل قيمة صحيحة أكبر من 0")
                 return
 
-            if db.add_user_balance(target, amount):
+            if await db.aio.add_user_balance(target, amount, reason='admin'):
                 await update.message.reply_text(f"✅ تم إضافة {amount} ⭐ للمستخدم {target}")
-                db.add_log('admin', user.id, 'add_balance', f'أضف {amount} ل {target}')
+                await db.aio.add_log('admin', user.id, 'add_balance', f'أضف {amount} ل {target}')
             else:
                 await update.message.reply_text("❌ فشل إضافة الرصيد!")
 
@@ -925,9 +996,9 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
 
             # نضيف الرصيد فوراً (تجريبي)
-            if db.add_user_balance(user.id, amount):
+            if await db.aio.add_user_balance(user.id, amount):
                 await update.message.reply_text(f"✅ تمت إضافة {amount} ⭐ إلى رصيدك!")
-                db.add_log('purchase', user.id, 'buy_balance', f'قيمة: {amount}')
+                await db.aio.add_log('purchase', user.id, 'buy_balance', f'قيمة: {amount}')
             else:
                 await update.message.reply_text("❌ فشل إضافة الرصيد!")
 
@@ -975,9 +1046,9 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             product_id = context.user_data['changing_category']['product_id']
             new_category = update.message.text.strip()
 
-            if db.update_product(product_id, category=new_category):
+            if await db.aio.update_product(product_id, category=new_category):
                 await update.message.reply_text(f"✅ تم تغيير فئة المنتج إلى: {new_category}")
-                db.add_log('admin', user.id, 'change_category', f'منتج: {product_id}, فئة: {new_category}')
+                await db.aio.add_log('admin', user.id, 'change_category', f'منتج: {product_id}, فئة: {new_category}')
             else:
                 await update.message.reply_text("❌ فشل تغيير الفئة!")
 
@@ -1000,9 +1071,9 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text("❌ النسبة يجب أن تكون بين 0 و 100")
                 return
 
-            if db.update_product(product_id, discount_percentage=percent):
+            if await db.aio.update_product(product_id, discount_percentage=percent):
                 await update.message.reply_text(f"✅ تم تعيين خصم {percent}% للمنتج")
-                db.add_log('admin', user.id, 'set_custom_discount', f'منتج: {product_id}, نسبة: {percent}')
+                await db.aio.add_log('admin', user.id, 'set_custom_discount', f'منتج: {product_id}, نسبة: {percent}')
             else:
                 await update.message.reply_text("❌ فشل تطبيق الخصم!")
 
@@ -1055,14 +1126,14 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
                         if pid:
                             # محاولة التحديث
-                            if db.update_product(int(pid), name=name, description=description, price=price,
+                            if await db.aio.update_product(int(pid), name=name, description=description, price=price,
                                                  type=ptype, delivery_content=content, stock=stock,
                                                  is_limited=is_limited, category=category):
                                 updated += 1
                             else:
                                 failed += 1
                         else:
-                            new_id = db.add_product(name, description, price, ptype, content, stock, is_limited, category)
+                            new_id = await db.aio.add_product(name, description, price, ptype, content, stock, is_limited, category)
                             if new_id:
                                 added += 1
                             else:
@@ -1071,7 +1142,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         failed += 1
 
             await update.message.reply_text(f"✅ استيراد مكتمل — أضيف: {added}, تم تحديث: {updated}, فشل: {failed}")
-            db.add_log('admin', user.id, 'import_products_csv', f'added={added},updated={updated},failed={failed}')
+            await db.aio.add_log('admin', user.id, 'import_products_csv', f'added={added},updated={updated},failed={failed}')
         except Exception as e:
             logger.error(f"خطأ في استيراد CSV: {e}")
             await update.message.reply_text("❌ فشل في معالجة ملف CSV")
@@ -1090,14 +1161,14 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text("❌ النسبة يجب أن تكون بين 0 و 100")
                 return
 
-            products = db.get_active_products()
+            products = await db.aio.get_active_products()
             count = 0
             for p in products:
-                if db.update_product(p['id'], discount_percentage=percent):
+                if await db.aio.update_product(p['id'], discount_percentage=percent):
                     count += 1
 
             await update.message.reply_text(f"✅ تم تطبيق خصم {percent}% على {count} منتج(ـًا)")
-            db.add_log('admin', user.id, 'bulk_discount', f'percent={percent}, applied={count}')
+            await db.aio.add_log('admin', user.id, 'bulk_discount', f'percent={percent}, applied={count}')
 
         except ValueError:
             await update.message.reply_text("❌ الرجاء إدخال رقم صحيح للخصم")
@@ -1174,7 +1245,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     return
 
             # إنشاء الحملة مع الخيارات إن وُجدت
-            donation_id = db.create_donation(
+            donation_id = await db.aio.create_donation(
                 donor_id=user.id,
                 amount=context.user_data.get('donation_amount'),
                 description=context.user_data.get('donation_description'),
@@ -1182,7 +1253,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
 
             if donation_id:
-                donation_obj = db.get_donation(donation_id)
+                donation_obj = await db.aio.get_donation(donation_id)
 
                 await update.message.reply_text(
                     f"✅ تم إنشاء حملة التبرع!\n\n"
@@ -1193,7 +1264,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     f"شارك الرابط مع أصدقائك!",
                     parse_mode='HTML'
                 )
-                db.add_log('donation', user.id, 'donation_created', f'id={donation_id}, options={options}')
+                await db.aio.add_log('donation', user.id, 'donation_created', f'id={donation_id}, options={options}')
 
                 # تنظيف الحالة
                 for k in ['donation_step', 'donation_amount', 'donation_description']:
@@ -1210,7 +1281,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if exchange_step == 'amount':
             try:
                 points = int(text)
-                user_points = db.get_user_points(user.id)
+                user_points = await db.aio.get_user_points(user.id)
                 
                 if points > user_points['points']:
                     await update.message.reply_text(
@@ -1225,7 +1296,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     return
                 
                 # استبدال النقاط
-                if db.exchange_points_to_stars(user.id, points):
+                if await db.aio.exchange_points_to_stars(user.id, points):
                     stars_received = int(points * 0.1)
                     
                     await update.message.reply_text(
@@ -1320,11 +1391,11 @@ async def handle_edit_product_step(update: Update, context: ContextTypes.DEFAULT
         text = update.message.text
 
         if step == 'name':
-            db.update_product(product_id, name=text)
+            await db.aio.update_product(product_id, name=text)
             await update.message.reply_text(f"✅ تم تحديث الاسم: {text}", reply_markup=kb.product_detail(product_id, is_admin=True))
 
         elif step == 'description':
-            db.update_product(product_id, description=text)
+            await db.aio.update_product(product_id, description=text)
             await update.message.reply_text("✅ تم تحديث الوصف", reply_markup=kb.product_detail(product_id, is_admin=True))
 
         elif step == 'price':
@@ -1333,7 +1404,7 @@ async def handle_edit_product_step(update: Update, context: ContextTypes.DEFAULT
                 if price < config.MIN_PRODUCT_PRICE or price > config.MAX_PRODUCT_PRICE:
                     await update.message.reply_text(f"❌ السعر يجب أن يكون بين {config.MIN_PRODUCT_PRICE} و {config.MAX_PRODUCT_PRICE} نجمة!")
                     return
-                db.update_product(product_id, price=price)
+                await db.aio.update_product(product_id, price=price)
                 await update.message.reply_text(f"✅ تم تحديث السعر: {price} ⭐", reply_markup=kb.product_detail(product_id, is_admin=True))
             except ValueError:
                 await update.message.reply_text("❌ أدخل رقماً صحيحاً للسعر!")
@@ -1341,7 +1412,7 @@ async def handle_edit_product_step(update: Update, context: ContextTypes.DEFAULT
         elif step == 'stock':
             try:
                 stock = int(text)
-                db.update_product(product_id, stock=stock, is_limited=1 if stock >= 0 else 0)
+                await db.aio.update_product(product_id, stock=stock, is_limited=1 if stock >= 0 else 0)
                 await update.message.reply_text(f"✅ تم تحديث المخزون: {stock}", reply_markup=kb.product_detail(product_id, is_admin=True))
             except ValueError:
                 await update.message.reply_text("❌ أدخل رقماً صحيحاً للمخزون!")
@@ -1352,7 +1423,7 @@ async def handle_edit_product_step(update: Update, context: ContextTypes.DEFAULT
                 if discount < 0 or discount > 100:
                     await update.message.reply_text("❌ نسبة الخصم يجب أن تكون بين 0 و 100")
                     return
-                db.update_product(product_id, discount_percentage=discount)
+                await db.aio.update_product(product_id, discount_percentage=discount)
                 await update.message.reply_text(f"✅ تم تحديث الخصم: {discount}%", reply_markup=kb.product_detail(product_id, is_admin=True))
             except ValueError:
                 await update.message.reply_text("❌ أدخل رقماً صحيحاً للخصم!")
@@ -1367,67 +1438,107 @@ async def handle_edit_product_step(update: Update, context: ContextTypes.DEFAULT
             else:
                 content = text
 
-            db.update_product(product_id, delivery_content=content)
+            await db.aio.update_product(product_id, delivery_content=content)
             await update.message.reply_text("✅ تم تحديث المحتوى", reply_markup=kb.product_detail(product_id, is_admin=True))
 
         # إنهاء وضع التحرير
         if 'editing_product' in context.user_data:
             del context.user_data['editing_product']
 
-        db.add_log('admin', user.id, 'edit_product', f'منتج: {product_id}, خطوة: {step}')
+        await db.aio.add_log('admin', user.id, 'edit_product', f'منتج: {product_id}, خطوة: {step}')
 
     except Exception as e:
         logger.error(f"خطأ في تعديل المنتج: {e}")
         await update.message.reply_text("❌ حدث خطأ أثناء تعديل المنتج")
 
 
-async def handle_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """معالجة البث الجماعي"""
-    user = update.effective_user
-    text = update.message.text
-    
-    if not is_admin(user.id):
-        return
-    
-    await update.message.reply_text("⏳ جاري إرسال الرسالة...")
-    
-    users = db.get_all_users()
+async def _send_broadcast(context, users, text: str):
+    """إرسال رسالة البث للمستخدمين، ويُرجع (نجح، فشل، متوقف)"""
     success_count = 0
     failed_count = 0
     
+    interrupted = False
     for user_data in users:
+        # عند إيقاف البوت يتوقف البث بين رسالتين ويُبلَّغ المسؤول بما أُرسل
+        if lifecycle.stopping:
+            interrupted = True
+            break
         try:
             await context.bot.send_message(
                 chat_id=user_data['user_id'],
                 text=f"📢 رسالة من الإدارة:\n\n{text}"
             )
             success_count += 1
+            BROADCAST_MESSAGES.labels('sent').inc()
             
             # تأخير بسيط لتجنب الحظر
             await asyncio.sleep(config.BROADCAST_DELAY)
         except Exception as e:
             failed_count += 1
+            BROADCAST_MESSAGES.labels('failed').inc()
             logger.warning(f"فشل إرسال رسالة إلى {user_data['user_id']}: {e}")
     
+    return success_count, failed_count, interrupted
+
+
+async def handle_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """معالجة البث الجماعي"""
+    user = update.effective_user
+    text = update.message.text
+    
+    if not is_admin(user.id):
+        return
+    
+    # قفل مشترك حتى لا يعمل بثّان في نفس الوقت (في أي عملية)
+    lock = JobLock('broadcast', database=db)
+    if not await lock.acquire():
+        await update.message.reply_text("⏳ يوجد بث جماعي جارٍ حالياً، حاول لاحقاً")
+        context.user_data.pop('broadcasting', None)
+        return
+    
+    await update.message.reply_text("⏳ جاري إرسال الرسالة...")
+    
+    try:
+        users = await db.aio.get_all_users()
+        success_count, failed_count, interrupted = await _send_broadcast(context, users, text)
+    finally:
+        await lock.release()
+    
     result_text = (
         f"✅ تم إرسال الرسالة!\n\n"
         f"نجح: {success_count}\n"
         f"فشل: {failed_count}"
     )
+    if interrupted:
+        remaining = len(users) - success_count - failed_count
+        result_text += f"\n\n⏹ توقف البث بسبب إعادة تشغيل البوت (لم يُرسل إلى {remaining})"
     
     await update.message.reply_text(result_text)
     
     # إنهاء وضع البث
     del context.user_data['broadcasting']
     
-    db.add_log('admin', user.id, 'broadcast', f'إرسال جماعي: نجح {success_count}, فشل {failed_count}')
+    await db.aio.add_log('admin', user.id, 'broadcast',
+               f'إرسال جماعي: نجح {success_count}, فشل {failed_count}'
+               + (', متوقف عند الإغلاق' if interrupted else ''))
 
 
 # ==================== معالجات العرض ====================
 
-async def browse_products_handler(query, context, page: int = 0):
-    """عرض قائمة المنتجات"""
-    products = db.get_active_products()
+async def browse_products_handler(query, context, page: int = 0, show_categories: bool = True):
+    """عرض قائمة المنتجات (أو الفئات عند وجود أكثر من فئة)"""
+    if show_categories:
+        categories = await db.aio.get_category_counts()
+        if len(categories) > 1:
+            total = sum(category['count'] for category in categories)
+            await query.edit_message_text(
+                f"🛍 المنتجات المتاحة ({total})\n\n"
+                "اختر الفئة:",
+                reply_markup=kb.categories_list(categories)
+            )
+            return
+    
+    products = await db.aio.get_active_products()
     
     if not products:
         await query.edit_message_text(
@@ -1439,13 +1550,122 @@ async def browse_products_handler(query, context, page: int = 0):
     await query.edit_message_text(
         f"🛍 المنتجات المتاحة ({len(products)})\n\n"
         "اختر المنتج الذي تريده:",
-        reply_markup=kb.products_list(products, page, "product")
+        reply_markup=kb.products_list(products, page, "product", await db.aio.get_catalog_version())
+    )
+
+
+async def browse_category_handler(query, context, category_id: int, page: int = 0):
+    """عرض صفحة من منتجات فئة (استعلام صفحة واحدة عبر الفهرس)"""
+    category = await db.aio.get_category_count(category_id)
+    
+    if not category or category['count'] <= 0:
+        await query.edit_message_text(
+            config.MESSAGES['no_products'],
+            reply_markup=kb.back_button("browse_products")
+        )
+        return
+    
+    products = await db.aio.get_active_products(
+        category=category['name'],
+        limit=config.PRODUCTS_PER_PAGE,
+        offset=page * config.PRODUCTS_PER_PAGE
+    )
+    
+    await query.edit_message_text(
+        f"📂 {category['name']} ({category['count']})\n\n"
+        "اختر المنتج الذي تريده:",
+        reply_markup=kb.category_products(products, category_id, page, category['count'])
+    )
+
+
+async def search_products_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """عرض نتائج البحث عن المنتجات"""
+    products = await db.aio.search_products(text, limit=config.SEARCH_RESULTS_LIMIT)
+    
+    if not products:
+        await update.message.reply_text(
+            f"{config.EMOJI['search']} لا توجد نتائج لـ \"{text}\"",
+            reply_markup=kb.search_results([])
+        )
+        return
+    
+    await update.message.reply_text(
+        f"{config.EMOJI['search']} نتائج البحث عن \"{text}\" ({len(products)}):",
+        reply_markup=kb.search_results(products)
+    )
+
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """البحث المضمّن في الكتالوج (@bot كلمة)"""
+    inline_query = update.inline_query
+    
+    try:
+        offset = max(0, int(inline_query.offset or 0))
+    except ValueError:
+        offset = 0
+    
+    results, next_offset = await get_inline_results(
+        inline_query.query, offset, context.bot.username
+    )
+    
+    await inline_query.answer(
+        results,
+        cache_time=config.INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=next_offset
+    )
+
+
+async def get_inline_results(query_text: str, offset: int, bot_username: str):
+    """نتائج البحث المضمّن لصفحة واحدة (مع كاش حسب الاستعلام المطبّع ونسخة الكتالوج)"""
+    version = await db.aio.get_catalog_version()
+    if _inline_cache_version[0] != version or len(_inline_cache) >= config.INLINE_CACHE_SIZE:
+        _inline_cache.clear()
+        _inline_cache_version[0] = version
+    
+    key = (normalize_search_text(query_text), offset)
+    cached = _inline_cache.get(key)
+    cache_hit('inline_results', cached is not None)
+    if cached is not None:
+        return cached
+    
+    limit = config.INLINE_RESULTS_PER_PAGE
+    # جلب عنصر إضافي لمعرفة وجود صفحة تالية
+    if key[0]:
+        products = await db.aio.search_products(query_text, limit=limit + 1, offset=offset)
+    else:
+        products = await db.aio.get_top_selling_products(limit=limit + 1, offset=offset)
+    
+    next_offset = str(offset + limit) if len(products) > limit else ""
+    results = [_inline_product_result(product, bot_username) for product in products[:limit]]
+    
+    _inline_cache[key] = (results, next_offset)
+    return _inline_cache[key]
+
+
+def _inline_product_result(product: dict, bot_username: str) -> InlineQueryResultArticle:
+    """بطاقة منتج في نتائج البحث المضمّن"""
+    description = (product.get('description') or '')[:100]
+    return InlineQueryResultArticle(
+        id=str(product['id']),
+        title=product['name'],
+        description=f"{product['price']}⭐ • {description}",
+        input_message_content=InputTextMessageContent(
+            format_product_info(product, include_stock=False),
+            parse_mode='HTML'
+        ),
+        reply_markup=InlineKeyboardMarkup([[
+            InlineKeyboardButton(
+                f"{config.EMOJI['store']} شراء من البوت",
+                url=f"https://t.me/{bot_username}?start=product_{product['id']}"
+            )
+        ]])
     )
 
 
 async def show_product_handler(query, context, product_id: int, is_admin: bool = False):
     """عرض تفاصيل منتج"""
-    product = db.get_product(product_id)
+    product = await db.aio.get_product(product_id)
     
     if not product:
         await query.answer("❌ المنتج غير موجود!", show_alert=True)
@@ -1462,7 +1682,7 @@ async def show_product_handler(query, context, product_id: int, is_admin: bool =
 
 async def buy_product_handler(query, context, product_id: int, user_id: int):
     """معالج شراء المنتج"""
-    product = db.get_product(product_id)
+    product = await db.aio.get_product(product_id)
     
     if not product:
         await query.answer("❌ المنتج غير موجود!", show_alert=True)
@@ -1479,7 +1699,7 @@ async def buy_product_handler(query, context, product_id: int, user_id: int):
     
     # التحقق من الأكواد للمنتجات من نوع code
     if product['type'] == 'code':
-        available_codes = db.get_available_codes_count(product_id)
+        available_codes = await db.aio.get_available_codes_count(product_id)
         if available_codes <= 0:
             await query.answer(config.MESSAGES['out_of_stock'], show_alert=True)
             return
@@ -1510,7 +1730,7 @@ async def buy_product_handler(query, context, product_id: int, user_id: int):
             )
 
             await query.answer("💳 تم إنشاء الفاتورة! أكمل الدفع 👆")
-            db.add_log('purchase', user_id, 'invoice_created', f'منتج: {product_id}')
+            await db.aio.add_log('purchase', user_id, 'invoice_created', f'منتج: {product_id}')
         else:
             # إذا لم يتم تكوين موفر الدفع، أعلم المستخدم بدل إنشاء فاتورة
             await query.edit_message_text(
@@ -1524,9 +1744,11 @@ async def buy_product_handler(query, context, product_id: int, user_id: int):
         await query.answer("❌ فشل إنشاء الفاتورة!", show_alert=True)
 
 
-async def my_purchases_handler(query, context, user_id: int):
-    """عرض مشتريات المستخدم"""
-    orders = db.get_user_orders(user_id, limit=20)
+async def my_purchases_handler(query, context, user_id: int, page: int = 0):
+    """عرض صفحة من مشتريات المستخدم"""
+    per_page = config.PURCHASES_PER_PAGE
+    # جلب عنصر إضافي لمعرفة وجود صفحة تالية
+    orders = await db.aio.get_user_orders(user_id, limit=per_page + 1, offset=page * per_page)
     
     if not orders:
         await query.edit_message_text(
@@ -1537,7 +1759,7 @@ async def my_purchases_handler(query, context, user_id: int):
     
     purchases_text = "⭐ مشترياتي:\n\n"
     
-    for order in orders:
+    for order in orders[:per_page]:
         status_emoji = "✅" if order['status'] == 'completed' else "⏳"
         purchases_text += (
             f"{status_emoji} {order['product_name']}\n"
@@ -1547,13 +1769,14 @@ async def my_purchases_handler(query, context, user_id: int):
     
     await query.edit_message_text(
         purchases_text,
-        reply_markup=kb.back_button("start")
+        reply_markup=kb.history_pages("my_purchases", page, len(orders) > per_page)
     )
 
 
-async def my_orders_handler(query, context, user_id: int):
-    """عرض طلبات المستخدم"""
-    orders = db.get_user_orders(user_id, limit=10)
+async def my_orders_handler(query, context, user_id: int, page: int = 0):
+    """عرض صفحة من طلبات المستخدم"""
+    per_page = config.ORDERS_PER_PAGE
+    orders = await db.aio.get_user_orders(user_id, limit=per_page + 1, offset=page * per_page)
     
     if not orders:
         await query.edit_message_text(
@@ -1564,18 +1787,18 @@ async def my_orders_handler(query, context, user_id: int):
     
     orders_text = "🧾 طلباتي:\n\n"
     
-    for order in orders:
+    for order in orders[:per_page]:
         orders_text += format_order_info(order) + "\n"
     
     await query.edit_message_text(
         orders_text,
-        reply_markup=kb.back_button("start")
+        reply_markup=kb.history_pages("my_orders", page, len(orders) > per_page)
     )
 
 
 async def my_account_handler(query, context, user_id: int):
     """عرض معلومات الحساب"""
-    user_data = db.get_user(user_id)
+    user_data = await db.aio.get_user(user_id)
     
     if not user_data:
         await query.answer("❌ خطأ في جلب البيانات!", show_alert=True)
@@ -1594,7 +1817,7 @@ async def my_account_handler(query, context, user_id: int):
 
 async def show_statistics_handler(query, context):
     """عرض الإحصائيات"""
-    stats = db.get_statistics()
+    stats = await db.aio.get_statistics()
     
     stats_text = (
         f"📊 إحصائيات البوت\n\n"
@@ -1610,16 +1833,70 @@ async def show_statistics_handler(query, context):
     for i, product in enumerate(stats.get('top_products', [])[:5], 1):
         stats_text += f"{i}. {product['name']} - {product['sales_count']} مبيعة\n"
     
+    top_spenders = stats.get('top_spenders', [])
+    if top_spenders:
+        stats_text += "\n💎 الأعلى إنفاقاً:\n"
+    for i, spender in enumerate(top_spenders, 1):
+        name = spender['first_name'] or spender['username'] or spender['user_id']
+        stats_text += f"{i}. {name} - {spender['total_spent']} ⭐\n"
+    
     await query.edit_message_text(
         stats_text,
         reply_markup=kb.back_button("admin_panel")
     )
 
 
+async def dbstats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """أمر /dbstats: عرض زمن استعلامات قاعدة البيانات للمسؤول"""
+    user = update.effective_user
+    
+    if not is_admin(user.id):
+        await update.message.reply_text("⛔ غير مصرح لك!")
+        return
+    
+    if context.args and context.args[0] == 'reset':
+        instrumentation.stats.reset()
+        await update.message.reply_text("✅ تم تصفير إحصائيات قاعدة البيانات")
+        return
+    
+    await update.message.reply_text(instrumentation.format_report())
+
+
+async def profile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """أمر /profile [ثواني]: تشغيل محلل الأداء وإرسال النتيجة للمسؤول"""
+    user = update.effective_user
+    
+    if not is_admin(user.id):
+        await update.message.reply_text("⛔ غير مصرح لك!")
+        return
+    
+    if profiler.is_profiling():
+        await update.message.reply_text("⏳ يوجد تحليل جارٍ بالفعل")
+        return
+    
+    seconds = config.PROFILER_DEFAULT_SECONDS
+    if context.args:
+        try:
+            seconds = max(1, min(int(context.args[0]), config.PROFILER_MAX_SECONDS))
+        except ValueError:
+            await update.message.reply_text("❌ الاستخدام: /profile [عدد الثواني]")
+            return
+    
+    await update.message.reply_text(f"🔥 بدأ تحليل الأداء لمدة {seconds} ثانية...")
+    
+    # تشغيل التحليل في مهمة منفصلة حتى لا يتوقف استقبال التحديثات
+    lifecycle.create_task(
+        context.application,
+        profiler.send_profile(context.bot, [update.effective_chat.id], seconds),
+        name='profile'
+    )
+    await db.aio.add_log('admin', user.id, 'profile', f'تحليل الأداء لمدة {seconds} ثانية')
+
+
 async def show_users_handler(query, context, page: int = 0):
     """عرض المستخدمين"""
-    users = db.get_all_users(limit=10, offset=page * 10)
-    total_users = db.get_users_count()
+    users = await db.aio.get_all_users(limit=10, offset=page * 10)
+    total_users = await db.aio.get_users_count()
     
     users_text = f"👥 المستخدمون ({total_users})\n\n"
     
@@ -1637,13 +1914,23 @@ async def show_users_handler(query, context, page: int = 0):
     )
 
 
-async def show_orders_handler(query, context):
-    """عرض الطلبات"""
-    orders = db.get_all_orders(limit=20)
+async def show_orders_handler(query, context, status: str = None, before_id: int = None):
+    """عرض صفحة من الطلبات مع عددها لكل حالة"""
+    per_page = config.ADMIN_ORDERS_PER_PAGE
+    # جلب عنصر إضافي لمعرفة وجود صفحة تالية
+    orders = await db.aio.get_order_feed(status=status, before_id=before_id, limit=per_page + 1)
+    counts = await db.aio.get_order_status_counts()
+    
+    orders_text = f"🧾 الطلبات ({sum(counts.values())}):\n"
+    orders_text += " | ".join(
+        f"{label} {counts.get(key, 0)}" for key, label in config.ORDER_STATUSES.items()
+    )
+    orders_text += "\n\n"
     
-    orders_text = "🧾 آخر الطلبات:\n\n"
+    if not orders:
+        orders_text += "😔 لا توجد طلبات"
     
-    for order in orders:
+    for order in orders[:per_page]:
         orders_text += (
             f"#{order['id']} - {order['product_name']}\n"
             f"   👤 @{order.get('username', 'غير معروف')}\n"
@@ -1651,15 +1938,16 @@ async def show_orders_handler(query, context):
             f"   📅 {order['created_at'][:16]}\n\n"
         )
     
+    last_id = orders[:per_page][-1]['id'] if orders else 0
     await query.edit_message_text(
         orders_text,
-        reply_markup=kb.back_button("admin_panel")
+        reply_markup=kb.admin_orders(status, last_id, len(orders) > per_page, before_id is None)
     )
 
 
 async def show_logs_handler(query, context):
     """عرض السجلات"""
-    logs = db.get_logs(limit=20)
+    logs = await db.aio.get_logs(limit=20)
     
     logs_text = "🔒 سجلات الأمان:\n\n"
     
@@ -1678,26 +1966,28 @@ async def show_logs_handler(query, context):
 
 async def backup_database_handler(query, context):
     """نسخ احتياطي لقاعدة البيانات"""
-    import shutil
     import os
-    from datetime import datetime
+    
+    # نسخة احتياطية واحدة في نفس الوقت حتى مع عدة عمليات
+    lock = JobLock('backup', database=db)
+    if not await lock.acquire():
+        await query.answer("⏳ يوجد نسخ احتياطي جارٍ حالياً", show_alert=True)
+        return
     
     try:
         # إنشاء مجلد النسخ الاحتياطية
         os.makedirs(config.BACKUP_PATH, exist_ok=True)
         
-        # اسم الملف
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_file = f"{config.BACKUP_PATH}backup_{timestamp}.db"
-        
-        # نسخ قاعدة البيانات
-        shutil.copy2(config.DATABASE_NAME, backup_file)
+        # نسخ قاعدة البيانات (نسخة متسقة تشمل ملف WAL)
+        backup_file = await db.aio.backup_database(config.BACKUP_PATH)
+        if backup_file is None:
+            raise RuntimeError("تعذر إنشاء النسخة الاحتياطية")
         
         # إرسال الملف
         with open(backup_file, 'rb') as file:
             await query.message.reply_document(
                 document=file,
-                filename=f"backup_{timestamp}.db",
+                filename=os.path.basename(backup_file),
                 caption="💾 نسخة احتياطية من قاعدة البيانات"
             )
         
@@ -1709,11 +1999,13 @@ async def backup_database_handler(query, context):
             for old_backup in backups[:-config.MAX_BACKUPS]:
                 os.remove(os.path.join(config.BACKUP_PATH, old_backup))
         
-        db.add_log('admin', query.from_user.id, 'backup', 'نسخ احتياطي')
+        await db.aio.add_log('admin', query.from_user.id, 'backup', 'نسخ احتياطي')
     
     except Exception as e:
         logger.error(f"خطأ في النسخ الاحتياطي: {e}")
         await query.answer("❌ فشل إنشاء النسخة الاحتياطية!", show_alert=True)
+    finally:
+        await lock.release()
 
 
 # ==================== معالجات التبرع والنقاط ====================
@@ -1746,7 +2038,7 @@ async def create_donation_handler(query, context, user_id: int):
 
 async def my_donations_handler(query, context, user_id: int):
     """عرض حملات التبرع الخاصة بالمستخدم"""
-    donations = db.get_user_donations(user_id)
+    donations = await db.aio.get_user_donations(user_id)
     
     if not donations:
         await query.edit_message_text(
@@ -1781,16 +2073,25 @@ async def my_donations_handler(query, context, user_id: int):
 
 async def view_points_handler(query, context, user_id: int):
     """عرض نقاط المستخدم"""
-    user_points = db.get_user_points(user_id)
+    user_points = await db.aio.get_user_points(user_id)
     
     points_text = (
         f"📊 <b>نقاطك</b>\n\n"
         f"النقاط الحالية: {user_points['points']} 🎯\n"
         f"إجمالي المكتسب: {user_points['total_earned']} 📈\n"
         f"المستبدل: {user_points['total_exchanged']} ⭐\n\n"
-        f"<i>اكسب نقاط بالتبرع والشراء!</i>"
     )
     
+    leaders = await db.aio.get_points_leaderboard(limit=3)
+    if leaders:
+        points_text += "🏆 <b>الأعلى نقاطاً:</b>\n"
+        for rank, leader in enumerate(leaders, 1):
+            name = html.escape(leader['first_name'] or leader['username'] or str(leader['user_id']))
+            points_text += f"{rank}. {name} - {leader['total_earned']} 🎯\n"
+        points_text += "\n"
+    
+    points_text += "<i>اكسب نقاط بالتبرع والشراء!</i>"
+    
     await query.edit_message_text(
         points_text,
         reply_markup=kb.points_menu(),
@@ -1800,7 +2101,7 @@ async def view_points_handler(query, context, user_id: int):
 
 async def exchange_points_handler(query, context, user_id: int):
     """بدء عملية استبدال النقاط"""
-    user_points = db.get_user_points(user_id)
+    user_points = await db.aio.get_user_points(user_id)
     
     if user_points['points'] < 10:
         await query.answer(
@@ -1824,7 +2125,7 @@ async def exchange_points_handler(query, context, user_id: int):
 
 async def points_history_handler(query, context, user_id: int):
     """عرض سجل تبادل النقاط"""
-    history = db.get_exchange_history(user_id)
+    history = await db.aio.get_exchange_history(user_id)
     
     if not history:
         await query.edit_message_text(
@@ -1853,7 +2154,7 @@ async def points_history_handler(query, context, user_id: int):
 async def campaign_stats_handler(query, context, donation_id: int):
     """عرض إحصائيات حملة تبرع محددة"""
     try:
-        stats = db.get_campaign_stats(donation_id)
+        stats = await db.aio.get_campaign_stats(donation_id)
         
         if not stats:
             await query.answer("❌ الحملة غير موجودة", show_alert=True)
@@ -1890,7 +2191,7 @@ async def campaign_stats_handler(query, context, donation_id: int):
 async def top_campaigns_handler(query, context):
     """عرض أفضل حملات التبرع"""
     try:
-        campaigns = db.get_top_campaigns(10)
+        campaigns = await db.aio.get_top_campaigns(10)
         
         if not campaigns:
             await query.edit_message_text(
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Query Instrumentation
+قياس زمن استعلامات قاعدة البيانات
+
+يغلّف مؤشرات sqlite3 لتسجيل زمن كل استعلام حسب نص الاستعلام ودالة Database
+المستدعية، وعدد الصفوف، وزمن انتظار الأقفال وأخطاء القفل، مع سجل للاستعلامات البطيئة.
+"""
+
+import logging
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger('database.slow')
+
+# حدود فئات المدرج التكراري بالمللي ثانية
+BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float('inf'))
+
+_WHITESPACE = re.compile(r'\s+')
+_MAX_SQL_LENGTH = 160
+
+
+class LatencyStats:
+    """إحصائيات زمن مجمّعة مع مدرج تكراري ثابت الفئات"""
+
+    __slots__ = ('count', 'total', 'max', 'rows', 'errors', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.errors = 0
+        self.buckets = [0] * len(BUCKETS_MS)
+
+    def observe(self, elapsed_ms: float):
+        self.count += 1
+        self.total += elapsed_ms
+        if elapsed_ms > self.max:
+            self.max = elapsed_ms
+        for i, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                break
+
+    def percentile(self, pct: float) -> float:
+        """تقدير النسبة المئوية من المدرج (الحد الأعلى للفئة)"""
+        if not self.count:
+            return 0.0
+        target = self.count * pct / 100
+        seen = 0
+        for bound, hits in zip(BUCKETS_MS, self.buckets):
+            seen += hits
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'total_ms': round(self.total, 3),
+            'avg_ms': round(self.total / self.count, 3) if self.count else 0.0,
+            'p95_ms': round(self.percentile(95), 3),
+            'max_ms': round(self.max, 3),
+            'rows': self.rows,
+            'errors': self.errors,
+        }
+
+
+class QueryStats:
+    """سجل مركزي لإحصائيات الاستعلامات (آمن مع الخيوط)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._observers = []
+        self.reset()
+
+    def reset(self):
+        """تصفير جميع الإحصائيات"""
+        with self._lock:
+            self.by_method: Dict[str, LatencyStats] = {}
+            self.by_statement: Dict[str, LatencyStats] = {}
+            self.lock_wait_ms = 0.0
+            self.commit_ms = 0.0
+            self.busy_errors = 0
+            self.slow_queries = 0
+            self.started_at = time.time()
+
+    def add_observer(self, callback):
+        """تسجيل دالة تُستدعى بـ (method, statement, elapsed_ms) بعد كل استعلام"""
+        self._observers.append(callback)
+
+    def record(self, method: str, statement: str, elapsed_ms: float,
+               rows: int = 0, error: Optional[BaseException] = None):
+        """تسجيل تنفيذ استعلام واحد"""
+        with self._lock:
+            for table, key in ((self.by_method, method), (self.by_statement, statement)):
+                stats = table.get(key)
+                if stats is None:
+                    stats = table[key] = LatencyStats()
+                stats.observe(elapsed_ms)
+                stats.rows += rows
+                if error is not None:
+                    stats.errors += 1
+
+            if statement.startswith('BEGIN'):
+                self.lock_wait_ms += elapsed_ms
+            elif statement == 'COMMIT':
+                self.commit_ms += elapsed_ms
+
+            if error is not None and _is_busy_error(error):
+                self.busy_errors += 1
+
+            slow = elapsed_ms >= config.SLOW_QUERY_THRESHOLD_MS
+            if slow:
+                self.slow_queries += 1
+
+        if slow:
+            slow_logger.warning(f"استعلام بطيء ({elapsed_ms:.1f}ms) في {method}: {statement}")
+
+        for callback in self._observers:
+            try:
+                callback(method, statement, elapsed_ms)
+            except Exception as e:
+                logger.error(f"خطأ في مراقب الاستعلامات: {e}")
+
+    def add_rows(self, method: str, statement: str, rows: int):
+        """إضافة عدد الصفوف المُعادة بعد الجلب"""
+        with self._lock:
+            for table, key in ((self.by_method, method), (self.by_statement, statement)):
+                stats = table.get(key)
+                if stats is not None:
+                    stats.rows += rows
+
+    def top(self, by: str = 'method', limit: int = 10,
+            order: str = 'total_ms') -> List[Tuple[str, Dict]]:
+        """أعلى الدوال أو الاستعلامات حسب معيار الترتيب"""
+        with self._lock:
+            table = self.by_method if by == 'method' else self.by_statement
+            items = [(key, stats.as_dict()) for key, stats in table.items()]
+        items.sort(key=lambda item: item[1][order], reverse=True)
+        return items[:limit]
+
+    def snapshot(self) -> Dict:
+        """لقطة كاملة من الإحصائيات"""
+        with self._lock:
+            return {
+                'uptime_s': round(time.time() - self.started_at, 1),
+                'queries': sum(s.count for s in self.by_statement.values()),
+                'lock_wait_ms': round(self.lock_wait_ms, 3),
+                'commit_ms': round(self.commit_ms, 3),
+                'busy_errors': self.busy_errors,
+                'slow_queries': self.slow_queries,
+                'by_method': {k: v.as_dict() for k, v in self.by_method.items()},
+                'by_statement': {k: v.as_dict() for k, v in self.by_statement.items()},
+            }
+
+
+stats = QueryStats()
+
+_statement_keys: Dict[str, str] = {}
+
+
+def normalize_statement(sql: str) -> str:
+    """توحيد نص الاستعلام لاستخدامه كمفتاح (مع كاش لتجنب التكرار)"""
+    key = _statement_keys.get(sql)
+    if key is None:
+        key = _WHITESPACE.sub(' ', sql).strip()
+        if len(key) > _MAX_SQL_LENGTH:
+            key = key[:_MAX_SQL_LENGTH] + '…'
+        if len(_statement_keys) < 2048:
+            _statement_keys[sql] = key
+    return key
+
+
+def _is_busy_error(error: BaseException) -> bool:
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+# ==================== الاتصال والمؤشر المُقاسان ====================
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """مؤشر يقيس زمن كل استعلام وعدد الصفوف"""
+
+    _method = ''
+    _statement = ''
+
+    def _timed(self, run, sql: str, method: str):
+        self._method = method
+        self._statement = statement = normalize_statement(sql)
+        start = time.perf_counter()
+        try:
+            result = run()
+        except Exception as e:
+            stats.record(method, statement, (time.perf_counter() - start) * 1000, error=e)
+            raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        stats.record(method, statement, elapsed_ms, max(self.rowcount, 0))
+        return result
+
+    def execute(self, sql, *args):
+        method = sys._getframe(1).f_code.co_name
+        return self._timed(lambda: super(InstrumentedCursor, self).execute(sql, *args),
+                           sql, method)
+
+    def executemany(self, sql, *args):
+        method = sys._getframe(1).f_code.co_name
+        return self._timed(lambda: super(InstrumentedCursor, self).executemany(sql, *args),
+                           sql, method)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            stats.add_rows(self._method, self._statement, 1)
+        return row
+
+    def fetchmany(self, *args):
+        rows = super().fetchmany(*args)
+        stats.add_rows(self._method, self._statement, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        stats.add_rows(self._method, self._statement, len(rows))
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """اتصال يعيد مؤشرات مُقاسة ويقيس زمن التثبيت"""
+
+    def cursor(self, factory=None):
+        if factory is None and config.ENABLE_DB_INSTRUMENTATION:
+            factory = InstrumentedCursor
+        return super().cursor(factory or sqlite3.Cursor)
+
+    def commit(self):
+        if not config.ENABLE_DB_INSTRUMENTATION:
+            return super().commit()
+        method = sys._getframe(1).f_code.co_name
+        start = time.perf_counter()
+        try:
+            result = super().commit()
+        except Exception as e:
+            stats.record(method, 'COMMIT', (time.perf_counter() - start) * 1000, error=e)
+            raise
+        stats.record(method, 'COMMIT', (time.perf_counter() - start) * 1000)
+        return result
+
+
+def format_report(limit: int = 10) -> str:
+    """نص تقرير /dbstats للمسؤول"""
+    snapshot = stats.snapshot()
+    lines = [
+        "🗄 إحصائيات قاعدة البيانات\n",
+        f"⏱ منذ: {snapshot['uptime_s']:.0f} ثانية",
+        f"🔢 الاستعلامات: {snapshot['queries']}",
+        f"🔒 انتظار الأقفال: {snapshot['lock_wait_ms']:.1f}ms",
+        f"💾 زمن التثبيت: {snapshot['commit_ms']:.1f}ms",
+        f"⚠️ أخطاء القفل: {snapshot['busy_errors']}",
+        f"🐢 استعلامات بطيئة (≥{config.SLOW_QUERY_THRESHOLD_MS}ms): {snapshot['slow_queries']}",
+        "",
+        "🔥 أكثر الدوال استهلاكاً للوقت:",
+    ]
+    for name, item in stats.top('method', limit):
+        lines.append(
+            f"• {name}: {item['count']}× متوسط {item['avg_ms']:.2f}ms "
+            f"p95 {item['p95_ms']:.2f}ms أقصى {item['max_ms']:.1f}ms صفوف {item['rows']}"
+        )
+    lines.append("")
+    lines.append("🐢 أبطأ الاستعلامات (p95):")
+    for statement, item in stats.top('statement', 5, order='p95_ms'):
+        lines.append(f"• {item['p95_ms']:.2f}ms ({item['count']}×) {statement[:80]}")
+    return "\n".join(lines)
@@ -5,14 +5,69 @@ Keyboards Module
 """
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from typing import List, Dict
-from config import EMOJI, PRODUCTS_PER_PAGE, PRODUCT_TYPES
+from typing import List, Dict, Hashable
+from collections import OrderedDict
+import functools
+import time
+from config import (EMOJI, PRODUCTS_PER_PAGE, PRODUCT_TYPES, ORDER_STATUSES, ENABLE_CACHE,
+                    KEYBOARD_CACHE_SIZE, PRODUCT_PAGES_TTL)
+from metrics import cache_hit
+
+
+# كاش اللوحات الثابتة: InlineKeyboardMarkup غير قابلة للتعديل لذا يمكن مشاركتها بأمان.
+# محدود بـ KEYBOARD_CACHE_SIZE (الأقدم استخداماً يخرج أولاً) لأن بعض اللوحات لكل منتج
+_static_cache: "OrderedDict[tuple, InlineKeyboardMarkup]" = OrderedDict()
+
+# اللوحات المبنية لمنتج واحد (أول وسيط هو معرف المنتج)
+_PRODUCT_KEYBOARDS = ('product_detail', 'edit_product_menu')
+
+# كاش صفحات المنتجات: يُفرَّغ بالكامل عند تغيّر نسخة الكتالوج. المخزون في نص الأزرار لا يغير
+# النسخة المشتركة بين العمليات، لذا تنتهي الصفحة بعد PRODUCT_PAGES_TTL: (اللوحة، وقت البناء)
+_pages_cache: Dict[tuple, tuple] = {}
+_pages_version: List = [None]
+
+
+def _memoized(func):
+    """تخزين ناتج دالة بناء لوحة ثابتة حسب وسائطها"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLE_CACHE:
+            return func(*args, **kwargs)
+        
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        markup = _static_cache.get(key)
+        cache_hit('keyboards', markup is not None)
+        if markup is None:
+            markup = func(*args, **kwargs)
+            _static_cache[key] = markup
+            if len(_static_cache) > KEYBOARD_CACHE_SIZE:
+                _static_cache.popitem(last=False)
+        else:
+            _static_cache.move_to_end(key)
+        return markup
+    return wrapper
 
 
 class Keyboards:
     """فئة لإنشاء لوحات المفاتيح"""
     
     @staticmethod
+    def clear_cache():
+        """تفريغ جميع لوحات المفاتيح المخزنة"""
+        _static_cache.clear()
+        _pages_cache.clear()
+        _pages_version[0] = None
+    
+    @staticmethod
+    def forget_product(product_id: int = None):
+        """إخراج لوحات منتج من الكاش بعد تعديله أو حذفه (None لكل المنتجات)"""
+        stale = [key for key in _static_cache
+                 if key[0] in _PRODUCT_KEYBOARDS and (product_id is None or key[1][:1] == (product_id,))]
+        for key in stale:
+            del _static_cache[key]
+    
+    @staticmethod
+    @_memoized
     def donation_stars_amounts() -> InlineKeyboardMarkup:
         """أزرار اختيار مبلغ التبرع"""
         keyboard = [
@@ -39,6 +94,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @_memoized
     def main_menu(is_admin: bool = False) -> InlineKeyboardMarkup:
         """القائمة الرئيسية"""
         keyboard = [
@@ -46,6 +102,10 @@ class Keyboards:
                 InlineKeyboardButton(
                     f"{EMOJI['store']} المنتجات",
                     callback_data="browse_products"
+                ),
+                InlineKeyboardButton(
+                    f"{EMOJI['search']} بحث",
+                    callback_data="search_products"
                 )
             ],
             [
@@ -87,6 +147,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @_memoized
     def admin_panel() -> InlineKeyboardMarkup:
         """لوحة تحكم المسؤول"""
         keyboard = [
@@ -133,6 +194,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @_memoized
     def admin_products() -> InlineKeyboardMarkup:
         """قائمة إدارة المنتجات"""
         keyboard = [
@@ -183,6 +245,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @_memoized
     def product_types() -> InlineKeyboardMarkup:
         """أنواع المنتجات"""
         keyboard = [
@@ -223,6 +286,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @_memoized
     def stock_type() -> InlineKeyboardMarkup:
         """نوع المخزون"""
         keyboard = [
@@ -268,8 +332,34 @@ class Keyboards:
     
     @staticmethod
     def products_list(products: List[Dict], page: int = 0, 
-                     callback_prefix: str = "product") -> InlineKeyboardMarkup:
-        """قائمة المنتجات مع pagination"""
+                     callback_prefix: str = "product",
+                     version: Hashable = None) -> InlineKeyboardMarkup:
+        """قائمة المنتجات مع pagination
+        
+        عند تمرير version (نسخة الكتالوج) تُخزَّن الصفحة وتُعاد من الكاش
+        ما دامت النسخة لم تتغير ولم تنتهِ مدة PRODUCT_PAGES_TTL.
+        """
+        if version is None or not ENABLE_CACHE:
+            return Keyboards._build_products_list(products, page, callback_prefix)
+        
+        if _pages_version[0] != version:
+            _pages_cache.clear()
+            _pages_version[0] = version
+        
+        key = (callback_prefix, page)
+        entry = _pages_cache.get(key)
+        hit = entry is not None and time.monotonic() - entry[1] <= PRODUCT_PAGES_TTL
+        cache_hit('product_pages', hit)
+        if hit:
+            return entry[0]
+        markup = Keyboards._build_products_list(products, page, callback_prefix)
+        _pages_cache[key] = (markup, time.monotonic())
+        return markup
+    
+    @staticmethod
+    def _build_products_list(products: List[Dict], page: int,
+                             callback_prefix: str) -> InlineKeyboardMarkup:
+        """بناء صفحة قائمة المنتجات"""
         keyboard = []
         
         start = page * PRODUCTS_PER_PAGE
@@ -329,6 +419,34 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    def search_results(products: List[Dict]) -> InlineKeyboardMarkup:
+        """نتائج البحث عن المنتجات"""
+        keyboard = []
+        
+        for product in products:
+            icon = EMOJI.get(product['type'], EMOJI['products'])
+            keyboard.append([
+                InlineKeyboardButton(
+                    f"{icon} {product['name']} - {product['price']}⭐",
+                    callback_data=f"product:{product['id']}"
+                )
+            ])
+        
+        keyboard.append([
+            InlineKeyboardButton(
+                f"{EMOJI['search']} بحث جديد",
+                callback_data="search_products"
+            ),
+            InlineKeyboardButton(
+                f"{EMOJI['back']} رجوع",
+                callback_data="start"
+            )
+        ])
+        
+        return InlineKeyboardMarkup(keyboard)
+    
+    @staticmethod
+    @_memoized
     def product_detail(product_id: int, is_admin: bool = False) -> InlineKeyboardMarkup:
         """تفاصيل المنتج"""
         keyboard = []
@@ -410,14 +528,15 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
 
     @staticmethod
-    def category_select(product_id: int) -> InlineKeyboardMarkup:
-        """لوحة لاختيار الفئة من القيم المعرفة"""
+    def category_select(product_id: int, counts: Dict[str, int] = None) -> InlineKeyboardMarkup:
+        """لوحة لاختيار الفئة من القيم المعرفة (مع عدد المنتجات النشطة في كل فئة)"""
         keyboard = []
+        counts = counts or {}
         # PRODUCT_TYPES keys may be many; arrange two per row
         items = list(PRODUCT_TYPES.items())
         row = []
         for key, label in items:
-            row.append(InlineKeyboardButton(f"{label}", callback_data=f"set_category:{product_id}:{key}"))
+            row.append(InlineKeyboardButton(f"{label} ({counts.get(label, 0)})", callback_data=f"set_category:{product_id}:{key}"))
             if len(row) >= 2:
                 keyboard.append(row)
                 row = []
@@ -433,6 +552,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @_memoized
     def admin_settings() -> InlineKeyboardMarkup:
         """إعدادات المسؤول"""
         keyboard = [
@@ -517,6 +637,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @_memoized
     def export_options() -> InlineKeyboardMarkup:
         """خيارات التصدير"""
         keyboard = [
@@ -555,6 +676,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @_memoized
     def back_button(callback_data: str = "start") -> InlineKeyboardMarkup:
         """زر رجوع بسيط"""
         return InlineKeyboardMarkup([
@@ -567,6 +689,7 @@ class Keyboards:
         ])
     
     @staticmethod
+    @_memoized
     def edit_product_menu(product_id: int) -> InlineKeyboardMarkup:
         """قائمة تعديل المنتج"""
         keyboard = [
@@ -618,9 +741,10 @@ class Keyboards:
         keyboard = []
         
         for category in categories:
+            count = f" ({category['count']})" if 'count' in category else ""
             keyboard.append([
                 InlineKeyboardButton(
-                    f"{category.get('icon', '📦')} {category['name']}",
+                    f"{category.get('icon', '📦')} {category['name']}{count}",
                     callback_data=f"category:{category['id']}"
                 )
             ])
@@ -642,6 +766,110 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    def category_products(products: List[Dict], category_id: int, page: int,
+                          total: int) -> InlineKeyboardMarkup:
+        """صفحة منتجات فئة (المنتجات المعطاة هي الصفحة الحالية فقط)"""
+        keyboard = []
+        
+        for product in products:
+            icon = EMOJI.get(product['type'], EMOJI['products'])
+            stock_info = f" [{product['stock']}]" if product['is_limited'] else " [♾️]"
+            keyboard.append([
+                InlineKeyboardButton(
+                    f"{icon} {product['name']} - {product['price']}⭐{stock_info}",
+                    callback_data=f"product:{product['id']}"
+                )
+            ])
+        
+        nav_buttons = []
+        if page > 0:
+            nav_buttons.append(
+                InlineKeyboardButton("◀️ السابق", callback_data=f"category:{category_id}:{page-1}")
+            )
+        if (page + 1) * PRODUCTS_PER_PAGE < total:
+            nav_buttons.append(
+                InlineKeyboardButton("▶️ التالي", callback_data=f"category:{category_id}:{page+1}")
+            )
+        if nav_buttons:
+            keyboard.append(nav_buttons)
+        
+        keyboard.append([
+            InlineKeyboardButton(
+                f"{EMOJI['back']} الفئات",
+                callback_data="browse_products"
+            )
+        ])
+        
+        return InlineKeyboardMarkup(keyboard)
+    
+    @staticmethod
+    def admin_orders(status: str, last_id: int, has_next: bool,
+                     first_page: bool) -> InlineKeyboardMarkup:
+        """لوحة طلبات المسؤول: مرشحات الحالة والتنقل بالمؤشر (last_id آخر طلب معروض)"""
+        current = status or 'all'
+        filters = [('all', '📋 الكل')] + list(ORDER_STATUSES.items())
+        keyboard = []
+        
+        row = []
+        for key, label in filters:
+            mark = '• ' if key == current else ''
+            row.append(InlineKeyboardButton(f"{mark}{label}", callback_data=f"admin_orders:{key}"))
+            if len(row) == 3:
+                keyboard.append(row)
+                row = []
+        if row:
+            keyboard.append(row)
+        
+        nav_buttons = []
+        if not first_page:
+            nav_buttons.append(
+                InlineKeyboardButton("⏮ الأحدث", callback_data=f"admin_orders:{current}")
+            )
+        if has_next:
+            nav_buttons.append(
+                InlineKeyboardButton("▶️ الأقدم", callback_data=f"admin_orders:{current}:{last_id}")
+            )
+        if nav_buttons:
+            keyboard.append(nav_buttons)
+        
+        keyboard.append([
+            InlineKeyboardButton(
+                f"{EMOJI['back']} رجوع",
+                callback_data="admin_panel"
+            )
+        ])
+        
+        return InlineKeyboardMarkup(keyboard)
+    
+    @staticmethod
+    def history_pages(callback_prefix: str, page: int, has_next: bool,
+                      back: str = "start") -> InlineKeyboardMarkup:
+        """أزرار التنقل بين صفحات سجل (طلباتي، مشترياتي)"""
+        keyboard = []
+        
+        nav_buttons = []
+        if page > 0:
+            nav_buttons.append(
+                InlineKeyboardButton("◀️ الأحدث", callback_data=f"{callback_prefix}:{page-1}")
+            )
+        if has_next:
+            nav_buttons.append(
+                InlineKeyboardButton("▶️ الأقدم", callback_data=f"{callback_prefix}:{page+1}")
+            )
+        if nav_buttons:
+            keyboard.append(nav_buttons)
+        
+        keyboard.append([
+            InlineKeyboardButton(
+                f"{EMOJI['back']} رجوع",
+                callback_data=back
+            )
+        ])
+        
+        return InlineKeyboardMarkup(keyboard)
+    
+    @staticmethod
+    @_memoized
     def my_account_menu() -> InlineKeyboardMarkup:
         """قائمة حسابي"""
         keyboard = [
@@ -702,6 +930,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @_memoized
     def donation_menu() -> InlineKeyboardMarkup:
         """قائمة التبرع"""
         keyboard = [
@@ -734,6 +963,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @_memoized
     def points_menu() -> InlineKeyboardMarkup:
         """قائمة النقاط"""
         keyboard = [
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Leaderboards
+قوائم الأعلى (الرصيد، الإنفاق، مبيعات المنتجات، مجموع الحملات) من الذاكرة
+
+كل قائمة تحمل أول LEADERBOARD_SIZE صفاً مرتبة (score DESC, key DESC) كما يُرجعها
+استعلام مفهرس واحد، ثم تُحدَّث مع كل كتابة بعد التزامها:
+    - offer(key, score): عضو بقي فوق الحد يُعدَّل في مكانه، ومن هو دون الحد يُتجاهل،
+      وأي تغيير لا يمكن حسمه من الذاكرة (دخول عضو جديد أو هبوط عضو تحت الحد) يُبطل القائمة
+    - update(key, **fields): تحديث أعمدة العرض لعضو دون تغيير الترتيب
+    - invalidate(key=None): إبطال القائمة (أو فقط إن كان المفتاح عضواً فيها)
+
+رقم الجيل يزداد مع كل كتابة، فالقراءة التي بدأت قبل كتابة لا تملأ القائمة بنتيجة قديمة.
+مدة LEADERBOARD_TTL تغطي كتابات العمليات الأخرى.
+"""
+
+import threading
+import time
+from dataclasses import replace
+from typing import Callable, List, Optional
+
+import config
+
+
+class Leaderboard:
+    """أول N صفاً حسب عمود score مع تحديث تزايدي عند الكتابة"""
+
+    def __init__(self, key: str, score: str, floor: int = None,
+                 size: int = None, ttl: float = None):
+        self.key = key
+        self.score = score
+        # الصفوف التي لا تتجاوز floor لا تدخل القائمة (مثل رصيد 0)
+        self.floor = floor
+        self.size = config.LEADERBOARD_SIZE if size is None else size
+        self.ttl = config.LEADERBOARD_TTL if ttl is None else ttl
+        self.generation = 0
+        self._rows = None
+        self._complete = False
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _rank(self, row) -> tuple:
+        return row[self.score], row[self.key]
+
+    def _index(self, key) -> Optional[int]:
+        for index, row in enumerate(self._rows):
+            if row[self.key] == key:
+                return index
+        return None
+
+    def _below_cut(self, key, score) -> bool:
+        """القائمة ممتلئة والصف لا يسبق آخر عضو فيها"""
+        return not self._complete and (score, key) < self._rank(self._rows[-1])
+
+    def get(self, limit: int, offset: int = 0) -> Optional[List]:
+        """الصفوف المطلوبة من الذاكرة، أو None إن لم تكن محمّلة أو لا تغطي المدى"""
+        with self._lock:
+            rows = self._rows
+            if rows is None or time.monotonic() - self._loaded_at > self.ttl:
+                return None
+            if offset + limit > len(rows) and not self._complete:
+                return None
+            return rows[offset:offset + limit]
+
+    def fill(self, rows: List, generation: int) -> None:
+        """حفظ نتيجة الاستعلام إن لم تحدث كتابة منذ قراءة رقم الجيل"""
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._rows = list(rows)
+            self._complete = len(self._rows) < self.size
+            self._loaded_at = time.monotonic()
+
+    def read(self, limit: int, offset: int, load: Callable) -> List:
+        """القراءة من الذاكرة أو عبر load(limit, offset) وملء القائمة"""
+        if not config.ENABLE_CACHE or offset + limit > self.size:
+            return load(limit, offset)
+        rows = self.get(limit, offset)
+        if rows is None:
+            generation = self.generation
+            rows = load(self.size, 0)
+            self.fill(rows, generation)
+            rows = rows[offset:offset + limit]
+        return rows
+
+    async def aread(self, limit: int, offset: int, load: Callable) -> List:
+        """مثل read لكن load دالة غير متزامنة"""
+        if not config.ENABLE_CACHE or offset + limit > self.size:
+            return await load(limit, offset)
+        rows = self.get(limit, offset)
+        if rows is None:
+            generation = self.generation
+            rows = await load(self.size, 0)
+            self.fill(rows, generation)
+            rows = rows[offset:offset + limit]
+        return rows
+
+    def offer(self, key, score: int, **fields) -> None:
+        """إبلاغ القائمة بالقيمة الجديدة لصف بعد التزام الكتابة"""
+        with self._lock:
+            self.generation += 1
+            if self._rows is None:
+                return
+            qualifies = self.floor is None or score > self.floor
+            index = self._index(key)
+            if index is None:
+                if qualifies and not self._below_cut(key, score):
+                    # صف جديد يدخل القائمة ولا نملك أعمدة عرضه
+                    self._rows = None
+                return
+            if not qualifies:
+                if self._complete:
+                    del self._rows[index]
+                else:
+                    self._rows = None
+                return
+            if self._below_cut(key, score):
+                # قد يسبقه صف خارج القائمة
+                self._rows = None
+                return
+            self._rows[index] = replace(self._rows[index], **{self.score: score}, **fields)
+            self._rows.sort(key=self._rank, reverse=True)
+
+    def update(self, key, **fields) -> None:
+        """تحديث أعمدة العرض لعضو في القائمة"""
+        with self._lock:
+            self.generation += 1
+            if self._rows is None:
+                return
+            index = self._index(key)
+            if index is not None:
+                self._rows[index] = replace(self._rows[index], **fields)
+
+    def invalidate(self, key=None) -> None:
+        """إبطال القائمة كلها، أو فقط إن كان key عضواً فيها"""
+        with self._lock:
+            self.generation += 1
+            if self._rows is not None and (key is None or self._index(key) is not None):
+                self._rows = None
+
+
+class Leaderboards:
+    """قوائم الأعلى لكل تخزين"""
+
+    def __init__(self):
+        self.balance = Leaderboard('user_id', 'balance', floor=0)
+        self.spend = Leaderboard('user_id', 'total_spent', floor=0)
+        self.products = Leaderboard('id', 'sales_count')
+        self.campaigns = Leaderboard('id', 'total_received')
+
+    def invalidate(self) -> None:
+        for board in (self.balance, self.spend, self.products, self.campaigns):
+            board.invalidate()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Lifecycle Manager
+إدارة دورة حياة البوت والإغلاق المنظم
+
+عند استقبال SIGTERM/SIGINT يتوقف استقبال التحديثات، وتُكمل المعالجات الجارية عملها
+(الدفع لا يُقطع، والبث يتوقف بين رسالتين)، وتُلغى المعالجات والمهام الخلفية التي تتجاوز
+المهلة، ثم تُفرغ الكتابات المؤجلة ويُدمج ملف WAL وتُغلق اتصالات قاعدة البيانات.
+
+مهام المعالجات تُسجَّل عبر PerUserUpdateProcessor (CONCURRENT_UPDATES > 1)؛ في الوضع
+التسلسلي يبقى المعالج الجاري بلا مهلة. التحديثات المنتظرة عند تيليجرام لا تُحذف عند
+إعادة التشغيل (drop_pending_updates=False): successful_payment المُعاد تسليمه يُسجَّل مرة
+واحدة لأن الطلبات والتبرعات (للحملات وللبوت) فريدة حسب telegram_payment_charge_id.
+"""
+
+import asyncio
+import inspect
+import logging
+import signal
+from typing import Callable, Iterable, List, Tuple
+
+import config
+from database import Database
+from storage import Storage, active_storage
+
+logger = logging.getLogger(__name__)
+
+
+class Lifecycle:
+    """تتبع المهام الخلفية وتنفيذ خطوات الإغلاق بالترتيب"""
+
+    def __init__(self):
+        self.stopping = False
+        self.cancelled = 0
+        self._tasks = set()
+        self._writers: List[Tuple[str, Callable]] = []
+        self._deadline = None
+
+    def reset(self):
+        """إعادة الحالة (للاختبارات)"""
+        if self._deadline is not None:
+            self._deadline.cancel()
+        self.__init__()
+
+    # ==================== المهام الخلفية ====================
+
+    def create_task(self, application, coroutine, name: str = None) -> asyncio.Task:
+        """إنشاء مهمة خلفية تُنتظر عند الإغلاق وتُلغى بعد انتهاء المهلة"""
+        return self.track(application.create_task(coroutine, name=name))
+
+    def track(self, task: asyncio.Task) -> asyncio.Task:
+        """تسجيل مهمة قائمة (مثل مهمة معالج تحديث) لتشملها مهلة الإغلاق"""
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    @property
+    def pending(self) -> int:
+        return sum(1 for task in self._tasks if not task.done())
+
+    def cancel_pending(self) -> int:
+        """إلغاء المهام التي لم تنتهِ بعد"""
+        cancelled = 0
+        for task in list(self._tasks):
+            if not task.done():
+                task.cancel()
+                cancelled += 1
+        if cancelled:
+            self.cancelled += cancelled
+            logger.warning(f"⏹ تم إلغاء {cancelled} مهمة لم تنتهِ خلال مهلة الإغلاق")
+        return cancelled
+
+    async def drain(self, timeout: float = None) -> int:
+        """انتظار المهام الخلفية حتى المهلة ثم إلغاء الباقي، ويُرجع عدد الملغاة"""
+        timeout = config.SHUTDOWN_DRAIN_TIMEOUT if timeout is None else timeout
+        tasks = [task for task in self._tasks if not task.done()]
+        if not tasks:
+            return 0
+
+        _, still_running = await asyncio.wait(tasks, timeout=timeout)
+        cancelled = self.cancel_pending() if still_running else 0
+        await asyncio.gather(*still_running, return_exceptions=True)
+        return cancelled
+
+    # ==================== الإيقاف ====================
+
+    def install(self, application, signals: Iterable[int] = None) -> bool:
+        """ربط إشارات الإيقاف بالإغلاق المنظم (بدلاً من معالج المكتبة الافتراضي)"""
+        if signals is None:
+            signals = [signal.SIGINT, signal.SIGTERM]
+
+        loop = asyncio.get_running_loop()
+        try:
+            for sig in signals:
+                loop.add_signal_handler(sig, self.request_stop, application)
+        except (NotImplementedError, RuntimeError) as e:
+            logger.warning(f"تعذر ربط إشارات الإيقاف: {e}")
+            return False
+        return True
+
+    def request_stop(self, application, timeout: float = None):
+        """بدء الإغلاق: إيقاف الاستقبال وتحديد مهلة للمهام الجارية"""
+        if self.stopping:
+            return
+        self.stopping = True
+        timeout = config.SHUTDOWN_DRAIN_TIMEOUT if timeout is None else timeout
+        logger.info(f"⏳ بدء الإغلاق المنظم ({self.pending} مهمة جارية، المهلة {timeout}s)")
+
+        # التطبيق ينتظر مهامه قبل الخطافات اللاحقة، لذا تُفرض المهلة من هنا
+        self._deadline = asyncio.get_running_loop().call_later(timeout, self.cancel_pending)
+        application.stop_running()
+
+    # ==================== الكتابات المؤجلة ====================
+
+    def register_writer(self, name: str, flush: Callable) -> None:
+        """تسجيل دالة تفريغ (عادية أو async) تُستدعى عند الإغلاق"""
+        self._writers.append((name, flush))
+
+    async def flush_writers(self) -> int:
+        """تفريغ كل الكتابات المؤجلة، ويُرجع عدد الدوال التي فشلت"""
+        failed = 0
+        for name, flush in self._writers:
+            try:
+                result = flush()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                failed += 1
+                logger.error(f"خطأ في تفريغ {name}: {e}")
+        return failed
+
+    async def shutdown(self, databases: Iterable[Storage] = None):
+        """الخطوات الأخيرة: تفريغ الكتابات، دمج WAL، وإغلاق الاتصالات"""
+        if self._deadline is not None:
+            self._deadline.cancel()
+            self._deadline = None
+        await self.drain()
+        await self.flush_writers()
+
+        if databases is None:
+            databases = list(Database._instances.values())
+            storage = active_storage()
+            if storage is not None and storage not in databases:
+                databases.append(storage)
+        for database in databases:
+            database.checkpoint()
+            database.close_all()
+        logger.info("✅ اكتمل الإغلاق المنظم")
+
+
+lifecycle = Lifecycle()
@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+"""
+Offline Load Test Harness
+أداة اختبار الحمل دون اتصال
+
+تشغّل معالجات التطبيق الحقيقية من main.py على تحديثات اصطناعية
+مقابل خادم Bot API محلي وهمي، مع تأخير قابل للضبط وحقن أخطاء 429.
+
+الاستخدام:
+    python loadtest.py --scenario browse --updates 2000 --concurrency 50
+    python loadtest.py --scenario all --latency-ms 20 --rate-limit-every 100 --json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import config
+import instrumentation
+from loop_monitor import LoopMonitor
+
+SCENARIOS = ('browse', 'buy', 'donate', 'broadcast')
+
+BOT_USER = {
+    'id': 1000000001,
+    'is_bot': True,
+    'first_name': 'LoadTestBot',
+    'username': 'loadtest_bot',
+}
+
+
+# ==================== خادم Bot API الوهمي ====================
+
+class StubBotAPI:
+    """خادم HTTP محلي يحاكي Bot API لتيليجرام"""
+
+    def __init__(self, latency: float = 0.0, rate_limit_every: int = 0,
+                 retry_after: int = 1):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.calls: Dict[str, int] = {}
+        self.rate_limited = 0
+        self._counter = itertools.count(1)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.port = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, '127.0.0.1', 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _result_for(self, method: str):
+        """نتيجة مقبولة لكل طريقة API"""
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('sendMessage', 'editMessageText', 'sendInvoice',
+                      'sendDocument', 'sendPhoto'):
+            return {
+                'message_id': next(self._counter),
+                'date': int(time.time()),
+                'chat': {'id': 1, 'type': 'private'},
+                'from': BOT_USER,
+                'text': '',
+            }
+        return True
+
+    async def _handle_connection(self, reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                lines = head.decode('latin-1').split('\r\n')
+                path = lines[0].split(' ')[1]
+                length = 0
+                for line in lines[1:]:
+                    if line.lower().startswith('content-length:'):
+                        length = int(line.split(':', 1)[1])
+                if length:
+                    await reader.readexactly(length)
+
+                method = path.rsplit('/', 1)[-1]
+                status, payload = await self._dispatch(method)
+                body = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: keep-alive\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str):
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        total = sum(self.calls.values())
+        if (self.rate_limit_every and method != 'getMe'
+                and total % self.rate_limit_every == 0):
+            self.rate_limited += 1
+            return "429 Too Many Requests", {
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            }
+
+        return "200 OK", {'ok': True, 'result': self._result_for(method)}
+
+
+# ==================== التحديثات الاصطناعية ====================
+
+class UpdateFactory:
+    """إنشاء تحديثات Telegram اصطناعية"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._ids = itertools.count(1)
+
+    @staticmethod
+    def user(user_id: int) -> dict:
+        return {
+            'id': user_id,
+            'is_bot': False,
+            'first_name': f'User{user_id}',
+            'username': f'user{user_id}',
+        }
+
+    def _chat(self, user_id: int) -> dict:
+        return {'id': user_id, 'type': 'private'}
+
+    def callback(self, user_id: int, data: str):
+        from telegram import Update
+        update_id = next(self._ids)
+        return Update.de_json({
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self.user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': update_id,
+                    'date': int(time.time()),
+                    'chat': self._chat(user_id),
+                    'from': BOT_USER,
+                    'text': '...',
+                },
+            },
+        }, self.bot)
+
+    def text(self, user_id: int, text: str):
+        from telegram import Update
+        update_id = next(self._ids)
+        return Update.de_json({
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': self._chat(user_id),
+                'from': self.user(user_id),
+                'text': text,
+            },
+        }, self.bot)
+
+    def payment(self, user_id: int, payload: str, amount: int):
+        from telegram import Update
+        update_id = next(self._ids)
+        return Update.de_json({
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': self._chat(user_id),
+                'from': self.user(user_id),
+                'successful_payment': {
+                    'currency': 'XTR',
+                    'total_amount': amount,
+                    'invoice_payload': payload,
+                    'telegram_payment_charge_id': f'tg_{update_id}',
+                    'provider_payment_charge_id': f'pr_{update_id}',
+                },
+            },
+        }, self.bot)
+
+
+# ==================== السيناريوهات ====================
+
+def seed_database(db, users: int, products: int) -> List[dict]:
+    """تعبئة قاعدة البيانات ببيانات اختبار"""
+    for user_id in range(1, users + 1):
+        db.add_user(user_id, f'user{user_id}', f'User{user_id}')
+
+    for i in range(products):
+        product_type = ('text', 'code', 'balance')[i % 3]
+        content = '10' if product_type == 'balance' else f'content {i}'
+        product_id = db.add_product(f'منتج {i}', f'وصف المنتج {i}', 10 + i,
+                                    product_type, content)
+        if product_type == 'code':
+            db.add_codes(product_id, [f'CODE-{product_id}-{n}' for n in range(users * 4)])
+
+    return db.get_active_products()
+
+
+def build_scenario(name: str, factory: UpdateFactory, products: List[dict],
+                   users: int, count: int, admin_id: int) -> List[List]:
+    """بناء تسلسلات التحديثات لسيناريو (كل تسلسل يُنفَّذ بالترتيب)"""
+    sequences = []
+    user_ids = itertools.cycle(range(1, users + 1))
+    product_cycle = itertools.cycle(products)
+
+    if name == 'browse':
+        for _ in range(count):
+            user_id = next(user_ids)
+            product = next(product_cycle)
+            data = ('browse_products', f"product:{product['id']}",
+                    'page:product:1', 'start')[len(sequences) % 4]
+            sequences.append([('browse', factory.callback(user_id, data))])
+
+    elif name == 'buy':
+        for _ in range(max(1, count // 2)):
+            user_id = next(user_ids)
+            product = next(product_cycle)
+            payload = f"product_{product['id']}_{user_id}_{len(sequences)}"
+            sequences.append([
+                ('invoice', factory.callback(user_id, f"buy:{product['id']}")),
+                ('payment', factory.payment(user_id, payload, product['price'])),
+            ])
+
+    elif name == 'donate':
+        for _ in range(max(1, count // 2)):
+            user_id = next(user_ids)
+            sequences.append([
+                ('invoice', factory.callback(user_id, 'donate_stars:5')),
+                ('payment', factory.payment(user_id, f'donation_{user_id}_lt{len(sequences)}', 5)),
+            ])
+
+    elif name == 'broadcast':
+        sequences.append([
+            ('start', factory.callback(admin_id, 'broadcast_message')),
+            ('broadcast', factory.text(admin_id, 'رسالة اختبار الحمل')),
+        ])
+
+    return sequences
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """حساب النسبة المئوية (بالمللي ثانية)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index] * 1000
+
+
+async def run_scenario(application, stub: StubBotAPI, name: str,
+                       sequences: List[List], concurrency: int) -> dict:
+    """تشغيل سيناريو وجمع المقاييس"""
+    latencies: Dict[str, List[float]] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    calls_before = dict(stub.calls)
+    rate_limited_before = stub.rate_limited
+    db_before = instrumentation.stats.snapshot()
+    monitor = LoopMonitor()
+    monitor.start()
+
+    async def run_sequence(sequence):
+        async with semaphore:
+            for kind, update in sequence:
+                start = time.perf_counter()
+                await application.process_update(update)
+                latencies.setdefault(kind, []).append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_sequence(seq) for seq in sequences))
+    elapsed = time.perf_counter() - started
+    db_after = instrumentation.stats.snapshot()
+    await monitor.stop()
+
+    stalls: Dict[str, int] = {}
+    for stall in monitor.stalls:
+        location = f"{stall['handler']} @ {stall['site']}"
+        stalls[location] = stalls.get(location, 0) + 1
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    api_calls = {
+        method: stub.calls.get(method, 0) - calls_before.get(method, 0)
+        for method in stub.calls
+        if stub.calls.get(method, 0) - calls_before.get(method, 0)
+    }
+
+    return {
+        'scenario': name,
+        'updates': len(all_latencies),
+        'elapsed_s': round(elapsed, 3),
+        'updates_per_sec': round(len(all_latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(all_latencies, 50), 2),
+        'p95_ms': round(percentile(all_latencies, 95), 2),
+        'p99_ms': round(percentile(all_latencies, 99), 2),
+        'by_kind': {
+            kind: {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 50), 2),
+                'p95_ms': round(percentile(values, 95), 2),
+                'p99_ms': round(percentile(values, 99), 2),
+            }
+            for kind, values in latencies.items()
+        },
+        'db_lock_wait_ms': round(db_after['lock_wait_ms'] - db_before['lock_wait_ms'], 2),
+        'db_commit_ms': round(db_after['commit_ms'] - db_before['commit_ms'], 2),
+        'db_queries': db_after['queries'] - db_before['queries'],
+        'db_busy_errors': db_after['busy_errors'] - db_before['busy_errors'],
+        'api_calls': api_calls,
+        'rate_limited_responses': stub.rate_limited - rate_limited_before,
+        'loop_lag_max_ms': round(monitor.max_lag * 1000, 1),
+        'loop_stalls': stalls,
+        'messages_per_sec': round(api_calls.get('sendMessage', 0) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+async def run_load_test(args) -> List[dict]:
+    """تجهيز البيئة وتشغيل السيناريوهات المطلوبة"""
+    stub = StubBotAPI(args.latency_ms / 1000, args.rate_limit_every)
+    await stub.start()
+
+    # يجب ضبط الإعدادات قبل استيراد المعالجات (تنشئ قاعدة البيانات عند الاستيراد)
+    from storage import get_storage
+    import main
+    from metrics import MetricsRequest
+
+    application = main.build_application(
+        token='123456:LOADTEST',
+        base_url=stub.base_url,
+        request=MetricsRequest(connection_pool_size=max(8, args.concurrency)),
+    )
+    await application.initialize()
+
+    db = get_storage()
+    products = seed_database(db, args.users, args.products)
+    factory = UpdateFactory(application.bot)
+    admin_id = config.ADMIN_IDS[0]
+    db.add_user(admin_id, 'admin', 'Admin')
+
+    scenarios = SCENARIOS if args.scenario == 'all' else (args.scenario,)
+    results = []
+    try:
+        for name in scenarios:
+            sequences = build_scenario(name, factory, products, args.users,
+                                       args.updates, admin_id)
+            results.append(await run_scenario(application, stub, name,
+                                              sequences, args.concurrency))
+    finally:
+        await application.shutdown()
+        await stub.stop()
+
+    return results
+
+
+def print_report(results: List[dict]):
+    """طباعة تقرير مقروء"""
+    print(f"{'scenario':<10} {'updates':>8} {'upd/s':>9} {'p50 ms':>8} "
+          f"{'p95 ms':>8} {'p99 ms':>8} {'lock ms':>9} {'msg/s':>8} {'lag ms':>8}")
+    for r in results:
+        print(f"{r['scenario']:<10} {r['updates']:>8} {r['updates_per_sec']:>9} "
+              f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} "
+              f"{r['db_lock_wait_ms']:>9} {r['messages_per_sec']:>8} {r['loop_lag_max_ms']:>8}")
+    for r in results:
+        for location, count in r['loop_stalls'].items():
+            print(f"  ⚠️ {r['scenario']}: {count}× loop stall in {location}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="اختبار حمل البوت دون اتصال")
+    parser.add_argument('--scenario', choices=SCENARIOS + ('all',), default='all')
+    parser.add_argument('--updates', type=int, default=500,
+                        help="عدد التحديثات لكل سيناريو")
+    parser.add_argument('--concurrency', type=int, default=20,
+                        help="عدد التسلسلات المتزامنة")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--products', type=int, default=60)
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help="تأخير الخادم الوهمي لكل طلب API")
+    parser.add_argument('--rate-limit-every', type=int, default=0,
+                        help="إرجاع 429 لكل N طلب (0 للتعطيل)")
+    parser.add_argument('--keep-rate-limit', action='store_true',
+                        help="الإبقاء على حد الطلبات لكل مستخدم")
+    parser.add_argument('--json', action='store_true', help="إخراج النتائج بصيغة JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='loadtest_')
+
+    config.DATABASE_NAME = os.path.join(workdir, 'loadtest.db')
+    config.LOG_FILE = os.path.join(workdir, 'loadtest.log')
+    config.LOG_LEVEL = 'CRITICAL'
+    config.PAYMENT_PROVIDER_TOKEN = 'loadtest'
+    config.BROADCAST_DELAY = 0
+    if not args.keep_rate_limit:
+        config.MAX_REQUESTS_PER_MINUTE = 10 ** 9
+
+    results = asyncio.run(run_load_test(args))
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_report(results)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Event Loop Monitor
+مراقبة تأخر حلقة الأحداث واكتشاف الاستدعاءات الحاجبة
+
+مهمة نبض تقيس تأخر حلقة الأحداث باستمرار، وخيط مراقبة يلتقط مكدس خيط الحلقة
+عندما يتوقف النبض أكثر من الحد المسموح، لتحديد المعالج والسطر الذي حجب الحلقة.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+import config
+from metrics import REGISTRY, Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = REGISTRY.register(Histogram(
+    'bot_event_loop_lag_seconds', 'Event loop scheduling lag',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, float('inf'))))
+LOOP_STALLS = REGISTRY.register(Counter(
+    'bot_event_loop_stalls_total', 'Event loop stalls above the lag threshold', ('handler',)))
+
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+_ASYNCIO_DIR = os.path.dirname(os.path.abspath(asyncio.__file__))
+
+# ملفات المشروع التي لا تمثل معالجات (نقاط التشغيل وأغلفة القياس)
+_IGNORED_FILES = {'main.py', 'loadtest.py', 'loop_monitor.py', 'metrics.py',
+                  'instrumentation.py', 'profiler.py'}
+
+
+def describe_stack(frame) -> Dict:
+    """استخراج المعالج الجاري وموضع الحجب من مكدس خيط الحلقة"""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+
+    stack = [f"{os.path.basename(f.f_code.co_filename)}:{f.f_lineno} {f.f_code.co_name}"
+             for f in frames]
+
+    # الإطارات بعد آخر إطار من asyncio تخص المهمة التي تعمل حالياً
+    task_start = 0
+    for i, f in enumerate(frames):
+        if os.path.dirname(os.path.abspath(f.f_code.co_filename)) == _ASYNCIO_DIR:
+            task_start = i + 1
+
+    project_frames = [
+        (f.f_code.co_name, stack[i])
+        for i, f in enumerate(frames[task_start:], task_start)
+        if os.path.dirname(os.path.abspath(f.f_code.co_filename)) == _PROJECT_DIR
+        and os.path.basename(f.f_code.co_filename) not in _IGNORED_FILES
+    ]
+
+    return {
+        # أول إطار من ملفات المشروع داخل المهمة هو المعالج، وآخرها هو موضع الحجب
+        'handler': project_frames[0][0] if project_frames else 'unknown',
+        'site': project_frames[-1][1] if project_frames else (stack[-1] if stack else 'unknown'),
+        'stack': stack,
+    }
+
+
+class LoopMonitor:
+    """مراقب تأخر حلقة الأحداث"""
+
+    def __init__(self, interval_ms: float = None, threshold_ms: float = None,
+                 on_stall: Callable[[Dict], None] = None):
+        self.interval = (interval_ms or config.LOOP_LAG_INTERVAL_MS) / 1000
+        self.threshold = (threshold_ms or config.LOOP_LAG_THRESHOLD_MS) / 1000
+        self.on_stall = on_stall
+        self.max_lag = 0.0
+        self.stalls: deque = deque(maxlen=50)
+        self._beat = 0
+        self._last_beat = time.monotonic()
+        self._captured: Optional[Dict] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """بدء المراقبة (يُستدعى من داخل حلقة الأحداث)"""
+        loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        """إيقاف المراقبة"""
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            self._last_beat = time.monotonic()
+            self._beat += 1
+            await asyncio.sleep(self.interval)
+
+            lag = max(0.0, time.monotonic() - expected)
+            LOOP_LAG.observe(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if lag >= self.threshold:
+                self._report(lag)
+
+    def _watch(self):
+        """خيط يلتقط مكدس الحلقة أثناء توقفها (لا يمكن فعل ذلك من داخل الحلقة)"""
+        while not self._stop.wait(self.interval / 2):
+            beat = self._beat
+            if self._captured is not None and self._captured['beat'] == beat:
+                continue
+            if time.monotonic() - self._last_beat - self.interval < self.threshold:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                captured = describe_stack(frame)
+                captured['beat'] = beat
+                self._captured = captured
+
+    def _report(self, lag: float):
+        captured = self._captured
+        self._captured = None
+        # المكدس الملتقط يخص هذا التوقف فقط إذا التُقط قبل النبضة الحالية
+        if captured is None or captured['beat'] != self._beat:
+            captured = {'handler': 'unknown', 'site': 'unknown', 'stack': []}
+
+        stall = {
+            'lag_ms': round(lag * 1000, 1),
+            'handler': captured['handler'],
+            'site': captured['site'],
+            'stack': captured['stack'],
+            'time': time.time(),
+        }
+        self.stalls.append(stall)
+        LOOP_STALLS.labels(stall['handler']).inc()
+        logger.warning(
+            f"⚠️ توقف حلقة الأحداث {stall['lag_ms']}ms في {stall['handler']} ({stall['site']})\n"
+            + "\n".join(stall['stack'][-15:])
+        )
+
+        if self.on_stall is not None:
+            try:
+                self.on_stall(stall)
+            except Exception as e:
+                logger.error(f"خطأ في إبلاغ توقف الحلقة: {e}")
+
+
+def admin_notifier(application, admin_ids: List[int] = None) -> Callable[[Dict], None]:
+    """دالة ترسل تنبيه التوقف للمسؤولين (مع فترة تهدئة بين التنبيهات)"""
+    admin_ids = admin_ids if admin_ids is not None else config.ADMIN_IDS
+    last_sent = [None]
+
+    def notify(stall: Dict):
+        now = time.monotonic()
+        if last_sent[0] is not None and now - last_sent[0] < config.LOOP_LAG_ALERT_COOLDOWN:
+            return
+        last_sent[0] = now
+
+        text = (
+            f"⚠️ توقفت حلقة الأحداث {stall['lag_ms']}ms\n\n"
+            f"🧩 المعالج: {stall['handler']}\n"
+            f"📍 الموضع: {stall['site']}"
+        )
+        for admin_id in admin_ids:
+            application.create_task(application.bot.send_message(chat_id=admin_id, text=text))
+
+    return notify
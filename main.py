@@ -5,13 +5,22 @@ Telegram Store Bot - Main File
 الملف الرئيسي
 """
 
+import time
+
+# بداية قياس زمن الإقلاع (قبل استيراد المكتبات الثقيلة)
+_STARTUP_BEGAN = time.perf_counter()
+
+import argparse
+import asyncio
 import logging
 import sys
+from contextlib import contextmanager
 from telegram import Update
 from telegram.ext import (
     Application,
     CommandHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     MessageHandler,
     PreCheckoutQueryHandler,
     filters
@@ -19,17 +28,30 @@ from telegram.ext import (
 
 # استيراد الوحدات
 import config
-from database import Database
+from storage import Storage, get_storage
 from handlers import (
     start_handler,
+    dbstats_handler,
+    profile_handler,
     callback_handler,
+    inline_query_handler,
     message_handler
 )
 from payment_handler import (
     precheckout_handler,
     successful_payment_handler
 )
-from utils import clean_temp_files
+from utils import clean_temp_files, prerender_product_cards
+from profiler import install_signal_handler
+from lifecycle import lifecycle
+from cluster import JobLock
+from update_processor import PerUserUpdateProcessor
+from persistence import SQLitePersistence
+from loop_monitor import LoopMonitor, admin_notifier
+from metrics import (
+    MetricsServer, MetricsRequest,
+    instrument_application, install_db_observer
+)
 
 # إعداد نظام التسجيل
 logging.basicConfig(
@@ -44,11 +66,198 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def main():
+async def error_handler(update: Update, context):
+    """معالج الأخطاء العام"""
+    logger.error(f"حدث خطأ: {context.error}")
+    
+    if update and update.effective_user:
+        try:
+            error_message = (
+                "❌ عذراً، حدث خطأ غير متوقع!\n"
+                "الرجاء المحاولة مرة أخرى أو التواصل مع الدعم."
+            )
+            
+            if update.message:
+                await update.message.reply_text(error_message)
+            elif update.callback_query:
+                await update.callback_query.answer(error_message, show_alert=True)
+        except:
+            pass
+
+
+def register_handlers(application: Application):
+    """تسجيل جميع المعالجات على التطبيق"""
+    
+    # ==================== معالجات الأوامر ====================
+    application.add_handler(CommandHandler("start", start_handler))
+    application.add_handler(CommandHandler("dbstats", dbstats_handler))
+    application.add_handler(CommandHandler("profile", profile_handler))
+    
+    # ==================== معالجات الأزرار ====================
+    application.add_handler(CallbackQueryHandler(callback_handler))
+    
+    # ==================== البحث المضمّن ====================
+    application.add_handler(InlineQueryHandler(inline_query_handler))
+    
+    # ==================== معالجات الرسائل ====================
+    application.add_handler(MessageHandler(
+        filters.TEXT & ~filters.COMMAND,
+        message_handler
+    ))
+    
+    # ==================== معالجات الدفع ====================
+    application.add_handler(PreCheckoutQueryHandler(precheckout_handler))
+    application.add_handler(MessageHandler(
+        filters.SUCCESSFUL_PAYMENT,
+        successful_payment_handler
+    ))
+    
+    # ==================== معالج الأخطاء ====================
+    application.add_error_handler(error_handler)
+
+
+def build_application(token: str = None, **builder_options) -> Application:
+    """إنشاء التطبيق وتسجيل المعالجات
+    
+    builder_options: خيارات إضافية لـ ApplicationBuilder بالاسم
+    (مثل base_url=...) تُستخدم في أدوات الاختبار.
+    """
+    builder = Application.builder().token(token or config.BOT_TOKEN)
+    if config.ENABLE_METRICS and 'request' not in builder_options:
+        builder.request(MetricsRequest(connection_pool_size=256))
+    if config.CONCURRENT_UPDATES > 1 and 'concurrent_updates' not in builder_options:
+        builder.concurrent_updates(PerUserUpdateProcessor())
+    if config.ENABLE_STATE_PERSISTENCE and 'persistence' not in builder_options:
+        builder.persistence(SQLitePersistence())
+    if config.ENABLE_METRICS and 'get_updates_request' not in builder_options:
+        # نفس سياق SSL المشترك بدلاً من بناء سياق ثانٍ عند الإقلاع
+        builder.get_updates_request(MetricsRequest())
+    for option, value in builder_options.items():
+        getattr(builder, option)(value)
+    
+    application = builder.build()
+    register_handlers(application)
+    
+    if config.ENABLE_METRICS:
+        instrument_application(application)
+        install_db_observer()
+    return application
+
+
+async def start_metrics_server(application: Application):
+    """تشغيل خادم المقاييس بعد تهيئة التطبيق"""
+    if not config.ENABLE_METRICS:
+        return
+    
+    server = MetricsServer()
+    try:
+        await server.start()
+        application.bot_data['metrics_server'] = server
+    except OSError as e:
+        logger.error(f"❌ تعذر تشغيل خادم المقاييس: {e}")
+
+
+async def compact_balance_ledger_periodically(database: Storage = None):
+    """دمج حركات الرصيد القديمة دورياً (عملية واحدة فقط حتى مع عدة عمال)"""
+    database = database or get_storage()
+    while True:
+        await asyncio.sleep(config.BALANCE_LEDGER_COMPACT_INTERVAL)
+        async with JobLock('balance_ledger_compaction', database=database) as lock:
+            if not lock.acquired:
+                continue
+            # خارج حلقة الأحداث حتى لا تتوقف معالجة التحديثات أثناء الدمج
+            removed = await asyncio.to_thread(
+                database.compact_balance_ledger, config.BALANCE_LEDGER_RETENTION_DAYS
+            )
+            if removed:
+                logger.info(f"📒 دُمجت {removed} حركة رصيد قديمة")
+
+
+async def post_init(application: Application):
+    """تهيئة الخدمات المساعدة بعد تشغيل حلقة الأحداث"""
+    # SIGTERM/SIGINT تبدأ الإغلاق المنظم (انظر lifecycle.py)
+    lifecycle.install(application)
+    if application.persistence is not None:
+        lifecycle.register_writer('persistence', application.persistence.flush)
+    
+    await start_metrics_server(application)
+    
+    # SIGUSR1 يشغّل محلل الأداء ويرسل النتيجة للمسؤولين
+    if install_signal_handler(application):
+        logger.info("🔥 إشارة SIGUSR1 تشغّل محلل الأداء")
+    
+    # مراقبة توقف حلقة الأحداث بسبب الاستدعاءات الحاجبة
+    if config.ENABLE_LOOP_MONITOR:
+        monitor = LoopMonitor(on_stall=admin_notifier(application))
+        monitor.start()
+        application.bot_data['loop_monitor'] = monitor
+    
+    application.bot_data['ledger_compaction'] = asyncio.get_running_loop().create_task(
+        compact_balance_ledger_periodically()
+    )
+
+
+async def post_shutdown(application: Application):
+    """إيقاف الخدمات المساعدة عند الإغلاق"""
+    compaction = application.bot_data.pop('ledger_compaction', None)
+    if compaction is not None:
+        compaction.cancel()
+    
+    monitor = application.bot_data.pop('loop_monitor', None)
+    if monitor is not None:
+        await monitor.stop()
+    
+    server = application.bot_data.pop('metrics_server', None)
+    if server is not None:
+        await server.stop()
+    
+    # تفريغ الكتابات المؤجلة، دمج WAL وإغلاق اتصالات قاعدة البيانات
+    await lifecycle.shutdown()
+
+
+# ==================== قياس زمن الإقلاع ====================
+
+class StartupProfile:
+    """تسجيل زمن كل مرحلة من مراحل الإقلاع (--profile-startup)"""
+    
+    def __init__(self, began: float = None):
+        self.phases = []
+        if began is not None:
+            self.phases.append(('imports', time.perf_counter() - began))
+    
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+    
+    @property
+    def total(self) -> float:
+        return sum(elapsed for _, elapsed in self.phases)
+    
+    def report(self) -> str:
+        lines = ["⏱ مراحل الإقلاع:"]
+        for name, elapsed in self.phases:
+            lines.append(f"  {name:<16} {elapsed * 1000:8.1f} ms")
+        lines.append(f"  {'total':<16} {self.total * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+
+def main(argv=None):
     """الدالة الرئيسية لتشغيل البوت"""
+    parser = argparse.ArgumentParser(description="بوت متجر تيليجرام")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="قياس زمن مراحل الإقلاع ثم الخروج")
+    parser.add_argument('--workers', type=int, default=config.CLUSTER_WORKERS,
+                        help="عدد العمليات العاملة خلف webhook (0 أو 1 = عملية واحدة)")
+    args = parser.parse_args(argv)
+    profile_startup = args.profile_startup
+    startup = StartupProfile(_STARTUP_BEGAN)
     
-    # التحقق من التوكن
-    if config.BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
+    # التحقق من التوكن (غير مطلوب لقياس الإقلاع فقط)
+    if config.BOT_TOKEN == "YOUR_BOT_TOKEN_HERE" and not profile_startup:
         logger.error("❌ خطأ: لم يتم إدخال توكن البوت!")
         logger.error("الرجاء فتح ملف config.py ووضع التوكن الخاص بك")
         sys.exit(1)
@@ -60,59 +269,43 @@ def main():
     
     logger.info("🚀 بدء تشغيل البوت...")
     
-    # إنشاء قاعدة البيانات
+    # إنشاء قاعدة البيانات وتطبيق الترحيلات (مرة واحدة لكل العملية)
     try:
-        db = Database(config.DATABASE_NAME)
+        with startup.phase('database'):
+            db = get_storage()
+            db.initialize()
         logger.info("✅ تم إنشاء قاعدة البيانات بنجاح")
     except Exception as e:
         logger.error(f"❌ خطأ في إنشاء قاعدة البيانات: {e}")
         sys.exit(1)
     
     # تنظيف الملفات المؤقتة
-    clean_temp_files()
+    with startup.phase('temp_cleanup'):
+        clean_temp_files()
     
-    # إنشاء التطبيق
-    application = Application.builder().token(config.BOT_TOKEN).build()
+    # وضع العمليات المتعددة: هذه العملية تستقبل webhook فقط وتوزع التحديثات
+    if args.workers > 1 and not profile_startup:
+        from cluster import run_cluster
+        run_cluster(args.workers)
+        return
     
-    # ==================== معالجات الأوامر ====================
-    application.add_handler(CommandHandler("start", start_handler))
-    
-    # ==================== معالجات الأزرار ====================
-    application.add_handler(CallbackQueryHandler(callback_handler))
-    
-    # ==================== معالجات الرسائل ====================
-    application.add_handler(MessageHandler(
-        filters.TEXT & ~filters.COMMAND,
-        message_handler
-    ))
+    # تجهيز بطاقات المنتجات الأكثر مبيعاً مسبقاً
+    with startup.phase('prerender'):
+        prerendered = prerender_product_cards()
+    logger.info(f"🗂 تم تجهيز {prerendered} بطاقة منتج مسبقاً")
     
-    # ==================== معالجات الدفع ====================
-    application.add_handler(PreCheckoutQueryHandler(precheckout_handler))
-    application.add_handler(MessageHandler(
-        filters.SUCCESSFUL_PAYMENT,
-        successful_payment_handler
-    ))
-    
-    # ==================== معالج الأخطاء ====================
-    async def error_handler(update: Update, context):
-        """معالج الأخطاء العام"""
-        logger.error(f"حدث خطأ: {context.error}")
-        
-        if update and update.effective_user:
-            try:
-                error_message = (
-                    "❌ عذراً، حدث خطأ غير متوقع!\n"
-                    "الرجاء المحاولة مرة أخرى أو التواصل مع الدعم."
-                )
-                
-                if update.message:
-                    await update.message.reply_text(error_message)
-                elif update.callback_query:
-                    await update.callback_query.answer(error_message, show_alert=True)
-            except:
-                pass
+    # إنشاء التطبيق
+    with startup.phase('application'):
+        application = build_application(
+            token="0:startup-profile" if profile_startup else None,
+            post_init=post_init,
+            post_shutdown=post_shutdown
+        )
     
-    application.add_error_handler(error_handler)
+    logger.info(startup.report())
+    if profile_startup:
+        # قياس الإقلاع فقط: لا نتصل بتيليجرام
+        return
     
     # ==================== بدء التشغيل ====================
     logger.info("✅ تم تهيئة البوت بنجاح")
@@ -122,9 +315,11 @@ def main():
     logger.info("🎯 البوت جاهز لاستقبال الرسائل...")
     
     # تشغيل البوت
+    # التحديثات المنتظرة أثناء إعادة التشغيل (ومنها successful_payment) تُعالج ولا تُحذف؛
+    # الطلبات والتبرعات فريدة حسب telegram_payment_charge_id فلا يُحتسب الدفع مرتين
     application.run_polling(
         allowed_updates=Update.ALL_TYPES,
-        drop_pending_updates=True
+        drop_pending_updates=False
     )
 
 
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+Runtime Metrics
+مقاييس تشغيل البوت بصيغة Prometheus
+
+عدادات ومدرجات تكرارية ومقاييس لحظية بدون اعتماديات خارجية،
+تُعرض عبر خادم HTTP محلي على /metrics بصيغة النص المعيارية.
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+from telegram.request import HTTPXRequest
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# حدود فئات الزمن بالثواني
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+# ==================== أنواع المقاييس ====================
+
+class _Metric:
+    """أساس مشترك للمقاييس ذات التسميات"""
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values, **kwargs):
+        """الحصول على السلسلة الخاصة بقيم التسميات"""
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class _Value:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    """عداد متزايد فقط"""
+
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+                for key, child in list(self._children.items())]
+
+
+class Gauge(_Metric):
+    """مقياس لحظي (يمكن ربطه بدالة تُقرأ عند الجمع)"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable[[], float]] = None
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, function: Optional[Callable[[], float]]):
+        """قراءة القيمة من دالة عند كل جمع"""
+        self._function = function
+
+    def _samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(self._function())}"]
+            except Exception as e:
+                logger.error(f"خطأ في قراءة المقياس {self.name}: {e}")
+                return []
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+                for key, child in list(self._children.items())]
+
+
+class _HistogramValue:
+    __slots__ = ('bounds', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.bounds):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+
+class Histogram(_Metric):
+    """مدرج تكراري للأزمنة"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, child in list(self._children.items()):
+            cumulative = 0
+            for bound, hits in zip(child.bounds, child.counts):
+                cumulative += hits
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    """سجل المقاييس المعروضة"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """تصدير جميع المقاييس بصيغة Prometheus النصية"""
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+REGISTRY = Registry()
+
+UPDATES = REGISTRY.register(Counter(
+    'bot_updates_total', 'Updates processed per handler', ('handler',)))
+HANDLER_LATENCY = REGISTRY.register(Histogram(
+    'bot_handler_duration_seconds', 'Handler processing time', ('handler',)))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    'bot_handler_errors_total', 'Unhandled handler exceptions', ('handler',)))
+DB_QUERY_LATENCY = REGISTRY.register(Histogram(
+    'bot_db_query_duration_seconds', 'SQLite query time per Database method', ('method',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, float('inf'))))
+API_LATENCY = REGISTRY.register(Histogram(
+    'bot_telegram_api_duration_seconds', 'Telegram Bot API call time', ('endpoint',)))
+API_ERRORS = REGISTRY.register(Counter(
+    'bot_telegram_api_errors_total', 'Failed Telegram Bot API calls', ('endpoint',)))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'bot_cache_requests_total', 'Cache lookups', ('cache', 'result')))
+BROADCAST_MESSAGES = REGISTRY.register(Counter(
+    'bot_broadcast_messages_total', 'Broadcast messages sent', ('result',)))
+UPDATE_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'bot_update_queue_depth', 'Updates waiting in the application queue'))
+
+
+def cache_hit(cache: str, hit: bool):
+    """تسجيل نتيجة بحث في الكاش"""
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+# ==================== ربط المقاييس بالتطبيق ====================
+
+def track_handler(callback, name: str = None):
+    """تغليف معالج لتسجيل عدد التحديثات وزمن المعالجة"""
+    if getattr(callback, '_metrics_wrapped', False):
+        return callback
+    name = name or getattr(callback, '__name__', 'handler')
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        UPDATES.labels(name).inc()
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.labels(name).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(name).observe(time.perf_counter() - start)
+
+    wrapper._metrics_wrapped = True
+    return wrapper
+
+
+def instrument_application(application):
+    """تغليف جميع المعالجات المسجلة وربط عمق طابور التحديثات"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = track_handler(handler.callback)
+    UPDATE_QUEUE_DEPTH.set_function(application.update_queue.qsize)
+
+
+_db_observer_installed = [False]
+
+
+def install_db_observer():
+    """ربط زمن الاستعلامات من instrumentation بالمدرج التكراري (مرة واحدة)"""
+    import instrumentation
+
+    if _db_observer_installed[0]:
+        return
+    _db_observer_installed[0] = True
+    instrumentation.stats.add_observer(
+        lambda method, statement, elapsed_ms: DB_QUERY_LATENCY.labels(method).observe(elapsed_ms / 1000)
+    )
+
+
+_ssl_context = None
+
+
+def _shared_ssl_context():
+    """سياق SSL واحد لكل العملية (تحميل الشهادات يكلف ~100ms لكل عميل)"""
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = httpx.create_ssl_context()
+    return _ssl_context
+
+
+class MetricsRequest(HTTPXRequest):
+    """طلبات Bot API مع قياس الزمن والأخطاء لكل دالة"""
+
+    def _build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(verify=_shared_ssl_context(), **self._client_kwargs)
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            API_ERRORS.labels(endpoint).inc()
+            raise
+        finally:
+            API_LATENCY.labels(endpoint).observe(time.perf_counter() - start)
+        if code >= 400:
+            API_ERRORS.labels(endpoint).inc()
+        return code, payload
+
+
+# ==================== خادم العرض ====================
+
+class MetricsServer:
+    """خادم HTTP بسيط يعرض /metrics"""
+
+    def __init__(self, host: str = None, port: int = None, registry: Registry = REGISTRY):
+        self.host = host or config.METRICS_HOST
+        self.port = config.METRICS_PORT if port is None else port
+        self.registry = registry
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"📈 المقاييس متاحة على http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.registry.render().encode('utf-8')
+            else:
+                status, body = '404 Not Found', b'not found\n'
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"خطأ في خادم المقاييس: {e}")
+        finally:
+            writer.close()
@@ -0,0 +1,646 @@
+# -*- coding: utf-8 -*-
+"""
+Schema Migrations
+ترحيلات مخطط قاعدة البيانات
+
+كل ترحيل له رقم نسخة ويُطبَّق مرة واحدة داخل معاملة، ثم يُحفظ رقمه في
+PRAGMA user_version. عند بدء التشغيل يكفي قراءة رقم النسخة إذا كانت القاعدة محدثة.
+
+لإضافة تغيير على المخطط: أضف دالة جديدة بالمزخرف @migration برقم أكبر من آخر ترحيل،
+ولا تعدّل ترحيلاً سبق نشره.
+"""
+
+import logging
+import sqlite3
+from typing import Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS: List[Tuple[int, str, Callable]] = []
+
+
+def migration(version: int, description: str):
+    """تسجيل دالة ترحيل برقم نسخة"""
+    def decorator(func):
+        if MIGRATIONS and version <= MIGRATIONS[-1][0]:
+            raise ValueError(f"رقم الترحيل {version} يجب أن يكون أكبر من {MIGRATIONS[-1][0]}")
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+
+def latest_version() -> int:
+    """رقم آخر ترحيل معرّف"""
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    """رقم نسخة المخطط المطبقة على قاعدة البيانات"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, target: int = None) -> int:
+    """تطبيق الترحيلات الناقصة حتى target (أو آخر نسخة) وإرجاع عدد ما طُبّق"""
+    if target is None:
+        target = latest_version()
+    if get_version(conn) >= target:
+        return 0
+
+    applied = 0
+    for version, description, func in MIGRATIONS:
+        if version > target:
+            break
+
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # إعادة الفحص داخل المعاملة: قد تكون عملية أخرى طبقت الترحيل
+            if get_version(conn) >= version:
+                conn.rollback()
+                continue
+            func(cursor)
+            cursor.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"فشل الترحيل {version} ({description}): {e}")
+            raise
+
+        applied += 1
+        logger.info(f"تم تطبيق الترحيل {version}: {description}")
+
+    return applied
+
+
+# ==================== الترحيلات ====================
+
+@migration(1, "المخطط الأساسي")
+def _initial_schema(cursor):
+    # جدول المستخدمين
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            balance INTEGER DEFAULT 0,
+            total_spent INTEGER DEFAULT 0,
+            total_purchases INTEGER DEFAULT 0,
+            referrer_id INTEGER,
+            referral_count INTEGER DEFAULT 0,
+            join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_banned INTEGER DEFAULT 0,
+            ban_reason TEXT,
+            language TEXT DEFAULT 'ar'
+        )
+    """)
+
+    # جدول المنتجات
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            price INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            delivery_content TEXT,
+            stock INTEGER DEFAULT -1,
+            is_limited INTEGER DEFAULT 0,
+            is_active INTEGER DEFAULT 1,
+            category TEXT DEFAULT 'عام',
+            image_url TEXT,
+            discount_percentage INTEGER DEFAULT 0,
+            sales_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # جدول الأكواد
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS codes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL,
+            code_value TEXT NOT NULL,
+            is_used INTEGER DEFAULT 0,
+            used_by INTEGER,
+            used_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+        )
+    """)
+
+    # جدول الطلبات
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            payment_id TEXT UNIQUE NOT NULL,
+            price INTEGER NOT NULL,
+            discount_amount INTEGER DEFAULT 0,
+            final_price INTEGER NOT NULL,
+            status TEXT DEFAULT 'pending',
+            delivery_status TEXT DEFAULT 'pending',
+            delivery_content TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )
+    """)
+
+    # جدول السجلات
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            user_id INTEGER,
+            action TEXT NOT NULL,
+            details TEXT,
+            ip_address TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # جدول الإحصائيات اليومية
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date DATE UNIQUE NOT NULL,
+            total_sales INTEGER DEFAULT 0,
+            total_revenue INTEGER DEFAULT 0,
+            new_users INTEGER DEFAULT 0,
+            total_orders INTEGER DEFAULT 0
+        )
+    """)
+
+    # جدول معدل الطلبات (للحماية من الفلود)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            user_id INTEGER PRIMARY KEY,
+            request_count INTEGER DEFAULT 0,
+            last_reset TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            failed_attempts INTEGER DEFAULT 0,
+            is_temp_banned INTEGER DEFAULT 0,
+            temp_ban_until TIMESTAMP
+        )
+    """)
+
+    # جدول الإعدادات القابلة للتعديل
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # جدول الفئات
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            description TEXT,
+            icon TEXT DEFAULT '📦',
+            is_active INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # جدول التبرعات
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS donations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            donor_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            donation_url TEXT UNIQUE,
+            description TEXT,
+            status TEXT DEFAULT 'active',
+            total_received INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (donor_id) REFERENCES users (user_id)
+        )
+    """)
+
+    # جدول سجل التبرعات
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS donation_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            donation_id INTEGER NOT NULL,
+            contributor_id INTEGER,
+            amount INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (donation_id) REFERENCES donations (id),
+            FOREIGN KEY (contributor_id) REFERENCES users (user_id)
+        )
+    """)
+
+    # جدول النقاط
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_points (
+            user_id INTEGER PRIMARY KEY,
+            points INTEGER DEFAULT 0,
+            total_earned INTEGER DEFAULT 0,
+            total_exchanged INTEGER DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    """)
+
+    # جدول سجل تبادل النقاط
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS points_exchange_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            points_used INTEGER NOT NULL,
+            stars_received INTEGER NOT NULL,
+            exchange_rate REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    """)
+
+    # جدول التبرعات للبوت
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bot_donations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            username TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    """)
+
+    # إنشاء الفهارس لتحسين الأداء
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_codes_product ON codes(product_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_codes_used ON codes(is_used)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_active ON products(is_active)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_logs_user ON logs(user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_logs_type ON logs(type)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_donations_donor ON donations(donor_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_donations_status ON donations(status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_donation_records_donation ON donation_records(donation_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bot_donations_user ON bot_donations(user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bot_donations_created ON bot_donations(created_at)")
+
+
+@migration(2, "عمود خيارات التبرع في الحملات")
+def _donation_options(cursor):
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(donations)").fetchall()]
+    if 'donation_options' not in columns:
+        cursor.execute("ALTER TABLE donations ADD COLUMN donation_options TEXT DEFAULT NULL")
+
+
+@migration(3, "فهرس البحث النصي للمنتجات (FTS5)")
+def _products_search_index(cursor):
+    """يتطلب تسجيل الدالة normalize_ar على الاتصال (يفعل ذلك Database._get_connection)
+
+    المشغلات هنا استبدلها الترحيل 14 بمشغلات تفهرس search_text دون الدالة.
+    """
+    try:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'")
+        exists = cursor.fetchone() is not None
+
+        if not exists:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE products_fts USING fts5(
+                    name, description, category,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            """)
+            # فهرسة المنتجات الموجودة مسبقاً
+            cursor.execute("""
+                INSERT INTO products_fts (rowid, name, description, category)
+                SELECT id, normalize_ar(name), normalize_ar(description), normalize_ar(category)
+                FROM products
+            """)
+
+        # المشغلات تعيد الفهرسة فقط عند تغيير الحقول المفهرسة (لا عند تغيير المخزون)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products
+            BEGIN
+                INSERT INTO products_fts (rowid, name, description, category)
+                VALUES (new.id, normalize_ar(new.name), normalize_ar(new.description),
+                        normalize_ar(new.category));
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_fts_update
+            AFTER UPDATE OF name, description, category ON products
+            BEGIN
+                DELETE FROM products_fts WHERE rowid = old.id;
+                INSERT INTO products_fts (rowid, name, description, category)
+                VALUES (new.id, normalize_ar(new.name), normalize_ar(new.description),
+                        normalize_ar(new.category));
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products
+            BEGIN
+                DELETE FROM products_fts WHERE rowid = old.id;
+            END
+        """)
+    except sqlite3.OperationalError as e:
+        logger.warning(f"FTS5 غير متاح، سيُستخدم البحث البسيط: {e}")
+
+
+@migration(4, "فهرس تصفح الفئات وجدول أعداد الفئات")
+def _category_counts(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_active_category ON products(is_active, category, created_at)")
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'category_counts'")
+    exists = cursor.fetchone() is not None
+
+    if not exists:
+        cursor.execute("""
+            CREATE TABLE category_counts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                category TEXT UNIQUE NOT NULL,
+                active_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("""
+            INSERT INTO category_counts (category, active_count)
+            SELECT category, SUM(is_active = 1) FROM products
+            WHERE category IS NOT NULL
+            GROUP BY category
+        """)
+
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS category_counts_insert
+        AFTER INSERT ON products WHEN new.is_active = 1 AND new.category IS NOT NULL
+        BEGIN
+            INSERT INTO category_counts (category, active_count) VALUES (new.category, 1)
+            ON CONFLICT(category) DO UPDATE SET active_count = active_count + 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS category_counts_delete
+        AFTER DELETE ON products WHEN old.is_active = 1 AND old.category IS NOT NULL
+        BEGIN
+            UPDATE category_counts SET active_count = active_count - 1
+            WHERE category = old.category;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS category_counts_update
+        AFTER UPDATE OF is_active, category ON products
+        WHEN (old.is_active = 1) != (new.is_active = 1) OR old.category IS NOT new.category
+        BEGIN
+            UPDATE category_counts SET active_count = active_count - 1
+            WHERE category = old.category AND old.is_active = 1;
+            INSERT INTO category_counts (category, active_count)
+            SELECT new.category, 1 WHERE new.is_active = 1 AND new.category IS NOT NULL
+            ON CONFLICT(category) DO UPDATE SET active_count = active_count + 1;
+        END
+    """)
+
+
+@migration(5, "جدول حالة المحادثات (user_data)")
+def _user_state(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+@migration(6, "أقفال المهام المشتركة ونسخة الكتالوج بين العمليات")
+def _cluster_coordination(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_locks (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+
+    # رقم يزداد مع كل تعديل على المنتجات لتعرف كل عملية متى تُبطل الكاش الخاص بها
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO catalog_state (id, version) VALUES (1, 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS catalog_state_{event.lower()}
+            AFTER {event} ON products
+            BEGIN
+                UPDATE catalog_state SET version = version + 1 WHERE id = 1;
+            END
+        """)
+
+
+@migration(7, "فصل عدادات المستخدم المتغيرة في جدول user_stats")
+def _user_stats(cursor):
+    # صف ضيق لكل مستخدم: كل نقرة (النشاط، فحص الحظر، الرصيد) تقرأ وتكتب صفحات هذا الجدول فقط،
+    # وتبقى بيانات الملف الشخصي النصية في users. بلا فهرس على last_activity حتى لا يُكتب مع كل نقرة
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            is_banned INTEGER NOT NULL DEFAULT 0,
+            balance INTEGER NOT NULL DEFAULT 0,
+            total_spent INTEGER NOT NULL DEFAULT 0,
+            total_purchases INTEGER NOT NULL DEFAULT 0,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    """)
+
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(users)").fetchall()]
+    if 'balance' in columns:
+        cursor.execute("""
+            INSERT OR IGNORE INTO user_stats
+            (user_id, is_banned, balance, total_spent, total_purchases, last_activity)
+            SELECT user_id, COALESCE(is_banned, 0), COALESCE(balance, 0), COALESCE(total_spent, 0),
+                   COALESCE(total_purchases, 0), last_activity
+            FROM users
+        """)
+        for column in ('is_banned', 'balance', 'total_spent', 'total_purchases', 'last_activity'):
+            cursor.execute(f"ALTER TABLE users DROP COLUMN {column}")
+
+
+@migration(8, "سجل حركات الرصيد balance_ledger مع مفاتيح منع التكرار")
+def _balance_ledger(cursor):
+    # سجل إلحاقي: كل حركة تحفظ الرصيد بعدها، وuser_stats.balance هو الإجمالي الجاري لآخر حركة
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS balance_ledger (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            balance_after INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            idempotency_key TEXT UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # شاشة سجل الرصيد والدمج يقرآن نطاقاً واحداً من هذا الفهرس
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_balance_ledger_user
+        ON balance_ledger(user_id, id)
+    """)
+    # سطر افتتاحي للأرصدة الموجودة قبل السجل حتى يطابق مجموع الحركات الرصيد
+    cursor.execute("""
+        INSERT INTO balance_ledger (user_id, delta, balance_after, reason)
+        SELECT s.user_id, s.balance, s.balance, 'opening'
+        FROM user_stats s
+        WHERE s.balance != 0
+          AND NOT EXISTS (SELECT 1 FROM balance_ledger l WHERE l.user_id = s.user_id)
+    """)
+
+
+@migration(9, "فهرس ترتيب النقاط المكتسبة")
+def _points_leaderboard(cursor):
+    # قائمة الأعلى نقاطاً تقرأ أول N من الفهرس بدل فرز جدول user_points كاملاً
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_points_leaderboard
+        ON user_points(total_earned DESC, user_id)
+    """)
+
+
+@migration(10, "فهارس قوائم الأعلى (الرصيد، الإنفاق، المبيعات، الحملات)")
+def _leaderboard_indexes(cursor):
+    # كل قائمة تُحمَّل بقراءة أول N من فهرس مرتب بنفس ترتيب الاستعلام بدل فرز الجدول كاملاً.
+    # فهارس user_stats لا تُكتب إلا عند تغيّر الرصيد أو الإنفاق، لا مع كل نقرة
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_stats_balance
+        ON user_stats(balance DESC, user_id DESC)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_stats_spent
+        ON user_stats(total_spent DESC, user_id DESC)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_products_top_selling
+        ON products(is_active, sales_count DESC, id DESC)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_donations_top
+        ON donations(status, total_received DESC, id DESC)
+    """)
+
+
+@migration(11, "فهرس سجل طلبات المستخدم المغطي")
+def _order_history_index(cursor):
+    # صفحات "طلباتي" تُقرأ من الفهرس وحده بترتيبه (أعمدة العرض ضمنه)، فلا فرز ولا قراءة
+    # لصفوف الجدول. يحل محل idx_orders_user لأن user_id بادئته
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orders_user_history
+        ON orders(user_id, created_at DESC, id DESC, product_name, final_price, status, discount_amount)
+    """)
+    cursor.execute("DROP INDEX IF EXISTS idx_orders_user")
+
+
+@migration(12, "فهارس لوحة طلبات المسؤول (الزمن، الحالة، المنتج)")
+def _order_feed_indexes(cursor):
+    # كل مرشح في لوحة الطلبات يقرأ مدى من فهرس يبدأ به ثم (created_at, id) بنفس ترتيب
+    # العرض، فتتوقف القراءة عند حد الصفحة. الفهرس الجديد للحالة يحل محل idx_orders_status
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orders_created
+        ON orders(created_at DESC, id DESC)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orders_status_created
+        ON orders(status, created_at DESC, id DESC)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orders_product_created
+        ON orders(product_id, created_at DESC, id DESC)
+    """)
+    cursor.execute("DROP INDEX IF EXISTS idx_orders_status")
+
+
+@migration(13, "قصر زيادة نسخة الكتالوج على أعمدة الكتالوج")
+def _catalog_columns_trigger(cursor):
+    # المخزون وعدد المبيعات يتغيران مع كل شراء ويُبطلان كاش المنتج وحده (_touch_catalog)،
+    # فلا يقفلان صف catalog_state ولا يمسحان كاش العمليات الأخرى
+    cursor.execute("DROP TRIGGER IF EXISTS catalog_state_update")
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS catalog_state_update
+        AFTER UPDATE OF name, description, price, type, delivery_content, is_limited,
+                        is_active, category, image_url, discount_percentage ON products
+        BEGIN
+            UPDATE catalog_state SET version = version + 1 WHERE id = 1;
+        END
+    """)
+
+
+# صف products_fts من search_text (السطر الأول الاسم ثم الوصف ثم الفئة)
+_FTS_ROW = """
+    SELECT id, substr(search_text, 1, first - 1),
+           substr(search_text, first + 1, second - first - 1),
+           substr(search_text, second + 1)
+    FROM (SELECT id, search_text, first,
+                 first + instr(substr(search_text, first + 1), char(10)) AS second
+          FROM (SELECT id, search_text, instr(search_text, char(10)) AS first FROM {source}))
+"""
+
+
+@migration(14, "نص البحث المطبّع للمنتجات وفهرسته دون دالة normalize_ar")
+def _stored_search_text(cursor):
+    # التطبيع يتم في بايثون عند الإضافة والتعديل (كما في PostgreSQL)، فأي اتصال يكتب
+    # المنتجات دون تسجيل دالة مخصصة. صف كُتب دون search_text لا يظهر في البحث فقط
+    from database import product_search_text
+
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(products)").fetchall()]
+    if 'search_text' not in columns:
+        cursor.execute("ALTER TABLE products ADD COLUMN search_text TEXT NOT NULL DEFAULT ''")
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'")
+    fts = cursor.fetchone() is not None
+    if fts:
+        cursor.execute("DROP TRIGGER IF EXISTS products_fts_insert")
+        cursor.execute("DROP TRIGGER IF EXISTS products_fts_update")
+
+    rows = cursor.execute("SELECT id, name, description, category FROM products").fetchall()
+    cursor.executemany(
+        "UPDATE products SET search_text = ? WHERE id = ?",
+        [(product_search_text(name, description, category), product_id)
+         for product_id, name, description, category in rows]
+    )
+
+    if not fts:
+        return
+    cursor.execute("DELETE FROM products_fts")
+    cursor.execute(f"""
+        INSERT INTO products_fts (rowid, name, description, category)
+        {_FTS_ROW.format(source='products')}
+    """)
+    new_row = _FTS_ROW.format(source='(SELECT new.id AS id, new.search_text AS search_text)')
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products
+        BEGIN
+            INSERT INTO products_fts (rowid, name, description, category) {new_row};
+        END
+    """)
+
+
+@migration(15, "معرف دفع تيليجرام الفريد للتبرعات")
+def _donation_payment_ids(cursor):
+    # successful_payment قد يُعاد تسليمه بعد إعادة التشغيل، فيُسجَّل التبرع مرة واحدة لكل
+    # telegram_payment_charge_id (القيم NULL للتبرعات القديمة والمستوردة لا تتعارض)
+    for table in ('donation_records', 'bot_donations'):
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+        if 'payment_id' not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN payment_id TEXT")
+        cursor.execute(f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_payment ON {table}(payment_id)
+        """)
+    # يُحدَّث search_text فقط عند تغيير الاسم أو الوصف أو الفئة
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS products_fts_update
+        AFTER UPDATE OF search_text ON products
+        BEGIN
+            DELETE FROM products_fts WHERE rowid = old.id;
+            INSERT INTO products_fts (rowid, name, description, category) {new_row};
+        END
+    """)
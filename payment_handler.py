@@ -9,12 +9,12 @@ from telegram.ext import ContextTypes
 import logging
 from datetime import datetime
 
-from database import Database
+from storage import get_storage
 from utils import send_product_to_user
 import config
 
 logger = logging.getLogger(__name__)
-db = Database(config.DATABASE_NAME)
+db = get_storage()
 
 
 async def precheckout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -50,13 +50,13 @@ async def precheckout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
             # التحقق من صحة المستخدم
             if query.from_user.id != user_id:
                 await query.answer(ok=False, error_message="❌ المستخدم غير مطابق!")
-                db.add_log('security', user_id, 'donation_fraud_attempt', 
+                await db.aio.add_log('security', user_id, 'donation_fraud_attempt', 
                           f'محاولة دفع تبرع من مستخدم مختلف')
                 return
             
             # كل شيء على ما يرام، قبول الدفع
             await query.answer(ok=True)
-            db.add_log('payment', user_id, 'donation_precheckout_approved', 
+            await db.aio.add_log('payment', user_id, 'donation_precheckout_approved', 
                       f'سعر: {query.total_amount}, donation_id: {donation_id}')
             return
         
@@ -71,12 +71,12 @@ async def precheckout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         # التحقق من صحة المستخدم
         if query.from_user.id != user_id:
             await query.answer(ok=False, error_message="❌ المستخدم غير مطابق!")
-            db.add_log('security', user_id, 'payment_fraud_attempt', 
+            await db.aio.add_log('security', user_id, 'payment_fraud_attempt', 
                       f'محاولة دفع من مستخدم مختلف')
             return
         
         # التحقق من وجود المنتج
-        product = db.get_product(product_id)
+        product = await db.aio.get_product(product_id)
         
         if not product:
             await query.answer(ok=False, error_message="❌ المنتج غير موجود!")
@@ -95,7 +95,7 @@ async def precheckout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         
         # التحقق من الأكواد (للمنتجات من نوع code)
         if product['type'] == 'code':
-            available_codes = db.get_available_codes_count(product_id)
+            available_codes = await db.aio.get_available_codes_count(product_id)
             if available_codes <= 0:
                 await query.answer(ok=False, error_message=config.MESSAGES['out_of_stock'])
                 return
@@ -107,14 +107,14 @@ async def precheckout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         
         if query.total_amount != final_price:
             await query.answer(ok=False, error_message="❌ السعر غير مطابق!")
-            db.add_log('security', user_id, 'price_manipulation', 
+            await db.aio.add_log('security', user_id, 'price_manipulation', 
                       f'محاولة تعديل السعر للمنتج {product_id}')
             return
         
         # كل شيء على ما يرام، قبول الدفع
         await query.answer(ok=True)
         
-        db.add_log('payment', user_id, 'precheckout_approved', 
+        await db.aio.add_log('payment', user_id, 'precheckout_approved', 
                   f'منتج: {product_id}, سعر: {final_price}')
     
     except Exception as e:
@@ -158,9 +158,10 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
 
             if donation_id:
                 # add contribution to campaign
-                if db.add_donation_contribution(donation_id, user_id, amount):
+                if await db.aio.add_donation_contribution(donation_id, user_id, amount,
+                                                          payment_id=payment.telegram_payment_charge_id):
                     await message.reply_text(f"🎉 شكراً لتبرعك بـ {amount}⭐ للحملة!")
-                    donation = db.get_donation(donation_id)
+                    donation = await db.aio.get_donation(donation_id)
                     try:
                         await context.bot.send_message(
                             chat_id=donation['donor_id'],
@@ -170,7 +171,7 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
                         )
                     except:
                         pass
-                    db.add_log('donation', user_id, 'donation_campaign_successful', f'حملة: {donation_id}, مبلغ: {amount}')
+                    await db.aio.add_log('donation', user_id, 'donation_campaign_successful', f'حملة: {donation_id}, مبلغ: {amount}')
                     return
                 else:
                     await message.reply_text("❌ فشل إضافة المساهمة للحملة!")
@@ -193,7 +194,7 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
         telegram_payment_id = payment.telegram_payment_charge_id
         
         # التحقق من عدم تكرار الطلب
-        existing_order = db.create_order(
+        existing_order = await db.aio.create_order(
             user_id=user_id,
             product_id=product_id,
             product_name="منتج",
@@ -212,14 +213,14 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
             return
         
         # جلب تفاصيل المنتج
-        product = db.get_product(product_id)
+        product = await db.aio.get_product(product_id)
         
         if not product:
             await message.reply_text(
                 "❌ حدث خطأ: المنتج غير موجود!\n"
                 "تم استرجاع مبلغك تلقائياً."
             )
-            db.update_order_status(existing_order, 'failed', 'failed', 'المنتج غير موجود')
+            await db.aio.update_order_status(existing_order, 'failed', 'failed', 'المنتج غير موجود')
             return
         
         # معالجة منتجات الرصيد - إضافة الرصيد مباشرة
@@ -228,16 +229,17 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
                 balance_amount = int(product.get('delivery_content', 0))
                 
                 # إضافة الرصيد للمستخدم
-                if db.add_user_balance(user_id, balance_amount):
+                if await db.aio.add_user_balance(user_id, balance_amount, reason='purchase',
+                                       idempotency_key=f'order:{existing_order}'):
                     # تحديث حالة الطلب
-                    db.update_order_status(
+                    await db.aio.update_order_status(
                         existing_order,
                         status='completed',
                         delivery_status='delivered'
                     )
                     
                     # تحديث إحصائيات الشراء
-                    db.complete_purchase(user_id, product_id, payment.total_amount)
+                    await db.aio.complete_purchase(user_id, product_id, payment.total_amount)
                     
                     # رسالة نجاح
                     success_message = (
@@ -266,7 +268,7 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
                             except Exception as e:
                                 logger.error(f"فشل إرسال إشعار للمسؤول: {e}")
                     
-                    db.add_log('purchase', user_id, 'balance_purchase_completed', 
+                    await db.aio.add_log('purchase', user_id, 'balance_purchase_completed', 
                               f'رصيد: {balance_amount}, طلب: {existing_order}')
                     return
                 else:
@@ -275,7 +277,7 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
                         "فشل إضافة الرصيد إلى حسابك.\n"
                         "تواصل مع الدعم مع رقم الطلب: #{existing_order}"
                     )
-                    db.update_order_status(existing_order, 'failed', 'failed', 'فشل إضافة الرصيد')
+                    await db.aio.update_order_status(existing_order, 'failed', 'failed', 'فشل إضافة الرصيد')
                     return
             except Exception as e:
                 logger.error(f"خطأ في معالجة منتج الرصيد: {e}")
@@ -284,18 +286,18 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
                     "حدث خطأ في معالجة الرصيد.\n"
                     "تواصل مع الدعم مع رقم الطلب: #{existing_order}"
                 )
-                db.update_order_status(existing_order, 'failed', 'failed', 'خطأ في معالجة الرصيد')
+                await db.aio.update_order_status(existing_order, 'failed', 'failed', 'خطأ في معالجة الرصيد')
                 return
         
         # تقليل المخزون (مع قفل لمنع race conditions)
         if product['is_limited']:
-            stock_decreased = db.decrease_stock(product_id)
+            stock_decreased = await db.aio.decrease_stock(product_id)
             if not stock_decreased:
                 await message.reply_text(
                     "❌ نفذت الكمية المتاحة!\n"
                     "سيتم استرجاع مبلغك."
                 )
-                db.update_order_status(existing_order, 'failed', 'failed', 'نفذ المخزون')
+                await db.aio.update_order_status(existing_order, 'failed', 'failed', 'نفذ المخزون')
                 return
         
         # توصيل المنتج حسب نوعه
@@ -308,14 +310,14 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
         
         if delivery_success:
             # تحديث حالة الطلب
-            db.update_order_status(
+            await db.aio.update_order_status(
                 existing_order,
                 status='completed',
                 delivery_status='delivered'
             )
             
             # تحديث إحصائيات الشراء
-            db.complete_purchase(user_id, product_id, payment.total_amount)
+            await db.aio.complete_purchase(user_id, product_id, payment.total_amount)
             
             # رسالة نجاح
             success_message = (
@@ -347,16 +349,19 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
             
             # معالجة مكافأة الإحالة
             if config.ENABLE_REFERRAL:
-                user_data = db.get_user(user_id)
+                user_data = await db.aio.get_user(user_id)
                 if user_data and user_data.get('referrer_id'):
                     # التحقق إذا كانت أول عملية شراء
                     if user_data['total_purchases'] == 1:
                         referrer_id = user_data['referrer_id']
                         # إضافة مكافأة للمُحيل
-                        db.update_user_activity(referrer_id)
+                        await db.aio.update_user_activity(referrer_id)
                         
                         # إضافة الرصيد فعلياً للمُحيل
-                        if db.add_user_balance(referrer_id, config.REFERRAL_REWARD_STARS):
+                        # مكافأة واحدة لكل مستخدم محال حتى لو أُعيد إرسال الدفع
+                        if await db.aio.add_user_balance(referrer_id, config.REFERRAL_REWARD_STARS,
+                                               reason='referral',
+                                               idempotency_key=f'referral:{user_id}'):
                             try:
                                 await context.bot.send_message(
                                     chat_id=referrer_id,
@@ -372,12 +377,12 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
                         else:
                             logger.error(f"فشل إضافة رصيد الإحالة للمستخدم {referrer_id}")
             
-            db.add_log('purchase', user_id, 'purchase_completed', 
+            await db.aio.add_log('purchase', user_id, 'purchase_completed', 
                       f'منتج: {product_id}, طلب: {existing_order}')
         
         else:
             # فشل التوصيل
-            db.update_order_status(existing_order, 'failed', 'failed', 'فشل التوصيل')
+            await db.aio.update_order_status(existing_order, 'failed', 'failed', 'فشل التوصيل')
             
             await message.reply_text(
                 f"❌ {config.MESSAGES['purchase_failed']}\n\n"
@@ -385,7 +390,7 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
                 "تواصل مع الدعم مع رقم الطلب: #{existing_order}"
             )
             
-            db.add_log('error', user_id, 'delivery_failed', f'طلب: {existing_order}')
+            await db.aio.add_log('error', user_id, 'delivery_failed', f'طلب: {existing_order}')
     
     except Exception as e:
         logger.error(f"خطأ في معالجة الدفع الناجح: {e}")
@@ -394,7 +399,7 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
             "تواصل مع الدعم للمساعدة."
         )
         
-        db.add_log('error', user.id, 'payment_processing_error', str(e))
+        await db.aio.add_log('error', user.id, 'payment_processing_error', str(e))
 
 
 async def refund_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -404,7 +409,7 @@ async def refund_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         admin = message.from_user
 
         # تسجيل الحدث في السجل
-        db.add_log('admin', admin.id, 'refund_requested', f'payload: {getattr(message, "text", "")[:200]}')
+        await db.aio.add_log('admin', admin.id, 'refund_requested', f'payload: {getattr(message, "text", "")[:200]}')
 
         # إخطار المسؤولين بأن هناك طلب استرداد (يحتاج تنفيذ خارجي)
         notify_text = (
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite Persistence
+حفظ حالة المحادثات (context.user_data) في قاعدة البيانات
+
+تُحفظ user_data فقط كنص JSON لكل مستخدم في جدول user_state. تُكتب الحالات المتغيرة
+فقط (مقارنة بآخر نص محفوظ) وفي معاملة واحدة لكل دفعة، وتُحذف الحالة عندما تفرغ.
+قبل كل تحديث يُعاد تحميل حالة المستخدم إذا غيّرتها عملية أخرى تشارك نفس القاعدة.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Dict, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import config
+from storage import Storage, get_storage
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """تخزين user_data في SQLite مع تتبع التغييرات والكتابة على دفعات"""
+
+    def __init__(self, database: Storage = None, update_interval: float = None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False,
+                                        user_data=True, callback_data=False),
+            update_interval=config.STATE_UPDATE_INTERVAL if update_interval is None else update_interval
+        )
+        self.db = database or get_storage()
+        # آخر نص JSON محفوظ لكل مستخدم (للمقارنة وتجنب الكتابة غير الضرورية)
+        self._saved: Dict[int, str] = {}
+        # التغييرات التي لم تُكتب بعد (None = حذف)
+        self._pending: Dict[int, Optional[str]] = {}
+        self._flush_scheduled = False
+        self.writes = 0
+
+    # ==================== التحويل ====================
+
+    @staticmethod
+    def _dump(data: dict) -> Optional[str]:
+        """تحويل الحالة إلى JSON (None إذا كانت فارغة)، مع تجاهل القيم غير القابلة للتحويل"""
+        if not data:
+            return None
+        try:
+            return json.dumps(data, ensure_ascii=False, sort_keys=True)
+        except (TypeError, ValueError):
+            clean = {}
+            for key, value in data.items():
+                try:
+                    json.dumps(value)
+                    clean[str(key)] = value
+                except (TypeError, ValueError):
+                    logger.warning(f"تم تجاهل المفتاح {key} في حالة المحادثة (غير قابل للحفظ)")
+            return json.dumps(clean, ensure_ascii=False, sort_keys=True) if clean else None
+
+    # ==================== user_data ====================
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        states = self.db.get_user_states()
+        self._saved = dict(states)
+        return {user_id: json.loads(data) for user_id, data in states.items()}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        dumped = self._dump(data)
+        if dumped == self._pending.get(user_id, self._saved.get(user_id)):
+            return
+        self._pending[user_id] = dumped
+        self._schedule_flush()
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        # تغييرات هذه العملية التي لم تُكتب بعد لها الأولوية
+        if user_id in self._pending:
+            return
+        stored = self.db.get_user_state(user_id)
+        if stored == self._saved.get(user_id):
+            return
+
+        user_data.clear()
+        if stored is not None:
+            user_data.update(json.loads(stored))
+            self._saved[user_id] = stored
+        else:
+            self._saved.pop(user_id, None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        if self._saved.get(user_id) is None and self._pending.get(user_id) is None:
+            self._pending.pop(user_id, None)
+            return
+        self._pending[user_id] = None
+        self._schedule_flush()
+
+    # ==================== الكتابة ====================
+
+    def _schedule_flush(self):
+        """تجميع تغييرات نفس الدورة في معاملة واحدة"""
+        if self._flush_scheduled:
+            return
+        self._flush_scheduled = True
+        asyncio.get_running_loop().call_soon(self._write_pending)
+
+    def _write_pending(self) -> bool:
+        self._flush_scheduled = False
+        if not self._pending:
+            return True
+
+        pending, self._pending = self._pending, {}
+        if not self.db.save_user_states(pending):
+            # إعادة التغييرات للمحاولة في الدفعة القادمة دون الكتابة فوق الأحدث
+            for user_id, data in pending.items():
+                self._pending.setdefault(user_id, data)
+            return False
+
+        for user_id, data in pending.items():
+            if data is None:
+                self._saved.pop(user_id, None)
+            else:
+                self._saved[user_id] = data
+        self.writes += 1
+        return True
+
+    async def flush(self) -> None:
+        self._write_pending()
+
+    # ==================== البيانات غير المحفوظة ====================
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
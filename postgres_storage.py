@@ -0,0 +1,1898 @@
+# -*- coding: utf-8 -*-
+"""
+PostgreSQL Storage
+تخزين PostgreSQL للمتاجر الكبيرة
+
+AsyncPostgresStorage ينفذ واجهة Storage بدوال غير متزامنة فوق مجمع اتصالات asyncpg،
+وPostgresStorage يشغّله على حلقة أحداث في خيط مستقل. المعالجات تنتظر الاستعلام عبر
+await db.aio.<الدالة>(...) دون إيقاف حلقة البوت؛ أما الدوال المتزامنة (db.<الدالة>)
+فتوقف الخيط المستدعي حتى يعود الاستعلام، ولذا تقتصر على بدء التشغيل والمهام الخلفية.
+
+بخلاف SQLite لا يوجد كاتب واحد للقاعدة كلها، لذا تُقفل الصفوف المعنية فقط:
+- المخزون والرصيد: تحديث مشروط (WHERE stock > 0) يقفل صف المنتج أو المستخدم وحده.
+- الأكواد: FOR UPDATE SKIP LOCKED حتى لا ينتظر مشتريان متزامنان نفس الكود.
+- التحويل واستبدال النقاط: FOR UPDATE على صفوف المستخدمين بترتيب ثابت لتجنب الجمود.
+
+يتطلب asyncpg (انظر requirements-optional.txt).
+"""
+
+import abc
+import asyncio
+import inspect
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Type
+
+import config
+import instrumentation
+from database import normalize_search_text
+from counters import CachedCounts
+from leaderboards import Leaderboards
+from records import Donation, LogEntry, Order, Product, Record, Row, User
+from storage import AsyncCalls, Storage
+
+logger = logging.getLogger(__name__)
+
+try:
+    import asyncpg
+except ImportError:  # اعتماد اختياري
+    asyncpg = None
+
+# CURRENT_TIMESTAMP في SQLite بتوقيت UTC وبلا منطقة زمنية
+_NOW = "(now() AT TIME ZONE 'utc')"
+
+
+# ==================== المخطط ====================
+
+# نفس أرقام ترحيلات SQLite (migrations.py) حتى يبقى المخططان متطابقين.
+# لا توجد مفاتيح أجنبية لأن SQLite لا يفرضها (PRAGMA foreign_keys معطل)
+PG_MIGRATIONS = [
+    (1, "المخطط الأساسي", [
+        f"""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            balance INTEGER DEFAULT 0,
+            total_spent INTEGER DEFAULT 0,
+            total_purchases INTEGER DEFAULT 0,
+            referrer_id BIGINT,
+            referral_count INTEGER DEFAULT 0,
+            join_date TIMESTAMP DEFAULT {_NOW},
+            last_activity TIMESTAMP DEFAULT {_NOW},
+            is_banned INTEGER DEFAULT 0,
+            ban_reason TEXT,
+            language TEXT DEFAULT 'ar'
+        )
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS products (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT,
+            price INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            delivery_content TEXT,
+            stock INTEGER DEFAULT -1,
+            is_limited INTEGER DEFAULT 0,
+            is_active INTEGER DEFAULT 1,
+            category TEXT DEFAULT 'عام',
+            image_url TEXT,
+            discount_percentage INTEGER DEFAULT 0,
+            sales_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT {_NOW},
+            updated_at TIMESTAMP DEFAULT {_NOW}
+        )
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS codes (
+            id SERIAL PRIMARY KEY,
+            product_id INTEGER NOT NULL,
+            code_value TEXT NOT NULL,
+            is_used INTEGER DEFAULT 0,
+            used_by BIGINT,
+            used_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT {_NOW}
+        )
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS orders (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            product_id INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            payment_id TEXT UNIQUE NOT NULL,
+            price INTEGER NOT NULL,
+            discount_amount INTEGER DEFAULT 0,
+            final_price INTEGER NOT NULL,
+            status TEXT DEFAULT 'pending',
+            delivery_status TEXT DEFAULT 'pending',
+            delivery_content TEXT,
+            created_at TIMESTAMP DEFAULT {_NOW},
+            completed_at TIMESTAMP
+        )
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS logs (
+            id SERIAL PRIMARY KEY,
+            type TEXT NOT NULL,
+            user_id BIGINT,
+            action TEXT NOT NULL,
+            details TEXT,
+            ip_address TEXT,
+            timestamp TIMESTAMP DEFAULT {_NOW}
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            id SERIAL PRIMARY KEY,
+            date DATE UNIQUE NOT NULL,
+            total_sales INTEGER DEFAULT 0,
+            total_revenue INTEGER DEFAULT 0,
+            new_users INTEGER DEFAULT 0,
+            total_orders INTEGER DEFAULT 0
+        )
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            user_id BIGINT PRIMARY KEY,
+            request_count INTEGER DEFAULT 0,
+            last_reset TIMESTAMP DEFAULT {_NOW},
+            failed_attempts INTEGER DEFAULT 0,
+            is_temp_banned INTEGER DEFAULT 0,
+            temp_ban_until TIMESTAMP
+        )
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT {_NOW}
+        )
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS categories (
+            id SERIAL PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL,
+            description TEXT,
+            icon TEXT DEFAULT '📦',
+            is_active INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT {_NOW}
+        )
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS donations (
+            id SERIAL PRIMARY KEY,
+            donor_id BIGINT NOT NULL,
+            amount INTEGER NOT NULL,
+            donation_url TEXT UNIQUE,
+            description TEXT,
+            status TEXT DEFAULT 'active',
+            total_received INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT {_NOW}
+        )
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS donation_records (
+            id SERIAL PRIMARY KEY,
+            donation_id INTEGER NOT NULL,
+            contributor_id BIGINT,
+            amount INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT {_NOW}
+        )
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS user_points (
+            user_id BIGINT PRIMARY KEY,
+            points INTEGER DEFAULT 0,
+            total_earned INTEGER DEFAULT 0,
+            total_exchanged INTEGER DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT {_NOW}
+        )
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS points_exchange_history (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            points_used INTEGER NOT NULL,
+            stars_received INTEGER NOT NULL,
+            exchange_rate DOUBLE PRECISION NOT NULL,
+            created_at TIMESTAMP DEFAULT {_NOW}
+        )
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS bot_donations (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            amount INTEGER NOT NULL,
+            username TEXT,
+            created_at TIMESTAMP DEFAULT {_NOW}
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)",
+        # فهرس جزئي للأكواد المتاحة: حجز كود يقرأ أول صف غير مستخدم مباشرة
+        "CREATE INDEX IF NOT EXISTS idx_codes_available ON codes(product_id, id) WHERE is_used = 0",
+        "CREATE INDEX IF NOT EXISTS idx_products_active ON products(is_active)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_user ON logs(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_type ON logs(type)",
+        "CREATE INDEX IF NOT EXISTS idx_donations_donor ON donations(donor_id)",
+        "CREATE INDEX IF NOT EXISTS idx_donations_status ON donations(status)",
+        "CREATE INDEX IF NOT EXISTS idx_donation_records_donation ON donation_records(donation_id)",
+        "CREATE INDEX IF NOT EXISTS idx_bot_donations_user ON bot_donations(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_bot_donations_created ON bot_donations(created_at)",
+    ]),
+    (2, "عمود خيارات التبرع في الحملات", [
+        "ALTER TABLE donations ADD COLUMN IF NOT EXISTS donation_options TEXT DEFAULT NULL",
+    ]),
+    # نص البحث المطبّع يُحسب في بايثون (normalize_search_text) عند الإضافة والتعديل
+    (3, "نص البحث المطبّع للمنتجات", [
+        "ALTER TABLE products ADD COLUMN IF NOT EXISTS search_text TEXT NOT NULL DEFAULT ''",
+    ]),
+    (4, "فهرس تصفح الفئات وجدول أعداد الفئات", [
+        "CREATE INDEX IF NOT EXISTS idx_products_active_category ON products(is_active, category, created_at)",
+        """
+        CREATE TABLE IF NOT EXISTS category_counts (
+            id SERIAL PRIMARY KEY,
+            category TEXT UNIQUE NOT NULL,
+            active_count INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE OR REPLACE FUNCTION category_counts_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND old.is_active = 1 AND old.category IS NOT NULL THEN
+                UPDATE category_counts SET active_count = active_count - 1
+                WHERE category = old.category;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'INSERT') AND new.is_active = 1 AND new.category IS NOT NULL THEN
+                INSERT INTO category_counts (category, active_count) VALUES (new.category, 1)
+                ON CONFLICT (category) DO UPDATE SET active_count = category_counts.active_count + 1;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS category_counts_insert ON products",
+        """
+        CREATE TRIGGER category_counts_insert AFTER INSERT OR DELETE ON products
+        FOR EACH ROW EXECUTE FUNCTION category_counts_apply()
+        """,
+        "DROP TRIGGER IF EXISTS category_counts_update ON products",
+        """
+        CREATE TRIGGER category_counts_update AFTER UPDATE OF is_active, category ON products
+        FOR EACH ROW
+        WHEN ((old.is_active = 1) IS DISTINCT FROM (new.is_active = 1)
+              OR old.category IS DISTINCT FROM new.category)
+        EXECUTE FUNCTION category_counts_apply()
+        """,
+    ]),
+    (5, "جدول حالة المحادثات (user_data)", [
+        f"""
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id BIGINT PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT {_NOW}
+        )
+        """,
+    ]),
+    (6, "أقفال المهام المشتركة ونسخة الكتالوج بين العمليات", [
+        """
+        CREATE TABLE IF NOT EXISTS job_locks (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at DOUBLE PRECISION NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS catalog_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "INSERT INTO catalog_state (id, version) VALUES (1, 0) ON CONFLICT DO NOTHING",
+        """
+        CREATE OR REPLACE FUNCTION catalog_state_bump() RETURNS trigger AS $$
+        BEGIN
+            UPDATE catalog_state SET version = version + 1 WHERE id = 1;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS catalog_state_change ON products",
+        """
+        CREATE TRIGGER catalog_state_change AFTER INSERT OR UPDATE OR DELETE ON products
+        FOR EACH STATEMENT EXECUTE FUNCTION catalog_state_bump()
+        """,
+    ]),
+    (7, "فصل عدادات المستخدم المتغيرة في جدول user_stats", [
+        # fillfactor يترك مساحة في كل صفحة لتحديثات HOT (لا تلمس الفهارس) مع كل نقرة
+        f"""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id BIGINT PRIMARY KEY,
+            is_banned INTEGER NOT NULL DEFAULT 0,
+            balance INTEGER NOT NULL DEFAULT 0,
+            total_spent INTEGER NOT NULL DEFAULT 0,
+            total_purchases INTEGER NOT NULL DEFAULT 0,
+            last_activity TIMESTAMP DEFAULT {_NOW}
+        ) WITH (fillfactor = 80)
+        """,
+        """
+        INSERT INTO user_stats
+        (user_id, is_banned, balance, total_spent, total_purchases, last_activity)
+        SELECT user_id, COALESCE(is_banned, 0), COALESCE(balance, 0), COALESCE(total_spent, 0),
+               COALESCE(total_purchases, 0), last_activity
+        FROM users
+        ON CONFLICT DO NOTHING
+        """,
+        """
+        ALTER TABLE users
+            DROP COLUMN IF EXISTS is_banned, DROP COLUMN IF EXISTS balance,
+            DROP COLUMN IF EXISTS total_spent, DROP COLUMN IF EXISTS total_purchases,
+            DROP COLUMN IF EXISTS last_activity
+        """,
+    ]),
+    (8, "سجل حركات الرصيد balance_ledger مع مفاتيح منع التكرار", [
+        f"""
+        CREATE TABLE IF NOT EXISTS balance_ledger (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            delta INTEGER NOT NULL,
+            balance_after INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            idempotency_key TEXT UNIQUE,
+            created_at TIMESTAMP DEFAULT {_NOW}
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_balance_ledger_user ON balance_ledger(user_id, id)",
+        """
+        INSERT INTO balance_ledger (user_id, delta, balance_after, reason)
+        SELECT s.user_id, s.balance, s.balance, 'opening'
+        FROM user_stats s
+        WHERE s.balance != 0
+          AND NOT EXISTS (SELECT 1 FROM balance_ledger l WHERE l.user_id = s.user_id)
+        """,
+    ]),
+    (9, "فهرس ترتيب النقاط المكتسبة", [
+        """
+        CREATE INDEX IF NOT EXISTS idx_user_points_leaderboard
+        ON user_points(total_earned DESC, user_id)
+        """,
+    ]),
+    (10, "فهارس قوائم الأعلى (الرصيد، الإنفاق، المبيعات، الحملات)", [
+        # تحديثات last_activity تبقى HOT لأنها لا تمس هذه الفهارس
+        "CREATE INDEX IF NOT EXISTS idx_user_stats_balance ON user_stats(balance DESC, user_id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_user_stats_spent ON user_stats(total_spent DESC, user_id DESC)",
+        """
+        CREATE INDEX IF NOT EXISTS idx_products_top_selling
+        ON products(is_active, sales_count DESC, id DESC)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_donations_top
+        ON donations(status, total_received DESC, id DESC)
+        """,
+    ]),
+    (11, "فهرس سجل طلبات المستخدم المغطي", [
+        """
+        CREATE INDEX IF NOT EXISTS idx_orders_user_history
+        ON orders(user_id, created_at DESC, id DESC)
+        INCLUDE (product_name, final_price, status, discount_amount)
+        """,
+        "DROP INDEX IF EXISTS idx_orders_user",
+    ]),
+    (12, "فهارس لوحة طلبات المسؤول (الزمن، الحالة، المنتج)", [
+        "CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at DESC, id DESC)",
+        """
+        CREATE INDEX IF NOT EXISTS idx_orders_status_created
+        ON orders(status, created_at DESC, id DESC)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_orders_product_created
+        ON orders(product_id, created_at DESC, id DESC)
+        """,
+        "DROP INDEX IF EXISTS idx_orders_status",
+    ]),
+    # المخزون وعدد المبيعات يُبطلان كاش المنتج وحده؛ وعلى مستوى الصف حتى لا يزيد
+    # تحديث لم يطابق أي صف النسخة
+    (13, "قصر زيادة نسخة الكتالوج على أعمدة الكتالوج", [
+        "DROP TRIGGER IF EXISTS catalog_state_change ON products",
+        "DROP TRIGGER IF EXISTS catalog_state_rows ON products",
+        """
+        CREATE TRIGGER catalog_state_rows AFTER INSERT OR DELETE ON products
+        FOR EACH ROW EXECUTE FUNCTION catalog_state_bump()
+        """,
+        "DROP TRIGGER IF EXISTS catalog_state_update ON products",
+        """
+        CREATE TRIGGER catalog_state_update
+        AFTER UPDATE OF name, description, price, type, delivery_content, is_limited,
+                        is_active, category, image_url, discount_percentage ON products
+        FOR EACH ROW EXECUTE FUNCTION catalog_state_bump()
+        """,
+    ]),
+    # search_text موجود منذ الترحيل 3 هنا؛ الرقم محجوز ليبقى الترقيم مطابقاً لـ SQLite
+    (14, "نص البحث المطبّع للمنتجات وفهرسته دون دالة normalize_ar", []),
+    (15, "معرف دفع تيليجرام الفريد للتبرعات", [
+        "ALTER TABLE donation_records ADD COLUMN IF NOT EXISTS payment_id TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_donation_records_payment ON donation_records(payment_id)",
+        "ALTER TABLE bot_donations ADD COLUMN IF NOT EXISTS payment_id TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_bot_donations_payment ON bot_donations(payment_id)",
+    ]),
+]
+
+# أعمدة المستخدم الكاملة: الملف الشخصي من users والعدادات من user_stats
+_USER_COLUMNS = """
+    u.user_id, u.username, u.first_name, u.last_name,
+    COALESCE(s.balance, 0) AS balance, COALESCE(s.total_spent, 0) AS total_spent,
+    COALESCE(s.total_purchases, 0) AS total_purchases,
+    u.referrer_id, u.referral_count, u.join_date, s.last_activity,
+    COALESCE(s.is_banned, 0) AS is_banned, u.ban_reason, u.language
+"""
+_USER_FROM = "users u LEFT JOIN user_stats s ON s.user_id = u.user_id"
+
+# أعمدة صفحات سجل الطلبات: كلها ضمن فهرس idx_orders_user_history
+_ORDER_HISTORY_COLUMNS = "id, user_id, product_name, final_price, status, discount_amount, created_at"
+
+# نوع السجل لكل جدول قابل للتصدير (الباقي Row عام)
+_EXPORT_KINDS = {'users': User, 'products': Product, 'orders': Order,
+                 'donations': Donation, 'logs': LogEntry}
+
+# مفتاح القفل الاستشاري الذي يمنع عمليتين من تطبيق الترحيلات في نفس الوقت
+_MIGRATION_LOCK_KEY = 0x53544f5245
+
+
+def _search_text(name: str, description: str, category: str) -> str:
+    """النص المطبّع المخزن في products.search_text"""
+    return ' '.join(normalize_search_text(value) for value in (name, description, category))
+
+
+def _affected(status: str) -> int:
+    """عدد الصفوف من نص الحالة الذي يعيده asyncpg (مثل 'UPDATE 1' أو 'INSERT 0 1')"""
+    try:
+        return int(status.rsplit(' ', 1)[-1])
+    except (ValueError, AttributeError):
+        return 0
+
+
+def _value(value):
+    """تحويل القيم إلى نفس أنواع SQLite (التواريخ نصوص، والأعداد int/float)"""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='seconds')
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+
+def _record(row, kind: Optional[Type[Record]] = None) -> Optional[Dict]:
+    """صف asyncpg إلى سجل من النوع المطلوب (أو قاموس للنتائج الداخلية مثل الإحصائيات)"""
+    if row is None:
+        return None
+    if kind is None:
+        return {key: _value(value) for key, value in row.items()}
+    return kind.shape(tuple(row.keys()))(*map(_value, row.values()))
+
+
+def _limit_offset(limit, offset):
+    """نفس تحقق SQLite من قيم الترقيم"""
+    try:
+        l, o = max(int(limit), 0), max(int(offset), 0)
+    except Exception:
+        l, o = 0, 0
+    return l, o
+
+
+class AsyncPostgresStorage:
+    """تنفيذ Storage غير المتزامن فوق مجمع اتصالات asyncpg"""
+
+    def __init__(self, dsn: str, schema: str = None,
+                 min_size: int = None, max_size: int = None):
+        if asyncpg is None:
+            raise RuntimeError("تخزين PostgreSQL يتطلب تثبيت asyncpg")
+        self.dsn = dsn
+        self.schema = schema
+        self.min_size = config.POSTGRES_POOL_MIN if min_size is None else min_size
+        self.max_size = config.POSTGRES_POOL_MAX if max_size is None else max_size
+        self.pool = None
+        self._init_lock = None
+        self._catalog_version = 0
+        self._catalog_listeners = []
+        self._shared_catalog_version = None
+        self.leaderboards = Leaderboards()
+        self.order_counts = CachedCounts()
+
+    # ==================== الاتصال والمخطط ====================
+
+    async def initialize(self) -> None:
+        """فتح مجمع الاتصالات وتطبيق الترحيلات الناقصة"""
+        if self.pool is not None:
+            return
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if self.pool is not None:
+                return
+            server_settings = {'search_path': self.schema} if self.schema else None
+            pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size,
+                                             max_size=self.max_size,
+                                             server_settings=server_settings)
+            try:
+                await self._migrate(pool)
+            except Exception:
+                await pool.close()
+                raise
+            self.pool = pool
+
+    async def _migrate(self, pool) -> int:
+        applied = 0
+        async with pool.acquire() as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    applied_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+                )
+            """)
+            for version, description, statements in PG_MIGRATIONS:
+                async with conn.transaction():
+                    await conn.execute("SELECT pg_advisory_xact_lock($1)", _MIGRATION_LOCK_KEY)
+                    if await conn.fetchval("SELECT 1 FROM schema_version WHERE version = $1", version):
+                        continue
+                    for statement in statements:
+                        await conn.execute(statement)
+                    await conn.execute("INSERT INTO schema_version (version) VALUES ($1)", version)
+                applied += 1
+                logger.info(f"تم تطبيق ترحيل PostgreSQL {version}: {description}")
+        return applied
+
+    async def close(self) -> None:
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def checkpoint(self) -> bool:
+        # PostgreSQL يثبّت كل معاملة عند التزامها، فلا شيء لدمجه قبل الإيقاف
+        return True
+
+    async def _timed(self, run, sql: str, method: str):
+        """تنفيذ استعلام مع تسجيل زمنه في instrumentation (نفس إحصائيات SQLite)"""
+        if not config.ENABLE_DB_INSTRUMENTATION:
+            return await run()
+        statement = instrumentation.normalize_statement(sql)
+        start = time.perf_counter()
+        try:
+            result = await run()
+        except Exception as e:
+            instrumentation.stats.record(method, statement,
+                                         (time.perf_counter() - start) * 1000, error=e)
+            raise
+        if isinstance(result, list):
+            rows = len(result)
+        elif isinstance(result, str):
+            rows = _affected(result)
+        else:
+            rows = int(result is not None)
+        instrumentation.stats.record(method, statement, (time.perf_counter() - start) * 1000, rows)
+        return result
+
+    async def _target(self, conn):
+        if conn is not None:
+            return conn
+        await self.initialize()
+        return self.pool
+
+    async def _execute(self, sql: str, *args, conn=None) -> str:
+        target = await self._target(conn)
+        return await self._timed(lambda: target.execute(sql, *args), sql,
+                                 sys._getframe(1).f_code.co_name)
+
+    async def _executemany(self, sql: str, args, conn=None) -> None:
+        target = await self._target(conn)
+        await self._timed(lambda: target.executemany(sql, args), sql,
+                          sys._getframe(1).f_code.co_name)
+
+    async def _fetch(self, sql: str, *args, conn=None, kind: Optional[Type[Record]] = None) -> List[Dict]:
+        target = await self._target(conn)
+        rows = await self._timed(lambda: target.fetch(sql, *args), sql,
+                                 sys._getframe(1).f_code.co_name)
+        if kind is None or not rows:
+            return [_record(row) for row in rows]
+        # الصنف يُحدد مرة واحدة لكل نتيجة لا لكل صف
+        record_class = kind.shape(tuple(rows[0].keys()))
+        return [record_class(*map(_value, row.values())) for row in rows]
+
+    async def _fetchrow(self, sql: str, *args, conn=None, kind: Optional[Type[Record]] = None) -> Optional[Dict]:
+        target = await self._target(conn)
+        row = await self._timed(lambda: target.fetchrow(sql, *args), sql,
+                                sys._getframe(1).f_code.co_name)
+        return _record(row, kind)
+
+    async def _fetchval(self, sql: str, *args, conn=None):
+        target = await self._target(conn)
+        value = await self._timed(lambda: target.fetchval(sql, *args), sql,
+                                  sys._getframe(1).f_code.co_name)
+        return _value(value)
+
+    async def _acquire(self):
+        await self.initialize()
+        return self.pool.acquire()
+
+    # ==================== نسخة الكتالوج ====================
+
+    def get_catalog_version(self) -> int:
+        return self._catalog_version
+
+    def add_catalog_listener(self, callback) -> None:
+        self._catalog_listeners.append(callback)
+
+    def _touch_catalog(self, product_id: int = None) -> None:
+        self._catalog_version += 1
+        for callback in self._catalog_listeners:
+            try:
+                callback(product_id)
+            except Exception as e:
+                logger.error(f"خطأ في مستمع الكتالوج: {e}")
+
+    async def sync_catalog(self) -> bool:
+        try:
+            version = await self._fetchval("SELECT version FROM catalog_state WHERE id = 1") or 0
+            changed = self._shared_catalog_version is not None and version != self._shared_catalog_version
+            self._shared_catalog_version = version
+            if changed:
+                self.leaderboards.products.invalidate()
+                self._touch_catalog(None)
+            return changed
+        except Exception as e:
+            logger.error(f"خطأ في مزامنة نسخة الكتالوج: {e}")
+            return False
+
+    # ==================== المستخدمون ====================
+
+    async def add_user(self, user_id: int, username: str = None, first_name: str = None,
+                       last_name: str = None, referrer_id: int = None) -> bool:
+        try:
+            async with await self._acquire() as conn, conn.transaction():
+                status = await self._execute("""
+                    INSERT INTO users (user_id, username, first_name, last_name, referrer_id)
+                    VALUES ($1, $2, $3, $4, $5)
+                    ON CONFLICT (user_id) DO NOTHING
+                """, user_id, username, first_name, last_name, referrer_id, conn=conn)
+                added = _affected(status) > 0
+                await self._execute("INSERT INTO user_stats (user_id) VALUES ($1) ON CONFLICT DO NOTHING",
+                                    user_id, conn=conn)
+                if added and referrer_id:
+                    await self._execute("""
+                        UPDATE users SET referral_count = referral_count + 1
+                        WHERE user_id = $1
+                    """, referrer_id, conn=conn)
+                return added
+        except Exception as e:
+            logger.error(f"خطأ في إضافة مستخدم: {e}")
+            return False
+
+    async def get_user(self, user_id: int) -> Optional[Dict]:
+        try:
+            return await self._fetchrow(f"SELECT {_USER_COLUMNS} FROM {_USER_FROM} WHERE u.user_id = $1",
+                                        user_id, kind=User)
+        except Exception as e:
+            logger.error(f"خطأ في جلب بيانات المستخدم: {e}")
+            return None
+
+    async def is_user_banned(self, user_id: int) -> bool:
+        try:
+            return bool(await self._fetchval("SELECT is_banned FROM user_stats WHERE user_id = $1", user_id))
+        except Exception as e:
+            logger.error(f"خطأ في فحص حظر المستخدم: {e}")
+            return False
+
+    async def get_user_stats(self, user_id: int) -> Optional[Dict]:
+        try:
+            return await self._fetchrow("""
+                SELECT user_id, balance, total_spent, total_purchases, last_activity, is_banned
+                FROM user_stats WHERE user_id = $1
+            """, user_id, kind=Row)
+        except Exception as e:
+            logger.error(f"خطأ في جلب عدادات المستخدم: {e}")
+            return None
+
+    async def update_user_activity(self, user_id: int):
+        try:
+            await self._execute(f"UPDATE user_stats SET last_activity = {_NOW} WHERE user_id = $1", user_id)
+        except Exception as e:
+            logger.error(f"خطأ في تحديث نشاط المستخدم: {e}")
+
+    async def ban_user(self, user_id: int, reason: str = None) -> bool:
+        try:
+            async with await self._acquire() as conn, conn.transaction():
+                await self._execute("UPDATE users SET ban_reason = $1 WHERE user_id = $2",
+                                    reason, user_id, conn=conn)
+                await self._execute("UPDATE user_stats SET is_banned = 1 WHERE user_id = $1",
+                                    user_id, conn=conn)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في حظر المستخدم: {e}")
+            return False
+
+    async def unban_user(self, user_id: int) -> bool:
+        try:
+            async with await self._acquire() as conn, conn.transaction():
+                await self._execute("UPDATE users SET ban_reason = NULL WHERE user_id = $1",
+                                    user_id, conn=conn)
+                await self._execute("UPDATE user_stats SET is_banned = 0 WHERE user_id = $1",
+                                    user_id, conn=conn)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في إلغاء حظر المستخدم: {e}")
+            return False
+
+    async def get_all_users(self, limit: int = None, offset: int = 0) -> List[Dict]:
+        try:
+            query = f"SELECT {_USER_COLUMNS} FROM {_USER_FROM} ORDER BY u.join_date DESC"
+            if limit is None:
+                return await self._fetch(query, kind=User)
+            return await self._fetch(query + " LIMIT $1 OFFSET $2", *_limit_offset(limit, offset),
+                                     kind=User)
+        except Exception as e:
+            logger.error(f"خطأ في جلب المستخدمين: {e}")
+            return []
+
+    async def get_users_count(self) -> int:
+        try:
+            return await self._fetchval("SELECT COUNT(*) FROM users")
+        except Exception as e:
+            logger.error(f"خطأ في عد المستخدمين: {e}")
+            return 0
+
+    # ==================== المنتجات ====================
+
+    async def add_product(self, name: str, description: str, price: int,
+                          product_type: str, delivery_content: str = None,
+                          stock: int = -1, is_limited: int = 0,
+                          category: str = 'عام') -> Optional[int]:
+        try:
+            product_id = await self._fetchval("""
+                INSERT INTO products
+                (name, description, price, type, delivery_content, stock, is_limited,
+                 category, search_text)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                RETURNING id
+            """, name, description, price, product_type, delivery_content, stock,
+                is_limited, category, _search_text(name, description, category))
+            self.leaderboards.products.offer(product_id, 0)
+            self._touch_catalog(product_id)
+            return product_id
+        except Exception as e:
+            logger.error(f"خطأ في إضافة منتج: {e}")
+            return None
+
+    async def get_product(self, product_id: int) -> Optional[Dict]:
+        try:
+            return await self._fetchrow("SELECT * FROM products WHERE id = $1", product_id, kind=Product)
+        except Exception as e:
+            logger.error(f"خطأ في جلب المنتج: {e}")
+            return None
+
+    async def get_active_products(self, category: str = None,
+                                  limit: int = None, offset: int = 0) -> List[Dict]:
+        try:
+            query = "SELECT * FROM products WHERE is_active = 1"
+            params: List = []
+            if category:
+                params.append(category)
+                query += f" AND category = ${len(params)}"
+            query += " ORDER BY created_at DESC, id DESC"
+            if limit is not None:
+                params.extend(_limit_offset(limit, offset))
+                query += f" LIMIT ${len(params) - 1} OFFSET ${len(params)}"
+            return await self._fetch(query, *params, kind=Product)
+        except Exception as e:
+            logger.error(f"خطأ في جلب المنتجات: {e}")
+            return []
+
+    async def search_products(self, query: str, limit: int = 10, offset: int = 0) -> List[Dict]:
+        words = normalize_search_text(query).split()
+        if not words:
+            return []
+        try:
+            conditions = ' AND '.join(f"search_text LIKE ${i + 1}" for i in range(len(words)))
+            return await self._fetch(f"""
+                SELECT * FROM products
+                WHERE is_active = 1 AND {conditions}
+                ORDER BY sales_count DESC, id DESC
+                LIMIT ${len(words) + 1} OFFSET ${len(words) + 2}
+            """, *[f'%{word}%' for word in words], limit, offset, kind=Product)
+        except Exception as e:
+            logger.error(f"خطأ في البحث عن المنتجات: {e}")
+            return []
+
+    async def _load_top_products(self, limit: int, offset: int) -> List[Dict]:
+        return await self._fetch("""
+            SELECT * FROM products
+            WHERE is_active = 1
+            ORDER BY sales_count DESC, id DESC
+            LIMIT $1 OFFSET $2
+        """, limit, offset, kind=Product)
+
+    async def get_top_selling_products(self, limit: int = 10, offset: int = 0) -> List[Dict]:
+        try:
+            return await self.leaderboards.products.aread(limit, offset, self._load_top_products)
+        except Exception as e:
+            logger.error(f"خطأ في جلب المنتجات الأكثر مبيعاً: {e}")
+            return []
+
+    async def update_product(self, product_id: int, **kwargs) -> bool:
+        try:
+            updates = []
+            values = []
+            for key, value in kwargs.items():
+                if key in ['name', 'description', 'price', 'type', 'delivery_content',
+                           'stock', 'is_limited', 'is_active', 'category', 'discount_percentage']:
+                    values.append(value)
+                    updates.append(f"{key} = ${len(values)}")
+            if not updates:
+                return False
+
+            values.append(product_id)
+            async with await self._acquire() as conn, conn.transaction():
+                row = await self._fetchrow(f"""
+                    UPDATE products SET {', '.join(updates)}, updated_at = {_NOW}
+                    WHERE id = ${len(values)}
+                    RETURNING name, description, category, search_text
+                """, *values, conn=conn)
+                if row is None:
+                    return False
+                search_text = _search_text(row['name'], row['description'], row['category'])
+                if search_text != row['search_text']:
+                    await self._execute("UPDATE products SET search_text = $1 WHERE id = $2",
+                                        search_text, product_id, conn=conn)
+            self.leaderboards.products.invalidate(None if 'is_active' in kwargs else product_id)
+            self._touch_catalog(product_id)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في تحديث المنتج: {e}")
+            return False
+
+    async def delete_product(self, product_id: int) -> bool:
+        try:
+            deleted = _affected(await self._execute("DELETE FROM products WHERE id = $1", product_id)) > 0
+            if deleted:
+                self.leaderboards.products.invalidate(product_id)
+                self._touch_catalog(product_id)
+            return deleted
+        except Exception as e:
+            logger.error(f"خطأ في حذف المنتج: {e}")
+            return False
+
+    async def decrease_stock(self, product_id: int) -> bool:
+        try:
+            # التحديث المشروط يقفل صف المنتج فقط، ويُعاد تقييم الشرط بعد انتظار القفل
+            stock = await self._fetchval("""
+                UPDATE products SET stock = stock - 1
+                WHERE id = $1 AND is_limited = 1 AND stock > 0
+                RETURNING stock
+            """, product_id)
+            if stock is None:
+                return False
+            self.leaderboards.products.update(product_id, stock=stock)
+            self._touch_catalog(product_id)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في تقليل المخزون: {e}")
+            return False
+
+    # ==================== الأكواد ====================
+
+    async def add_codes(self, product_id: int, codes: List[str]) -> bool:
+        try:
+            await self._executemany("INSERT INTO codes (product_id, code_value) VALUES ($1, $2)",
+                                    [(product_id, code) for code in codes])
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في إضافة الأكواد: {e}")
+            return False
+
+    async def get_unused_code(self, product_id: int, user_id: int) -> Optional[str]:
+        try:
+            # SKIP LOCKED: المشتري التالي يأخذ الكود التالي بدل انتظار التزام الأول
+            return await self._fetchval(f"""
+                UPDATE codes SET is_used = 1, used_by = $2, used_at = {_NOW}
+                WHERE id = (
+                    SELECT id FROM codes
+                    WHERE product_id = $1 AND is_used = 0
+                    ORDER BY id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING code_value
+            """, product_id, user_id)
+        except Exception as e:
+            logger.error(f"خطأ في جلب الكود: {e}")
+            return None
+
+    async def get_available_codes_count(self, product_id: int) -> int:
+        try:
+            return await self._fetchval(
+                "SELECT COUNT(*) FROM codes WHERE product_id = $1 AND is_used = 0", product_id)
+        except Exception as e:
+            logger.error(f"خطأ في عد الأكواد: {e}")
+            return 0
+
+    # ==================== الطلبات ====================
+
+    async def create_order(self, user_id: int, product_id: int, product_name: str,
+                           payment_id: str, price: int, discount_amount: int = 0) -> Optional[int]:
+        try:
+            order_id = await self._fetchval("""
+                INSERT INTO orders
+                (user_id, product_id, product_name, payment_id, price,
+                 discount_amount, final_price)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+                RETURNING id
+            """, user_id, product_id, product_name, payment_id, price,
+                discount_amount, price - discount_amount)
+            self.order_counts.add('pending')
+            return order_id
+        except asyncpg.UniqueViolationError:
+            logger.warning(f"طلب مكرر: {payment_id}")
+            return None
+        except Exception as e:
+            logger.error(f"خطأ في إنشاء الطلب: {e}")
+            return None
+
+    async def update_order_status(self, order_id: int, status: str,
+                                  delivery_status: str = None,
+                                  delivery_content: str = None) -> bool:
+        try:
+            values = [status]
+            updates = ["status = $1"]
+            if delivery_status:
+                values.append(delivery_status)
+                updates.append(f"delivery_status = ${len(values)}")
+            if delivery_content:
+                values.append(delivery_content)
+                updates.append(f"delivery_content = ${len(values)}")
+            if status == 'completed':
+                updates.append(f"completed_at = {_NOW}")
+            values.append(order_id)
+            # الحالة السابقة من صف مقفل لنقل الطلب بين عدادات الحالات
+            old_status = await self._fetchval(f"""
+                UPDATE orders o SET {', '.join(updates)}
+                FROM (SELECT id, status FROM orders WHERE id = ${len(values)} FOR UPDATE) old
+                WHERE o.id = old.id
+                RETURNING old.status
+            """, *values)
+            if old_status is not None:
+                self.order_counts.move(old_status, status)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في تحديث الطلب: {e}")
+            return False
+
+    async def get_user_orders(self, user_id: int, limit: int = 10, offset: int = 0) -> List[Dict]:
+        try:
+            return await self._fetch(f"""
+                SELECT {_ORDER_HISTORY_COLUMNS} FROM orders WHERE user_id = $1
+                ORDER BY created_at DESC, id DESC
+                LIMIT $2 OFFSET $3
+            """, user_id, *_limit_offset(limit, offset), kind=Order)
+        except Exception as e:
+            logger.error(f"خطأ في جلب الطلبات: {e}")
+            return []
+
+    async def get_order(self, order_id: int) -> Optional[Dict]:
+        try:
+            return await self._fetchrow("SELECT * FROM orders WHERE id = $1", order_id, kind=Order)
+        except Exception as e:
+            logger.error(f"خطأ في جلب الطلب: {e}")
+            return None
+
+    async def get_all_orders(self, limit: int = 50) -> List[Dict]:
+        return await self.get_order_feed(limit=limit)
+
+    async def get_order_feed(self, status: str = None, product_id: int = None,
+                             since: str = None, until: str = None,
+                             before_id: int = None, limit: int = 20) -> List[Dict]:
+        try:
+            conditions = []
+            params: List = []
+            if status:
+                params.append(status)
+                conditions.append(f"o.status = ${len(params)}")
+            if product_id:
+                params.append(product_id)
+                conditions.append(f"o.product_id = ${len(params)}")
+            if since:
+                params.append(since)
+                conditions.append(f"o.created_at >= ${len(params)}::text::timestamp")
+            if until:
+                params.append(until)
+                conditions.append(f"o.created_at < ${len(params)}::text::timestamp")
+            if before_id:
+                params.append(before_id)
+                conditions.append(f"(o.created_at, o.id) < "
+                                  f"(SELECT created_at, id FROM orders WHERE id = ${len(params)})")
+            params.append(limit)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            return await self._fetch(f"""
+                SELECT o.*, u.username
+                FROM orders o
+                LEFT JOIN users u ON o.user_id = u.user_id
+                {where}
+                ORDER BY o.created_at DESC, o.id DESC
+                LIMIT ${len(params)}
+            """, *params, kind=Order)
+        except Exception as e:
+            logger.error(f"خطأ في جلب الطلبات: {e}")
+            return []
+
+    async def _load_order_counts(self) -> Dict[str, int]:
+        rows = await self._fetch("SELECT status, COUNT(*) AS count FROM orders GROUP BY status")
+        return {row['status']: row['count'] for row in rows}
+
+    async def get_order_status_counts(self) -> Dict[str, int]:
+        try:
+            return await self.order_counts.aread(self._load_order_counts)
+        except Exception as e:
+            logger.error(f"خطأ في عد الطلبات: {e}")
+            return {}
+
+    async def complete_purchase(self, user_id: int, product_id: int, price: int) -> bool:
+        try:
+            async with await self._acquire() as conn, conn.transaction():
+                spent = await self._fetchrow("""
+                    UPDATE user_stats
+                    SET total_spent = total_spent + $1, total_purchases = total_purchases + 1
+                    WHERE user_id = $2
+                    RETURNING total_spent, total_purchases
+                """, price, user_id, conn=conn)
+                sold = await self._fetchval("""
+                    UPDATE products SET sales_count = sales_count + 1 WHERE id = $1
+                    RETURNING sales_count
+                """, product_id, conn=conn)
+            boards = self.leaderboards
+            if spent:
+                boards.spend.offer(user_id, spent['total_spent'],
+                                   total_purchases=spent['total_purchases'])
+                boards.balance.update(user_id, total_spent=spent['total_spent'])
+            if sold is not None:
+                boards.products.offer(product_id, sold)
+            self._touch_catalog(product_id)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في إتمام الشراء: {e}")
+            return False
+
+    # ==================== السجلات والإحصائيات ====================
+
+    async def add_log(self, log_type: str, user_id: int, action: str,
+                      details: str = None) -> bool:
+        try:
+            await self._execute("""
+                INSERT INTO logs (type, user_id, action, details) VALUES ($1, $2, $3, $4)
+            """, log_type, user_id, action, details)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في إضافة السجل: {e}")
+            return False
+
+    async def get_logs(self, log_type: str = None, user_id: int = None,
+                       limit: int = 100) -> List[Dict]:
+        try:
+            query = "SELECT * FROM logs WHERE 1=1"
+            params = []
+            if log_type:
+                params.append(log_type)
+                query += f" AND type = ${len(params)}"
+            if user_id:
+                params.append(user_id)
+                query += f" AND user_id = ${len(params)}"
+            params.append(limit)
+            query += f" ORDER BY timestamp DESC, id DESC LIMIT ${len(params)}"
+            return await self._fetch(query, *params, kind=LogEntry)
+        except Exception as e:
+            logger.error(f"خطأ في جلب السجلات: {e}")
+            return []
+
+    async def get_statistics(self) -> Dict:
+        try:
+            async with await self._acquire() as conn:
+                stats = dict(await self._fetchrow(f"""
+                    SELECT
+                        (SELECT COUNT(*) FROM users) AS total_users,
+                        (SELECT COUNT(*) FROM user_stats
+                         WHERE last_activity >= {_NOW} - INTERVAL '1 day') AS active_users_24h,
+                        (SELECT COALESCE(SUM(final_price), 0) FROM orders
+                         WHERE status = 'completed') AS total_revenue,
+                        (SELECT COUNT(*) FROM products WHERE is_active = 1) AS active_products
+                """, conn=conn))
+            counts = await self.order_counts.aread(self._load_order_counts)
+            stats['total_orders'] = sum(counts.values())
+            stats['completed_orders'] = counts.get('completed', 0)
+            stats['top_products'] = await self.leaderboards.products.aread(5, 0, self._load_top_products)
+            stats['top_spenders'] = await self.leaderboards.spend.aread(5, 0, self._load_top_spenders)
+            return stats
+        except Exception as e:
+            logger.error(f"خطأ في جلب الإحصائيات: {e}")
+            return {}
+
+    # ==================== الحماية من الفلود ====================
+
+    async def check_rate_limit(self, user_id: int, max_requests: int = 20) -> bool:
+        try:
+            now = datetime.now()
+            async with await self._acquire() as conn, conn.transaction():
+                row = await self._fetchrow("""
+                    SELECT request_count, last_reset, is_temp_banned, temp_ban_until
+                    FROM rate_limits WHERE user_id = $1
+                    FOR UPDATE
+                """, user_id, conn=conn)
+
+                if row is None:
+                    await self._execute("""
+                        INSERT INTO rate_limits (user_id, request_count, last_reset)
+                        VALUES ($1, 1, $2)
+                        ON CONFLICT (user_id) DO UPDATE
+                        SET request_count = rate_limits.request_count + 1
+                    """, user_id, now, conn=conn)
+                    return True
+
+                if row['is_temp_banned']:
+                    if row['temp_ban_until']:
+                        if now < datetime.fromisoformat(row['temp_ban_until']):
+                            return False
+                        await self._execute("""
+                            UPDATE rate_limits SET is_temp_banned = 0, failed_attempts = 0
+                            WHERE user_id = $1
+                        """, user_id, conn=conn)
+
+                if (now - datetime.fromisoformat(row['last_reset'])).total_seconds() >= 60:
+                    await self._execute("""
+                        UPDATE rate_limits SET request_count = 1, last_reset = $1
+                        WHERE user_id = $2
+                    """, now, user_id, conn=conn)
+                    return True
+
+                if row['request_count'] >= max_requests:
+                    return False
+
+                await self._execute("""
+                    UPDATE rate_limits SET request_count = request_count + 1
+                    WHERE user_id = $1
+                """, user_id, conn=conn)
+                return True
+        except Exception as e:
+            logger.error(f"خطأ في فحص معدل الطلبات: {e}")
+            return True
+
+    async def record_failed_attempt(self, user_id: int, max_attempts: int = 5,
+                                    ban_duration: int = 1800) -> bool:
+        try:
+            async with await self._acquire() as conn, conn.transaction():
+                attempts = await self._fetchval("""
+                    INSERT INTO rate_limits (user_id, failed_attempts) VALUES ($1, 1)
+                    ON CONFLICT (user_id) DO UPDATE
+                    SET failed_attempts = rate_limits.failed_attempts + 1
+                    RETURNING failed_attempts
+                """, user_id, conn=conn)
+                if attempts < max_attempts:
+                    return False
+                ban_until = datetime.fromtimestamp(datetime.now().timestamp() + ban_duration)
+                await self._execute("""
+                    UPDATE rate_limits SET is_temp_banned = 1, temp_ban_until = $1
+                    WHERE user_id = $2
+                """, ban_until, user_id, conn=conn)
+                return True
+        except Exception as e:
+            logger.error(f"خطأ في تسجيل المحاولة الفاشلة: {e}")
+            return False
+
+    # ==================== الإعدادات ====================
+
+    async def get_setting(self, key: str) -> Optional[str]:
+        try:
+            return await self._fetchval("SELECT value FROM settings WHERE key = $1", key)
+        except Exception as e:
+            logger.error(f"خطأ في جلب الإعداد: {e}")
+            return None
+
+    async def set_setting(self, key: str, value: str) -> bool:
+        try:
+            await self._execute(f"""
+                INSERT INTO settings (key, value) VALUES ($1, $2)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value, updated_at = {_NOW}
+            """, key, value)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في تعيين الإعداد: {e}")
+            return False
+
+    async def get_all_settings(self) -> Dict:
+        try:
+            return {row['key']: row['value'] for row in await self._fetch("SELECT key, value FROM settings")}
+        except Exception as e:
+            logger.error(f"خطأ في جلب الإعدادات: {e}")
+            return {}
+
+    # ==================== حالة المحادثات وأقفال المهام ====================
+
+    async def get_user_states(self) -> Dict[int, str]:
+        try:
+            return {row['user_id']: row['data']
+                    for row in await self._fetch("SELECT user_id, data FROM user_state")}
+        except Exception as e:
+            logger.error(f"خطأ في جلب حالات المحادثات: {e}")
+            return {}
+
+    async def get_user_state(self, user_id: int) -> Optional[str]:
+        try:
+            return await self._fetchval("SELECT data FROM user_state WHERE user_id = $1", user_id)
+        except Exception as e:
+            logger.error(f"خطأ في جلب حالة المحادثة: {e}")
+            return None
+
+    async def save_user_states(self, states: Dict[int, Optional[str]]) -> bool:
+        try:
+            async with await self._acquire() as conn, conn.transaction():
+                saved = [(user_id, data) for user_id, data in states.items() if data is not None]
+                dropped = [user_id for user_id, data in states.items() if data is None]
+                if saved:
+                    await self._executemany(f"""
+                        INSERT INTO user_state (user_id, data) VALUES ($1, $2)
+                        ON CONFLICT (user_id) DO UPDATE
+                        SET data = excluded.data, updated_at = {_NOW}
+                    """, saved, conn=conn)
+                if dropped:
+                    await self._execute("DELETE FROM user_state WHERE user_id = ANY($1::bigint[])",
+                                        dropped, conn=conn)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في حفظ حالات المحادثات: {e}")
+            return False
+
+    async def acquire_job_lock(self, name: str, owner: str, ttl: float) -> bool:
+        try:
+            now = time.time()
+            status = await self._execute("""
+                INSERT INTO job_locks (name, owner, expires_at) VALUES ($1, $2, $3)
+                ON CONFLICT (name) DO UPDATE
+                SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE job_locks.expires_at < $4 OR job_locks.owner = excluded.owner
+            """, name, owner, now + ttl, now)
+            return _affected(status) == 1
+        except Exception as e:
+            logger.error(f"خطأ في حجز قفل المهمة: {e}")
+            return False
+
+    async def release_job_lock(self, name: str, owner: str) -> bool:
+        try:
+            status = await self._execute("DELETE FROM job_locks WHERE name = $1 AND owner = $2",
+                                         name, owner)
+            return _affected(status) == 1
+        except Exception as e:
+            logger.error(f"خطأ في تحرير قفل المهمة: {e}")
+            return False
+
+    # ==================== الفئات والتصدير ====================
+
+    async def add_category(self, name: str, description: str = None, icon: str = '📦') -> bool:
+        try:
+            await self._execute("INSERT INTO categories (name, description, icon) VALUES ($1, $2, $3)",
+                                name, description, icon)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في إضافة الفئة: {e}")
+            return False
+
+    async def get_categories(self) -> List[Dict]:
+        try:
+            return await self._fetch("SELECT * FROM categories WHERE is_active = 1 ORDER BY name", kind=Row)
+        except Exception as e:
+            logger.error(f"خطأ في جلب الفئات: {e}")
+            return []
+
+    async def get_category_counts(self) -> List[Dict]:
+        try:
+            return await self._fetch("""
+                SELECT id, category AS name, active_count AS count
+                FROM category_counts WHERE active_count > 0
+                ORDER BY category
+            """, kind=Row)
+        except Exception as e:
+            logger.error(f"خطأ في جلب أعداد الفئات: {e}")
+            return []
+
+    async def get_category_count(self, category_id: int) -> Optional[Dict]:
+        try:
+            return await self._fetchrow("""
+                SELECT id, category AS name, active_count AS count
+                FROM category_counts WHERE id = $1
+            """, category_id, kind=Row)
+        except Exception as e:
+            logger.error(f"خطأ في جلب الفئة: {e}")
+            return None
+
+    async def export_data(self, table: str) -> List[Dict]:
+        try:
+            if table == 'users':
+                return await self._fetch(f"SELECT {_USER_COLUMNS} FROM {_USER_FROM}", kind=User)
+            return await self._fetch(f"SELECT * FROM {table}", kind=_EXPORT_KINDS.get(table, Row))
+        except Exception as e:
+            logger.error(f"خطأ في تصدير البيانات: {e}")
+            return []
+
+    # ==================== الرصيد ====================
+
+    async def _apply_balance(self, conn, user_id: int, delta: int, reason: str,
+                             idempotency_key: str = None) -> Optional[int]:
+        """تحديث الإجمالي الجاري وإلحاق الحركة بالسجل في جملة واحدة (يُرجع الرصيد بعدها)"""
+        return await self._fetchval("""
+            WITH moved AS (
+                UPDATE user_stats SET balance = balance + $2
+                WHERE user_id = $1 AND balance + $2 >= 0
+                RETURNING balance
+            )
+            INSERT INTO balance_ledger (user_id, delta, balance_after, reason, idempotency_key)
+            SELECT $1, $2, balance, $3, $4 FROM moved
+            RETURNING balance_after
+        """, user_id, delta, reason, idempotency_key, conn=conn)
+
+    async def _post_balance(self, entries: List[tuple], idempotency_key: str = None) -> bool:
+        """تطبيق حركات (user_id, delta, reason) في معاملة واحدة، والمفتاح يُحفظ مع أول حركة"""
+        try:
+            async with await self._acquire() as conn, conn.transaction():
+                if idempotency_key is not None and await self._fetchval(
+                        "SELECT 1 FROM balance_ledger WHERE idempotency_key = $1",
+                        idempotency_key, conn=conn):
+                    return True
+                users = sorted({user_id for user_id, _, _ in entries})
+                if len(users) > 1:
+                    # قفل الصفوف بترتيب المعرف حتى لا يتعارض تحويلان متعاكسان
+                    locked = await self._fetch("""
+                        SELECT user_id FROM user_stats
+                        WHERE user_id = ANY($1::bigint[])
+                        ORDER BY user_id
+                        FOR UPDATE
+                    """, users, conn=conn)
+                    if len(locked) != len(users):
+                        return False
+                # الخصم يأتي أولاً، فإن لم يكفِ الرصيد لم يُكتب شيء بعد
+                balances = []
+                for index, (user_id, delta, reason) in enumerate(entries):
+                    key = idempotency_key if index == 0 else None
+                    balance = await self._apply_balance(conn, user_id, delta, reason, key)
+                    if balance is None:
+                        return False
+                    balances.append((user_id, balance))
+            for user_id, balance in balances:
+                self.leaderboards.balance.offer(user_id, balance)
+            return True
+        except asyncpg.UniqueViolationError:
+            # طلب متزامن بنفس المفتاح سبقنا إلى التسجيل
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في تسجيل حركة الرصيد: {e}")
+            return False
+
+    async def add_user_balance(self, user_id: int, amount: int, reason: str = 'deposit',
+                               idempotency_key: str = None) -> bool:
+        return await self._post_balance([(user_id, amount, reason)], idempotency_key)
+
+    async def subtract_user_balance(self, user_id: int, amount: int, reason: str = 'withdraw',
+                                    idempotency_key: str = None) -> bool:
+        return await self._post_balance([(user_id, -amount, reason)], idempotency_key)
+
+    async def get_user_balance(self, user_id: int) -> int:
+        try:
+            return await self._fetchval("SELECT balance FROM user_stats WHERE user_id = $1", user_id) or 0
+        except Exception as e:
+            logger.error(f"خطأ في جلب الرصيد: {e}")
+            return 0
+
+    async def transfer_balance(self, from_user: int, to_user: int, amount: int,
+                               idempotency_key: str = None) -> bool:
+        if amount <= 0:
+            return False
+        return await self._post_balance([(from_user, -amount, 'transfer_out'),
+                                         (to_user, amount, 'transfer_in')], idempotency_key)
+
+    async def get_balance_history(self, user_id: int, limit: int = 20) -> List[Dict]:
+        try:
+            return await self._fetch("""
+                SELECT id, delta, balance_after, reason, created_at
+                FROM balance_ledger
+                WHERE user_id = $1
+                ORDER BY id DESC
+                LIMIT $2
+            """, user_id, limit, kind=Row)
+        except Exception as e:
+            logger.error(f"خطأ في جلب سجل الرصيد: {e}")
+            return []
+
+    async def compact_balance_ledger(self, older_than_days: int, batch_size: int = 500) -> int:
+        try:
+            cutoff = await self._fetchval(
+                f"SELECT {_NOW} - make_interval(days => $1)", int(older_than_days))
+            users = [row['user_id'] for row in await self._fetch("""
+                SELECT user_id FROM balance_ledger
+                WHERE created_at < $1::text::timestamp
+                GROUP BY user_id HAVING COUNT(*) > 1
+            """, cutoff)]
+
+            removed = 0
+            for start in range(0, len(users), batch_size):
+                async with await self._acquire() as conn, conn.transaction():
+                    # آخر حركة قديمة تحمل الرصيد بعدها، فتصبح سطراً افتتاحياً بمجموع ما قبلها
+                    status = await self._execute("""
+                        WITH groups AS (
+                            SELECT user_id, MAX(id) AS last_id, SUM(delta) AS total
+                            FROM balance_ledger
+                            WHERE user_id = ANY($1::bigint[]) AND created_at < $2::text::timestamp
+                            GROUP BY user_id HAVING COUNT(*) > 1
+                        ), snapshot AS (
+                            UPDATE balance_ledger l
+                            SET delta = g.total, reason = 'snapshot', idempotency_key = NULL
+                            FROM groups g WHERE l.id = g.last_id
+                        )
+                        DELETE FROM balance_ledger l
+                        USING groups g
+                        WHERE l.user_id = g.user_id AND l.id < g.last_id
+                    """, users[start:start + batch_size], cutoff, conn=conn)
+                    removed += _affected(status)
+            return removed
+        except Exception as e:
+            logger.error(f"خطأ في دمج سجل الرصيد: {e}")
+            return 0
+
+    async def _load_top_balances(self, limit: int, offset: int) -> List[Dict]:
+        return await self._fetch("""
+            SELECT s.user_id, u.username, u.first_name, s.balance, s.total_spent
+            FROM user_stats s
+            JOIN users u ON u.user_id = s.user_id
+            WHERE s.balance > 0
+            ORDER BY s.balance DESC, s.user_id DESC
+            LIMIT $1 OFFSET $2
+        """, limit, offset, kind=User)
+
+    async def _load_top_spenders(self, limit: int, offset: int) -> List[Dict]:
+        return await self._fetch("""
+            SELECT s.user_id, u.username, u.first_name, s.total_spent, s.total_purchases
+            FROM user_stats s
+            JOIN users u ON u.user_id = s.user_id
+            WHERE s.total_spent > 0
+            ORDER BY s.total_spent DESC, s.user_id DESC
+            LIMIT $1 OFFSET $2
+        """, limit, offset, kind=User)
+
+    async def get_top_users_by_balance(self, limit: int = 10) -> List[Dict]:
+        try:
+            return await self.leaderboards.balance.aread(limit, 0, self._load_top_balances)
+        except Exception as e:
+            logger.error(f"خطأ في جلب المستخدمين برصيد: {e}")
+            return []
+
+    async def get_top_users_by_spend(self, limit: int = 10) -> List[Dict]:
+        try:
+            return await self.leaderboards.spend.aread(limit, 0, self._load_top_spenders)
+        except Exception as e:
+            logger.error(f"خطأ في جلب المستخدمين الأعلى إنفاقاً: {e}")
+            return []
+
+    async def reset_all_balances(self) -> bool:
+        try:
+            async with await self._acquire() as conn, conn.transaction():
+                await self._execute("""
+                    INSERT INTO balance_ledger (user_id, delta, balance_after, reason)
+                    SELECT user_id, -balance, 0, 'reset' FROM user_stats WHERE balance != 0
+                """, conn=conn)
+                await self._execute("UPDATE user_stats SET balance = 0 WHERE balance != 0", conn=conn)
+            self.leaderboards.balance.invalidate()
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في إعادة تعيين الأرصدة: {e}")
+            return False
+
+    # ==================== النسخ الاحتياطي والصيانة ====================
+
+    async def backup_database(self, backup_path: str = None) -> Optional[str]:
+        try:
+            pg_dump = shutil.which('pg_dump')
+            if pg_dump is None:
+                logger.error("النسخ الاحتياطي لـ PostgreSQL يتطلب pg_dump")
+                return None
+
+            backup_path = backup_path or "backups"
+            os.makedirs(backup_path, exist_ok=True)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            backup_file = os.path.join(backup_path, f"backup_{timestamp}.sql")
+
+            args = [pg_dump, '--dbname', self.dsn, '--file', backup_file]
+            if self.schema:
+                args += ['--schema', self.schema]
+            process = await asyncio.create_subprocess_exec(*args, stderr=asyncio.subprocess.PIPE)
+            _, stderr = await process.communicate()
+            if process.returncode != 0:
+                logger.error(f"خطأ في النسخ الاحتياطي: {stderr.decode(errors='replace').strip()}")
+                return None
+
+            logger.info(f"تم إنشاء نسخة احتياطية: {backup_file}")
+            return backup_file
+        except Exception as e:
+            logger.error(f"خطأ في النسخ الاحتياطي: {e}")
+            return None
+
+    async def vacuum_database(self) -> bool:
+        try:
+            await self._execute("VACUUM ANALYZE")
+            logger.info("تم تحسين قاعدة البيانات")
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في تحسين البيانات: {e}")
+            return False
+
+    # ==================== التبرعات والنقاط ====================
+
+    async def create_donation(self, donor_id: int, amount: int,
+                              description: str = None, options: list = None) -> Optional[int]:
+        try:
+            donation_id = await self._fetchval("""
+                INSERT INTO donations (donor_id, amount, donation_url, description, donation_options)
+                VALUES ($1, $2, $3, $4, $5)
+                RETURNING id
+            """, donor_id, amount, f"donate_{uuid.uuid4().hex[:10]}", description,
+                json.dumps(options) if options else None)
+            self.leaderboards.campaigns.offer(donation_id, 0)
+            logger.info(f"تم إنشاء حملة تبرع جديدة: {donation_id}")
+            return donation_id
+        except Exception as e:
+            logger.error(f"خطأ في إنشاء حملة تبرع: {e}")
+            return None
+
+    async def get_donation(self, donation_id: int) -> Optional[Dict]:
+        try:
+            return await self._fetchrow("SELECT * FROM donations WHERE id = $1", donation_id, kind=Donation)
+        except Exception as e:
+            logger.error(f"خطأ في جلب حملة التبرع: {e}")
+            return None
+
+    async def add_donation_contribution(self, donation_id: int, contributor_id: int,
+                                        amount: int, payment_id: str = None) -> bool:
+        try:
+            async with await self._acquire() as conn, conn.transaction():
+                inserted = await self._fetchval("""
+                    INSERT INTO donation_records (donation_id, contributor_id, amount, payment_id)
+                    VALUES ($1, $2, $3, $4)
+                    ON CONFLICT DO NOTHING
+                    RETURNING id
+                """, donation_id, contributor_id, amount, payment_id, conn=conn)
+                if inserted is None:
+                    # دفع سبق تسجيله (تحديث أُعيد تسليمه)
+                    return True
+                totals = await self._fetch("""
+                    UPDATE donations SET total_received = total_received + $1 WHERE id = $2
+                    RETURNING id, amount, total_received
+                """, amount, donation_id, conn=conn)
+                # 1 نقطة لكل نجمة، في نفس المعاملة
+                await self._accrue_points([(contributor_id, amount)], conn)
+            self._offer_campaigns(totals)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في إضافة مساهمة: {e}")
+            return False
+
+    async def add_donation_contributions(self, contributions: List[tuple]) -> int:
+        if not contributions:
+            return 0
+        totals: Dict[int, int] = {}
+        points: Dict[int, int] = {}
+        for donation_id, contributor_id, amount in contributions:
+            totals[donation_id] = totals.get(donation_id, 0) + amount
+            points[contributor_id] = points.get(contributor_id, 0) + amount
+        try:
+            async with await self._acquire() as conn, conn.transaction():
+                await self._executemany("""
+                    INSERT INTO donation_records (donation_id, contributor_id, amount)
+                    VALUES ($1, $2, $3)
+                """, contributions, conn=conn)
+                # ترتيب ثابت للتحديثات حتى لا تتعارض دفعتان متزامنتان
+                await self._executemany("""
+                    UPDATE donations SET total_received = total_received + $2 WHERE id = $1
+                """, sorted(totals.items()), conn=conn)
+                updated = await self._fetch("""
+                    SELECT id, amount, total_received FROM donations WHERE id = ANY($1::bigint[])
+                """, list(totals), conn=conn)
+                await self._accrue_points(sorted(points.items()), conn)
+            self._offer_campaigns(updated)
+            return len(contributions)
+        except Exception as e:
+            logger.error(f"خطأ في إضافة المساهمات: {e}")
+            return 0
+
+    async def get_donation_by_url(self, donation_url: str) -> Optional[Dict]:
+        try:
+            return await self._fetchrow("SELECT * FROM donations WHERE donation_url = $1", donation_url,
+                                        kind=Donation)
+        except Exception as e:
+            logger.error(f"خطأ في جلب الحملة: {e}")
+            return None
+
+    async def get_user_donations(self, user_id: int) -> List[Dict]:
+        try:
+            return await self._fetch("""
+                SELECT * FROM donations WHERE donor_id = $1
+                ORDER BY created_at DESC, id DESC
+            """, user_id, kind=Donation)
+        except Exception as e:
+            logger.error(f"خطأ في جلب الحملات: {e}")
+            return []
+
+    async def _accrue_points(self, accruals, conn=None) -> None:
+        """UPSERT واحد لكل مستخدم (user_id, points) داخل معاملة المستدعي"""
+        await self._executemany(f"""
+            INSERT INTO user_points (user_id, points, total_earned) VALUES ($1, $2, $2)
+            ON CONFLICT (user_id) DO UPDATE
+            SET points = user_points.points + excluded.points,
+                total_earned = user_points.total_earned + excluded.total_earned,
+                updated_at = {_NOW}
+        """, accruals, conn=conn)
+
+    async def add_user_points(self, user_id: int, points: int) -> bool:
+        try:
+            await self._accrue_points([(user_id, points)])
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في إضافة نقاط: {e}")
+            return False
+
+    async def get_user_points(self, user_id: int) -> Dict:
+        empty = {'user_id': user_id, 'points': 0, 'total_earned': 0, 'total_exchanged': 0}
+        try:
+            row = await self._fetchrow("SELECT * FROM user_points WHERE user_id = $1", user_id, kind=Row)
+            if row:
+                return row
+            await self._execute("INSERT INTO user_points (user_id) VALUES ($1) ON CONFLICT DO NOTHING",
+                                user_id)
+            return empty
+        except Exception as e:
+            logger.error(f"خطأ في جلب النقاط: {e}")
+            return empty
+
+    async def get_points_leaderboard(self, limit: int = 10) -> List[Dict]:
+        try:
+            return await self._fetch("""
+                SELECT p.user_id, u.username, u.first_name, p.points, p.total_earned
+                FROM user_points p
+                LEFT JOIN users u ON u.user_id = p.user_id
+                WHERE p.total_earned > 0
+                ORDER BY p.total_earned DESC, p.user_id
+                LIMIT $1
+            """, limit, kind=Row)
+        except Exception as e:
+            logger.error(f"خطأ في جلب ترتيب النقاط: {e}")
+            return []
+
+    async def exchange_points_to_stars(self, user_id: int, points: int,
+                                       exchange_rate: float = 0.1) -> bool:
+        try:
+            async with await self._acquire() as conn, conn.transaction():
+                available = await self._fetchval(
+                    "SELECT points FROM user_points WHERE user_id = $1 FOR UPDATE", user_id, conn=conn)
+                if available is None or available < points:
+                    return False
+
+                stars = int(points * exchange_rate)
+                await self._execute("""
+                    UPDATE user_points
+                    SET points = points - $1, total_exchanged = total_exchanged + $2
+                    WHERE user_id = $3
+                """, points, stars, user_id, conn=conn)
+                balance = await self._apply_balance(conn, user_id, stars, 'points_exchange')
+                if balance is None:
+                    raise RuntimeError(f"المستخدم {user_id} غير موجود")
+                await self._execute("""
+                    INSERT INTO points_exchange_history
+                    (user_id, points_used, stars_received, exchange_rate)
+                    VALUES ($1, $2, $3, $4)
+                """, user_id, points, stars, exchange_rate, conn=conn)
+            self.leaderboards.balance.offer(user_id, balance)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في استبدال النقاط: {e}")
+            return False
+
+    async def get_exchange_history(self, user_id: int, limit: int = 20) -> List[Dict]:
+        try:
+            return await self._fetch("""
+                SELECT * FROM points_exchange_history WHERE user_id = $1
+                ORDER BY created_at DESC, id DESC
+                LIMIT $2
+            """, user_id, limit, kind=Row)
+        except Exception as e:
+            logger.error(f"خطأ في جلب السجل: {e}")
+            return []
+
+    async def add_donation_to_bot(self, user_id: int, amount: int, username: str = None,
+                                  payment_id: str = None) -> bool:
+        try:
+            await self._execute("""
+                INSERT INTO bot_donations (user_id, amount, username, payment_id)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT DO NOTHING
+            """, user_id, amount, username, payment_id)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في إضافة التبرع: {e}")
+            return False
+
+    async def get_donation_stats(self) -> Dict:
+        try:
+            row = await self._fetchrow("""
+                SELECT COALESCE(SUM(amount), 0) AS total_amount,
+                       COUNT(DISTINCT user_id) AS total_donors,
+                       COALESCE(AVG(amount), 0) AS average_amount,
+                       COALESCE(MAX(amount), 0) AS max_amount
+                FROM bot_donations
+            """)
+            row['average_amount'] = int(row['average_amount'])
+            return row
+        except Exception as e:
+            logger.error(f"خطأ في جلب إحصائيات التبرعات: {e}")
+            return {'total_amount': 0, 'total_donors': 0, 'average_amount': 0, 'max_amount': 0}
+
+    async def get_bot_donations(self, limit: int = 10) -> List[Dict]:
+        try:
+            return await self._fetch("""
+                SELECT * FROM bot_donations ORDER BY created_at DESC, id DESC LIMIT $1
+            """, limit, kind=Row)
+        except Exception as e:
+            logger.error(f"خطأ في جلب التبرعات: {e}")
+            return []
+
+    async def get_campaign_stats(self, donation_id: int) -> Dict:
+        try:
+            donation = await self.get_donation(donation_id)
+            if not donation:
+                return {}
+
+            row = await self._fetchrow("""
+                SELECT COUNT(DISTINCT contributor_id) AS contributors,
+                       COALESCE(AVG(amount), 0) AS average_contribution,
+                       COALESCE(MAX(amount), 0) AS max_contribution
+                FROM donation_records WHERE donation_id = $1
+            """, donation_id)
+            goal, received = donation['amount'], donation['total_received']
+            percentage = (received / goal * 100) if goal > 0 else 0
+
+            return {
+                'donation_id': donation_id,
+                'description': donation['description'],
+                'goal': goal,
+                'received': received,
+                'percentage': int(percentage),
+                'contributors': row['contributors'],
+                'average_contribution': int(row['average_contribution']),
+                'max_contribution': row['max_contribution'],
+                'remaining': max(0, goal - received),
+                'status': 'مكتملة' if percentage >= 100 else 'جارية'
+            }
+        except Exception as e:
+            logger.error(f"خطأ في جلب إحصائيات الحملة: {e}")
+            return {}
+
+    def _offer_campaigns(self, totals) -> None:
+        for row in totals:
+            percentage = row['total_received'] / row['amount'] * 100 if row['amount'] else None
+            self.leaderboards.campaigns.offer(row['id'], row['total_received'], percentage=percentage)
+
+    async def _load_top_campaigns(self, limit: int, offset: int) -> List[Dict]:
+        return await self._fetch("""
+            SELECT id, description, amount, total_received,
+                   (CAST(total_received AS FLOAT) / NULLIF(amount, 0) * 100) AS percentage,
+                   donor_id, created_at
+            FROM donations
+            WHERE status = 'active'
+            ORDER BY total_received DESC, id DESC
+            LIMIT $1 OFFSET $2
+        """, limit, offset, kind=Donation)
+
+    async def get_top_campaigns(self, limit: int = 10) -> List[Dict]:
+        try:
+            return await self.leaderboards.campaigns.aread(limit, 0, self._load_top_campaigns)
+        except Exception as e:
+            logger.error(f"خطأ في جلب أفضل الحملات: {e}")
+            return []
+
+
+# ==================== الواجهة المتزامنة ====================
+
+class _PostgresCalls(AsyncCalls):
+    """db.aio لـ PostgreSQL: ينتظر الاستعلام على حلقة التخزين دون إيقاف حلقة المستدعي"""
+
+    def call(self, name: str):
+        storage = self._storage
+        method = getattr(storage.backend, name, None)
+        if not inspect.iscoroutinefunction(method):
+            # دوال محلية في الذاكرة (نسخة الكتالوج والمستمعون)
+            return super().call(name)
+
+        async def call(*args, **kwargs):
+            return await storage._submit(method(*args, **kwargs))
+        return call
+
+
+class PostgresStorage(Storage):
+    """تنفيذ Storage: يشغّل AsyncPostgresStorage على حلقة أحداث في خيط خاص
+
+    مجمع الاتصالات مرتبط بتلك الحلقة، فالمعالجات تنتظر نتيجتها عبر db.aio بينما تبقى
+    حلقة البوت حرة لبقية التحديثات. الدوال المتزامنة تنتظر النتيجة في الخيط المستدعي.
+    """
+
+    async_calls = _PostgresCalls
+
+    def __init__(self, dsn: str, schema: str = None,
+                 min_size: int = None, max_size: int = None):
+        self.backend = AsyncPostgresStorage(dsn, schema, min_size, max_size)
+        self._loop = None
+        self._thread = None
+        self._loop_lock = threading.Lock()
+
+    def _schedule(self, coroutine):
+        if self._loop is None:
+            with self._loop_lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    self._thread = threading.Thread(target=loop.run_forever,
+                                                    name='postgres-storage', daemon=True)
+                    self._thread.start()
+                    self._loop = loop
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def _run(self, coroutine):
+        return self._schedule(coroutine).result()
+
+    def _submit(self, coroutine):
+        """انتظار الاستعلام من حلقة أحداث أخرى دون إيقافها"""
+        return asyncio.wrap_future(self._schedule(coroutine))
+
+    def initialize(self) -> None:
+        self._run(self.backend.initialize())
+
+    def close_all(self) -> None:
+        """إغلاق مجمع الاتصالات وإيقاف خيط الحلقة"""
+        if self._loop is None:
+            return
+        try:
+            self._run(self.backend.close())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(5)
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+
+    def get_catalog_version(self) -> int:
+        return self.backend.get_catalog_version()
+
+    def add_catalog_listener(self, callback) -> None:
+        self.backend.add_catalog_listener(callback)
+
+
+def _blocking(name: str):
+    """دالة متزامنة تنتظر الدالة غير المتزامنة المقابلة في AsyncPostgresStorage"""
+    def method(self, *args, **kwargs):
+        return self._run(getattr(self.backend, name)(*args, **kwargs))
+    method.__name__ = name
+    method.__doc__ = getattr(Storage, name).__doc__
+    return method
+
+
+# بقية دوال الواجهة تُولّد بدل تكرار كل توقيع مرتين
+for _name in sorted(Storage.__abstractmethods__):
+    if _name not in PostgresStorage.__dict__:
+        setattr(PostgresStorage, _name, _blocking(_name))
+abc.update_abstractmethods(PostgresStorage)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Sampling Profiler
+محلل أداء بأخذ العينات أثناء التشغيل
+
+يأخذ عينات دورية من مكدسات جميع الخيوط عبر sys._current_frames لمدة محددة،
+ويكتبها بصيغة collapsed stacks المتوافقة مع flamegraph.pl و speedscope.
+لا يعمل أي شيء عندما يكون المحلل متوقفاً.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+import config
+from lifecycle import lifecycle
+
+logger = logging.getLogger(__name__)
+
+
+class StackSampler:
+    """أخذ عينات من مكدسات الخيوط في خيط منفصل"""
+
+    def __init__(self, interval: float = None):
+        self.interval = interval or config.PROFILER_INTERVAL_MS / 1000
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: float):
+        """بدء أخذ العينات لمدة محددة بالثواني"""
+        self.started_at = time.time()
+        self._thread = threading.Thread(
+            target=self._run, args=(duration,), name='stack-sampler', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """إيقاف أخذ العينات وانتظار انتهاء الخيط"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, duration: float):
+        own_id = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + duration
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                self.stacks[_collapse(frame, names.get(thread_id, str(thread_id)))] += 1
+            self.samples += 1
+            self._stop.wait(self.interval)
+
+    def collapsed(self) -> str:
+        """نص العينات بصيغة collapsed stacks (سطر لكل مكدس)"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def write(self, directory: str = None) -> str:
+        """كتابة العينات إلى ملف وإرجاع مساره"""
+        directory = directory or config.TEMP_EXPORT_PATH
+        os.makedirs(directory, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(directory, f"profile_{timestamp}.collapsed")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+        return path
+
+
+def _collapse(frame, thread_name: str) -> str:
+    """تحويل مكدس خيط إلى سطر واحد من الجذر إلى الإطار الحالي"""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    parts.append(thread_name)
+    parts.reverse()
+    return ';'.join(part.replace(';', ':') for part in parts)
+
+
+# ==================== التشغيل من البوت ====================
+
+_active: list = [None]
+
+
+def is_profiling() -> bool:
+    """هل توجد جلسة تحليل جارية"""
+    return _active[0] is not None and _active[0].is_running
+
+
+async def run_profile(seconds: float) -> Optional[str]:
+    """تشغيل جلسة تحليل محددة المدة وإرجاع مسار الملف (None إذا كانت جلسة أخرى جارية)"""
+    if is_profiling():
+        return None
+
+    seconds = max(1.0, min(float(seconds), config.PROFILER_MAX_SECONDS))
+    sampler = StackSampler()
+    _active[0] = sampler
+    sampler.start(seconds)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        sampler.stop()
+        _active[0] = None
+
+    path = sampler.write()
+    logger.info(f"🔥 تم حفظ التحليل ({sampler.samples} عينة): {path}")
+    return path
+
+
+async def send_profile(bot, chat_ids, seconds: float) -> Optional[str]:
+    """تشغيل التحليل ثم إرسال الملف إلى المسؤولين"""
+    path = await run_profile(seconds)
+    if path is None:
+        return None
+
+    for chat_id in chat_ids:
+        try:
+            with open(path, 'rb') as file:
+                await bot.send_document(
+                    chat_id=chat_id,
+                    document=file,
+                    filename=os.path.basename(path),
+                    caption=f"🔥 تحليل الأداء لمدة {seconds:g} ثانية (صيغة flamegraph)"
+                )
+        except Exception as e:
+            logger.error(f"خطأ في إرسال ملف التحليل إلى {chat_id}: {e}")
+    return path
+
+
+def install_signal_handler(application) -> bool:
+    """تشغيل التحليل عند استقبال SIGUSR1 وإرسال النتيجة إلى المسؤولين"""
+    if not hasattr(signal, 'SIGUSR1'):
+        return False
+
+    def on_signal():
+        if is_profiling():
+            logger.warning("⚠️ جلسة تحليل جارية بالفعل")
+            return
+        lifecycle.create_task(
+            application,
+            send_profile(application.bot, config.ADMIN_IDS, config.PROFILER_DEFAULT_SECONDS),
+            name='profile'
+        )
+
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, on_signal)
+    except (NotImplementedError, RuntimeError) as e:
+        logger.warning(f"تعذر ربط إشارة التحليل: {e}")
+        return False
+    return True
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Row Records
+سجلات صفوف مدمجة بدل dict(row)
+
+كل نوع (User, Product, Order, Donation, LogEntry) يُنشئ صنفاً بـ __slots__ لكل شكل
+أعمدة مختلف (SELECT * أو JOIN إضافي) ويُخزَّن الصنف مرة واحدة، فيُبنى الصف من الـ tuple
+مباشرة دون قاموس لكل صف. الوصول بالخاصية (product.price) هو الأسرع، ويبقى الوصول
+كقاموس (product['price'] و get و keys و dict(product)) متاحاً للمعالجات الحالية.
+
+الاستخدام مع SQLite:
+    cursor.row_factory = Product.row_factory
+    products = cursor.fetchall()
+"""
+
+import keyword
+import threading
+from collections.abc import Mapping
+from dataclasses import make_dataclass
+from typing import Dict, Tuple, Type
+
+_RESERVED = frozenset(('keys', 'values', 'items', 'get', 'to_dict', 'shape', 'row_factory'))
+
+
+class Record:
+    """أساس السجلات: وصول للقراءة فقط متوافق مع القاموس"""
+
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+    _keys = {}.keys()
+    _shapes: Dict[Tuple[str, ...], Type['Record']] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # الأنواع المعلنة فقط تملك ذاكرة أشكالها، والأصناف المولّدة ترثها
+        if '_fields' not in cls.__dict__:
+            cls._shapes = {}
+            cls._shapes_lock = threading.Lock()
+
+    @classmethod
+    def shape(cls, fields: Tuple[str, ...]) -> Type['Record']:
+        """الصنف المولّد لهذا الترتيب من الأعمدة (يُنشأ مرة واحدة)"""
+        record_class = cls._shapes.get(fields)
+        if record_class is None:
+            with cls._shapes_lock:
+                record_class = cls._shapes.get(fields)
+                if record_class is None:
+                    record_class = cls._build(fields)
+                    cls._shapes[fields] = record_class
+        return record_class
+
+    @classmethod
+    def _build(cls, fields: Tuple[str, ...]) -> Type['Record']:
+        for name in fields:
+            if (not name.isidentifier() or keyword.iskeyword(name)
+                    or name.startswith('_') or name in _RESERVED):
+                raise ValueError(f"اسم عمود غير صالح للسجل: {name!r}")
+        namespace = {'_fields': fields, '_keys': dict.fromkeys(fields).keys(),
+                     '__module__': cls.__module__}
+        return make_dataclass(cls.__name__, fields, bases=(cls,), namespace=namespace,
+                              slots=True, eq=False, repr=False)
+
+    @classmethod
+    def row_factory(cls, cursor, row):
+        """row_factory لـ sqlite3: الصنف يُحدد من وصف المؤشر"""
+        description = cursor.description
+        cache = cls._factory_cache
+        if cache[0] is not description:
+            cache = (description, cls.shape(tuple(column[0] for column in description)))
+            cls._factory_cache = cache
+        return cache[1](*row)
+
+    _factory_cache = (None, None)
+
+    # ==================== توافق القاموس ====================
+
+    def __getitem__(self, key):
+        if key in self._keys:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self._keys:
+            return getattr(self, key)
+        return default
+
+    def keys(self):
+        return self._keys
+
+    def values(self):
+        return [getattr(self, name) for name in self._fields]
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self._fields]
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self._fields}
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, Mapping)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # الأصناف مولّدة ديناميكياً، لذا النسخ والتسلسل ينتجان قاموساً عادياً
+        return dict, (self.to_dict(),)
+
+    def __repr__(self):
+        values = ', '.join(f"{name}={getattr(self, name)!r}" for name in self._fields)
+        return f"{type(self).__name__}({values})"
+
+
+Mapping.register(Record)
+
+
+class Row(Record):
+    """صف عام (إحصائيات وقوائم مساعدة)"""
+    __slots__ = ()
+
+
+class User(Record):
+    """مستخدم (الملف الشخصي مع عداداته)"""
+    __slots__ = ()
+
+
+class Product(Record):
+    """منتج"""
+    __slots__ = ()
+
+
+class Order(Record):
+    """طلب"""
+    __slots__ = ()
+
+
+class Donation(Record):
+    """حملة تبرع"""
+    __slots__ = ()
+
+
+class LogEntry(Record):
+    """سجل نشاط"""
+    __slots__ = ()
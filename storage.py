@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+"""
+Storage Interface
+واجهة التخزين المشتركة بين قواعد البيانات
+
+كل ما تستدعيه المعالجات من قاعدة البيانات معرّف هنا كدوال متزامنة بنفس الأسماء
+والقيم المُعادة (قواميس بأعمدة الجداول، والتواريخ كنص 'YYYY-MM-DD HH:MM:SS').
+المعالجات غير المتزامنة تستدعيها عبر await db.aio.<الدالة>(...) حتى لا يوقف
+استعلام بعيد حلقة أحداث البوت.
+التنفيذ الافتراضي هو SQLite (database.Database)، ويمكن استبداله بـ PostgreSQL
+(postgres_storage.PostgresStorage) للمتاجر الكبيرة عبر STORAGE_BACKEND في config.py.
+"""
+
+import threading
+from abc import ABC, abstractmethod
+from functools import cached_property
+from typing import Dict, List, Optional
+
+import config
+
+
+class AsyncCalls:
+    """دوال التخزين كدوال قابلة للانتظار: await db.aio.get_product(1)
+
+    التنفيذ الافتراضي يستدعي الدالة المتزامنة مباشرة (SQLite ملف محلي واستعلاماته قصيرة)،
+    والتنفيذ البعيد يستبدل call بانتظار لا يوقف حلقة الأحداث.
+    """
+
+    def __init__(self, storage: 'Storage'):
+        self._storage = storage
+
+    def call(self, name: str):
+        method = getattr(self._storage, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        call = self.call(name)
+        call.__name__ = name
+        # الدالة تُنشأ مرة واحدة لكل اسم
+        setattr(self, name, call)
+        return call
+
+
+class Storage(ABC):
+    """العمليات التي يجب أن يوفرها كل تنفيذ للتخزين"""
+
+    # الصنف المستخدم لـ db.aio (يستبدله التنفيذ البعيد)
+    async_calls = AsyncCalls
+
+    @cached_property
+    def aio(self) -> AsyncCalls:
+        """دوال التخزين بصيغة قابلة للانتظار من المعالجات"""
+        return self.async_calls(self)
+
+    # ==================== دورة الحياة ====================
+
+    @abstractmethod
+    def initialize(self) -> None:
+        """تهيئة المخطط (مرة واحدة، آمنة بين الخيوط والعمليات)"""
+
+    @abstractmethod
+    def checkpoint(self) -> bool:
+        """تثبيت ما في الذاكرة أو السجل على القرص قبل الإيقاف"""
+
+    @abstractmethod
+    def close_all(self) -> None:
+        """إغلاق كل الاتصالات"""
+
+    # ==================== نسخة الكتالوج ====================
+
+    @abstractmethod
+    def get_catalog_version(self) -> int:
+        """رقم نسخة الكتالوج الحالي (يتغير عند أي تعديل على المنتجات)"""
+
+    @abstractmethod
+    def add_catalog_listener(self, callback) -> None:
+        """تسجيل دالة تُستدعى بمعرف المنتج عند تعديل الكتالوج"""
+
+    @abstractmethod
+    def sync_catalog(self) -> bool:
+        """إبطال الكاش المحلي إذا عدّلت عملية أخرى المنتجات"""
+
+    # ==================== المستخدمون ====================
+
+    @abstractmethod
+    def add_user(self, user_id: int, username: str = None, first_name: str = None,
+                 last_name: str = None, referrer_id: int = None) -> bool:
+        """إضافة مستخدم جديد"""
+
+    @abstractmethod
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        """الحصول على بيانات مستخدم"""
+
+    @abstractmethod
+    def is_user_banned(self, user_id: int) -> bool:
+        """فحص الحظر وحده (يُستدعى مع كل تحديث)"""
+
+    @abstractmethod
+    def get_user_stats(self, user_id: int) -> Optional[Dict]:
+        """عدادات المستخدم فقط: الرصيد والمصروفات والمشتريات وآخر نشاط"""
+
+    @abstractmethod
+    def update_user_activity(self, user_id: int):
+        """تحديث آخر نشاط للمستخدم"""
+
+    @abstractmethod
+    def ban_user(self, user_id: int, reason: str = None) -> bool:
+        """حظر مستخدم"""
+
+    @abstractmethod
+    def unban_user(self, user_id: int) -> bool:
+        """إلغاء حظر مستخدم"""
+
+    @abstractmethod
+    def get_all_users(self, limit: int = None, offset: int = 0) -> List[Dict]:
+        """الحصول على جميع المستخدمين"""
+
+    @abstractmethod
+    def get_users_count(self) -> int:
+        """عدد المستخدمين الكلي"""
+
+    # ==================== المنتجات ====================
+
+    @abstractmethod
+    def add_product(self, name: str, description: str, price: int,
+                    product_type: str, delivery_content: str = None,
+                    stock: int = -1, is_limited: int = 0,
+                    category: str = 'عام') -> Optional[int]:
+        """إضافة منتج جديد"""
+
+    @abstractmethod
+    def get_product(self, product_id: int) -> Optional[Dict]:
+        """الحصول على منتج"""
+
+    @abstractmethod
+    def get_active_products(self, category: str = None,
+                            limit: int = None, offset: int = 0) -> List[Dict]:
+        """الحصول على المنتجات النشطة"""
+
+    @abstractmethod
+    def search_products(self, query: str, limit: int = 10, offset: int = 0) -> List[Dict]:
+        """البحث في المنتجات النشطة بالاسم والوصف والفئة"""
+
+    @abstractmethod
+    def get_top_selling_products(self, limit: int = 10, offset: int = 0) -> List[Dict]:
+        """الحصول على المنتجات النشطة الأكثر مبيعاً"""
+
+    @abstractmethod
+    def update_product(self, product_id: int, **kwargs) -> bool:
+        """تحديث منتج"""
+
+    @abstractmethod
+    def delete_product(self, product_id: int) -> bool:
+        """حذف منتج"""
+
+    @abstractmethod
+    def decrease_stock(self, product_id: int) -> bool:
+        """تقليل المخزون بمقدار واحد إن كان متوفراً (ذري)"""
+
+    # ==================== الأكواد ====================
+
+    @abstractmethod
+    def add_codes(self, product_id: int, codes: List[str]) -> bool:
+        """إضافة أكواد لمنتج"""
+
+    @abstractmethod
+    def get_unused_code(self, product_id: int, user_id: int) -> Optional[str]:
+        """حجز كود غير مستخدم (لا يُعطى نفس الكود لمشتريين)"""
+
+    @abstractmethod
+    def get_available_codes_count(self, product_id: int) -> int:
+        """عدد الأكواد المتاحة"""
+
+    # ==================== الطلبات ====================
+
+    @abstractmethod
+    def create_order(self, user_id: int, product_id: int, product_name: str,
+                     payment_id: str, price: int, discount_amount: int = 0) -> Optional[int]:
+        """إنشاء طلب جديد (None إذا تكرر payment_id)"""
+
+    @abstractmethod
+    def update_order_status(self, order_id: int, status: str,
+                            delivery_status: str = None,
+                            delivery_content: str = None) -> bool:
+        """تحديث حالة الطلب"""
+
+    @abstractmethod
+    def get_user_orders(self, user_id: int, limit: int = 10, offset: int = 0) -> List[Dict]:
+        """صفحة من طلبات المستخدم (الأحدث أولاً، بأعمدة العرض فقط)"""
+
+    @abstractmethod
+    def get_order(self, order_id: int) -> Optional[Dict]:
+        """الحصول على طلب بعينه"""
+
+    @abstractmethod
+    def get_all_orders(self, limit: int = 50) -> List[Dict]:
+        """الحصول على جميع الطلبات"""
+
+    @abstractmethod
+    def get_order_feed(self, status: str = None, product_id: int = None,
+                       since: str = None, until: str = None,
+                       before_id: int = None, limit: int = 20) -> List[Dict]:
+        """صفحة من كل الطلبات (الأحدث أولاً) بمرشحات اختيارية، والتالية تبدأ بعد before_id"""
+
+    @abstractmethod
+    def get_order_status_counts(self) -> Dict[str, int]:
+        """عدد الطلبات لكل حالة"""
+
+    @abstractmethod
+    def complete_purchase(self, user_id: int, product_id: int, price: int) -> bool:
+        """تحديث إحصائيات الشراء"""
+
+    # ==================== السجلات والإحصائيات ====================
+
+    @abstractmethod
+    def add_log(self, log_type: str, user_id: int, action: str,
+                details: str = None) -> bool:
+        """إضافة سجل"""
+
+    @abstractmethod
+    def get_logs(self, log_type: str = None, user_id: int = None,
+                 limit: int = 100) -> List[Dict]:
+        """الحصول على السجلات"""
+
+    @abstractmethod
+    def get_statistics(self) -> Dict:
+        """الحصول على الإحصائيات العامة"""
+
+    # ==================== الحماية من الفلود ====================
+
+    @abstractmethod
+    def check_rate_limit(self, user_id: int, max_requests: int = 20) -> bool:
+        """التحقق من معدل الطلبات"""
+
+    @abstractmethod
+    def record_failed_attempt(self, user_id: int, max_attempts: int = 5,
+                              ban_duration: int = 1800) -> bool:
+        """تسجيل محاولة فاشلة (True إذا حُظر المستخدم مؤقتاً)"""
+
+    # ==================== الإعدادات ====================
+
+    @abstractmethod
+    def get_setting(self, key: str) -> Optional[str]:
+        """الحصول على إعداد"""
+
+    @abstractmethod
+    def set_setting(self, key: str, value: str) -> bool:
+        """تعيين إعداد"""
+
+    @abstractmethod
+    def get_all_settings(self) -> Dict:
+        """الحصول على جميع الإعدادات"""
+
+    # ==================== حالة المحادثات وأقفال المهام ====================
+
+    @abstractmethod
+    def get_user_states(self) -> Dict[int, str]:
+        """جميع حالات المحادثات المحفوظة (نص JSON لكل مستخدم)"""
+
+    @abstractmethod
+    def get_user_state(self, user_id: int) -> Optional[str]:
+        """حالة محادثة مستخدم واحد (نص JSON)"""
+
+    @abstractmethod
+    def save_user_states(self, states: Dict[int, Optional[str]]) -> bool:
+        """حفظ عدة حالات في معاملة واحدة (None = حذف الحالة)"""
+
+    @abstractmethod
+    def acquire_job_lock(self, name: str, owner: str, ttl: float) -> bool:
+        """حجز قفل مهمة عامة أو تمديده إن كان لنفس المالك"""
+
+    @abstractmethod
+    def release_job_lock(self, name: str, owner: str) -> bool:
+        """تحرير قفل مهمة (فقط إن كان لنفس المالك)"""
+
+    # ==================== الفئات والتصدير ====================
+
+    @abstractmethod
+    def add_category(self, name: str, description: str = None, icon: str = '📦') -> bool:
+        """إضافة فئة جديدة"""
+
+    @abstractmethod
+    def get_categories(self) -> List[Dict]:
+        """الحصول على الفئات"""
+
+    @abstractmethod
+    def get_category_counts(self) -> List[Dict]:
+        """الفئات التي تحتوي منتجات نشطة مع عدد منتجاتها (id, name, count)"""
+
+    @abstractmethod
+    def get_category_count(self, category_id: int) -> Optional[Dict]:
+        """فئة واحدة مع عدد منتجاتها النشطة"""
+
+    @abstractmethod
+    def export_data(self, table: str) -> List[Dict]:
+        """تصدير بيانات جدول"""
+
+    # ==================== الرصيد ====================
+
+    # كل حركة تُسجَّل في balance_ledger مع الرصيد بعدها. الحركة ذات idempotency_key
+    # المسجَّل مسبقاً لا تُطبق مرة ثانية وتُعتبر ناجحة
+
+    @abstractmethod
+    def add_user_balance(self, user_id: int, amount: int, reason: str = 'deposit',
+                         idempotency_key: str = None) -> bool:
+        """إضافة رصيد للمستخدم"""
+
+    @abstractmethod
+    def subtract_user_balance(self, user_id: int, amount: int, reason: str = 'withdraw',
+                              idempotency_key: str = None) -> bool:
+        """خصم رصيد من المستخدم إن كان كافياً"""
+
+    @abstractmethod
+    def get_user_balance(self, user_id: int) -> int:
+        """الحصول على رصيد المستخدم"""
+
+    @abstractmethod
+    def transfer_balance(self, from_user: int, to_user: int, amount: int,
+                         idempotency_key: str = None) -> bool:
+        """تحويل رصيد بين مستخدمين"""
+
+    @abstractmethod
+    def get_balance_history(self, user_id: int, limit: int = 20) -> List[Dict]:
+        """آخر حركات رصيد المستخدم (الأحدث أولاً)"""
+
+    @abstractmethod
+    def compact_balance_ledger(self, older_than_days: int) -> int:
+        """دمج الحركات الأقدم من المدة في سطر واحد لكل مستخدم، ويُرجع عدد الأسطر المحذوفة"""
+
+    @abstractmethod
+    def get_top_users_by_balance(self, limit: int = 10) -> List[Dict]:
+        """الحصول على أعلى المستخدمين برصيد"""
+
+    @abstractmethod
+    def get_top_users_by_spend(self, limit: int = 10) -> List[Dict]:
+        """الحصول على أعلى المستخدمين إنفاقاً"""
+
+    @abstractmethod
+    def reset_all_balances(self) -> bool:
+        """إعادة تعيين جميع الأرصدة"""
+
+    # ==================== النسخ الاحتياطي والصيانة ====================
+
+    @abstractmethod
+    def backup_database(self, backup_path: str = None) -> Optional[str]:
+        """نسخ احتياطي متسق وإرجاع مسار الملف"""
+
+    @abstractmethod
+    def vacuum_database(self) -> bool:
+        """تحسين وتنظيف قاعدة البيانات"""
+
+    # ==================== التبرعات والنقاط ====================
+
+    @abstractmethod
+    def create_donation(self, donor_id: int, amount: int,
+                        description: str = None, options: list = None) -> Optional[int]:
+        """إنشاء حملة تبرع جديدة"""
+
+    @abstractmethod
+    def get_donation(self, donation_id: int) -> Optional[Dict]:
+        """جلب بيانات حملة تبرع"""
+
+    @abstractmethod
+    def add_donation_contribution(self, donation_id: int, contributor_id: int,
+                                  amount: int, payment_id: str = None) -> bool:
+        """إضافة مساهمة لحملة تبرع (مع نقاط المساهم في نفس المعاملة)
+
+        تكرار payment_id (معرف دفع تيليجرام) لا يُضاف مرة ثانية ويُعد نجاحاً.
+        """
+
+    @abstractmethod
+    def add_donation_contributions(self, contributions: List[tuple]) -> int:
+        """إضافة مساهمات (donation_id, contributor_id, amount) دفعة واحدة وإرجاع عددها"""
+
+    @abstractmethod
+    def get_donation_by_url(self, donation_url: str) -> Optional[Dict]:
+        """جلب حملة تبرع من الرابط"""
+
+    @abstractmethod
+    def get_user_donations(self, user_id: int) -> List[Dict]:
+        """جلب حملات التبرع للمستخدم"""
+
+    @abstractmethod
+    def add_user_points(self, user_id: int, points: int) -> bool:
+        """إضافة نقاط للمستخدم"""
+
+    @abstractmethod
+    def get_user_points(self, user_id: int) -> Dict:
+        """جلب نقاط المستخدم"""
+
+    @abstractmethod
+    def get_points_leaderboard(self, limit: int = 10) -> List[Dict]:
+        """أعلى المستخدمين في النقاط المكتسبة"""
+
+    @abstractmethod
+    def exchange_points_to_stars(self, user_id: int, points: int,
+                                 exchange_rate: float = 0.1) -> bool:
+        """استبدال النقاط بنجوم"""
+
+    @abstractmethod
+    def get_exchange_history(self, user_id: int, limit: int = 20) -> List[Dict]:
+        """جلب سجل تبادل النقاط"""
+
+    @abstractmethod
+    def add_donation_to_bot(self, user_id: int, amount: int, username: str = None,
+                            payment_id: str = None) -> bool:
+        """إضافة تبرع للبوت (تكرار payment_id لا يُضاف مرة ثانية ويُعد نجاحاً)"""
+
+    @abstractmethod
+    def get_donation_stats(self) -> Dict:
+        """جلب إحصائيات التبرعات"""
+
+    @abstractmethod
+    def get_bot_donations(self, limit: int = 10) -> List[Dict]:
+        """جلب التبرعات للبوت"""
+
+    @abstractmethod
+    def get_campaign_stats(self, donation_id: int) -> Dict:
+        """جلب إحصائيات حملة تبرع محددة"""
+
+    @abstractmethod
+    def get_top_campaigns(self, limit: int = 10) -> List[Dict]:
+        """جلب أفضل حملات التبرع"""
+
+
+# ==================== اختيار التنفيذ ====================
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """التخزين المستخدم في البوت حسب STORAGE_BACKEND (مثيل واحد لكل عملية)"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if config.STORAGE_BACKEND == 'postgres':
+                    from postgres_storage import PostgresStorage
+                    _storage = PostgresStorage(config.POSTGRES_DSN)
+                elif config.STORAGE_BACKEND == 'sqlite':
+                    from database import Database
+                    _storage = Database(config.DATABASE_NAME)
+                else:
+                    raise ValueError(f"نوع التخزين غير معروف: {config.STORAGE_BACKEND}")
+    return _storage
+
+
+def active_storage() -> Optional[Storage]:
+    """التخزين الذي أنشأته get_storage إن وُجد (دون إنشائه)"""
+    return _storage
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for keyboard and rendering caches
+اختبارات الكاش للوحات المفاتيح والعرض
+"""
+
+import pytest
+import keyboards
+from database import Database
+from keyboards import Keyboards
+
+
+@pytest.fixture
+def temp_db():
+    """Create a temporary in-memory database for testing"""
+    return Database(":memory:")
+
+
+@pytest.fixture(autouse=True)
+def clear_keyboard_cache():
+    Keyboards.clear_cache()
+    yield
+    Keyboards.clear_cache()
+
+
+class TestKeyboardCache:
+    """Test memoized keyboard construction"""
+
+    def test_static_menus_are_reused(self):
+        assert Keyboards.admin_panel() is Keyboards.admin_panel()
+        assert Keyboards.main_menu(True) is Keyboards.main_menu(True)
+        assert Keyboards.main_menu(True) is not Keyboards.main_menu(False)
+
+    def test_per_product_keyboards_are_bounded(self, monkeypatch):
+        monkeypatch.setattr(keyboards, 'KEYBOARD_CACHE_SIZE', 3)
+        menu = Keyboards.admin_panel()
+        for product_id in range(5):
+            Keyboards.product_detail(product_id)
+            assert Keyboards.admin_panel() is menu
+        assert len(keyboards._static_cache) == 3
+        assert Keyboards.product_detail(4) is Keyboards.product_detail(4)
+
+    def test_product_keyboards_forgotten_on_change(self, temp_db):
+        temp_db.add_catalog_listener(Keyboards.forget_product)
+        pid = temp_db.add_product("P", "D", 10, "text", "x")
+        detail = Keyboards.product_detail(pid, is_admin=True)
+        edit = Keyboards.edit_product_menu(pid)
+        other = Keyboards.edit_product_menu(pid + 1)
+
+        temp_db.update_product(pid, price=20)
+        assert Keyboards.product_detail(pid, is_admin=True) is not detail
+        assert Keyboards.edit_product_menu(pid) is not edit
+        assert Keyboards.edit_product_menu(pid + 1) is other
+
+    def test_catalog_version_changes_on_product_writes(self, temp_db):
+        v0 = temp_db.get_catalog_version()
+        pid = temp_db.add_product("P", "D", 10, "text", "x")
+        v1 = temp_db.get_catalog_version()
+        assert v1 > v0
+
+        temp_db.update_product(pid, price=20)
+        assert temp_db.get_catalog_version() > v1
+
+    def test_products_page_cached_per_version(self, temp_db):
+        temp_db.add_product("P1", "D", 10, "text", "x")
+        products = temp_db.get_active_products()
+        version = temp_db.get_catalog_version()
+
+        first = Keyboards.products_list(products, 0, "product", version)
+        assert Keyboards.products_list(products, 0, "product", version) is first
+
+        temp_db.add_product("P2", "D", 15, "text", "y")
+        products = temp_db.get_active_products()
+        refreshed = Keyboards.products_list(products, 0, "product",
+                                            temp_db.get_catalog_version())
+        assert refreshed is not first
+        assert len(refreshed.inline_keyboard) == len(first.inline_keyboard) + 1
+
+    def test_products_page_expires_for_other_workers_stock(self, temp_db, monkeypatch):
+        pid = temp_db.add_product("P1", "D", 10, "text", "x", stock=5, is_limited=1)
+        version = temp_db.get_catalog_version()
+        first = Keyboards.products_list(temp_db.get_active_products(), 0, "product", version)
+
+        # عملية أخرى باعت نسخة: لا تتغير نسخة الكتالوج هنا
+        conn = temp_db._get_connection()
+        conn.execute("UPDATE products SET stock = 4 WHERE id = ?", (pid,))
+        conn.commit()
+        assert Keyboards.products_list(temp_db.get_active_products(), 0, "product", version) is first
+
+        monkeypatch.setattr(keyboards, 'PRODUCT_PAGES_TTL', -1)
+        refreshed = Keyboards.products_list(temp_db.get_active_products(), 0, "product", version)
+        assert "[4]" in refreshed.inline_keyboard[0][0].text
+
+
+class TestProductCardCache:
+    """Test cached product cards from format_product_info"""
+
+    def test_card_reused_until_product_changes(self):
+        import utils
+
+        product = {
+            'id': 9001, 'type': 'code', 'name': 'كود', 'description': 'وصف',
+            'price': 100, 'discount_percentage': 0, 'is_limited': 1,
+            'stock': 5, 'sales_count': 0, 'is_active': 1,
+            'updated_at': '2026-01-01 00:00:00'
+        }
+        first = utils.format_product_info(product)
+        assert utils.format_product_info(dict(product)) is first
+
+        sold = dict(product, stock=4)
+        card = utils.format_product_info(sold)
+        assert card is not first
+        assert "4 متوفر" in card
+
+    def test_invalidated_by_catalog_write(self, temp_db):
+        import utils
+
+        temp_db.add_catalog_listener(utils.invalidate_product_card)
+        product_id = temp_db.add_product("بطاقة", "وصف", 50, "text", "x")
+        first = utils.format_product_info(temp_db.get_product(product_id))
+
+        temp_db.update_product(product_id, discount_percentage=10)
+        assert (product_id, True) not in utils._card_cache
+
+        updated = utils.format_product_info(temp_db.get_product(product_id))
+        assert updated is not first
+        assert "10%" in updated
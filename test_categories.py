@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for category counts and category browsing
+اختبارات أعداد الفئات وتصفحها
+"""
+
+import pytest
+
+from database import Database
+from keyboards import Keyboards
+
+
+@pytest.fixture
+def temp_db():
+    """Create a temporary in-memory database for testing"""
+    return Database(":memory:")
+
+
+def counts(db):
+    return {c['name']: c['count'] for c in db.get_category_counts()}
+
+
+class TestCategoryCounts:
+    """Test the trigger-maintained category_counts table"""
+
+    def test_counts_follow_product_writes(self, temp_db):
+        a = temp_db.add_product("A", "D", 1, "text", "x", category="كتب")
+        b = temp_db.add_product("B", "D", 1, "text", "x", category="كتب")
+        c = temp_db.add_product("C", "D", 1, "text", "x", category="ألعاب")
+        assert counts(temp_db) == {"كتب": 2, "ألعاب": 1}
+
+        temp_db.update_product(a, is_active=0)
+        assert counts(temp_db) == {"كتب": 1, "ألعاب": 1}
+
+        temp_db.update_product(b, category="ألعاب")
+        assert counts(temp_db) == {"ألعاب": 2}
+
+        temp_db.delete_product(c)
+        temp_db.update_product(a, is_active=1)
+        assert counts(temp_db) == {"كتب": 1, "ألعاب": 1}
+
+    def test_stock_updates_do_not_touch_counts(self, temp_db):
+        pid = temp_db.add_product("A", "D", 1, "text", "x", stock=5, is_limited=True, category="كتب")
+        temp_db.update_product(pid, stock=3, price=2)
+        assert counts(temp_db) == {"كتب": 1}
+
+    def test_backfill_for_existing_database(self, tmp_path):
+        path = str(tmp_path / "store.db")
+        db = Database(path)
+        db.add_product("A", "D", 1, "text", "x", category="كتب")
+        conn = db._get_connection()
+        conn.execute("DROP TABLE category_counts")
+        conn.execute("PRAGMA user_version = 3")
+        conn.commit()
+
+        db._create_tables()
+        assert counts(db) == {"كتب": 1}
+        db.close()
+        Database._instances.pop(path, None)
+
+    def test_category_page_uses_index(self, temp_db):
+        plan = temp_db._get_connection().execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM products WHERE is_active = 1 AND category = ? "
+            "ORDER BY created_at DESC LIMIT 6", ("كتب",)
+        ).fetchall()
+        details = " ".join(row[3] for row in plan)
+        assert "idx_products_active_category" in details
+        assert "TEMP B-TREE" not in details
+
+
+class TestCategoryKeyboards:
+    """Test counts shown in category keyboards"""
+
+    def test_categories_list_shows_counts(self):
+        markup = Keyboards.categories_list([{'id': 3, 'name': 'كتب', 'count': 4}])
+        button = markup.inline_keyboard[0][0]
+        assert button.text.endswith("كتب (4)")
+        assert button.callback_data == "category:3"
+
+    def test_category_products_paging(self):
+        products = [{'id': i, 'name': f'P{i}', 'type': 'text', 'price': 1,
+                     'is_limited': 0, 'stock': -1} for i in range(6)]
+        markup = Keyboards.category_products(products, 3, 0, total=8)
+        nav = markup.inline_keyboard[-2]
+        assert [b.callback_data for b in nav] == ["category:3:1"]
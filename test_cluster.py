@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for multi-process mode: sharding, ingress and job locks
+اختبارات وضع العمليات المتعددة
+"""
+
+import asyncio
+import json
+import sqlite3
+
+import pytest
+
+import cluster
+from database import Database
+
+
+@pytest.fixture
+def file_db(tmp_path):
+    path = str(tmp_path / "store.db")
+    db = Database(path)
+    yield db
+    db.close_all()
+    Database._instances.pop(path, None)
+
+
+def message_update(update_id, user_id):
+    return {'update_id': update_id, 'message': {
+        'message_id': 1, 'date': 0, 'text': 'hi',
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'U'},
+        'chat': {'id': user_id, 'type': 'private'}}}
+
+
+class FakeQueue:
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+
+class TestSharding:
+    """Test that updates are routed by user"""
+
+    def test_shard_key_for_common_updates(self):
+        assert cluster.shard_key(message_update(1, 42)) == 42
+        assert cluster.shard_key({'update_id': 2, 'callback_query': {'id': 'x', 'from': {'id': 7}}}) == 7
+        assert cluster.shard_key({'update_id': 3, 'poll_answer': {'user': {'id': 9}}}) == 9
+        assert cluster.shard_key({'update_id': 4, 'channel_post': {'chat': {'id': -100}}}) == -100
+        assert cluster.shard_key({'update_id': 5}) is None
+
+    def test_same_user_same_worker(self):
+        shards = {cluster.shard_for(message_update(i, 42), 4) for i in range(10)}
+        assert shards == {42 % 4}
+
+
+class TestIngress:
+    """Test the webhook receiver"""
+
+    async def post(self, ingress, body, path='/telegram', secret='s3cret'):
+        reader, writer = await asyncio.open_connection('127.0.0.1', ingress.port)
+        writer.write(
+            f"POST {path} HTTP/1.1\r\nHost: x\r\nContent-Length: {len(body)}\r\n"
+            f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+        status = (await reader.readline()).decode().split()[1]
+        writer.close()
+        return status
+
+    def test_routes_and_checks_secret(self):
+        queues = [FakeQueue(), FakeQueue()]
+
+        async def scenario():
+            ingress = cluster.Ingress(queues, host='127.0.0.1', port=0,
+                                      path='/telegram', secret='s3cret')
+            await ingress.start()
+            try:
+                body = json.dumps(message_update(1, 3)).encode()
+                results = [
+                    await self.post(ingress, body),
+                    await self.post(ingress, body, secret='wrong'),
+                    await self.post(ingress, body, path='/other'),
+                    await self.post(ingress, b'not json'),
+                ]
+            finally:
+                await ingress.stop()
+            return results
+
+        assert asyncio.run(scenario()) == ['200', '403', '404', '400']
+        assert queues[1].items == [json.dumps(message_update(1, 3)).encode()]
+        assert queues[0].items == []
+
+
+class TestJobLocks:
+    """Test the shared advisory lock table"""
+
+    def test_exclusive_until_released_or_expired(self, file_db):
+        assert file_db.acquire_job_lock('broadcast', 'a', 60)
+        assert not file_db.acquire_job_lock('broadcast', 'b', 60)
+        assert file_db.acquire_job_lock('broadcast', 'a', 60)
+        assert not file_db.release_job_lock('broadcast', 'b')
+        assert file_db.release_job_lock('broadcast', 'a')
+        assert file_db.acquire_job_lock('broadcast', 'b', -1)
+        assert file_db.acquire_job_lock('broadcast', 'a', 60)
+
+    def test_job_lock_context_manager(self, file_db):
+        async def scenario():
+            async with cluster.JobLock('backup', ttl=60, database=file_db) as lock:
+                held = lock.acquired
+                blocked = not file_db.acquire_job_lock('backup', 'someone', 60)
+            return held, blocked, file_db.acquire_job_lock('backup', 'someone', 60)
+
+        assert asyncio.run(scenario()) == (True, True, True)
+
+
+class TestCatalogSync:
+    """Test cache invalidation across processes"""
+
+    def test_other_process_product_change_invalidates(self, file_db):
+        seen = []
+        file_db.add_catalog_listener(seen.append)
+        assert file_db.sync_catalog() is False
+
+        other = sqlite3.connect(file_db.db_name)
+        other.execute("UPDATE catalog_state SET version = version + 1")
+        other.commit()
+        other.close()
+
+        assert file_db.sync_catalog() is True
+        assert seen == [None]
+        assert file_db.sync_catalog() is False
+
+    def test_stock_and_sales_do_not_bump_catalog(self, file_db):
+        product_id = file_db.add_product("كتاب", "وصف", 10, "text", "x")
+        file_db.update_product(product_id, stock=5, is_limited=1)
+        assert file_db.sync_catalog() is False
+
+        other = sqlite3.connect(file_db.db_name)
+        other.execute("UPDATE products SET stock = stock - 1, sales_count = sales_count + 1")
+        other.commit()
+        assert file_db.sync_catalog() is False
+
+        other.execute("UPDATE products SET price = 12")
+        other.commit()
+        other.close()
+        assert file_db.sync_catalog() is True
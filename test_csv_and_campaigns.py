@@ -217,7 +217,21 @@ class TestDonationCampaigns:
         
         donation = temp_db.get_donation(donation_id)
         assert donation['total_received'] == 60
-    
+
+    def test_failed_points_accrual_rolls_back_contribution(self, temp_db, admin_user, regular_user):
+        """Test that points are written in the contribution's transaction"""
+        temp_db.add_user(admin_user['user_id'], admin_user['username'], admin_user['first_name'])
+        donation_id = temp_db.create_donation(admin_user['user_id'], 100, 'حملة')
+        temp_db._get_connection().execute("""
+            CREATE TRIGGER fail_points BEFORE INSERT ON user_points
+            BEGIN SELECT RAISE(ABORT, 'points unavailable'); END
+        """)
+
+        assert not temp_db.add_donation_contribution(donation_id, regular_user['user_id'], 25)
+        assert temp_db.add_donation_contributions([(donation_id, regular_user['user_id'], 5)]) == 0
+        assert temp_db.get_donation(donation_id)['total_received'] == 0
+        assert temp_db.get_campaign_stats(donation_id)['contributors'] == 0
+
     def test_get_campaign_by_url(self, temp_db, admin_user):
         """Test retrieving campaign by donation URL"""
         temp_db.add_user(admin_user['user_id'], admin_user['username'], admin_user['first_name'])
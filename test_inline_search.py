@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for inline-mode catalog search
+اختبارات البحث المضمّن
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import config
+import handlers
+from database import Database
+
+
+@pytest.fixture
+def temp_db(monkeypatch):
+    """Replace the handlers database with an in-memory one"""
+    db = Database(":memory:")
+    monkeypatch.setattr(handlers, 'db', db)
+    monkeypatch.setattr(config, 'INLINE_RESULTS_PER_PAGE', 2)
+    handlers._inline_cache.clear()
+    handlers._inline_cache_version[0] = None
+    for i in range(3):
+        db.add_product(f"كتاب {i}", "وصف", 10 + i, "text", "x")
+    db.add_product("اشتراك", "حساب", 50, "text", "x")
+    return db
+
+
+class FakeInlineQuery:
+    def __init__(self, query, offset=''):
+        self.query = query
+        self.offset = offset
+        self.answers = []
+
+    async def answer(self, results, **kwargs):
+        self.answers.append((results, kwargs))
+
+
+def run_inline(query, offset=''):
+    inline_query = FakeInlineQuery(query, offset)
+    update = SimpleNamespace(inline_query=inline_query)
+    context = SimpleNamespace(bot=SimpleNamespace(username='store_bot'))
+    asyncio.run(handlers.inline_query_handler(update, context))
+    return inline_query.answers[0]
+
+
+def inline_results(query):
+    return asyncio.run(handlers.get_inline_results(query, 0, 'store_bot'))
+
+
+class TestInlineSearch:
+    """Test inline query answers and caching"""
+
+    def test_paginates_with_next_offset(self, temp_db):
+        results, kwargs = run_inline("كتاب")
+        assert len(results) == 2
+        assert kwargs['next_offset'] == '2'
+        assert kwargs['is_personal'] is False
+        assert kwargs['cache_time'] == config.INLINE_CACHE_TIME
+
+        results, kwargs = run_inline("كتاب", kwargs['next_offset'])
+        assert len(results) == 1
+        assert kwargs['next_offset'] == ''
+
+    def test_empty_query_lists_products(self, temp_db):
+        results, _ = run_inline("")
+        assert len(results) == 2
+
+    def test_result_links_to_product(self, temp_db):
+        results, _ = run_inline("اشتراك")
+        assert len(results) == 1
+        button = results[0].reply_markup.inline_keyboard[0][0]
+        assert button.url == f"https://t.me/store_bot?start=product_{results[0].id}"
+
+    def test_cache_keyed_by_normalized_query(self, temp_db):
+        first = inline_results("الكتاب")
+        assert inline_results("كِتاب") is first
+
+        temp_db.add_product("كتاب جديد", "وصف", 5, "text", "x")
+        refreshed = inline_results("كتاب")
+        assert refreshed is not first
+
+    def test_product_card_is_sent_as_html(self, temp_db, monkeypatch):
+        results, _ = run_inline("اشتراك")
+        assert results[0].input_message_content.parse_mode == 'HTML'
+
+        async def allow(update, context):
+            return True
+
+        for check in ('check_maintenance', 'check_banned', 'check_rate_limit'):
+            monkeypatch.setattr(handlers, check, allow)
+        replies = []
+
+        async def reply_text(text, **kwargs):
+            replies.append(kwargs)
+
+        update = SimpleNamespace(
+            effective_user=SimpleNamespace(id=7, username='u', first_name='U', last_name=None),
+            message=SimpleNamespace(reply_text=reply_text))
+        context = SimpleNamespace(args=[f"product_{results[0].id}"], user_data={})
+        asyncio.run(handlers.start_handler(update, context))
+        assert replies[0]['parse_mode'] == 'HTML'
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for query instrumentation
+اختبارات قياس زمن الاستعلامات
+"""
+
+import logging
+
+import pytest
+
+import config
+import instrumentation
+from database import Database
+
+
+@pytest.fixture
+def temp_db():
+    """Create a temporary in-memory database for testing"""
+    db = Database(":memory:")
+    # الترحيلات خارج القياس حتى لا تزاحم دوال الاختبار في التقرير
+    db.initialize()
+    instrumentation.stats.reset()
+    yield db
+    instrumentation.stats.reset()
+
+
+class TestQueryStats:
+    """Test per-method and per-statement recording"""
+
+    def test_records_calling_method(self, temp_db):
+        temp_db.add_user(1, "u", "User")
+        temp_db.get_user(1)
+
+        methods = dict(instrumentation.stats.top('method', limit=50))
+        assert methods['add_user']['count'] >= 1
+        assert methods['get_user']['count'] == 1
+        assert methods['get_user']['rows'] == 1
+
+    def test_statement_keys_are_normalized(self, temp_db):
+        temp_db.get_user_stats(1)
+        statements = instrumentation.stats.snapshot()['by_statement']
+        assert any(key.startswith('SELECT user_id, balance, total_spent, total_purchases, '
+                                  'last_activity, is_banned FROM user_stats WHERE user_id = ?')
+                   for key in statements)
+        assert all('\n' not in key for key in statements)
+
+    def test_transactions_count_lock_wait(self, temp_db):
+        pid = temp_db.add_product("P", "D", 10, "text", "x")
+        temp_db.complete_purchase(1, pid, 10)
+        snapshot = instrumentation.stats.snapshot()
+        assert any(key.startswith('BEGIN') for key in snapshot['by_statement'])
+        assert snapshot['commit_ms'] > 0
+
+    def test_slow_query_log(self, temp_db, monkeypatch, caplog):
+        monkeypatch.setattr(config, 'SLOW_QUERY_THRESHOLD_MS', 0)
+        with caplog.at_level(logging.WARNING, logger='database.slow'):
+            temp_db.get_user(1)
+        assert instrumentation.stats.snapshot()['slow_queries'] >= 1
+        assert any('get_user' in record.getMessage() for record in caplog.records)
+
+    def test_disabled(self, temp_db, monkeypatch):
+        monkeypatch.setattr(config, 'ENABLE_DB_INSTRUMENTATION', False)
+        instrumentation.stats.reset()
+        temp_db.get_user(1)
+        assert instrumentation.stats.snapshot()['queries'] == 0
+
+    def test_report(self, temp_db):
+        temp_db.get_user(1)
+        report = instrumentation.format_report()
+        assert "get_user" in report
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for in-memory leaderboards
+اختبارات قوائم الأعلى
+"""
+
+import pytest
+
+from leaderboards import Leaderboard
+from records import Row
+
+Entry = Row.shape(('id', 'name', 'score'))
+
+
+class Table:
+    """جدول وهمي يُحمّل كما يفعل الاستعلام المفهرس"""
+
+    def __init__(self, scores):
+        self.scores = dict(scores)
+        self.loads = 0
+
+    def load(self, limit, offset):
+        self.loads += 1
+        rows = sorted((Entry(key, f"#{key}", score) for key, score in self.scores.items()
+                       if score > 0), key=lambda row: (row.score, row.id), reverse=True)
+        return rows[offset:offset + limit]
+
+    def write(self, board, key, score):
+        self.scores[key] = score
+        board.offer(key, score)
+
+
+@pytest.fixture
+def board():
+    return Leaderboard('id', 'score', floor=0, size=3, ttl=60)
+
+
+def ids(rows):
+    return [row['id'] for row in rows]
+
+
+class TestLeaderboard:
+    """Test incremental maintenance against a reference table"""
+
+    def test_serves_from_memory_after_first_load(self, board):
+        table = Table({1: 10, 2: 30, 3: 20, 4: 5})
+        assert ids(board.read(2, 0, table.load)) == [2, 3]
+        assert ids(board.read(3, 0, table.load)) == [2, 3, 1]
+        assert table.loads == 1
+        # خارج ما تحفظه القائمة يذهب للجدول مباشرة
+        assert ids(board.read(2, 2, table.load)) == [1, 4]
+        assert table.loads == 2
+
+    def test_member_moves_in_place(self, board):
+        table = Table({1: 10, 2: 30, 3: 20, 4: 5})
+        board.read(3, 0, table.load)
+        table.write(board, 1, 40)
+        table.write(board, 4, 6)
+        assert ids(board.read(3, 0, table.load)) == [1, 2, 3]
+        assert board.get(1)[0].score == 40 and table.loads == 1
+
+    def test_changes_that_need_reload(self, board):
+        table = Table({1: 10, 2: 30, 3: 20, 4: 5})
+        for key, score in ((4, 25), (3, 2), (2, 0)):
+            board.read(3, 0, table.load)
+            table.write(board, key, score)
+            assert board.get(3) is None
+            assert ids(board.read(3, 0, table.load)) == ids(table.load(3, 0))
+
+    def test_complete_board_drops_members(self, board):
+        table = Table({1: 10, 2: 30})
+        board.read(3, 0, table.load)
+        table.write(board, 1, 0)
+        assert ids(board.read(3, 0, table.load)) == [2]
+        assert table.loads == 1
+
+    def test_stale_load_is_not_cached(self, board):
+        table = Table({1: 10, 2: 30})
+        generation = board.generation
+        rows = table.load(3, 0)
+        table.write(board, 1, 50)
+        board.fill(rows, generation)
+        assert board.get(3) is None
+
+    def test_update_and_invalidate(self, board):
+        table = Table({1: 10, 2: 30, 3: 20})
+        board.read(3, 0, table.load)
+        board.update(2, name="renamed")
+        assert board.get(1)[0].name == "renamed"
+        board.invalidate(99)
+        assert board.get(3) is not None
+        board.invalidate(3)
+        assert board.get(3) is None
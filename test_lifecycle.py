@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for ordered shutdown
+اختبارات الإغلاق المنظم
+"""
+
+import asyncio
+import os
+import sqlite3
+
+import pytest
+
+from database import Database
+from lifecycle import Lifecycle
+
+
+class FakeApplication:
+    def __init__(self):
+        self.stopped = False
+
+    def create_task(self, coroutine, name=None):
+        return asyncio.get_running_loop().create_task(coroutine, name=name)
+
+    def stop_running(self):
+        self.stopped = True
+
+
+@pytest.fixture
+def file_db(tmp_path):
+    path = str(tmp_path / "store.db")
+    db = Database(path)
+    yield db
+    db.close_all()
+    Database._instances.pop(path, None)
+
+
+class TestDrain:
+    """Test waiting for and cancelling background tasks"""
+
+    def test_finished_tasks_are_kept_and_slow_ones_cancelled(self):
+        async def scenario():
+            lifecycle = Lifecycle()
+            app = FakeApplication()
+            quick = lifecycle.create_task(app, asyncio.sleep(0.01, result='ok'))
+            slow = lifecycle.create_task(app, asyncio.sleep(10))
+            cancelled = await lifecycle.drain(timeout=0.1)
+            return quick, slow, cancelled
+
+        quick, slow, cancelled = asyncio.run(scenario())
+        assert quick.result() == 'ok'
+        assert slow.cancelled()
+        assert cancelled == 1
+
+    def test_request_stop_enforces_deadline(self):
+        async def scenario():
+            lifecycle = Lifecycle()
+            app = FakeApplication()
+            slow = lifecycle.create_task(app, asyncio.sleep(10))
+            lifecycle.request_stop(app, timeout=0.05)
+            lifecycle.request_stop(app, timeout=0.05)
+            await asyncio.sleep(0.1)
+            return lifecycle, app, slow
+
+        lifecycle, app, slow = asyncio.run(scenario())
+        assert lifecycle.stopping and app.stopped
+        assert slow.cancelled()
+        assert lifecycle.cancelled == 1
+
+
+class TestShutdown:
+    """Test flushing writers and closing the database"""
+
+    def test_writers_flushed_in_order_despite_errors(self):
+        calls = []
+
+        async def async_flush():
+            calls.append('async')
+
+        def broken():
+            raise RuntimeError("boom")
+
+        lifecycle = Lifecycle()
+        lifecycle.register_writer('sync', lambda: calls.append('sync'))
+        lifecycle.register_writer('broken', broken)
+        lifecycle.register_writer('async', async_flush)
+        assert asyncio.run(lifecycle.flush_writers()) == 1
+        assert calls == ['sync', 'async']
+
+    def test_shutdown_checkpoints_wal_and_closes(self, file_db):
+        order = []
+        lifecycle = Lifecycle()
+        lifecycle.register_writer('pending', lambda: order.append(
+            file_db.add_product("A", "D", 1, "text", "x")))
+
+        conn = file_db._get_connection()
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+
+        asyncio.run(lifecycle.shutdown([file_db]))
+        assert order and not file_db._connections
+        wal = file_db.db_name + "-wal"
+        assert not os.path.exists(wal) or os.path.getsize(wal) == 0
+        assert len(file_db.get_active_products()) == 1
+
+
+class TestBackup:
+    """Test that backups include data still in the WAL"""
+
+    def test_backup_includes_wal_data(self, file_db, tmp_path):
+        file_db.add_product("A", "D", 1, "text", "x")
+        backup = file_db.backup_database(str(tmp_path / "backups"))
+        rows = sqlite3.connect(backup).execute("SELECT name FROM products").fetchall()
+        assert rows == [("A",)]
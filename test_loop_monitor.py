@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the event loop monitor
+اختبارات مراقبة تأخر حلقة الأحداث
+"""
+
+import asyncio
+import time
+
+import loop_monitor
+
+
+async def blocking_handler():
+    await asyncio.sleep(0.05)
+    time.sleep(0.3)
+    await asyncio.sleep(0.05)
+
+
+class TestLoopMonitor:
+    """Test stall detection and attribution"""
+
+    def test_detects_blocking_handler(self):
+        stalls = []
+
+        async def run():
+            monitor = loop_monitor.LoopMonitor(interval_ms=10, threshold_ms=100,
+                                               on_stall=stalls.append)
+            monitor.start()
+            try:
+                # تشغيل المعالج كمهمة مستقلة كما يفعل Application
+                await asyncio.create_task(blocking_handler())
+            finally:
+                await monitor.stop()
+            return monitor
+
+        monitor = asyncio.run(run())
+        assert monitor.max_lag >= 0.2
+        assert len(stalls) == 1
+        assert stalls[0]['handler'] == 'blocking_handler'
+        assert stalls[0]['site'].startswith('test_loop_monitor.py:')
+        assert loop_monitor.LOOP_STALLS.labels('blocking_handler').value >= 1
+
+    def test_no_stall_when_idle(self):
+        stalls = []
+
+        async def run():
+            monitor = loop_monitor.LoopMonitor(interval_ms=10, threshold_ms=100,
+                                               on_stall=stalls.append)
+            monitor.start()
+            await asyncio.sleep(0.2)
+            await monitor.stop()
+
+        asyncio.run(run())
+        assert stalls == []
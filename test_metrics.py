@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the metrics subsystem
+اختبارات مقاييس التشغيل
+"""
+
+import asyncio
+import urllib.request
+
+import pytest
+
+import metrics
+
+
+def scrape(server: metrics.MetricsServer, path: str = '/metrics'):
+    with urllib.request.urlopen(f'http://127.0.0.1:{server.port}{path}', timeout=5) as response:
+        return response.status, response.headers['Content-Type'], response.read().decode('utf-8')
+
+
+class TestMetricTypes:
+    """Test text exposition of each metric type"""
+
+    def test_counter_and_histogram_render(self):
+        registry = metrics.Registry()
+        counter = registry.register(metrics.Counter('t_total', 'test', ('kind',)))
+        histogram = registry.register(metrics.Histogram('t_seconds', 'test', buckets=(0.1, 1, float('inf'))))
+
+        counter.labels('a').inc()
+        counter.labels(kind='a').inc(2)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+
+        text = registry.render()
+        assert '# TYPE t_total counter' in text
+        assert 't_total{kind="a"} 3' in text
+        assert 't_seconds_bucket{le="0.1"} 1' in text
+        assert 't_seconds_bucket{le="+Inf"} 2' in text
+        assert 't_seconds_count 2' in text
+
+    def test_gauge_function(self):
+        gauge = metrics.Gauge('t_depth', 'test')
+        gauge.set_function(lambda: 7)
+        assert 't_depth 7' in gauge.render()
+
+
+class TestHandlerTracking:
+    """Test handler wrapping"""
+
+    def test_counts_updates_and_errors(self):
+        async def sample_handler(update, context):
+            if update == 'boom':
+                raise ValueError(update)
+
+        wrapped = metrics.track_handler(sample_handler)
+        assert metrics.track_handler(wrapped) is wrapped
+
+        asyncio.run(wrapped('ok', None))
+        with pytest.raises(ValueError):
+            asyncio.run(wrapped('boom', None))
+
+        assert metrics.UPDATES.labels('sample_handler').value == 2
+        assert metrics.HANDLER_ERRORS.labels('sample_handler').value == 1
+        assert metrics.HANDLER_LATENCY.labels('sample_handler').count == 2
+
+
+class TestMetricsServer:
+    """Test scraping the endpoint on localhost"""
+
+    def test_scrape(self):
+        async def run():
+            server = metrics.MetricsServer('127.0.0.1', 0)
+            await server.start()
+            metrics.cache_hit('test_cache', True)
+            loop = asyncio.get_running_loop()
+            try:
+                ok = await loop.run_in_executor(None, scrape, server)
+                missing = await loop.run_in_executor(None, scrape, server, '/other')
+            except Exception as e:
+                missing = e
+            finally:
+                await server.stop()
+            return ok, missing
+
+        (status, content_type, body), missing = asyncio.run(run())
+        assert status == 200
+        assert content_type.startswith('text/plain')
+        assert 'bot_cache_requests_total{cache="test_cache",result="hit"}' in body
+        assert '# TYPE bot_handler_duration_seconds histogram' in body
+        assert getattr(missing, 'code', None) == 404
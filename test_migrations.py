@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for schema migrations
+اختبارات ترحيلات المخطط
+"""
+
+import sqlite3
+
+import pytest
+
+import migrations
+from database import Database, normalize_search_text
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.create_function('normalize_ar', 1, normalize_search_text, deterministic=True)
+    return conn
+
+
+def tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index')")}
+
+
+class TestMigrationRunner:
+    """Test versioning and idempotency"""
+
+    def test_fresh_database_reaches_latest(self, tmp_path):
+        conn = connect(str(tmp_path / "fresh.db"))
+        applied = migrations.migrate(conn)
+
+        assert applied == migrations.latest_version()
+        assert migrations.get_version(conn) == migrations.latest_version()
+        assert {'users', 'products', 'donations', 'category_counts',
+                'idx_products_active_category'} <= tables(conn)
+
+    def test_second_run_is_a_noop(self, tmp_path):
+        conn = connect(str(tmp_path / "noop.db"))
+        migrations.migrate(conn)
+        assert migrations.migrate(conn) == 0
+
+    def test_partial_target(self, tmp_path):
+        conn = connect(str(tmp_path / "partial.db"))
+        assert migrations.migrate(conn, target=1) == 1
+        assert migrations.get_version(conn) == 1
+        assert 'category_counts' not in tables(conn)
+
+        assert migrations.migrate(conn) == migrations.latest_version() - 1
+
+    def test_failed_migration_rolls_back(self, tmp_path, monkeypatch):
+        conn = connect(str(tmp_path / "fail.db"))
+        migrations.migrate(conn)
+        version = migrations.latest_version()
+
+        def broken(cursor):
+            cursor.execute("CREATE TABLE half_done (id INTEGER)")
+            raise RuntimeError("boom")
+
+        monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS + [(version + 1, "broken", broken)])
+        with pytest.raises(RuntimeError):
+            migrations.migrate(conn)
+
+        assert migrations.get_version(conn) == version
+        assert 'half_done' not in tables(conn)
+
+    def test_versions_must_increase(self, monkeypatch):
+        monkeypatch.setattr(migrations, 'MIGRATIONS', list(migrations.MIGRATIONS))
+        with pytest.raises(ValueError):
+            migrations.migration(1, "duplicate")(lambda cursor: None)
+
+
+class TestSearchText:
+    """Test moving the search index off the normalize_ar function"""
+
+    def test_backfills_and_reindexes(self, tmp_path):
+        conn = connect(str(tmp_path / "search.db"))
+        migrations.migrate(conn, target=13)
+        conn.execute("INSERT INTO products (name, description, price, type, category) "
+                     "VALUES ('الكتاب الإسلامي', 'وصف', 10, 'text', 'كتب')")
+        conn.commit()
+        migrations.migrate(conn)
+
+        assert conn.execute("SELECT search_text FROM products").fetchone()[0] == \
+            "كتاب اسلامي\nوصف\nكتب"
+        row = conn.execute("SELECT name, description, category FROM products_fts "
+                           "WHERE products_fts MATCH 'اسلامي'").fetchone()
+        assert row == ("كتاب اسلامي", "وصف", "كتب")
+
+
+class TestLegacyDatabase:
+    """Test upgrading a database created before migrations existed"""
+
+    def test_adds_donation_options_column(self, tmp_path):
+        path = str(tmp_path / "legacy.db")
+        conn = connect(path)
+        migrations.migrate(conn, target=1)
+        conn.execute("PRAGMA user_version = 0")
+        conn.commit()
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(donations)")]
+        assert 'donation_options' not in columns
+        conn.close()
+
+        db = Database(path)
+        columns = [row[1] for row in db._get_connection().execute("PRAGMA table_info(donations)")]
+        assert 'donation_options' in columns
+        assert db.create_donation(1, 10, "حملة", options=[5, 10]) is not None
+
+        db.close()
+        Database._instances.pop(path, None)
+
+    def test_moves_user_counters_to_user_stats(self, tmp_path):
+        conn = connect(str(tmp_path / "counters.db"))
+        migrations.migrate(conn, target=6)
+        conn.execute("INSERT INTO users (user_id, username, balance, total_spent, is_banned) "
+                     "VALUES (1, 'alice', 40, 12, 1)")
+        conn.commit()
+
+        migrations.migrate(conn)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+        assert 'balance' not in columns and 'is_banned' not in columns
+        row = conn.execute("SELECT balance, total_spent, is_banned FROM user_stats WHERE user_id = 1").fetchone()
+        assert row == (40, 12, 1)
+
+    def test_opening_ledger_entries_match_balances(self, tmp_path):
+        conn = connect(str(tmp_path / "ledger.db"))
+        migrations.migrate(conn, target=7)
+        conn.execute("INSERT INTO user_stats (user_id, balance) VALUES (1, 40), (2, 0)")
+        conn.commit()
+
+        migrations.migrate(conn)
+        rows = conn.execute("SELECT user_id, delta, balance_after, reason FROM balance_ledger").fetchall()
+        assert rows == [(1, 40, 40, 'opening')]
+
+    def test_order_history_reads_only_the_index(self, tmp_path):
+        conn = connect(str(tmp_path / "history.db"))
+        migrations.migrate(conn)
+        assert 'idx_orders_user' not in tables(conn)
+
+        plan = conn.execute("""
+            EXPLAIN QUERY PLAN
+            SELECT id, user_id, product_name, final_price, status, discount_amount, created_at
+            FROM orders
+            WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT 10 OFFSET 10
+        """, (1,)).fetchall()
+        assert [row[3] for row in plan] == [
+            'SEARCH orders USING COVERING INDEX idx_orders_user_history (user_id=?)']
+
+    def test_order_feed_filters_use_matching_indexes(self, tmp_path):
+        conn = connect(str(tmp_path / "feed.db"))
+        migrations.migrate(conn)
+        assert 'idx_orders_status' not in tables(conn)
+
+        def plan(condition):
+            rows = conn.execute(f"""
+                EXPLAIN QUERY PLAN SELECT * FROM orders o WHERE {condition}
+                ORDER BY o.created_at DESC, o.id DESC LIMIT 20
+            """).fetchall()
+            return [row[3] for row in rows]
+
+        assert plan("1=1") == ['SCAN o USING INDEX idx_orders_created']
+        assert plan("o.status = 'pending'") == [
+            'SEARCH o USING INDEX idx_orders_status_created (status=?)']
+        assert plan("o.product_id = 3") == [
+            'SEARCH o USING INDEX idx_orders_product_created (product_id=?)']
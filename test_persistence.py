@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the SQLite user_data persistence
+اختبارات حفظ حالة المحادثات
+"""
+
+import asyncio
+
+import pytest
+
+from database import Database
+from persistence import SQLitePersistence
+
+
+@pytest.fixture
+def file_db(tmp_path):
+    path = str(tmp_path / "store.db")
+    db = Database(path)
+    yield db
+    db.close_all()
+    Database._instances.pop(path, None)
+
+
+async def settle():
+    """إعطاء الكتابة المجدولة فرصة للتنفيذ"""
+    await asyncio.sleep(0)
+
+
+class TestSQLitePersistence:
+    """Test dirty tracking, batching and reloading"""
+
+    def test_round_trip_and_empty_state_removed(self, file_db):
+        async def scenario():
+            persistence = SQLitePersistence(file_db)
+            await persistence.update_user_data(1, {'adding_product': {'step': 'name'}})
+            await persistence.update_user_data(2, {'donation_step': 'amount'})
+            await settle()
+            assert persistence.writes == 1
+
+            await persistence.update_user_data(2, {})
+            await persistence.flush()
+            return await SQLitePersistence(file_db).get_user_data()
+
+        assert asyncio.run(scenario()) == {1: {'adding_product': {'step': 'name'}}}
+
+    def test_unchanged_state_is_not_written(self, file_db):
+        async def scenario():
+            persistence = SQLitePersistence(file_db)
+            await persistence.update_user_data(1, {'exchange_step': 'amount'})
+            await settle()
+            await persistence.update_user_data(1, {'exchange_step': 'amount'})
+            await settle()
+            return persistence.writes
+
+        assert asyncio.run(scenario()) == 1
+
+    def test_refresh_picks_up_other_worker_changes(self, file_db):
+        async def scenario():
+            worker_a = SQLitePersistence(file_db)
+            worker_b = SQLitePersistence(file_db)
+            user_data = {'broadcasting': True}
+            await worker_a.update_user_data(1, user_data)
+            await worker_a.flush()
+
+            await worker_b.update_user_data(1, {'importing_products': True})
+            await worker_b.flush()
+
+            await worker_a.refresh_user_data(1, user_data)
+            return user_data
+
+        assert asyncio.run(scenario()) == {'importing_products': True}
+
+    def test_pending_changes_win_over_refresh(self, file_db):
+        async def scenario():
+            persistence = SQLitePersistence(file_db)
+            file_db.save_user_states({1: '{"old": 1}'})
+            user_data = {'new': 2}
+            await persistence.update_user_data(1, user_data)
+            await persistence.refresh_user_data(1, user_data)
+            return user_data
+
+        assert asyncio.run(scenario()) == {'new': 2}
+
+    def test_unserializable_values_are_skipped(self, file_db):
+        async def scenario():
+            persistence = SQLitePersistence(file_db)
+            await persistence.update_user_data(1, {'step': 'name', 'file': object()})
+            await persistence.flush()
+            return await persistence.get_user_data()
+
+        assert asyncio.run(scenario()) == {1: {'step': 'name'}}
+
+    def test_drop_user_data(self, file_db):
+        async def scenario():
+            persistence = SQLitePersistence(file_db)
+            await persistence.update_user_data(1, {'step': 'name'})
+            await persistence.flush()
+            await persistence.drop_user_data(1)
+            await persistence.flush()
+            return file_db.get_user_states()
+
+        assert asyncio.run(scenario()) == {}
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the sampling profiler
+اختبارات محلل الأداء
+"""
+
+import asyncio
+import os
+import time
+
+import config
+import profiler
+
+
+def busy_work(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        sum(range(1000))
+
+
+class TestStackSampler:
+    """Test stack sampling and collapsed output"""
+
+    def test_collapsed_stacks(self, tmp_path):
+        sampler = profiler.StackSampler(interval=0.001)
+        sampler.start(5)
+        busy_work(0.2)
+        sampler.stop()
+
+        assert sampler.samples > 0
+        text = sampler.collapsed()
+        assert 'busy_work (test_profiler.py' in text
+        assert 'stack-sampler' not in text
+        for line in text.splitlines():
+            stack, count = line.rsplit(' ', 1)
+            assert int(count) > 0
+            assert ';' in stack
+
+        path = sampler.write(str(tmp_path))
+        assert os.path.basename(path).endswith('.collapsed')
+        with open(path, encoding='utf-8') as f:
+            assert f.read() == text
+
+    def test_run_profile_is_exclusive(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(config, 'TEMP_EXPORT_PATH', str(tmp_path))
+
+        async def run():
+            first = asyncio.ensure_future(profiler.run_profile(1))
+            await asyncio.sleep(0.05)
+            assert profiler.is_profiling()
+            second = await profiler.run_profile(1)
+            return await first, second
+
+        path, second = asyncio.run(run())
+        assert second is None
+        assert os.path.exists(path)
+        assert not profiler.is_profiling()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for compact row records
+اختبارات سجلات الصفوف
+"""
+
+import copy
+import csv
+import io
+import pickle
+import sqlite3
+
+import pytest
+
+from records import Order, Product, Row
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE products (id INTEGER, name TEXT, price INTEGER)")
+    conn.executemany("INSERT INTO products VALUES (?, ?, ?)", [(1, 'كتاب', 10), (2, 'لعبة', 20)])
+    yield conn
+    conn.close()
+
+
+def fetch(conn, kind, sql):
+    cursor = conn.cursor()
+    cursor.row_factory = kind.row_factory
+    cursor.execute(sql)
+    return cursor.fetchall()
+
+
+class TestRecords:
+    """Test the dict-compatible record classes"""
+
+    def test_attribute_and_mapping_access(self, conn):
+        book = fetch(conn, Product, "SELECT * FROM products ORDER BY id")[0]
+
+        assert isinstance(book, Product)
+        assert book.price == book['price'] == book.get('price') == 10
+        assert book.get('missing', 5) == 5
+        with pytest.raises(KeyError):
+            book['missing']
+        assert list(book) == ['id', 'name', 'price'] and 'name' in book
+        assert dict(book) == {'id': 1, 'name': 'كتاب', 'price': 10} == book
+        assert not hasattr(book, '__dict__')
+
+    def test_shapes_are_cached_per_columns(self, conn):
+        first, second = fetch(conn, Product, "SELECT * FROM products")
+        narrow = fetch(conn, Product, "SELECT id, name FROM products")[0]
+
+        assert type(first) is type(second)
+        assert type(narrow) is not type(first) and list(narrow) == ['id', 'name']
+        assert Product.shape(('id', 'name')) is type(narrow)
+        assert type(fetch(conn, Order, "SELECT id, name FROM products")[0]) is not type(narrow)
+
+    def test_copy_pickle_and_csv(self, conn):
+        rows = fetch(conn, Row, "SELECT * FROM products")
+
+        assert copy.copy(rows[0]) == pickle.loads(pickle.dumps(rows[0])) == dict(rows[0])
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=rows[0].keys())
+        writer.writeheader()
+        writer.writerows(rows)
+        assert out.getvalue().splitlines() == ['id,name,price', '1,كتاب,10', '2,لعبة,20']
+
+    def test_rejects_unusable_column_names(self, conn):
+        with pytest.raises(ValueError):
+            fetch(conn, Row, "SELECT COUNT(*) FROM products")
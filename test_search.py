@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for full-text product search
+اختبارات البحث النصي في المنتجات
+"""
+
+import sqlite3
+
+import pytest
+
+from database import Database, normalize_search_text
+
+
+@pytest.fixture
+def temp_db():
+    """Create a temporary in-memory database with sample products"""
+    db = Database(":memory:")
+    db.add_product("الكتاب الإسلامي", "كتاب رائع للقراءة", 10, "text", "x")
+    db.add_product("اشتراك نتفليكس", "حساب بريميوم لمدة شهر", 20, "text", "x")
+    db.add_product("دورة برمجة", "تعلم الكتابة بلغة بايثون", 30, "text", "x")
+    return db
+
+
+class TestNormalization:
+    """Test Arabic text normalization"""
+
+    def test_diacritics_and_alef_variants(self):
+        assert normalize_search_text("إِسْلامِيّ") == normalize_search_text("اسلامي")
+        assert normalize_search_text("أحمد آمن") == "احمد امن"
+
+    def test_taa_marbuta_and_alef_maqsura(self):
+        assert normalize_search_text("مكتبة مستشفى") == "مكتبه مستشفي"
+
+    def test_definite_article_and_punctuation(self):
+        assert normalize_search_text("الكتاب، الجديد!") == "كتاب جديد"
+        assert normalize_search_text("ال") == "ال"
+
+
+class TestSearchProducts:
+    """Test FTS5-backed search"""
+
+    def test_fts_available(self, temp_db):
+        assert temp_db._fts_available
+
+    def test_name_ranks_above_description(self, temp_db):
+        results = temp_db.search_products("كتاب")
+        assert [p['name'] for p in results][0] == "الكتاب الإسلامي"
+
+    def test_normalized_and_prefix_match(self, temp_db):
+        assert [p['name'] for p in temp_db.search_products("إسلامي")] == ["الكتاب الإسلامي"]
+        assert [p['name'] for p in temp_db.search_products("نتف")] == ["اشتراك نتفليكس"]
+        assert temp_db.search_products("") == []
+        assert temp_db.search_products("!!!") == []
+
+    def test_index_follows_product_writes(self, temp_db):
+        product_id = temp_db.add_product("بطاقة هدايا", "رصيد", 5, "text", "x")
+        assert [p['id'] for p in temp_db.search_products("هدايا")] == [product_id]
+
+        temp_db.update_product(product_id, name="بطاقة ألعاب")
+        assert temp_db.search_products("هدايا") == []
+        assert [p['id'] for p in temp_db.search_products("العاب")] == [product_id]
+
+        temp_db.update_product(product_id, is_active=0)
+        assert temp_db.search_products("العاب") == []
+
+        temp_db.delete_product(product_id)
+        count = temp_db._get_connection().execute(
+            "SELECT COUNT(*) FROM products_fts WHERE rowid = ?", (product_id,)
+        ).fetchone()[0]
+        assert count == 0
+
+    def test_plain_connection_writes_without_udf(self, tmp_path):
+        path = str(tmp_path / "store.db")
+        db = Database(path)
+        try:
+            product_id = db.add_product("بطاقة هدايا", "رصيد", 5, "text", "x")
+            # اتصال لا يسجل normalize_ar (أداة خارجية أو عملية أخرى)
+            other = sqlite3.connect(path)
+            other.execute("UPDATE products SET name = 'x', stock = 3 WHERE id = ?", (product_id,))
+            other.execute("INSERT INTO products (name, price, type) VALUES ('y', 1, 'text')")
+            other.commit()
+            other.close()
+            db.update_product(product_id, name="بطاقة ألعاب")
+            assert [p['id'] for p in db.search_products("العاب")] == [product_id]
+        finally:
+            db.close_all()
+            Database._instances.pop(path, None)
+
+    def test_limit_and_offset(self, temp_db):
+        for i in range(5):
+            temp_db.add_product(f"منتج {i}", "وصف", 1, "text", "x")
+        first = temp_db.search_products("منتج", limit=3)
+        second = temp_db.search_products("منتج", limit=3, offset=3)
+        assert len(first) == 3 and len(second) == 2
+        assert not {p['id'] for p in first} & {p['id'] for p in second}
+
+    def test_fallback_without_fts(self, temp_db):
+        temp_db._fts_available = False
+        assert [p['name'] for p in temp_db.search_products("إسلامي")] == ["الكتاب الإسلامي"]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for startup profiling and deferred database initialization
+اختبارات زمن الإقلاع والتهيئة المؤجلة لقاعدة البيانات
+"""
+
+import sqlite3
+import threading
+
+import main
+import storage
+from database import Database
+
+
+class TestDeferredInitialization:
+    """Test that the schema is applied on first use, once"""
+
+    def test_constructor_does_not_touch_disk(self, tmp_path):
+        path = tmp_path / "store.db"
+        db = Database(str(path))
+        try:
+            assert not path.exists()
+            assert not db._schema_ready
+
+            db.initialize()
+            assert db._schema_ready
+            version = sqlite3.connect(str(path)).execute("PRAGMA user_version").fetchone()[0]
+            assert version > 0
+        finally:
+            db.close()
+            Database._instances.pop(str(path), None)
+
+    def test_first_query_applies_schema_once(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "store.db")
+        db = Database(path)
+        calls = []
+        original = Database._create_tables
+        monkeypatch.setattr(Database, '_create_tables', lambda self: calls.append(1) or original(self))
+        try:
+            threads = [threading.Thread(target=db.get_active_products) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert db.get_active_products() == []
+            assert calls == [1]
+        finally:
+            db.close()
+            Database._instances.pop(path, None)
+
+
+class TestStartupProfile:
+    """Test the --profile-startup report"""
+
+    def test_phases_are_recorded(self):
+        profile = main.StartupProfile()
+        with profile.phase('database'):
+            pass
+        with profile.phase('application'):
+            pass
+        assert [name for name, _ in profile.phases] == ['database', 'application']
+        report = profile.report()
+        assert 'database' in report and 'total' in report
+
+    def test_profile_startup_does_not_poll(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main.config, 'DATABASE_NAME', str(tmp_path / "store.db"))
+        monkeypatch.setattr(storage, '_storage', None)
+        monkeypatch.setattr(main.config, 'TEMP_EXPORT_PATH', str(tmp_path / "temp"))
+        monkeypatch.setattr(main, 'prerender_product_cards', lambda: 0)
+        monkeypatch.setattr(main.Application, 'run_polling',
+                            lambda *a, **k: (_ for _ in ()).throw(AssertionError("polling")))
+        try:
+            main.main(['--profile-startup'])
+        finally:
+            Database._instances.pop(str(tmp_path / "store.db"), None)
@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+"""
+Storage contract tests, run against every backend
+اختبارات واجهة التخزين على كل تنفيذ
+
+SQLite يُختبر دائماً. لاختبار PostgreSQL عيّن STORE_BOT_TEST_PG_DSN (يُنشأ مخطط مؤقت ويُحذف بعد كل اختبار):
+    STORE_BOT_TEST_PG_DSN=postgresql://postgres@localhost/postgres pytest test_storage.py
+"""
+
+import asyncio
+import os
+import re
+import threading
+import uuid
+
+import pytest
+
+import config
+import records
+import storage
+from database import Database
+
+PG_DSN = os.environ.get('STORE_BOT_TEST_PG_DSN')
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        path = str(tmp_path / "store.db")
+        db = Database(path)
+        yield db
+        db.close_all()
+        Database._instances.pop(path, None)
+        return
+
+    if not PG_DSN:
+        pytest.skip("STORE_BOT_TEST_PG_DSN غير معرّف")
+    asyncpg = pytest.importorskip('asyncpg')
+    from postgres_storage import PostgresStorage
+
+    schema = f"store_test_{uuid.uuid4().hex[:12]}"
+
+    async def admin(sql):
+        conn = await asyncpg.connect(PG_DSN)
+        try:
+            await conn.execute(sql)
+        finally:
+            await conn.close()
+
+    asyncio.run(admin(f"CREATE SCHEMA {schema}"))
+    db = PostgresStorage(PG_DSN, schema=schema, max_size=8)
+    try:
+        yield db
+    finally:
+        db.close_all()
+        asyncio.run(admin(f"DROP SCHEMA {schema} CASCADE"))
+
+
+def run_threads(count, target):
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        result = target()
+        with lock:
+            results.append(result)
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestUsers:
+    """Test user records"""
+
+    def test_add_get_ban(self, store):
+        assert store.add_user(1, 'alice', 'Alice')
+        assert not store.add_user(1, 'alice', 'Alice')
+        store.add_user(2, 'bob', 'Bob', referrer_id=1)
+
+        user = store.get_user(1)
+        assert user['username'] == 'alice' and user['balance'] == 0
+        assert user['referral_count'] == 1
+        assert re.fullmatch(r'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d', user['join_date'])
+        assert store.get_user(99) is None
+
+        assert store.ban_user(2, 'spam')
+        assert store.get_user(2)['is_banned'] == 1
+        assert store.get_user(2)['ban_reason'] == 'spam'
+        assert store.is_user_banned(2) and not store.is_user_banned(1)
+        assert store.unban_user(2)
+        assert store.get_user(2)['is_banned'] == 0
+        assert not store.is_user_banned(2)
+
+        store.add_user_balance(1, 15)
+        stats = store.get_user_stats(1)
+        assert (stats['balance'], stats['total_purchases'], stats['is_banned']) == (15, 0, 0)
+        assert store.get_user_stats(99) is None
+
+        assert store.get_users_count() == 2
+        assert len(store.get_all_users(limit=1)) == 1
+
+
+class TestProducts:
+    """Test catalog reads and writes"""
+
+    def test_crud_search_and_categories(self, store):
+        seen = []
+        store.add_catalog_listener(seen.append)
+        book = store.add_product("الكتاب الأزرق", "رواية", 10, 'text', category='كتب')
+        game = store.add_product("لعبة", "مفتاح تفعيل", 20, 'code', category='ألعاب')
+        assert seen == [book, game]
+
+        assert [p['id'] for p in store.get_active_products(category='كتب')] == [book]
+        assert [p['id'] for p in store.search_products("كتاب")] == [book]
+        assert [p['id'] for p in store.search_products("تفعيل")] == [game]
+
+        assert store.update_product(book, name="مجلة", price=12)
+        assert store.search_products("كتاب") == []
+        assert store.get_product(book)['price'] == 12
+        assert isinstance(store.get_product(book), records.Product)
+        assert store.get_product(book).name == "مجلة"
+
+        counts = {c['name']: c['count'] for c in store.get_category_counts()}
+        assert counts == {'كتب': 1, 'ألعاب': 1}
+        store.update_product(game, is_active=0)
+        assert [c['name'] for c in store.get_category_counts()] == ['كتب']
+        category_id = store.get_category_counts()[0]['id']
+        assert store.get_category_count(category_id)['count'] == 1
+
+        assert store.delete_product(game)
+        assert store.get_product(game) is None
+        assert store.get_catalog_version() == 5
+
+    def test_concurrent_stock_never_oversells(self, store):
+        product = store.add_product("محدود", "", 5, 'text', stock=5, is_limited=1)
+        results = run_threads(20, lambda: store.decrease_stock(product))
+        assert results.count(True) == 5
+        assert store.get_product(product)['stock'] == 0
+
+    def test_concurrent_codes_are_unique(self, store):
+        product = store.add_product("أكواد", "", 5, 'code')
+        store.add_codes(product, [f"CODE-{i}" for i in range(10)])
+        results = run_threads(20, lambda: store.get_unused_code(product, 7))
+        codes = [code for code in results if code is not None]
+        assert sorted(codes) == sorted(f"CODE-{i}" for i in range(10))
+        assert store.get_available_codes_count(product) == 0
+
+
+class TestOrders:
+    """Test orders and purchase totals"""
+
+    def test_order_lifecycle(self, store):
+        store.add_user(1, 'alice', 'Alice')
+        product = store.add_product("منتج", "", 30, 'text')
+        order = store.create_order(1, product, "منتج", 'pay-1', 30, discount_amount=5)
+        assert order is not None
+        assert store.create_order(1, product, "منتج", 'pay-1', 30) is None
+
+        assert store.update_order_status(order, 'completed', 'delivered')
+        saved = store.get_order(order)
+        assert saved['final_price'] == 25 and saved['delivery_status'] == 'delivered'
+        assert isinstance(saved['completed_at'], str)
+
+        assert store.complete_purchase(1, product, 25)
+        assert store.get_user(1)['total_spent'] == 25
+        assert store.get_product(product)['sales_count'] == 1
+        assert [o['id'] for o in store.get_user_orders(1)] == [order]
+        later = [store.create_order(1, product, "منتج", f'pay-{i}', 30) for i in range(2, 6)]
+        assert [o['id'] for o in store.get_user_orders(1, limit=2)] == later[:1:-1]
+        assert [o['id'] for o in store.get_user_orders(1, limit=2, offset=2)] == [later[1], later[0]]
+        assert [o['id'] for o in store.get_user_orders(1, limit=2, offset=4)] == [order]
+        assert store.get_all_orders()[0]['username'] == 'alice'
+
+        stats = store.get_statistics()
+        assert stats['total_revenue'] == 25 and stats['completed_orders'] == 1
+        assert stats['top_products'][0]['id'] == product
+
+
+    def test_admin_feed_and_status_counts(self, store):
+        store.add_user(1, 'alice', 'Alice')
+        book = store.add_product("كتاب", "", 10, 'text')
+        game = store.add_product("لعبة", "", 20, 'text')
+        # نفس الثانية لكل الطلبات: المؤشر يعتمد على المعرف لفك التعادل
+        orders = [store.create_order(1, book if i % 2 else game, "منتج", f'feed-{i}', 10)
+                  for i in range(7)]
+        assert store.get_order_status_counts() == {'pending': 7}
+        store.update_order_status(orders[0], 'completed')
+        store.update_order_status(orders[1], 'completed')
+        store.update_order_status(orders[2], 'failed')
+        assert store.get_order_status_counts() == {'pending': 4, 'completed': 2, 'failed': 1}
+        stats = store.get_statistics()
+        assert (stats['total_orders'], stats['completed_orders']) == (7, 2)
+
+        pages, before = [], None
+        while True:
+            page = store.get_order_feed(limit=3, before_id=before)
+            if not page:
+                break
+            pages.append([o['id'] for o in page])
+            before = page[-1]['id']
+        assert pages == [orders[:3:-1], orders[3:0:-1], orders[:1]]
+        assert store.get_order_feed(limit=1)[0]['username'] == 'alice'
+
+        assert [o['id'] for o in store.get_order_feed(status='completed')] == [orders[1], orders[0]]
+        by_product = store.get_order_feed(product_id=book, limit=2)
+        assert [o['id'] for o in by_product] == [orders[5], orders[3]]
+        assert [o['id'] for o in store.get_order_feed(product_id=book, before_id=orders[3])] == [orders[1]]
+        assert store.get_order_feed(since='2000-01-01', until='2000-01-02') == []
+        assert len(store.get_order_feed(since='2000-01-01')) == 7
+
+
+class TestBalances:
+    """Test wallet operations"""
+
+    def test_balance_operations(self, store):
+        store.add_user(1, 'a')
+        store.add_user(2, 'b')
+        assert store.add_user_balance(1, 100)
+        assert not store.subtract_user_balance(1, 150)
+        assert store.subtract_user_balance(1, 30)
+        assert store.transfer_balance(1, 2, 50)
+        assert not store.transfer_balance(1, 2, 50)
+        assert (store.get_user_balance(1), store.get_user_balance(2)) == (20, 50)
+        assert [u['user_id'] for u in store.get_top_users_by_balance()] == [2, 1]
+
+    def test_ledger_history_and_idempotency(self, store):
+        store.add_user(1, 'a')
+        store.add_user(2, 'b')
+        assert store.add_user_balance(1, 40, reason='purchase', idempotency_key='order:7')
+        assert store.add_user_balance(1, 40, reason='purchase', idempotency_key='order:7')
+        assert not store.transfer_balance(1, 99, 10)
+        assert store.transfer_balance(1, 2, 15)
+        assert store.get_user_balance(1) == 25
+
+        history = store.get_balance_history(1)
+        assert [(e['delta'], e['balance_after'], e['reason']) for e in history] == [
+            (-15, 25, 'transfer_out'), (40, 40, 'purchase')]
+        assert [e['reason'] for e in store.get_balance_history(2)] == ['transfer_in']
+
+        assert store.reset_all_balances()
+        assert store.get_balance_history(2, limit=1)[0]['balance_after'] == 0
+
+    def test_compaction_keeps_running_total(self, store):
+        store.add_user(1, 'a')
+        for amount in (10, 20, 30):
+            store.add_user_balance(1, amount, idempotency_key=f'pay:{amount}')
+        store.subtract_user_balance(1, 5)
+
+        # مدة سالبة تجعل كل الحركات "قديمة"
+        assert store.compact_balance_ledger(older_than_days=-1) == 3
+        history = store.get_balance_history(1)
+        assert [(e['delta'], e['balance_after'], e['reason']) for e in history] == [(55, 55, 'snapshot')]
+        assert store.compact_balance_ledger(older_than_days=-1) == 0
+        assert store.add_user_balance(1, 5)
+        assert store.get_user_balance(1) == store.get_balance_history(1)[0]['balance_after'] == 60
+
+    def test_concurrent_subtract(self, store):
+        store.add_user(1, 'a')
+        store.add_user_balance(1, 10)
+        results = run_threads(20, lambda: store.subtract_user_balance(1, 1))
+        assert results.count(True) == 10
+        assert store.get_user_balance(1) == 0
+
+
+class TestLeaderboards:
+    """Test top lists stay in step with writes"""
+
+    def test_top_lists_follow_writes(self, store):
+        for user_id in (1, 2, 3):
+            store.add_user(user_id, f'u{user_id}')
+        store.add_user_balance(1, 10)
+        store.add_user_balance(2, 30)
+        assert [u['user_id'] for u in store.get_top_users_by_balance()] == [2, 1]
+        store.add_user_balance(1, 50)
+        store.add_user_balance(3, 5)
+        store.subtract_user_balance(2, 30)
+        assert [(u['user_id'], u['balance']) for u in store.get_top_users_by_balance()] == [(1, 60), (3, 5)]
+
+        book = store.add_product("كتاب", "", 10, 'text')
+        game = store.add_product("لعبة", "", 20, 'text', stock=3, is_limited=1)
+        store.complete_purchase(1, game, 25)
+        assert store.get_top_selling_products(1)[0]['id'] == game
+        store.decrease_stock(game)
+        store.complete_purchase(2, book, 10)
+        store.complete_purchase(2, book, 10)
+        top = store.get_top_selling_products()
+        assert [(p['id'], p['sales_count']) for p in top] == [(book, 2), (game, 1)]
+        assert top[1]['stock'] == 2
+        store.update_product(book, is_active=0)
+        assert [p['id'] for p in store.get_top_selling_products()] == [game]
+        assert [u['user_id'] for u in store.get_top_users_by_spend()] == [1, 2]
+        assert store.get_statistics()['top_spenders'][0]['total_spent'] == 25
+
+        first = store.create_donation(1, 100, "أولى")
+        second = store.create_donation(1, 10, "ثانية")
+        store.add_donation_contribution(second, 2, 5)
+        assert [c['id'] for c in store.get_top_campaigns()] == [second, first]
+        store.add_donation_contributions([(first, 2, 20), (first, 3, 30)])
+        top = store.get_top_campaigns()
+        assert [(c['id'], c['total_received'], c['percentage']) for c in top] == [
+            (first, 50, 50), (second, 5, 50)]
+
+
+class TestDonationsAndPoints:
+    """Test campaigns, points and exchange"""
+
+    def test_campaign_points_exchange(self, store):
+        store.add_user(1, 'donor')
+        store.add_user(2, 'fan')
+        donation = store.create_donation(1, 100, "حملة", options=[10, 50])
+        assert store.get_donation_by_url(store.get_donation(donation)['donation_url'])['id'] == donation
+
+        assert store.add_donation_contribution(donation, 2, 40)
+        assert store.get_donation(donation)['total_received'] == 40
+        assert store.get_user_points(2)['points'] == 40
+
+        campaign = store.get_campaign_stats(donation)
+        assert campaign['percentage'] == 40 and campaign['contributors'] == 1
+
+        assert not store.exchange_points_to_stars(2, 100)
+        assert store.exchange_points_to_stars(2, 30, exchange_rate=0.1)
+        assert store.get_user_points(2)['points'] == 10
+        assert store.get_user_balance(2) == 3
+        assert store.get_exchange_history(2)[0]['stars_received'] == 3
+
+        assert store.add_donation_contributions([(donation, 1, 5), (donation, 2, 5), (donation, 1, 20)]) == 3
+        assert store.get_donation(donation)['total_received'] == 70
+        assert store.get_campaign_stats(donation)['contributors'] == 2
+        leaders = store.get_points_leaderboard()
+        assert [(l['user_id'], l['total_earned'], l['points']) for l in leaders] == [(2, 45, 15), (1, 25, 25)]
+        assert leaders[0]['username'] == 'fan'
+
+        assert store.add_donation_to_bot(2, 7, 'fan')
+        assert store.get_donation_stats()['total_amount'] == 7
+
+    def test_redelivered_payments_count_once(self, store):
+        store.add_user(1, 'donor')
+        store.add_user(2, 'fan')
+        donation = store.create_donation(1, 100, "حملة")
+        for _ in range(2):
+            assert store.add_donation_contribution(donation, 2, 40, payment_id='charge-1')
+            assert store.add_donation_to_bot(2, 7, 'fan', payment_id='charge-2')
+        assert store.add_donation_contribution(donation, 2, 5)
+        assert store.add_donation_contribution(donation, 2, 5)
+
+        assert store.get_donation(donation)['total_received'] == 50
+        assert store.get_user_points(2)['points'] == 50
+        assert store.get_donation_stats()['total_amount'] == 7
+
+
+class TestSettingsStateAndLocks:
+    """Test key/value tables and coordination"""
+
+    def test_settings_and_states(self, store):
+        assert store.set_setting('welcome', 'hi')
+        assert store.set_setting('welcome', 'hello')
+        assert store.get_setting('welcome') == 'hello'
+        assert store.get_all_settings() == {'welcome': 'hello'}
+
+        assert store.save_user_states({1: '{"a": 1}', 2: '{"b": 2}'})
+        assert store.save_user_states({1: None})
+        assert store.get_user_states() == {2: '{"b": 2}'}
+        assert store.get_user_state(2) == '{"b": 2}'
+
+    def test_job_locks(self, store):
+        assert store.acquire_job_lock('broadcast', 'a', 60)
+        assert not store.acquire_job_lock('broadcast', 'b', 60)
+        assert store.release_job_lock('broadcast', 'a')
+        assert store.acquire_job_lock('broadcast', 'b', 60)
+
+    def test_rate_limit_and_temp_ban(self, store):
+        assert [store.check_rate_limit(1, max_requests=2) for _ in range(3)] == [True, True, False]
+        assert not store.record_failed_attempt(5, max_attempts=2)
+        assert store.record_failed_attempt(5, max_attempts=2)
+        assert not store.check_rate_limit(5)
+
+
+class TestAsyncCalls:
+    """Test the awaitable db.aio path used by handlers"""
+
+    def test_aio_matches_sync_calls(self, store):
+        async def scenario():
+            assert await store.aio.add_user(1, 'alice', 'Alice')
+            pending = asyncio.ensure_future(store.aio.get_user(1))
+            await asyncio.sleep(0)
+            # PostgreSQL يُنتظر على حلقة التخزين فتبقى حلقة المستدعي حرة
+            waiting = not pending.done()
+            user = await pending
+            return user, waiting, await store.aio.get_catalog_version()
+
+        user, waiting, version = asyncio.run(scenario())
+        assert user['username'] == 'alice' and user == store.get_user(1)
+        assert waiting == (store.aio.__class__ is not storage.AsyncCalls)
+        assert version == store.get_catalog_version()
+        assert store.aio is store.aio
+
+
+class TestFactory:
+    """Test backend selection"""
+
+    def test_sqlite_backend(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "store.db")
+        monkeypatch.setattr(config, 'DATABASE_NAME', path)
+        monkeypatch.setattr(storage, '_storage', None)
+        try:
+            assert storage.get_storage() is Database(path)
+            assert storage.get_storage() is storage.active_storage()
+        finally:
+            Database._instances.pop(path, None)
+
+    def test_unknown_backend(self, monkeypatch):
+        monkeypatch.setattr(config, 'STORAGE_BACKEND', 'mysql')
+        monkeypatch.setattr(storage, '_storage', None)
+        with pytest.raises(ValueError):
+            storage.get_storage()
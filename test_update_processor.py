@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for per-user update ordering
+اختبارات معالجة التحديثات بالتسلسل لكل مستخدم
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from lifecycle import lifecycle
+from update_processor import PerUserUpdateProcessor, update_key
+
+
+def make_update(user_id=None, chat_id=None):
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id) if user_id is not None else None,
+        effective_chat=SimpleNamespace(id=chat_id) if chat_id is not None else None,
+    )
+
+
+async def run(processor, jobs):
+    """jobs: [(update, name, delay)] → ترتيب انتهاء المعالجات"""
+    finished = []
+    peak = [0]
+
+    async def handler(name, delay):
+        peak[0] = max(peak[0], processor.active)
+        await asyncio.sleep(delay)
+        finished.append(name)
+
+    await processor.initialize()
+    await asyncio.gather(*(
+        processor.process_update(update, handler(name, delay))
+        for update, name, delay in jobs
+    ))
+    return finished, peak[0]
+
+
+class TestUpdateKey:
+    """Test how updates are grouped"""
+
+    def test_user_then_chat(self):
+        assert update_key(make_update(1, 5)) == 1
+        assert update_key(make_update(chat_id=5)) == 5
+        assert update_key(make_update()) is None
+
+
+class TestPerUserUpdateProcessor:
+    """Test ordering and concurrency limits"""
+
+    def test_same_user_is_serial_other_users_overlap(self):
+        processor = PerUserUpdateProcessor(concurrency=4)
+        finished, peak = asyncio.run(run(processor, [
+            (make_update(1), 'a1', 0.05),
+            (make_update(1), 'a2', 0.0),
+            (make_update(2), 'b1', 0.01),
+        ]))
+        assert finished.index('a1') < finished.index('a2')
+        assert finished[0] == 'b1'
+        assert peak == 2
+        assert processor._locks == {} and processor.waiting == 0
+
+    def test_concurrency_limit(self):
+        processor = PerUserUpdateProcessor(concurrency=2)
+        _, peak = asyncio.run(run(processor, [
+            (make_update(user), f'u{user}', 0.01) for user in range(6)
+        ]))
+        assert peak == 2
+
+    def test_busy_user_does_not_block_others(self):
+        processor = PerUserUpdateProcessor(concurrency=2, max_pending=10)
+        finished, _ = asyncio.run(run(processor, [
+            (make_update(1), 'a1', 0.05),
+            (make_update(1), 'a2', 0.05),
+            (make_update(1), 'a3', 0.05),
+            (make_update(2), 'b1', 0.0),
+        ]))
+        assert finished == ['b1', 'a1', 'a2', 'a3']
+
+    def test_cancelled_before_start_is_not_counted(self):
+        async def scenario():
+            processor = PerUserUpdateProcessor(concurrency=1)
+            await processor.initialize()
+            blocker = asyncio.ensure_future(
+                processor.process_update(make_update(1), asyncio.sleep(0.1)))
+            waiting = asyncio.ensure_future(
+                processor.process_update(make_update(1), asyncio.sleep(0)))
+            await asyncio.sleep(0.01)
+            assert processor.waiting == 1
+            waiting.cancel()
+            await asyncio.gather(blocker, waiting, return_exceptions=True)
+            return processor
+
+        processor = asyncio.run(scenario())
+        assert processor.waiting == 0 and processor.active == 0
+        assert processor._locks == {}
+
+    def test_shutdown_deadline_cancels_hung_handler(self):
+        class Application:
+            def stop_running(self):
+                pass
+
+        async def scenario():
+            processor = PerUserUpdateProcessor(concurrency=2)
+            await processor.initialize()
+            hung = asyncio.ensure_future(
+                processor.process_update(make_update(1), asyncio.sleep(60)))
+            done = asyncio.ensure_future(
+                processor.process_update(make_update(2), asyncio.sleep(0)))
+            await asyncio.sleep(0.01)
+            lifecycle.request_stop(Application(), timeout=0.05)
+            return await asyncio.gather(hung, done, return_exceptions=True)
+
+        try:
+            hung, done = asyncio.run(scenario())
+            assert isinstance(hung, asyncio.CancelledError) and done is None
+            assert lifecycle.cancelled == 1
+        finally:
+            lifecycle.reset()
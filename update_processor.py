@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Per-User Update Processor
+معالجة التحديثات بالتوازي بين المستخدمين وبالتسلسل لكل مستخدم
+
+حالات user_data متعددة الخطوات (إضافة منتج، التبرع، التبادل...) تفترض أن تحديثات
+المستخدم الواحد تُعالج بالترتيب، لذا يُقفل كل مستخدم/محادثة على حدة بينما يُسمح
+لعدد محدود من المعالجات بالعمل في نفس الوقت لمستخدمين مختلفين.
+"""
+
+import asyncio
+import time
+from typing import Dict, Optional
+
+from telegram.ext import BaseUpdateProcessor
+
+import config
+from lifecycle import lifecycle
+from metrics import REGISTRY, Gauge, Histogram
+
+UPDATES_ACTIVE = REGISTRY.register(Gauge(
+    'bot_updates_active', 'Updates currently being handled'))
+UPDATES_WAITING = REGISTRY.register(Gauge(
+    'bot_updates_waiting', 'Updates waiting for their user or a free slot'))
+UPDATE_KEYS = REGISTRY.register(Gauge(
+    'bot_update_keys', 'Users/chats with at least one update in progress'))
+UPDATE_WAIT = REGISTRY.register(Histogram(
+    'bot_update_wait_seconds', 'Time an update waited before its handler started',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))))
+
+
+def update_key(update) -> Optional[int]:
+    """مفتاح التسلسل: المستخدم ثم المحادثة (None = بلا قيد ترتيب)"""
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return user.id
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """معالج تحديثات: تسلسلي لكل مستخدم، متوازٍ حتى حد معين بين المستخدمين
+
+    max_concurrent_updates في الفئة الأساسية يحد عدد التحديثات المقبولة (الجارية
+    والمنتظرة)، بينما concurrency يحد عدد المعالجات التي تعمل فعلياً. فصل الحدين يمنع
+    مستخدماً يرسل تحديثات كثيرة من حجز كل الأماكن وهو ينتظر قفله.
+    """
+
+    def __init__(self, concurrency: int = None, max_pending: int = None):
+        concurrency = config.CONCURRENT_UPDATES if concurrency is None else concurrency
+        max_pending = config.MAX_PENDING_UPDATES if max_pending is None else max_pending
+        super().__init__(max(max_pending, concurrency))
+        self.concurrency = concurrency
+        self._slots = asyncio.BoundedSemaphore(concurrency)
+        # مفتاح -> [القفل، عدد التحديثات المنتظرة أو الجارية]
+        self._locks: Dict[int, list] = {}
+        self.active = 0
+        self.waiting = 0
+
+    async def initialize(self) -> None:
+        UPDATES_ACTIVE.set_function(lambda: self.active)
+        UPDATES_WAITING.set_function(lambda: self.waiting)
+        UPDATE_KEYS.set_function(lambda: len(self._locks))
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_process_update(self, update, coroutine) -> None:
+        # مهمة التحديث (ينشئها Application) تُلغى إذا تجاوزت مهلة الإغلاق
+        task = asyncio.current_task()
+        if task is not None:
+            lifecycle.track(task)
+        key = update_key(update)
+        queued_at = time.perf_counter()
+        entry = None
+        if key is not None:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+
+        started = False
+        self.waiting += 1
+        try:
+            if entry is not None:
+                await entry[0].acquire()
+            try:
+                async with self._slots:
+                    self.waiting -= 1
+                    started = True
+                    UPDATE_WAIT.observe(time.perf_counter() - queued_at)
+                    self.active += 1
+                    try:
+                        await coroutine
+                    finally:
+                        self.active -= 1
+            finally:
+                if entry is not None:
+                    entry[0].release()
+        finally:
+            if not started:
+                # أُلغي التحديث قبل أن يبدأ
+                self.waiting -= 1
+                if hasattr(coroutine, 'close'):
+                    coroutine.close()
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._locks.pop(key, None)
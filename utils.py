@@ -11,11 +11,13 @@ from datetime import datetime
 import logging
 import os
 
-from database import Database
+from storage import get_storage
+from metrics import cache_hit
 import config
 
 logger = logging.getLogger(__name__)
-db = Database(config.DATABASE_NAME)
+db = get_storage()
+db.add_catalog_listener(lambda product_id: invalidate_product_card(product_id))
 
 
 def is_admin(user_id: int) -> bool:
@@ -27,9 +29,10 @@ async def check_banned(update: Update, context: ContextTypes.DEFAULT_TYPE,
                       is_callback: bool = False) -> bool:
     """التحقق من حظر المستخدم"""
     user = update.effective_user
-    user_data = db.get_user(user.id)
     
-    if user_data and user_data['is_banned']:
+    # الفحص المعتاد يقرأ علامة الحظر فقط، وبيانات المستخدم تُجلب للمحظورين فقط
+    if await db.aio.is_user_banned(user.id):
+        user_data = await db.aio.get_user(user.id) or {}
         ban_message = config.MESSAGES['banned']
         if user_data.get('ban_reason'):
             ban_message += f"\n\nالسبب: {user_data['ban_reason']}"
@@ -39,7 +42,7 @@ async def check_banned(update: Update, context: ContextTypes.DEFAULT_TYPE,
         else:
             await update.message.reply_text(ban_message)
         
-        db.add_log('security', user.id, 'banned_user_attempt', 'محاولة استخدام البوت')
+        await db.aio.add_log('security', user.id, 'banned_user_attempt', 'محاولة استخدام البوت')
         return False
     
     return True
@@ -55,7 +58,7 @@ async def check_maintenance(update: Update, context: ContextTypes.DEFAULT_TYPE,
         return True
     
     # التحقق من وضع الصيانة
-    maintenance_mode = db.get_setting('maintenance_mode')
+    maintenance_mode = await db.aio.get_setting('maintenance_mode')
     if maintenance_mode == 'True' or config.MAINTENANCE_MODE:
         if is_callback:
             await update.callback_query.answer(
@@ -80,7 +83,7 @@ async def check_rate_limit(update: Update, context: ContextTypes.DEFAULT_TYPE,
         return True
     
     # فحص معدل الطلبات
-    if not db.check_rate_limit(user.id, config.MAX_REQUESTS_PER_MINUTE):
+    if not await db.aio.check_rate_limit(user.id, config.MAX_REQUESTS_PER_MINUTE):
         warning_message = (
             "⚠️ تجاوزت الحد المسموح من الطلبات!\n"
             "انتظر قليلاً قبل المحاولة مرة أخرى."
@@ -91,36 +94,84 @@ async def check_rate_limit(update: Update, context: ContextTypes.DEFAULT_TYPE,
         else:
             await update.message.reply_text(warning_message)
         
-        db.add_log('security', user.id, 'rate_limit_exceeded', 
+        await db.aio.add_log('security', user.id, 'rate_limit_exceeded', 
                   f'تجاوز {config.MAX_REQUESTS_PER_MINUTE} طلب/دقيقة')
         return False
     
     return True
 
 
-def format_product_info(product: dict, include_stock: bool = True) -> str:
-    """تنسيق معلومات المنتج"""
-    icon = config.EMOJI.get(product['type'], config.EMOJI['products'])
-    
-    info = f"<b>{icon} {product['name']}</b>\n\n"
+# ==================== بطاقات المنتجات ====================
+
+# قوالب البطاقات المجهزة مسبقاً لكل (نوع منتج، حالة الخصم)
+_CARD_TEMPLATES = {}
+
+# كاش البطاقات: (معرف المنتج، include_stock) -> (مفتاح النسخة، النص)
+_card_cache = {}
+
+
+def _build_card_template(product_type: str, discounted: bool) -> str:
+    """بناء قالب بطاقة منتج مع تثبيت الأيقونة وتسمية النوع"""
+    icon = config.EMOJI.get(product_type, config.EMOJI['products'])
+    type_label = config.PRODUCT_TYPES.get(product_type, 'غير معروف')
     
-    if product.get('description'):
-        info += f"📝 <b>الوصف:</b>\n{product['description']}\n\n"
+    template = f"<b>{icon} {{name}}</b>\n\n{{description}}"
+    if discounted:
+        template += (
+            "💰 <b>السعر:</b> <s>{price}</s> {final_price} ⭐\n"
+            "🎁 <b>خصم:</b> {discount}%\n"
+        )
+    else:
+        template += "💰 <b>السعر:</b> {price} ⭐\n"
+    template += f"📦 <b>النوع:</b> {type_label}\n"
+    return template
+
+
+def _card_template(product_type: str, discounted: bool) -> str:
+    """جلب قالب البطاقة (يُبنى مرة واحدة لكل نوع)"""
+    key = (product_type, discounted)
+    template = _CARD_TEMPLATES.get(key)
+    if template is None:
+        template = _build_card_template(product_type, discounted)
+        _CARD_TEMPLATES[key] = template
+    return template
+
+
+def _stock_bucket(product: dict) -> int:
+    """حالة المخزون كما تظهر في البطاقة (-1 غير محدود، 0 نافد، وإلا الكمية)"""
+    if not product['is_limited']:
+        return -1
+    return max(product['stock'], 0)
+
+
+def invalidate_product_card(product_id: int = None):
+    """حذف بطاقة منتج من الكاش (أو جميع البطاقات)"""
+    if product_id is None:
+        _card_cache.clear()
+        return
     
-    # السعر مع الخصم
+    _card_cache.pop((product_id, True), None)
+    _card_cache.pop((product_id, False), None)
+
+
+def _render_product_info(product: dict, include_stock: bool) -> str:
+    """تنسيق بطاقة المنتج من القالب المجهز"""
     price = product['price']
     discount = product.get('discount_percentage', 0)
     
-    if discount > 0:
-        final_price = price - (price * discount // 100)
-        info += f"💰 <b>السعر:</b> <s>{price}</s> {final_price} ⭐\n"
-        info += f"🎁 <b>خصم:</b> {discount}%\n"
+    description = product.get('description')
+    if description:
+        description = f"📝 <b>الوصف:</b>\n{description}\n\n"
     else:
-        info += f"💰 <b>السعر:</b> {price} ⭐\n"
+        description = ""
     
-    # نوع المنتج
-    product_type = config.PRODUCT_TYPES.get(product['type'], 'غير معروف')
-    info += f"📦 <b>النوع:</b> {product_type}\n"
+    info = _card_template(product['type'], discount > 0).format(
+        name=product['name'],
+        description=description,
+        price=price,
+        final_price=price - (price * discount // 100),
+        discount=discount
+    )
     
     # المخزون
     if include_stock:
@@ -146,6 +197,44 @@ def format_product_info(product: dict, include_stock: bool = True) -> str:
     return info
 
 
+def format_product_info(product: dict, include_stock: bool = True) -> str:
+    """تنسيق معلومات المنتج (مع كاش حسب آخر تحديث وحالة المخزون)"""
+    product_id = product.get('id')
+    if product_id is None or not config.ENABLE_CACHE:
+        return _render_product_info(product, include_stock)
+    
+    version_key = (product.get('updated_at'), _stock_bucket(product),
+                   product.get('sales_count', 0))
+    entry = _card_cache.get((product_id, include_stock))
+    hit = entry is not None and entry[0] == version_key
+    cache_hit('product_cards', hit)
+    if hit:
+        return entry[1]
+    
+    info = _render_product_info(product, include_stock)
+    _card_cache[(product_id, include_stock)] = (version_key, info)
+    return info
+
+
+def prerender_product_cards(limit: int = None) -> int:
+    """تجهيز بطاقات المنتجات الأكثر مبيعاً مسبقاً (عند بدء التشغيل)"""
+    if limit is None:
+        limit = config.PRERENDER_TOP_PRODUCTS
+    
+    if not config.ENABLE_CACHE or limit <= 0:
+        return 0
+    
+    for product_type in config.PRODUCT_TYPES:
+        _card_template(product_type, False)
+        _card_template(product_type, True)
+    
+    products = db.get_top_selling_products(limit)
+    for product in products:
+        format_product_info(product)
+    
+    return len(products)
+
+
 def format_user_info(user: dict) -> str:
     """تنسيق معلومات المستخدم"""
     info = f"👤 <b>معلومات الحساب</b>\n\n"
@@ -192,6 +281,26 @@ def format_order_info(order: dict) -> str:
     return info
 
 
+def format_balance_entry(entry: dict) -> str:
+    """تنسيق سطر من سجل حركات الرصيد"""
+    reason = {
+        'deposit': 'شحن',
+        'withdraw': 'خصم',
+        'purchase': 'شراء رصيد',
+        'referral': 'مكافأة إحالة',
+        'admin': 'إضافة من الإدارة',
+        'transfer_in': 'تحويل وارد',
+        'transfer_out': 'تحويل صادر',
+        'points_exchange': 'استبدال نقاط',
+        'reset': 'تصفير',
+        'opening': 'رصيد افتتاحي',
+        'snapshot': 'رصيد مرحّل',
+    }.get(entry['reason'], entry['reason'])
+    
+    return (f"{format_timestamp(entry['created_at'])}  {entry['delta']:+d} ⭐ "
+            f"({reason}) ← {entry['balance_after']} ⭐")
+
+
 async def send_product_to_user(context: ContextTypes.DEFAULT_TYPE, 
                                user_id: int, 
                                product: dict,
@@ -239,7 +348,7 @@ async def send_product_to_user(context: ContextTypes.DEFAULT_TYPE,
         # منتج من نوع كود
         elif product_type == 'code':
             # الحصول على كود غير مستخدم
-            code = db.get_unused_code(product['id'], user_id)
+            code = await db.aio.get_unused_code(product['id'], user_id)
             
             if code:
                 code_message = (
@@ -256,7 +365,7 @@ async def send_product_to_user(context: ContextTypes.DEFAULT_TYPE,
                 )
                 
                 # حفظ الكود في الطلب
-                db.update_order_status(order_id, 'completed', 'delivered', code)
+                await db.aio.update_order_status(order_id, 'completed', 'delivered', code)
                 return True
             else:
                 logger.error(f"لا توجد أكواد متاحة للمنتج {product['id']}")
@@ -268,7 +377,8 @@ async def send_product_to_user(context: ContextTypes.DEFAULT_TYPE,
             balance_amount = int(product.get('delivery_content', 0))
             
             # إضافة الرصيد إلى قاعدة البيانات
-            if db.add_user_balance(user_id, balance_amount):
+            if await db.aio.add_user_balance(user_id, balance_amount, reason='purchase',
+                                   idempotency_key=f'order:{order_id}'):
                 balance_message = (
                     f"💰 <b>{product['name']}</b>\n\n"
                     f"✅ تم إضافة {balance_amount} ⭐ إلى رصيدك!\n\n"
@@ -281,7 +391,7 @@ async def send_product_to_user(context: ContextTypes.DEFAULT_TYPE,
                 )
                 
                 # تحديث حالة الطلب
-                db.update_order_status(order_id, 'completed', 'delivered')
+                await db.aio.update_order_status(order_id, 'completed', 'delivered')
                 return True
             else:
                 logger.error(f"فشل إضافة الرصيد للمستخدم {user_id}")
@@ -452,7 +562,7 @@ def calculate_discount(price: int, discount_percentage: int) -> int:
 
 async def log_error(user_id: int, error_type: str, error_message: str):
     """تسجيل الأخطاء"""
-    db.add_log('error', user_id, error_type, error_message)
+    await db.aio.add_log('error', user_id, error_type, error_message)
     logger.error(f"User {user_id} - {error_type}: {error_message}")
 
 